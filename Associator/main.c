@@ -26,15 +26,17 @@
 #include <windows.h>
 #include <commctrl.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include "resource.h"
 
-#define PYTHON_EXECUTABLE L"python.exe"
+#define LAUNCHER_EXECUTABLE L"py.exe"
 
 #define MSGSIZE 1024
-#define MAX_VERSION_SIZE    4
+#define MAX_VERSION_SIZE    32
 
 typedef struct {
-    wchar_t version[MAX_VERSION_SIZE]; /* m.n */
+    wchar_t version[MAX_VERSION_SIZE]; /* the registry tag, e.g. 3.12-32 */
     int bits;   /* 32 or 64 */
     wchar_t executable[MAX_PATH];
 } INSTALLED_PYTHON;
@@ -49,20 +51,6 @@ static INSTALLED_PYTHON installed_pythons[MAX_INSTALLED_PYTHONS];
 
 static size_t num_installed_pythons = 0;
 
-/* to hold SOFTWARE\Python\PythonCore\X.Y\InstallPath */
-#define IP_BASE_SIZE 40
-#define IP_SIZE (IP_BASE_SIZE + MAX_VERSION_SIZE)
-#define CORE_PATH L"SOFTWARE\\Python\\PythonCore"
-
-static wchar_t * location_checks[] = {
-    L"\\",
-/*
-    L"\\PCBuild\\",
-    L"\\PCBuild\\amd64\\",
- */
-    NULL
-};
-
 static wchar_t *
 skip_whitespace(wchar_t * p)
 {
@@ -109,185 +97,190 @@ static void winerror(int rc, wchar_t * message, int size)
         message, size, NULL);
 }
 
-static INSTALLED_PYTHON *
-find_existing_python(wchar_t * path)
-{
-    INSTALLED_PYTHON * result = NULL;
-    size_t i;
-    INSTALLED_PYTHON * ip;
+/*
+ * The installed Pythons come from the launcher: "py --list --json" prints
+ * each as a line of JSON, in order of preference, from its discovery cache
+ * when that's up to date - so there's no need to scan the registry here.
+ * The py.exe next to this program is used if there is one, else the one on
+ * PATH.
+ */
 
-    for (i = 0, ip = installed_pythons; i < num_installed_pythons; i++, ip++) {
-        if (_wcsicmp(path, ip->executable) == 0) {
-            result = ip;
-            break;
-        }
+static BOOL
+find_launcher(wchar_t * path)
+{
+    wchar_t * p;
+    DWORD n = GetModuleFileNameW(NULL, path, MAX_PATH);
+
+    if ((n > 0) && (n < MAX_PATH)) {
+        p = wcsrchr(path, L'\\');
+        if ((p != NULL) && (wcscpy_s(p + 1, MAX_PATH - (p + 1 - path),
+                                     LAUNCHER_EXECUTABLE) == 0) &&
+            (GetFileAttributesW(path) != INVALID_FILE_ATTRIBUTES))
+            return TRUE;
     }
-    return result;
+    n = SearchPathW(NULL, LAUNCHER_EXECUTABLE, NULL, MAX_PATH, path, NULL);
+    return (n > 0) && (n < MAX_PATH);
 }
 
-static void
-locate_pythons_for_key(HKEY root, REGSAM flags)
+/*
+ * Run the launcher to list the installed Pythons, returning its output as a
+ * malloc'd, NUL-terminated string, or NULL on failure.
+ */
+static char *
+read_inventory()
 {
-    HKEY core_root, ip_key;
-    LSTATUS status = RegOpenKeyExW(root, CORE_PATH, 0, flags, &core_root);
+    wchar_t launcher[MAX_PATH];
+    wchar_t command[MAX_PATH + 20];
     wchar_t message[MSGSIZE];
-    DWORD i;
-    size_t n;
+    SECURITY_ATTRIBUTES sa;
+    STARTUPINFOW si;
+    PROCESS_INFORMATION pi;
+    HANDLE read_end, write_end;
+    char * result = NULL;
+    char * p;
+    size_t size = 0, used = 0;
+    DWORD n;
     BOOL ok;
-    DWORD type, data_size, attrs;
-    INSTALLED_PYTHON * ip, * pip;
-    wchar_t ip_path[IP_SIZE];
-    wchar_t * check;
-    wchar_t ** checkp;
-    wchar_t *key_name = (root == HKEY_LOCAL_MACHINE) ? L"HKLM" : L"HKCU";
-
-    if (status != ERROR_SUCCESS)
-        debug(L"locate_pythons_for_key: unable to open PythonCore key in %ls\n",
-              key_name);
-    else {
-        ip = &installed_pythons[num_installed_pythons];
-        for (i = 0; num_installed_pythons < MAX_INSTALLED_PYTHONS; i++) {
-            status = RegEnumKeyW(core_root, i, ip->version, MAX_VERSION_SIZE);
-            if (status != ERROR_SUCCESS) {
-                if (status != ERROR_NO_MORE_ITEMS) {
-                    /* unexpected error */
-                    winerror(status, message, MSGSIZE);
-                    debug(L"Can't enumerate registry key for version %ls: %ls\n",
-                          ip->version, message);
-                }
+
+    if (!find_launcher(launcher)) {
+        debug(L"read_inventory: can't find %ls\n", LAUNCHER_EXECUTABLE);
+        return NULL;
+    }
+    _snwprintf_s(command, MAX_PATH + 20, _TRUNCATE,
+                 L"\"%ls\" --list --json", launcher);
+    debug(L"read_inventory: running %ls\n", command);
+    sa.nLength = sizeof(sa);
+    sa.lpSecurityDescriptor = NULL;
+    sa.bInheritHandle = TRUE;
+    if (!CreatePipe(&read_end, &write_end, &sa, 0)) {
+        winerror(GetLastError(), message, MSGSIZE);
+        debug(L"read_inventory: can't create pipe: %ls", message);
+        return NULL;
+    }
+    SetHandleInformation(read_end, HANDLE_FLAG_INHERIT, 0);
+    memset(&si, 0, sizeof(si));
+    si.cb = sizeof(si);
+    si.dwFlags = STARTF_USESTDHANDLES;
+    si.hStdInput = GetStdHandle(STD_INPUT_HANDLE);
+    si.hStdOutput = write_end;
+    si.hStdError = GetStdHandle(STD_ERROR_HANDLE);
+    ok = CreateProcessW(launcher, command, NULL, NULL, TRUE,
+                        CREATE_NO_WINDOW, NULL, NULL, &si, &pi);
+    /* Only the child should have the write end now, so reads see EOF. */
+    CloseHandle(write_end);
+    if (!ok) {
+        winerror(GetLastError(), message, MSGSIZE);
+        debug(L"read_inventory: can't run %ls: %ls", launcher, message);
+        CloseHandle(read_end);
+        return NULL;
+    }
+    for (;;) {
+        if (size - used < 4096) {
+            size = size ? size * 2 : 16384;
+            p = realloc(result, size);
+            if (p == NULL) {
+                free(result);
+                result = NULL;
                 break;
             }
-            else {
-                _snwprintf_s(ip_path, IP_SIZE, _TRUNCATE,
-                             L"%ls\\%ls\\InstallPath", CORE_PATH, ip->version);
-                status = RegOpenKeyExW(root, ip_path, 0, flags, &ip_key);
-                if (status != ERROR_SUCCESS) {
-                    winerror(status, message, MSGSIZE);
-                    // Note: 'message' already has a trailing \n
-                    debug(L"%ls\\%ls: %ls", key_name, ip_path, message);
-                    continue;
-                }
-                data_size = sizeof(ip->executable) - 1;
-                status = RegQueryValueEx(ip_key, NULL, NULL, &type,
-                                         (LPBYTE) ip->executable, &data_size);
-                RegCloseKey(ip_key);
-                if (status != ERROR_SUCCESS) {
-                    winerror(status, message, MSGSIZE);
-                    debug(L"%ls\\%ls: %ls\n", key_name, ip_path, message);
-                    continue;
-                }
-                if (type == REG_SZ) {
-                    data_size = data_size / sizeof(wchar_t) - 1;  /* for NUL */
-                    if (ip->executable[data_size - 1] == L'\\')
-                        --data_size; /* reg value ended in a backslash */
-                    /* ip->executable is data_size long */
-                    for (checkp = location_checks; *checkp; ++checkp) {
-                        check = *checkp;
-                        _snwprintf_s(&ip->executable[data_size],
-                                     MAX_PATH - data_size,
-                                     MAX_PATH - data_size,
-                                     L"%ls%ls", check, PYTHON_EXECUTABLE);
-                        attrs = GetFileAttributesW(ip->executable);
-                        if (attrs == INVALID_FILE_ATTRIBUTES) {
-                            winerror(GetLastError(), message, MSGSIZE);
-                            debug(L"locate_pythons_for_key: %ls: %ls",
-                                  ip->executable, message);
-                        }
-                        else if (attrs & FILE_ATTRIBUTE_DIRECTORY) {
-                            debug(L"locate_pythons_for_key: '%ls' is a \
-directory\n",
-                                  ip->executable, attrs);
-                        }
-                        else if (find_existing_python(ip->executable)) {
-                            debug(L"locate_pythons_for_key: %ls: already \
-found: %ls\n", ip->executable);
-                        }
-                        else {
-                            /* check the executable type. */
-                            ok = GetBinaryTypeW(ip->executable, &attrs);
-                            if (!ok) {
-                                debug(L"Failure getting binary type: %ls\n",
-                                      ip->executable);
-                            }
-                            else {
-                                if (attrs == SCS_64BIT_BINARY)
-                                    ip->bits = 64;
-                                else if (attrs == SCS_32BIT_BINARY)
-                                    ip->bits = 32;
-                                else
-                                    ip->bits = 0;
-                                if (ip->bits == 0) {
-                                    debug(L"locate_pythons_for_key: %ls: \
-invalid binary type: %X\n",
-                                          ip->executable, attrs);
-                                }
-                                else {
-                                    if (wcschr(ip->executable, L' ') != NULL) {
-                                        /* has spaces, so quote */
-                                        n = wcslen(ip->executable);
-                                        memmove(&ip->executable[1],
-                                                ip->executable, n * sizeof(wchar_t));
-                                        ip->executable[0] = L'\"';
-                                        ip->executable[n + 1] = L'\"';
-                                        ip->executable[n + 2] = L'\0';
-                                    }
-                                    debug(L"locate_pythons_for_key: %ls \
-is a %dbit executable\n",
-                                        ip->executable, ip->bits);
-                                    ++num_installed_pythons;
-                                    pip = ip++;
-                                    if (num_installed_pythons >=
-                                        MAX_INSTALLED_PYTHONS)
-                                        break;
-                                    /* Copy over the attributes for the next */
-                                    *ip = *pip;
-                                }
-                            }
-                        }
-                    }
-                }
-            }
+            result = p;
         }
-        RegCloseKey(core_root);
+        if (!ReadFile(read_end, &result[used], (DWORD) (size - used - 1), &n,
+                      NULL) || (n == 0))
+            break;
+        used += n;
     }
+    if (result != NULL)
+        result[used] = '\0';
+    CloseHandle(read_end);
+    WaitForSingleObject(pi.hProcess, INFINITE);
+    CloseHandle(pi.hProcess);
+    CloseHandle(pi.hThread);
+    return result;
 }
 
-static int
-compare_pythons(const void * p1, const void * p2)
+/*
+ * The value of a name in a line of JSON, or NULL if it isn't there. The
+ * launcher's output is one flat object per line, which is all this has to
+ * cope with.
+ */
+static char *
+json_value(char * line, const char * name)
 {
-    INSTALLED_PYTHON * ip1 = (INSTALLED_PYTHON *) p1;
-    INSTALLED_PYTHON * ip2 = (INSTALLED_PYTHON *) p2;
-    /* note reverse sorting on version */
-    int result = wcscmp(ip2->version, ip1->version);
+    char key[40];
+    char * p;
 
-    if (result == 0)
-        result = ip2->bits - ip1->bits; /* 64 before 32 */
-    return result;
+    _snprintf_s(key, sizeof(key), _TRUNCATE, "\"%s\": ", name);
+    p = strstr(line, key);
+    return (p == NULL) ? NULL : p + strlen(key);
+}
+
+/*
+ * Decode the JSON string at p into value, size characters long. The
+ * launcher escapes only quotes, backslashes and (as \uXXXX) anything not
+ * printable ASCII.
+ */
+static BOOL
+json_string_value(char * p, wchar_t * value, size_t size)
+{
+    size_t n = 0;
+    unsigned int c;
+
+    if ((p == NULL) || (*p++ != '\"'))
+        return FALSE;
+    while (*p != '\"') {
+        if (*p == '\0' || (n + 1 >= size))
+            return FALSE;
+        if (*p != '\\')
+            c = (unsigned char) *p++;
+        else if (p[1] != 'u') {
+            c = (unsigned char) p[1];
+            p += 2;
+        }
+        else {
+            if (sscanf_s(p + 2, "%4x", &c) != 1)
+                return FALSE;
+            p += 6;
+        }
+        value[n++] = (wchar_t) c;
+    }
+    value[n] = L'\0';
+    return TRUE;
 }
 
 static void
 locate_all_pythons()
 {
-#if defined(_M_X64)
-    // If we are a 64bit process, first hit the 32bit keys.
-    debug(L"locating Pythons in 32bit registry\n");
-    locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ | KEY_WOW64_32KEY);
-    locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ | KEY_WOW64_32KEY);
-#else
-    // If we are a 32bit process on a 64bit Windows, first hit the 64bit keys.
-    BOOL f64 = FALSE;
-    if (IsWow64Process(GetCurrentProcess(), &f64) && f64) {
-        debug(L"locating Pythons in 64bit registry\n");
-        locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ | KEY_WOW64_64KEY);
-        locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ | KEY_WOW64_64KEY);
+    char * inventory = read_inventory();
+    char * line;
+    char * next;
+    char * p;
+    INSTALLED_PYTHON * ip;
+
+    if (inventory == NULL)
+        return;
+    for (line = inventory; *line; line = next) {
+        next = strchr(line, '\n');
+        if (next == NULL)
+            next = line + strlen(line);
+        else
+            *next++ = '\0';
+        if (num_installed_pythons >= MAX_INSTALLED_PYTHONS)
+            break;
+        ip = &installed_pythons[num_installed_pythons];
+        /* The summary line has no version, so it's skipped here. */
+        if (!json_string_value(json_value(line, "version"), ip->version,
+                               MAX_VERSION_SIZE) ||
+            !json_string_value(json_value(line, "executable"),
+                               ip->executable, MAX_PATH))
+            continue;
+        p = json_value(line, "bits");
+        ip->bits = (p == NULL) ? 0 : atoi(p);
+        debug(L"locate_all_pythons: %ls is a %dbit executable\n",
+              ip->executable, ip->bits);
+        ++num_installed_pythons;
     }
-#endif    
-    // now hit the "native" key for this process bittedness.
-    debug(L"locating Pythons in native registry\n");
-    locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ);
-    locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ);
-    qsort(installed_pythons, num_installed_pythons, sizeof(INSTALLED_PYTHON),
-          compare_pythons);
+    free(inventory);
 }
 
 typedef struct {
@@ -0,0 +1,491 @@
+/*
+ * Discovery of the Pythons registered in the registry.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "discovery.h"
+#include "version_index.h"
+
+/* The states of a view's scan. */
+#define SCAN_PENDING    0
+#define SCAN_RUNNING    1
+#define SCAN_DONE       2
+
+/* Where PythonCore installations keep their executables. */
+static const wchar_t * location_checks[] = {
+    L"\\",
+    L"\\PCBuild\\win32\\",
+    L"\\PCBuild\\amd64\\",
+    // To support early 32bit versions of Python that stuck the build binaries
+    // directly in PCBuild...
+    L"\\PCBuild\\",
+    NULL
+};
+
+#if defined(_WIN32)
+
+#define lock(d)         EnterCriticalSection(&(d)->lock)
+#define unlock(d)       LeaveCriticalSection(&(d)->lock)
+#define wait_for_change(d) \
+    SleepConditionVariableCS(&(d)->changed, &(d)->lock, INFINITE)
+#define wake_all(d)     WakeAllConditionVariable(&(d)->changed)
+
+#else
+
+#define lock(d)         pthread_mutex_lock(&(d)->lock)
+#define unlock(d)       pthread_mutex_unlock(&(d)->lock)
+#define wait_for_change(d) \
+    pthread_cond_wait(&(d)->changed, &(d)->lock)
+#define wake_all(d)     pthread_cond_broadcast(&(d)->changed)
+
+#endif
+
+/* Copy a string, truncating it to fit in size characters. */
+static void
+copy_string(wchar_t * dest, size_t size, const wchar_t * src)
+{
+    size_t n = wcslen(src);
+
+    if (n >= size)
+        n = size - 1;
+    memcpy(dest, src, n * sizeof(wchar_t));
+    dest[n] = L'\0';
+}
+
+typedef struct {
+    DISCOVERY_CANDIDATE * items;
+    size_t count;
+    size_t capacity;
+    BOOL failed;
+} CANDIDATES;
+
+static DISCOVERY_CANDIDATE *
+new_candidate(CANDIDATES * list, const DISCOVERY_CANDIDATE * model)
+{
+    DISCOVERY_CANDIDATE * p;
+    size_t n;
+
+    if (list->count == list->capacity) {
+        n = list->capacity ? 2 * list->capacity : 16;
+        p = realloc(list->items, n * sizeof(DISCOVERY_CANDIDATE));
+        if (p == NULL) {
+            list->failed = TRUE;
+            return NULL;
+        }
+        list->items = p;
+        list->capacity = n;
+    }
+    p = &list->items[list->count++];
+    *p = *model;
+    return p;
+}
+
+/* Add the candidate executables for one installation to list. */
+static void
+add_installation(DISCOVERY * d, CANDIDATES * list, int view,
+                 const wchar_t * company, const wchar_t * tag)
+{
+    const DISCOVERY_BACKEND * backend = d->backend;
+    DISCOVERY_INSTALL install;
+    DISCOVERY_CANDIDATE model;
+    DISCOVERY_CANDIDATE * c;
+    INSTALLED_PYTHON * ip = &model.python;
+    const wchar_t * stem = d->windowed ? L"pythonw" : L"python";
+    const wchar_t * registered;
+    const wchar_t ** checkp;
+    wchar_t name[MAX_PATH];
+    BOOL core = _wcsicmp(company, CORE_COMPANY) == 0;
+    size_t n;
+
+    memset(&install, 0, sizeof(install));
+    if (!backend->read_install(backend->context, view, company, tag,
+                               &install))
+        return;
+    memset(&model, 0, sizeof(model));
+    copy_string(ip->company, MAX_COMPANY_SIZE, company);
+    copy_string(ip->version, MAX_VERSION_SIZE, tag);
+    ip->view = view;
+    /*
+     * PEP 514 says the tags of other companies mean nothing in particular,
+     * so their SysVersion is used if they give one. An installation whose
+     * version can't be worked out couldn't be listed or sorted sensibly,
+     * so it's left out.
+     */
+    if (!core && install.sys_version[0]) {
+        if (!parse_version(install.sys_version, &ip->parsed, FALSE))
+            return;
+    }
+    else if (!parse_version(tag, &ip->parsed, FALSE) && !core)
+        return;
+    n = wcslen(install.install_path);
+    if ((n > 0) && (install.install_path[n - 1] == L'\\'))
+        install.install_path[n - 1] = L'\0';    /* ended in a backslash */
+    if (!core) {
+        registered = d->windowed ? install.windowed_path :
+                                   install.executable_path;
+        if (*registered)
+            copy_string(ip->executable, MAX_PATH, registered);
+        else
+            swprintf(ip->executable, MAX_PATH, L"%ls\\%ls.exe",
+                     install.install_path, stem);
+        new_candidate(list, &model);
+        return;
+    }
+    /* Free-threaded builds are installed alongside an ordinary build. */
+    if (ip->parsed.freethreaded)
+        swprintf(name, MAX_PATH, L"%ls%d.%dt.exe", stem, ip->parsed.major,
+                 ip->parsed.minor);
+    else
+        swprintf(name, MAX_PATH, L"%ls.exe", stem);
+    for (checkp = location_checks; *checkp; ++checkp) {
+        c = new_candidate(list, &model);
+        if (c == NULL)
+            return;
+        swprintf(c->python.executable, MAX_PATH, L"%ls%ls%ls",
+                 install.install_path, *checkp, name);
+    }
+}
+
+static int
+compare_companies(const void * p1, const void * p2)
+{
+    const wchar_t * c1 = (const wchar_t *) p1;
+    const wchar_t * c2 = (const wchar_t *) p2;
+    BOOL core1 = _wcsicmp(c1, CORE_COMPANY) == 0;
+    BOOL core2 = _wcsicmp(c2, CORE_COMPANY) == 0;
+
+    if (core1 != core2)
+        return core1 ? -1 : 1;
+    return _wcsicmp(c1, c2);
+}
+
+/*
+ * Scan a view, outside the lock: list its companies, then the installations
+ * of each, making the view's list of candidates. Returns FALSE if memory ran
+ * out, leaving the list incomplete.
+ */
+static BOOL
+scan_view(DISCOVERY * d, DISCOVERY_VIEW * v)
+{
+    const DISCOVERY_BACKEND * backend = d->backend;
+    CANDIDATES list;
+    wchar_t (* companies)[MAX_COMPANY_SIZE] = NULL;
+    wchar_t (* p)[MAX_COMPANY_SIZE];
+    wchar_t tag[MAX_VERSION_SIZE];
+    unsigned long num_companies = 0, i, j;
+    void * key;
+
+    memset(&list, 0, sizeof(list));
+    v->start = backend->now(backend->context);
+    key = backend->open_key(backend->context, v->view, NULL);
+    v->opened = key != NULL;
+    if (key != NULL) {
+        for (;;) {
+            p = realloc(companies, (num_companies + 1) * MAX_COMPANY_SIZE *
+                                   sizeof(wchar_t));
+            if (p == NULL) {
+                list.failed = TRUE;
+                break;
+            }
+            companies = p;
+            if (!backend->enum_key(backend->context, key, num_companies,
+                                   companies[num_companies],
+                                   MAX_COMPANY_SIZE))
+                break;
+            ++num_companies;
+        }
+        backend->close_key(backend->context, key);
+    }
+    if (num_companies > 1)
+        qsort(companies, num_companies, sizeof(companies[0]),
+              compare_companies);
+    for (i = 0; (i < num_companies) && !list.failed; i++) {
+        key = backend->open_key(backend->context, v->view, companies[i]);
+        if (key == NULL)
+            continue;
+        for (j = 0; backend->enum_key(backend->context, key, j, tag,
+                                      MAX_VERSION_SIZE); j++) {
+            ++v->keys;
+            add_installation(d, &list, v->view, companies[i], tag);
+        }
+        backend->close_key(backend->context, key);
+    }
+    free(companies);
+    v->candidates = list.items;
+    v->num_candidates = list.count;
+    v->end = backend->now(backend->context);
+    return !list.failed;
+}
+
+/* Probe a candidate, outside the lock. */
+static int
+probe_candidate(DISCOVERY * d, DISCOVERY_CANDIDATE * c)
+{
+    const DISCOVERY_BACKEND * backend = d->backend;
+    INSTALLED_PYTHON * ip = &c->python;
+    int outcome;
+
+    c->start = backend->now(backend->context);
+    outcome = backend->probe(backend->context, ip->executable, &ip->bits);
+    if (outcome == PROBE_FOUND) {
+        /* Only the tag can tell arm64 from x64. */
+        if (ip->parsed.arch != ARCH_ARM64)
+            ip->parsed.arch = (ip->bits == 64) ? ARCH_64 : ARCH_32;
+    }
+    c->end = backend->now(backend->context);
+    return outcome;
+}
+
+/*
+ * Find some work, and do it. Called with the lock held, which is released
+ * while the work is done. Returns FALSE if there was nothing to do.
+ */
+static BOOL
+do_work(DISCOVERY * d)
+{
+    DISCOVERY_VIEW * v;
+    DISCOVERY_CANDIDATE * c;
+    int i, outcome;
+    BOOL ok;
+
+    /* Scans come first, as they make more work. */
+    for (i = 0; i < d->num_views; i++) {
+        v = &d->views[i];
+        if (v->state == SCAN_PENDING) {
+            v->state = SCAN_RUNNING;
+            unlock(d);
+            ok = scan_view(d, v);
+            lock(d);
+            if (!ok)
+                d->failed = TRUE;
+            v->state = SCAN_DONE;
+            wake_all(d);
+            return TRUE;
+        }
+    }
+    for (i = 0; i < d->num_views; i++) {
+        v = &d->views[i];
+        if ((v->state == SCAN_DONE) && (v->next_probe < v->num_candidates)) {
+            c = &v->candidates[v->next_probe++];
+            unlock(d);
+            outcome = probe_candidate(d, c);
+            lock(d);
+            c->outcome = outcome;
+            wake_all(d);
+            return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+static BOOL
+all_scanned(DISCOVERY * d)
+{
+    int i;
+
+    for (i = 0; i < d->num_views; i++) {
+        if (d->views[i].state != SCAN_DONE)
+            return FALSE;
+    }
+    return TRUE;
+}
+
+static void
+work(DISCOVERY * d)
+{
+    lock(d);
+    while (!d->stopping) {
+        if (!do_work(d)) {
+            if (all_scanned(d))
+                break;      /* and all the probes have been handed out */
+            wait_for_change(d);
+        }
+    }
+    unlock(d);
+}
+
+#if defined(_WIN32)
+
+static DWORD WINAPI
+worker_main(LPVOID arg)
+{
+    work((DISCOVERY *) arg);
+    return 0;
+}
+
+static BOOL
+start_worker(DISCOVERY * d, DISCOVERY_THREAD * thread)
+{
+    *thread = CreateThread(NULL, 0, worker_main, d, 0, NULL);
+    return *thread != NULL;
+}
+
+static void
+join_worker(DISCOVERY_THREAD thread)
+{
+    WaitForSingleObject(thread, INFINITE);
+    CloseHandle(thread);
+}
+
+#else
+
+static void *
+worker_main(void * arg)
+{
+    work((DISCOVERY *) arg);
+    return NULL;
+}
+
+static BOOL
+start_worker(DISCOVERY * d, DISCOVERY_THREAD * thread)
+{
+    return pthread_create(thread, NULL, worker_main, d) == 0;
+}
+
+static void
+join_worker(DISCOVERY_THREAD thread)
+{
+    pthread_join(thread, NULL);
+}
+
+#endif
+
+void
+discovery_start(DISCOVERY * d, const DISCOVERY_BACKEND * backend,
+                BOOL windowed, const int * views, int num_views, int workers)
+{
+    int i;
+
+    memset(d, 0, sizeof(DISCOVERY));
+    d->backend = backend;
+    d->windowed = windowed;
+    if (num_views > CACHE_MAX_VIEWS)
+        num_views = CACHE_MAX_VIEWS;
+    d->num_views = num_views;
+    for (i = 0; i < num_views; i++)
+        d->views[i].view = views[i];
+#if defined(_WIN32)
+    InitializeCriticalSection(&d->lock);
+    InitializeConditionVariable(&d->changed);
+#else
+    pthread_mutex_init(&d->lock, NULL);
+    pthread_cond_init(&d->changed, NULL);
+#endif
+    if (workers > DISCOVERY_MAX_WORKERS)
+        workers = DISCOVERY_MAX_WORKERS;
+    while ((d->num_workers < workers) &&
+           start_worker(d, &d->workers[d->num_workers]))
+        ++d->num_workers;
+}
+
+/*
+ * Has the candidate at the merge position already been found - by an
+ * earlier candidate found in this view or one before it? Paths are compared
+ * without regard to case.
+ */
+static BOOL
+is_duplicate(DISCOVERY * d, DISCOVERY_CANDIDATE * c)
+{
+    DISCOVERY_VIEW * v;
+    size_t i, n;
+    int j;
+
+    for (j = 0; j <= d->merged_views; j++) {
+        v = &d->views[j];
+        n = (j == d->merged_views) ? d->next_candidate : v->num_candidates;
+        for (i = 0; i < n; i++) {
+            if ((v->candidates[i].outcome == PROBE_FOUND) &&
+                (_wcsicmp(v->candidates[i].python.executable,
+                          c->python.executable) == 0))
+                return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+DISCOVERY_CANDIDATE *
+discovery_next(DISCOVERY * d)
+{
+    DISCOVERY_VIEW * v = NULL;
+    DISCOVERY_CANDIDATE * c = NULL;
+    int outcome;
+    BOOL ok;
+
+    lock(d);
+    while (d->merged_views < d->num_views) {
+        v = &d->views[d->merged_views];
+        if (v->state == SCAN_PENDING) {
+            /* No worker has got to it, so scan it here. */
+            v->state = SCAN_RUNNING;
+            ++d->scans_by_caller;
+            unlock(d);
+            ok = scan_view(d, v);
+            lock(d);
+            if (!ok)
+                d->failed = TRUE;
+            v->state = SCAN_DONE;
+            wake_all(d);
+        }
+        else if (v->state == SCAN_RUNNING) {
+            wait_for_change(d);
+        }
+        else if (d->next_candidate == v->num_candidates) {
+            ++d->merged_views;
+            d->next_candidate = 0;
+        }
+        else {
+            c = &v->candidates[d->next_candidate];
+            if (c->outcome != PROBE_PENDING)
+                break;
+            if (v->next_probe > d->next_candidate) {
+                wait_for_change(d); /* a worker is probing it */
+            }
+            else {
+                /* Candidates are probed in order, so it's the next one. */
+                ++v->next_probe;
+                ++d->probes_by_caller;
+                unlock(d);
+                outcome = probe_candidate(d, c);
+                lock(d);
+                c->outcome = outcome;
+                wake_all(d);
+            }
+            c = NULL;
+        }
+    }
+    if (c != NULL) {
+        if ((c->outcome == PROBE_FOUND) && is_duplicate(d, c))
+            c->outcome = PROBE_DUPLICATE;
+        if (c->outcome == PROBE_FOUND)
+            ++v->found;
+        ++d->next_candidate;
+    }
+    unlock(d);
+    return c;
+}
+
+void
+discovery_free(DISCOVERY * d)
+{
+    int i;
+
+    lock(d);
+    d->stopping = TRUE;
+    wake_all(d);
+    unlock(d);
+    for (i = 0; i < d->num_workers; i++)
+        join_worker(d->workers[i]);
+#if defined(_WIN32)
+    DeleteCriticalSection(&d->lock);
+#else
+    pthread_cond_destroy(&d->changed);
+    pthread_mutex_destroy(&d->lock);
+#endif
+    for (i = 0; i < d->num_views; i++)
+        free(d->views[i].candidates);
+    memset(d, 0, sizeof(DISCOVERY));
+}
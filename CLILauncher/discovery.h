@@ -0,0 +1,152 @@
+/*
+ * Discovery of the Pythons registered in the registry, as described by PEP
+ * 514: in each registry view, SOFTWARE\Python has a key for each company
+ * which distributes Python - PythonCore for the python.org builds, others
+ * for Anaconda, the Store and so on - holding a key for each installation
+ * (named by its tag), whose InstallPath subkey says where it is.
+ *
+ * The views are scanned, and the candidate executables they name probed,
+ * on a small pool of worker threads. The caller merges the results, with
+ * discovery_next(), in a fixed order which doesn't depend on how the work
+ * was scheduled: views in priority order, then PythonCore before the other
+ * companies (by name), then tags in registry order, then, for PythonCore,
+ * the build folders in the order the launcher has always checked them. An
+ * executable found more than once counts where it was first found, just as
+ * when views were scanned one at a time. The merge is incremental, so a
+ * caller that finds what it wants early can stop; the workers finish in the
+ * background.
+ *
+ * The registry and file system are reached through a backend, whose
+ * functions are called from the worker threads as well as the caller's.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef DISCOVERY_H
+#define DISCOVERY_H
+
+#include "install_cache.h"
+
+#if defined(_WIN32)
+typedef CRITICAL_SECTION DISCOVERY_LOCK;
+typedef CONDITION_VARIABLE DISCOVERY_COND;
+typedef HANDLE DISCOVERY_THREAD;
+#else
+#include <pthread.h>
+typedef pthread_mutex_t DISCOVERY_LOCK;
+typedef pthread_cond_t DISCOVERY_COND;
+typedef pthread_t DISCOVERY_THREAD;
+#endif
+
+#define DISCOVERY_MAX_WORKERS   8
+
+/* What probing a candidate executable found. */
+#define PROBE_PENDING       0   /* not probed yet */
+#define PROBE_FOUND         1
+#define PROBE_MISSING       2
+#define PROBE_DIRECTORY     3
+#define PROBE_UNKNOWN_TYPE  4   /* its binary type couldn't be read */
+#define PROBE_INVALID_TYPE  5   /* not a 32 or 64-bit Windows executable */
+#define PROBE_DUPLICATE     6   /* found, but already found earlier */
+
+/* What a company registers for one of its installations. */
+typedef struct {
+    wchar_t install_path[MAX_PATH];         /* InstallPath's default value */
+    wchar_t executable_path[MAX_PATH];      /* ExecutablePath, or empty */
+    wchar_t windowed_path[MAX_PATH];        /* WindowedExecutablePath */
+    wchar_t sys_version[MAX_VERSION_SIZE];  /* SysVersion, or empty */
+} DISCOVERY_INSTALL;
+
+typedef struct {
+    void * context;
+    /*
+     * Open SOFTWARE\Python in a view, or the key of one company under it if
+     * company isn't NULL. Returns NULL if there's no such key.
+     */
+    void * (*open_key)(void * context, int view, const wchar_t * company);
+    /*
+     * Copy the name of subkey 'index' of an open key into name, which holds
+     * size characters. Returns FALSE if there are no more subkeys - or if
+     * the name doesn't fit, which also ends the enumeration.
+     */
+    BOOL (*enum_key)(void * context, void * key, unsigned long index,
+                     wchar_t * name, size_t size);
+    void (*close_key)(void * context, void * key);
+    /*
+     * Read what's registered for an installation. Returns FALSE if it has
+     * no InstallPath.
+     */
+    BOOL (*read_install)(void * context, int view, const wchar_t * company,
+                         const wchar_t * tag, DISCOVERY_INSTALL * install);
+    /*
+     * Probe a candidate executable, returning PROBE_FOUND, with *bits set
+     * to 32 or 64, or why it isn't usable.
+     */
+    int (*probe)(void * context, const wchar_t * path, int * bits);
+    /* The time, in whatever units the caller wants times reported in. */
+    long long (*now)(void * context);
+} DISCOVERY_BACKEND;
+
+typedef struct {
+    /*
+     * The version is the tag, and the executable is unquoted. Its bits and
+     * (unless the tag says arm64) its architecture are only known once it
+     * has been probed.
+     */
+    INSTALLED_PYTHON python;
+    int outcome;                /* one of the PROBE_* values */
+    long long start, end;       /* when it was probed */
+} DISCOVERY_CANDIDATE;
+
+typedef struct {
+    int view;
+    int state;                  /* one of the SCAN_* values in the .c */
+    BOOL opened;                /* SOFTWARE\Python could be opened */
+    unsigned long keys;         /* installation keys looked at */
+    unsigned long found;        /* candidates merged as found */
+    DISCOVERY_CANDIDATE * candidates;
+    size_t num_candidates;
+    size_t next_probe;          /* the next candidate to be probed */
+    long long start, end;       /* when it was scanned */
+} DISCOVERY_VIEW;
+
+typedef struct {
+    const DISCOVERY_BACKEND * backend;
+    BOOL windowed;              /* looking for pythonw.exe? */
+    DISCOVERY_VIEW views[CACHE_MAX_VIEWS];
+    int num_views;
+    int merged_views;           /* views the merge has finished with */
+    size_t next_candidate;      /* the next to merge in the view after */
+    BOOL stopping;
+    BOOL failed;                /* memory ran out: results are incomplete */
+    DISCOVERY_LOCK lock;
+    DISCOVERY_COND changed;     /* signalled when a scan or probe is done */
+    DISCOVERY_THREAD workers[DISCOVERY_MAX_WORKERS];
+    int num_workers;
+    /* Statistics */
+    unsigned long scans_by_caller;  /* views the caller had to scan */
+    unsigned long probes_by_caller; /* candidates it had to probe */
+} DISCOVERY;
+
+/*
+ * Start discovering the Pythons in views (num_views of them, in priority
+ * order), looking for pythonw.exe rather than python.exe if windowed is
+ * set, with up to 'workers' worker threads. With none - or if threads
+ * can't be started - the caller does all the work, in merge order, as
+ * discovery_next() needs it.
+ */
+void discovery_start(DISCOVERY * discovery, const DISCOVERY_BACKEND * backend,
+                     BOOL windowed, const int * views, int num_views,
+                     int workers);
+
+/*
+ * The next candidate, in merge order, once it has been probed; or NULL when
+ * there are no more. A candidate whose outcome is PROBE_FOUND is a newly
+ * found Python.
+ */
+DISCOVERY_CANDIDATE * discovery_next(DISCOVERY * discovery);
+
+/* Stop the workers, waiting for them, and free everything. */
+void discovery_free(DISCOVERY * discovery);
+
+#endif
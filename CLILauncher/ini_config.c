@@ -0,0 +1,284 @@
+/*
+ * Single-pass parsing of py.ini files into a hash table.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <wctype.h>
+
+#include "ini_config.h"
+
+#define MIN_BUCKETS     16
+
+#define FNV_BASIS       2166136261U
+#define FNV_PRIME       16777619U
+
+static wchar_t
+fold(wchar_t c)
+{
+    return (wchar_t) towlower(c);
+}
+
+static BOOL
+is_blank(wchar_t c)
+{
+    return (c == L' ') || (c == L'\t') || (c == L'\r') || (c == L'\f') ||
+           (c == L'\v');
+}
+
+static void
+trim(const wchar_t ** start, const wchar_t ** end)
+{
+    while ((*start < *end) && is_blank(**start))
+        ++*start;
+    while ((*end > *start) && is_blank((*end)[-1]))
+        --*end;
+}
+
+static unsigned int
+hash_name(unsigned int h, const wchar_t * s, size_t n)
+{
+    while (n--) {
+        h ^= (unsigned int) fold(*s++);
+        h *= FNV_PRIME;
+    }
+    return h;
+}
+
+static unsigned int
+hash_entry(const wchar_t * section, size_t slen, const wchar_t * key,
+           size_t klen)
+{
+    unsigned int h = hash_name(FNV_BASIS, section, slen);
+
+    /* separate the section from the key, and markers from keys */
+    h ^= (key == NULL) ? 0xFFFEU : 0xFFFFU;
+    h *= FNV_PRIME;
+    return hash_name(h, key, klen);
+}
+
+/* Compare a NUL-terminated name with n characters at s. */
+static BOOL
+same_name(const wchar_t * name, const wchar_t * s, size_t n)
+{
+    while (n--) {
+        if (!*name || (fold(*name++) != fold(*s++)))
+            return FALSE;
+    }
+    return *name == L'\0';
+}
+
+/*
+ * Return the link to an entry, or to the NULL ending its bucket if there is
+ * no such entry. The table must have at least one bucket.
+ */
+static CONFIG_ENTRY **
+find_link(const CONFIG * config, unsigned int hash, const wchar_t * section,
+          size_t slen, const wchar_t * key, size_t klen)
+{
+    CONFIG_ENTRY ** link = &config->buckets[hash & (config->num_buckets - 1)];
+    CONFIG_ENTRY * entry;
+
+    for (; (entry = *link) != NULL; link = &entry->next) {
+        if ((entry->hash == hash) && ((entry->key == NULL) == (key == NULL)) &&
+            same_name(entry->section, section, slen) &&
+            ((key == NULL) || same_name(entry->key, key, klen)))
+            break;
+    }
+    return link;
+}
+
+static BOOL
+grow(CONFIG * config)
+{
+    size_t n = config->num_buckets ? 2 * config->num_buckets : MIN_BUCKETS;
+    CONFIG_ENTRY ** buckets = calloc(n, sizeof(CONFIG_ENTRY *));
+    CONFIG_ENTRY * entry;
+    CONFIG_ENTRY * next;
+    size_t i;
+
+    if (buckets == NULL)
+        return FALSE;
+    for (i = 0; i < config->num_buckets; i++) {
+        for (entry = config->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            entry->next = buckets[entry->hash & (n - 1)];
+            buckets[entry->hash & (n - 1)] = entry;
+        }
+    }
+    free(config->buckets);
+    config->buckets = buckets;
+    config->num_buckets = n;
+    return TRUE;
+}
+
+static wchar_t *
+copy_string(wchar_t * dest, const wchar_t * s, size_t n)
+{
+    memcpy(dest, s, n * sizeof(wchar_t));
+    dest[n] = L'\0';
+    return dest;
+}
+
+/* Allocate an entry with room for its strings in the same block. */
+static CONFIG_ENTRY *
+new_entry(unsigned int hash, unsigned int generation, const wchar_t * source,
+          const wchar_t * section, size_t slen, const wchar_t * key,
+          size_t klen, const wchar_t * value, size_t vlen)
+{
+    size_t n = slen + 1 + ((key == NULL) ? 0 : klen + vlen + 2);
+    CONFIG_ENTRY * entry;
+    wchar_t * p;
+
+    if (n > (((size_t) -1) - sizeof(CONFIG_ENTRY)) / sizeof(wchar_t))
+        return NULL;
+    entry = malloc(sizeof(CONFIG_ENTRY) + n * sizeof(wchar_t));
+    if (entry == NULL)
+        return NULL;
+    entry->next = NULL;
+    entry->hash = hash;
+    entry->generation = generation;
+    entry->source = source;
+    p = (wchar_t *) &entry[1];
+    entry->section = copy_string(p, section, slen);
+    entry->key = entry->value = NULL;
+    if (key != NULL) {
+        p += slen + 1;
+        entry->key = copy_string(p, key, klen);
+        p += klen + 1;
+        entry->value = copy_string(p, value, vlen);
+    }
+    return entry;
+}
+
+/*
+ * Add an entry - or for a section, a marker recording that it has been
+ * seen - unless one was already added by this parse. Returns 1 if added,
+ * 0 if not, or -1 if memory runs out.
+ */
+static int
+add_entry(CONFIG * config, const wchar_t * source, const wchar_t * section,
+          size_t slen, const wchar_t * key, size_t klen,
+          const wchar_t * value, size_t vlen)
+{
+    unsigned int hash = hash_entry(section, slen, key, klen);
+    CONFIG_ENTRY ** link;
+    CONFIG_ENTRY * old;
+    CONFIG_ENTRY * entry;
+
+    if ((config->num_entries >= config->num_buckets) && !grow(config) &&
+        (config->num_buckets == 0))
+        return -1;  /* a full table still works, if more slowly */
+    link = find_link(config, hash, section, slen, key, klen);
+    old = *link;
+    if (old != NULL) {
+        if (old->generation == config->generation)
+            return 0;   /* the first in a file wins */
+        if (key == NULL) {
+            old->generation = config->generation;
+            old->source = source;
+            return 1;
+        }
+    }
+    entry = new_entry(hash, config->generation, source, section, slen, key,
+                      klen, value, vlen);
+    if (entry == NULL)
+        return -1;
+    if (old == NULL) {
+        ++config->num_entries;
+    }
+    else {          /* an earlier file's value is overridden */
+        entry->next = old->next;
+        free(old);
+    }
+    *link = entry;
+    return 1;
+}
+
+BOOL
+config_parse(CONFIG * config, const wchar_t * text, size_t length,
+             const wchar_t * source)
+{
+    const wchar_t * end = text + length;
+    const wchar_t * line;
+    const wchar_t * eol;
+    const wchar_t * p;
+    const wchar_t * q;
+    const wchar_t * eq;
+    const wchar_t * v;
+    const wchar_t * section = NULL;     /* NULL if none, or ignored */
+    size_t slen = 0;
+    int rc;
+
+    ++config->generation;
+    for (line = text; line < end; line = eol + 1) {
+        eol = wmemchr(line, L'\n', end - line);
+        if (eol == NULL)
+            eol = end;
+        p = line;
+        q = eol;
+        trim(&p, &q);
+        if ((p == q) || (*p == L';'))
+            continue;
+        if (*p == L'[') {
+            ++p;
+            eq = wmemchr(p, L']', q - p);
+            if (eq != NULL)
+                q = eq;
+            trim(&p, &q);
+            rc = add_entry(config, source, p, q - p, NULL, 0, NULL, 0);
+            if (rc < 0)
+                return FALSE;
+            section = rc ? p : NULL;    /* later duplicates are ignored */
+            slen = q - p;
+            continue;
+        }
+        eq = wmemchr(p, L'=', q - p);
+        if ((section == NULL) || (eq == NULL))
+            continue;
+        v = eq + 1;
+        trim(&v, &q);
+        if ((q - v >= 2) && (*v == q[-1]) && ((*v == L'"') || (*v == L'\''))) {
+            ++v;
+            --q;
+        }
+        trim(&p, &eq);
+        if ((p == eq) || (v == q))
+            continue;
+        if (add_entry(config, source, section, slen, p, eq - p, v, q - v) < 0)
+            return FALSE;
+    }
+    return TRUE;
+}
+
+const CONFIG_ENTRY *
+config_find(const CONFIG * config, const wchar_t * section,
+            const wchar_t * key)
+{
+    size_t slen = wcslen(section);
+    size_t klen = wcslen(key);
+
+    if (config->num_buckets == 0)
+        return NULL;
+    return *find_link(config, hash_entry(section, slen, key, klen), section,
+                      slen, key, klen);
+}
+
+void
+config_free(CONFIG * config)
+{
+    CONFIG_ENTRY * entry;
+    CONFIG_ENTRY * next;
+    size_t i;
+
+    for (i = 0; i < config->num_buckets; i++) {
+        for (entry = config->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            free(entry);
+        }
+    }
+    free(config->buckets);
+    memset(config, 0, sizeof(CONFIG));
+}
@@ -0,0 +1,58 @@
+/*
+ * The launcher's configuration, read from py.ini files.
+ *
+ * Each file is read once and parsed in a single pass into a hash table keyed
+ * on (section, key), both compared case-insensitively. Entries are sized to
+ * fit, so there is no limit on the number or length of keys and values.
+ *
+ * Parsing follows GetPrivateProfileStringW, which the launcher used to call
+ * for every lookup: lines are trimmed of whitespace; those starting with ';'
+ * are comments; within a file, only the first section with a given name and
+ * the first occurrence of a key in it count; and values lose one level of
+ * matching quotes. A key with an empty value is treated as absent. When
+ * several files are parsed into one configuration, each overrides the ones
+ * parsed before it.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef INI_CONFIG_H
+#define INI_CONFIG_H
+
+#include "launcher.h"
+
+typedef struct CONFIG_ENTRY {
+    struct CONFIG_ENTRY * next;     /* next entry in the same bucket */
+    unsigned int hash;
+    unsigned int generation;        /* the config_parse() call adding it */
+    const wchar_t * source;         /* the file it came from */
+    wchar_t * section;
+    wchar_t * key;                  /* NULL for a section marker */
+    wchar_t * value;
+} CONFIG_ENTRY;
+
+/* A zeroed CONFIG is a valid, empty configuration. */
+typedef struct {
+    CONFIG_ENTRY ** buckets;
+    size_t num_buckets;             /* zero or a power of two */
+    size_t num_entries;
+    unsigned int generation;
+} CONFIG;
+
+/*
+ * Parse the text of an ini file (length characters, which needn't be
+ * NUL-terminated) into a configuration. source is recorded against each
+ * entry, and must stay valid for as long as the configuration. Returns FALSE
+ * if memory runs out, leaving whatever had been parsed so far.
+ */
+BOOL config_parse(CONFIG * config, const wchar_t * text, size_t length,
+                  const wchar_t * source);
+
+/* Look up a key, returning NULL if it isn't configured. */
+const CONFIG_ENTRY * config_find(const CONFIG * config,
+                                 const wchar_t * section,
+                                 const wchar_t * key);
+
+void config_free(CONFIG * config);
+
+#endif
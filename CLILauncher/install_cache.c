@@ -0,0 +1,264 @@
+/*
+ * On-disk cache of the table of installed Pythons.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "install_cache.h"
+
+typedef struct {
+    unsigned int magic;
+    unsigned int format;
+    unsigned int char_size;     /* sizeof(wchar_t) of the writer */
+    unsigned int entry_size;    /* sizeof(CACHE_ENTRY) of the writer */
+    unsigned int num_views;
+    unsigned int num_entries;
+    unsigned int checksum;      /* over everything, with this field zero */
+    int views[CACHE_MAX_VIEWS];
+    CACHE_STAMP view_stamps[CACHE_MAX_VIEWS];
+} CACHE_HEADER;
+
+typedef struct {
+    CACHE_STAMP stamp;
+    INSTALLED_PYTHON python;
+} CACHE_ENTRY;
+
+/* FNV-1a - only needs to catch truncated or otherwise mangled files. */
+static unsigned int
+checksum(const unsigned char * p, size_t size)
+{
+    unsigned int result = 2166136261U;
+
+    while (size--) {
+        result ^= *p++;
+        result *= 16777619U;
+    }
+    return result;
+}
+
+static unsigned int
+cache_checksum(const void * data, size_t size)
+{
+    CACHE_HEADER header;
+    unsigned int result;
+
+    memcpy(&header, data, sizeof(header));
+    header.checksum = 0;
+    result = checksum((const unsigned char *) &header, sizeof(header));
+    return result ^ checksum((const unsigned char *) data + sizeof(header),
+                             size - sizeof(header));
+}
+
+/*
+ * Executables containing spaces are stored quoted, ready for use on a
+ * command line. Strip the quotes before asking the backend about them.
+ */
+BOOL
+cache_stamp_file(const CACHE_BACKEND * backend, const wchar_t * executable,
+                 CACHE_STAMP * stamp)
+{
+    wchar_t path[MAX_PATH];
+    size_t n = wcslen(executable);
+
+    memset(stamp, 0, sizeof(CACHE_STAMP));
+    if ((n >= 2) && (executable[0] == L'\"') && (executable[n - 1] == L'\"')) {
+        n -= 2;
+        memcpy(path, &executable[1], n * sizeof(wchar_t));
+        path[n] = L'\0';
+        executable = path;
+    }
+    return backend->file_stamp(backend->context, executable, stamp);
+}
+
+/* Fold a key's stamp into a view's. */
+static BOOL
+add_key_stamp(const CACHE_REGISTRY * registry, void * key,
+              CACHE_STAMP * stamp)
+{
+    CACHE_STAMP key_stamp;
+
+    memset(&key_stamp, 0, sizeof(key_stamp));
+    if (!registry->key_stamp(registry->context, key, &key_stamp))
+        return FALSE;
+    if (key_stamp.time > stamp->time)
+        stamp->time = key_stamp.time;
+    stamp->size += key_stamp.size;
+    return TRUE;
+}
+
+/* Fold in a tag's key and its InstallPath key. */
+static BOOL
+add_tag_stamp(const CACHE_REGISTRY * registry, int view, void * tag_key,
+              CACHE_STAMP * stamp)
+{
+    void * install_key;
+    BOOL result = add_key_stamp(registry, tag_key, stamp);
+
+    install_key = registry->open_key(registry->context, view, tag_key,
+                                     L"InstallPath");
+    if (install_key != NULL) {
+        result = result && add_key_stamp(registry, install_key, stamp);
+        registry->close_key(registry->context, install_key);
+    }
+    return result;
+}
+
+static BOOL
+add_company_stamp(const CACHE_REGISTRY * registry, int view,
+                  void * company_key, CACHE_STAMP * stamp)
+{
+    wchar_t tag[MAX_VERSION_SIZE];
+    void * tag_key;
+    unsigned long i;
+    BOOL result = add_key_stamp(registry, company_key, stamp);
+
+    for (i = 0; result && registry->enum_key(registry->context, company_key,
+                                             i, tag, MAX_VERSION_SIZE); i++) {
+        tag_key = registry->open_key(registry->context, view, company_key,
+                                     tag);
+        if (tag_key != NULL) {
+            result = add_tag_stamp(registry, view, tag_key, stamp);
+            registry->close_key(registry->context, tag_key);
+        }
+    }
+    return result;
+}
+
+BOOL
+cache_stamp_registry(const CACHE_REGISTRY * registry, int view,
+                     CACHE_STAMP * stamp)
+{
+    wchar_t company[MAX_COMPANY_SIZE];
+    void * python_key;
+    void * company_key;
+    unsigned long i;
+    BOOL result;
+
+    memset(stamp, 0, sizeof(CACHE_STAMP));
+    python_key = registry->open_key(registry->context, view, NULL, NULL);
+    if (python_key == NULL)
+        return FALSE;
+    result = add_key_stamp(registry, python_key, stamp);
+    for (i = 0; result && registry->enum_key(registry->context, python_key,
+                                             i, company, MAX_COMPANY_SIZE);
+         i++) {
+        company_key = registry->open_key(registry->context, view, python_key,
+                                         company);
+        if (company_key != NULL) {
+            result = add_company_stamp(registry, view, company_key, stamp);
+            registry->close_key(registry->context, company_key);
+        }
+    }
+    registry->close_key(registry->context, python_key);
+    return result;
+}
+
+size_t
+cache_size(size_t num_pythons)
+{
+    return sizeof(CACHE_HEADER) + num_pythons * sizeof(CACHE_ENTRY);
+}
+
+void
+cache_stamp_views(const CACHE_BACKEND * backend, const int * views,
+                  int num_views, CACHE_STAMP * stamps)
+{
+    int i;
+
+    for (i = 0; i < num_views; i++) {
+        memset(&stamps[i], 0, sizeof(CACHE_STAMP));
+        backend->view_stamp(backend->context, views[i], &stamps[i]);
+    }
+}
+
+size_t
+cache_build(const CACHE_BACKEND * backend, const int * views,
+            const CACHE_STAMP * stamps, int num_views,
+            const INSTALLED_PYTHON * pythons, size_t num_pythons,
+            void ** data)
+{
+    size_t size = cache_size(num_pythons);
+    CACHE_HEADER * header;
+    CACHE_ENTRY * entry;
+    size_t i;
+
+    *data = NULL;
+    if ((num_views < 0) || (num_views > CACHE_MAX_VIEWS))
+        return 0;
+    header = calloc(1, size);   /* zeroes any padding, too */
+    if (header == NULL)
+        return 0;
+    header->magic = CACHE_MAGIC;
+    header->format = CACHE_FORMAT_VERSION;
+    header->char_size = sizeof(wchar_t);
+    header->entry_size = sizeof(CACHE_ENTRY);
+    header->num_views = num_views;
+    header->num_entries = (unsigned int) num_pythons;
+    memcpy(header->views, views, num_views * sizeof(int));
+    memcpy(header->view_stamps, stamps, num_views * sizeof(CACHE_STAMP));
+    entry = (CACHE_ENTRY *) &header[1];
+    for (i = 0; i < num_pythons; i++, entry++) {
+        entry->python = pythons[i];
+        cache_stamp_file(backend, pythons[i].executable, &entry->stamp);
+    }
+    header->checksum = cache_checksum(header, size);
+    *data = header;
+    return size;
+}
+
+long
+cache_validate(const CACHE_BACKEND * backend, const int * views,
+               int num_views, const void * data, size_t size)
+{
+    CACHE_HEADER header;
+    CACHE_STAMP stamp;
+    CACHE_ENTRY entry;
+    const unsigned char * p;
+    unsigned int i;
+
+    if ((data == NULL) || (size < sizeof(header)))
+        return -1;
+    memcpy(&header, data, sizeof(header));
+    if ((header.magic != CACHE_MAGIC) ||
+        (header.format != CACHE_FORMAT_VERSION) ||
+        (header.char_size != sizeof(wchar_t)) ||
+        (header.entry_size != sizeof(CACHE_ENTRY)) ||
+        (header.num_views != (unsigned int) num_views) ||
+        (size != cache_size(header.num_entries)) ||
+        (header.checksum != cache_checksum(data, size)))
+        return -1;
+    if (memcmp(header.views, views, num_views * sizeof(int)))
+        return -1;
+    /* Registry checks first - they're cheaper than touching the disk. */
+    for (i = 0; i < header.num_views; i++) {
+        memset(&stamp, 0, sizeof(stamp));
+        backend->view_stamp(backend->context, views[i], &stamp);
+        if (memcmp(&stamp, &header.view_stamps[i], sizeof(stamp)))
+            return -1;
+    }
+    p = (const unsigned char *) data + sizeof(header);
+    for (i = 0; i < header.num_entries; i++, p += sizeof(entry)) {
+        memcpy(&entry, p, sizeof(entry));
+        entry.python.executable[MAX_PATH - 1] = L'\0';
+        if (!cache_stamp_file(backend, entry.python.executable, &stamp) ||
+            memcmp(&stamp, &entry.stamp, sizeof(stamp)))
+            return -1;
+    }
+    return (long) header.num_entries;
+}
+
+void
+cache_get(const void * data, size_t index, INSTALLED_PYTHON * ip)
+{
+    CACHE_ENTRY entry;
+
+    memcpy(&entry, (const unsigned char *) data + cache_size(index),
+           sizeof(entry));
+    entry.python.version[MAX_VERSION_SIZE - 1] = L'\0';
+    entry.python.executable[MAX_PATH - 1] = L'\0';
+    entry.python.company[MAX_COMPANY_SIZE - 1] = L'\0';
+    *ip = entry.python;
+}
@@ -0,0 +1,119 @@
+/*
+ * On-disk cache of the table of installed Pythons built by
+ * locate_all_pythons().
+ *
+ * The cache records, for each registry view which was scanned, a stamp of
+ * its SOFTWARE\Python key and the keys under it (see cache_stamp_registry()),
+ * and for each installed Python the last-write time and size of its
+ * executable. A cache
+ * is only used if all of these still match; otherwise the registry is
+ * scanned again and the cache rewritten.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef INSTALL_CACHE_H
+#define INSTALL_CACHE_H
+
+#include "launcher.h"
+
+#define CACHE_MAGIC             0x4359504CU     /* "LPYC" */
+#define CACHE_FORMAT_VERSION    4
+#define CACHE_MAX_VIEWS         4
+
+typedef struct {
+    unsigned long long time;    /* last-write time, 0 if absent */
+    unsigned long long size;    /* file size or number of subkeys */
+} CACHE_STAMP;
+
+/*
+ * The backend knows how to stamp registry views and files. A view is
+ * identified by an integer chosen by the caller. Each function returns FALSE
+ * if the view or file doesn't exist, in which case the stamp is left zeroed.
+ */
+typedef struct {
+    void * context;
+    BOOL (*view_stamp)(void * context, int view, CACHE_STAMP * stamp);
+    BOOL (*file_stamp)(void * context, const wchar_t * path,
+                       CACHE_STAMP * stamp);
+} CACHE_BACKEND;
+
+/*
+ * The registry, as seen by cache_stamp_registry(), which walks it with these.
+ */
+typedef struct {
+    void * context;
+    /*
+     * Open SOFTWARE\Python in a view if parent is NULL, or else the subkey
+     * 'name' of parent, an open key in the same view. Returns NULL if
+     * there's no such key.
+     */
+    void * (*open_key)(void * context, int view, void * parent,
+                       const wchar_t * name);
+    /*
+     * Copy the name of subkey 'index' of an open key into name, which holds
+     * size characters. Returns FALSE if there are no more subkeys.
+     */
+    BOOL (*enum_key)(void * context, void * key, unsigned long index,
+                     wchar_t * name, size_t size);
+    /*
+     * Stamp an open key with its last-write time and number of subkeys.
+     * Returns FALSE if it can't be queried.
+     */
+    BOOL (*key_stamp)(void * context, void * key, CACHE_STAMP * stamp);
+    void (*close_key)(void * context, void * key);
+} CACHE_REGISTRY;
+
+/*
+ * Stamp a registry view, for a CACHE_BACKEND's view_stamp(). The stamp
+ * covers SOFTWARE\Python, each company's key under it, each of their tags'
+ * keys and each tag's InstallPath key: its time is the latest of their
+ * last-write times, and its size the total of their subkeys. A key's
+ * last-write time changes when a subkey is added or removed and when one of
+ * its values is written, so the stamp changes when a company or an
+ * installation is added or removed, and when an installation is registered
+ * again or moved - which rewrites InstallPath, or ExecutablePath in it - even
+ * under the same tag. Returns FALSE, with the stamp zeroed, if the view has
+ * no SOFTWARE\Python, and FALSE if any key couldn't be queried.
+ */
+BOOL cache_stamp_registry(const CACHE_REGISTRY * registry, int view,
+                          CACHE_STAMP * stamp);
+
+/*
+ * Stamp a file, which may be quoted (as an executable containing spaces is,
+ * on a command line). Returns FALSE, with the stamp zeroed, if it doesn't
+ * exist.
+ */
+BOOL cache_stamp_file(const CACHE_BACKEND * backend, const wchar_t * path,
+                      CACHE_STAMP * stamp);
+
+/* Size in bytes of a cache holding num_pythons entries. */
+size_t cache_size(size_t num_pythons);
+
+/*
+ * Stamp each of the views. Call this *before* scanning the registry, so that
+ * a change made while the scan is in progress invalidates the cache.
+ */
+void cache_stamp_views(const CACHE_BACKEND * backend, const int * views,
+                       int num_views, CACHE_STAMP * stamps);
+
+/*
+ * Serialize a cache. On success, *data points to a malloc'd block which the
+ * caller must free, and its size is returned. Returns 0 on failure.
+ */
+size_t cache_build(const CACHE_BACKEND * backend, const int * views,
+                   const CACHE_STAMP * stamps, int num_views,
+                   const INSTALLED_PYTHON * pythons, size_t num_pythons,
+                   void ** data);
+
+/*
+ * Check that a cache is well-formed, was built for the same views and is
+ * still up to date. Returns the number of entries if so, else -1.
+ */
+long cache_validate(const CACHE_BACKEND * backend, const int * views,
+                    int num_views, const void * data, size_t size);
+
+/* Copy out entry 'index' of a cache which has been validated. */
+void cache_get(const void * data, size_t index, INSTALLED_PYTHON * ip);
+
+#endif
@@ -0,0 +1,175 @@
+/*
+ * The launcher's side of the launch server protocol.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <limits.h>
+#include <string.h>
+
+#include "launch_server.h"
+
+/* Writes to a buffer, or just counts, if there's no room. */
+typedef struct {
+    unsigned char * p;
+    size_t size;
+    size_t used;
+} WRITER;
+
+static void
+put_byte(WRITER * w, unsigned int c)
+{
+    if ((w->p != NULL) && (w->used < w->size))
+        w->p[w->used] = (unsigned char) c;
+    ++w->used;
+}
+
+static void
+put_u32(WRITER * w, unsigned long n)
+{
+    int i;
+
+    for (i = 0; i < 4; i++) {
+        put_byte(w, n & 0xFF);
+        n >>= 8;
+    }
+}
+
+/* Write a character as UTF-8 (or WTF-8, for an unpaired surrogate). */
+static void
+put_char(WRITER * w, unsigned long c)
+{
+    if (c < 0x80)
+        put_byte(w, c);
+    else if (c < 0x800) {
+        put_byte(w, 0xC0 | (c >> 6));
+        put_byte(w, 0x80 | (c & 0x3F));
+    }
+    else if (c < 0x10000) {
+        put_byte(w, 0xE0 | (c >> 12));
+        put_byte(w, 0x80 | ((c >> 6) & 0x3F));
+        put_byte(w, 0x80 | (c & 0x3F));
+    }
+    else {
+        put_byte(w, 0xF0 | (c >> 18));
+        put_byte(w, 0x80 | ((c >> 12) & 0x3F));
+        put_byte(w, 0x80 | ((c >> 6) & 0x3F));
+        put_byte(w, 0x80 | (c & 0x3F));
+    }
+}
+
+static void
+put_chars(WRITER * w, const wchar_t * s)
+{
+    unsigned long c;
+
+    for (; *s; s++) {
+        c = (unsigned long) *s;
+#if WCHAR_MAX <= 0xFFFF
+        if ((c >= 0xD800) && (c < 0xDC00) && (s[1] >= 0xDC00) &&
+            (s[1] < 0xE000)) {
+            c = 0x10000 + ((c - 0xD800) << 10) + ((unsigned long) s[1] -
+                                                   0xDC00);
+            ++s;
+        }
+#endif
+        if (c > 0x10FFFF)
+            c = 0xFFFD;
+        put_char(w, c);
+    }
+}
+
+/* A string: its length in bytes, then its bytes. */
+static void
+put_string(WRITER * w, const wchar_t * s)
+{
+    WRITER counter = { NULL, 0, 0 };
+
+    if (s == NULL)
+        s = L"";
+    put_chars(&counter, s);
+    put_u32(w, (unsigned long) counter.used);
+    put_chars(w, s);
+}
+
+static void
+put_ascii(WRITER * w, const char * s)
+{
+    if (s == NULL)
+        s = "";
+    put_u32(w, (unsigned long) strlen(s));
+    for (; *s; s++)
+        put_byte(w, (unsigned char) *s);
+}
+
+void
+server_make_header(int type, size_t length, unsigned char * header)
+{
+    WRITER w = { header, SERVER_HEADER_SIZE, 0 };
+
+    put_byte(&w, type);
+    put_u32(&w, (unsigned long) length);
+}
+
+BOOL
+server_parse_header(const unsigned char * header, int * type,
+                    size_t * length)
+{
+    unsigned long n = 0;
+    int i;
+
+    for (i = 4; i >= 1; i--)
+        n = (n << 8) | header[i];
+    *type = header[0];
+    *length = n;
+    return n <= SERVER_MAX_PAYLOAD;
+}
+
+size_t
+server_encode_request(const SERVER_REQUEST_INFO * request,
+                      unsigned char * buffer, size_t size)
+{
+    WRITER w = { buffer, size, SERVER_HEADER_SIZE };
+    const wchar_t * p;
+    unsigned long count = 0;
+    int i;
+
+    put_ascii(&w, request->token);
+    put_string(&w, request->version);
+    put_string(&w, request->executable);
+    put_string(&w, request->cwd);
+    put_u32(&w, (unsigned long) request->argc);
+    for (i = 0; i < request->argc; i++)
+        put_string(&w, request->argv[i]);
+    if (request->environment != NULL) {
+        for (p = request->environment; *p; p += wcslen(p) + 1) {
+            if (*p != L'=')
+                ++count;
+        }
+    }
+    put_u32(&w, count);
+    if (request->environment != NULL) {
+        for (p = request->environment; *p; p += wcslen(p) + 1) {
+            if (*p != L'=')
+                put_string(&w, p);
+        }
+    }
+    if ((buffer != NULL) && (w.used <= size))
+        server_make_header(SERVER_REQUEST, w.used - SERVER_HEADER_SIZE,
+                           buffer);
+    return w.used;
+}
+
+int
+server_exit_code(const unsigned char * payload)
+{
+    unsigned long n = 0;
+    int i;
+
+    for (i = 3; i >= 0; i--)
+        n = (n << 8) | payload[i];
+    /* two's complement, without relying on how the cast does it */
+    if (n & 0x80000000UL)
+        return (int) ((long long) n - 0x100000000LL);
+    return (int) n;
+}
@@ -0,0 +1,82 @@
+/*
+ * The launcher's side of the protocol spoken with a launch server
+ * (launchserver.py in the source distribution), which keeps interpreters
+ * started and waiting, so that a script can be handed to one rather than
+ * starting a new process for it.
+ *
+ * The launcher connects to the server over TCP on the loopback interface,
+ * at the port given in the server's address file, and the two exchange
+ * frames: a type byte, the length of the payload (4 bytes, little-endian),
+ * and the payload. The launcher sends a request, holding the server's
+ * token (also from the address file, which only its user can read), the
+ * version tag and executable of the Python to run the script with, the
+ * current directory, the arguments (the script and its arguments) and the
+ * environment. Each string is its length (4 bytes, little-endian) and its
+ * characters in UTF-8 - or rather WTF-8, so that unpaired surrogates survive
+ * - and each list of strings starts with how many there are (4 bytes).
+ *
+ * The server answers with SERVER_ACCEPT, or SERVER_REFUSE and a reason, in
+ * which case the launcher runs the script itself as usual. Once accepted,
+ * the launcher relays its standard input as SERVER_STDIN frames, an empty
+ * one marking the end; the server relays the script's output as
+ * SERVER_STDOUT and SERVER_STDERR frames, and finally sends SERVER_EXIT
+ * with the exit code (4 bytes, little-endian, signed).
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef LAUNCH_SERVER_H
+#define LAUNCH_SERVER_H
+
+#include "launcher.h"
+
+#define SERVER_HEADER_SIZE  5
+#define SERVER_MAX_PAYLOAD  (64 * 1024 * 1024)
+
+/* Frame types */
+#define SERVER_REQUEST  'Q'
+#define SERVER_ACCEPT   'A'
+#define SERVER_REFUSE   'R'
+#define SERVER_STDIN    'I'
+#define SERVER_STDOUT   'O'
+#define SERVER_STDERR   'E'
+#define SERVER_EXIT     'X'
+#define SERVER_STATS    'S'
+
+typedef struct {
+    const char * token;
+    const wchar_t * version;    /* the registry tag, or empty if unknown */
+    const wchar_t * executable;
+    const wchar_t * cwd;
+    int argc;
+    wchar_t ** argv;
+    /*
+     * An environment block, as from GetEnvironmentStringsW(): strings, each
+     * ending with a NUL, and an empty one to end the block. Entries which
+     * start with '=' (Windows' per-drive directories) aren't sent.
+     */
+    const wchar_t * environment;
+} SERVER_REQUEST_INFO;
+
+/* Fill in the header for a frame. */
+void server_make_header(int type, size_t length, unsigned char * header);
+
+/*
+ * Read a frame header, returning FALSE if its payload would be longer than
+ * SERVER_MAX_PAYLOAD.
+ */
+BOOL server_parse_header(const unsigned char * header, int * type,
+                         size_t * length);
+
+/*
+ * Encode a request, header and all, into buffer, if it's at least size
+ * bytes. Returns the size of the whole frame, so call with a NULL buffer
+ * first to find how big it must be.
+ */
+size_t server_encode_request(const SERVER_REQUEST_INFO * request,
+                             unsigned char * buffer, size_t size);
+
+/* The exit code in a SERVER_EXIT frame's payload. */
+int server_exit_code(const unsigned char * payload);
+
+#endif
@@ -29,11 +29,26 @@
  * Curt Hagenlocher (job management)
  */
 
+#include <winsock2.h>   /* before windows.h, which would include winsock.h */
 #include <windows.h>
 #include <shlobj.h>
 #include <stdio.h>
 #include <tchar.h>
 
+#include "launcher.h"
+#include "discovery.h"
+#include "ini_config.h"
+#include "install_cache.h"
+#include "launch_server.h"
+#include "path_index.h"
+#include "script_header.h"
+#include "shebang.h"
+#include "plan_cache.h"
+#include "project.h"
+#include "trace.h"
+#include "version_index.h"
+#include "wrapper_archive.h"
+
 #define BUFSIZE 256
 #define MSGSIZE 1024
 
@@ -86,6 +101,248 @@ debug(wchar_t * format, ...)
     }
 }
 
+static LONGLONG
+get_ticks()
+{
+    LARGE_INTEGER counter;
+
+    QueryPerformanceCounter(&counter);
+    return counter.QuadPart;
+}
+
+static double
+ticks_to_us(LONGLONG ticks)
+{
+    static LARGE_INTEGER frequency;
+
+    if (frequency.QuadPart == 0)
+        QueryPerformanceFrequency(&frequency);
+    return (ticks * 1000000.0) / frequency.QuadPart;
+}
+
+/*
+ * Time spent in each phase of a launch. With PYLAUNCH_DEBUG set, these are
+ * reported on a "timings:" line just after the child has been created (see
+ * bench_startup.py). The shebang phase includes any command lookup.
+ */
+#define TIMING_CONFIG       0   /* finding and reading py.ini files */
+#define TIMING_VERSION      1   /* reading the launcher's version resource */
+#define TIMING_DISCOVERY    2   /* finding installed Pythons */
+#define TIMING_SHEBANG      3   /* reading and parsing a script's header */
+#define TIMING_PATH         4   /* searching PATH */
+#define TIMING_CHILD        5   /* creating the child process */
+#define NUM_TIMINGS         6
+
+static wchar_t * timing_names[NUM_TIMINGS] = {
+    L"config", L"version", L"discovery", L"shebang", L"path", L"child"
+};
+
+static LONGLONG timings[NUM_TIMINGS];
+static LONGLONG launch_start;
+
+static void
+report_timings()
+{
+    int i;
+
+    debug(L"timings:");
+    for (i = 0; i < NUM_TIMINGS; i++)
+        debug(L" %ls=%.1f", timing_names[i], ticks_to_us(timings[i]));
+    debug(L" total=%.1f (microseconds)\n",
+          ticks_to_us(get_ticks() - launch_start));
+}
+
+/*
+ * Structured tracing (see trace.h). PYLAUNCH_TRACE is either "stderr" or the
+ * path of a file to append events to. PYLAUNCH_TRACE_SUMMARY is the path of
+ * a log to which one line is appended per launch, giving the phase timings
+ * and a histogram of the time taken by each kind of event; it is rotated
+ * (to the same name with ".1" added) once it reaches TRACE_SUMMARY_SIZE.
+ * Either variable turns tracing on. Each event's t_us is when it started,
+ * relative to the start of the launch, and events are added as they end.
+ */
+#define EVENT_START             0
+#define EVENT_CONFIG_LOCATE     1
+#define EVENT_CONFIG_READ       2
+#define EVENT_VERSION_INFO      3
+#define EVENT_DISCOVERY_CACHE   4
+#define EVENT_REGISTRY_VIEW     5
+#define EVENT_PROBE             6
+#define EVENT_SHEBANG           7
+#define EVENT_COMMAND           8
+#define EVENT_PATH_SEARCH       9
+#define EVENT_CREATE_PROCESS    10
+#define EVENT_CHILD_EXIT        11
+#define EVENT_ERROR             12
+#define EVENT_PLAN_CACHE        13
+#define EVENT_LAUNCH_SERVER     14
+#define EVENT_PROJECT           15
+#define NUM_EVENTS              16
+
+static char * event_names[NUM_EVENTS] = {
+    "start", "config_locate", "config_read", "version_info",
+    "discovery_cache", "registry_view", "probe", "shebang", "command",
+    "path_search", "create_process", "child_exit", "error", "plan_cache",
+    "launch_server", "project"
+};
+
+#define TRACE_SUMMARY_SIZE  (1024 * 1024)
+
+static BOOL tracing = FALSE;
+static BOOL trace_to_stderr = FALSE;
+static wchar_t trace_path[MAX_PATH];
+static wchar_t trace_summary_path[MAX_PATH];
+static HANDLE trace_handle = INVALID_HANDLE_VALUE;
+static TRACE trace;
+static HISTOGRAM event_times[NUM_EVENTS];
+static int launch_rc = 0;   /* the exit code, for the summary */
+
+/*
+ * Record an event which started at t0 and ended at t1. Returns TRUE if the
+ * caller should add any fields and then call trace_end(); otherwise, the
+ * event is at most counted in the summary.
+ */
+static BOOL
+trace_span(int kind, LONGLONG t0, LONGLONG t1)
+{
+    double duration;
+
+    if (!tracing)
+        return FALSE;
+    duration = ticks_to_us(t1 - t0);
+    histogram_add(&event_times[kind], duration);
+    if (!trace_to_stderr && !trace_path[0])
+        return FALSE;
+    trace_begin(&trace, event_names[kind], ticks_to_us(t0 - launch_start));
+    trace_number(&trace, "dur_us", duration);
+    return TRUE;
+}
+
+/* Record an event which started at t0 and has just ended. */
+static BOOL
+trace_event(int kind, LONGLONG t0)
+{
+    return tracing && trace_span(kind, t0, get_ticks());
+}
+
+/* Add the fields identifying a launch. */
+static void
+trace_launch()
+{
+    FILETIME now;
+    ULONGLONG t;
+
+    GetSystemTimeAsFileTime(&now);
+    t = ((ULONGLONG) now.dwHighDateTime << 32) | now.dwLowDateTime;
+    trace_integer(&trace, "pid", GetCurrentProcessId());
+    /* FILETIMEs count 100ns intervals from 1601 */
+    trace_integer(&trace, "time_ms",
+                  (long long) ((t - 116444736000000000ULL) / 10000));
+    trace_string(&trace, "command_line", GetCommandLineW());
+}
+
+static void
+write_data(HANDLE h, const char * data, size_t size)
+{
+    DWORD written;
+
+    while (size > 0) {
+        if (!WriteFile(h, data, (DWORD) size, &written, NULL) ||
+            (written == 0))
+            break;
+        data += written;
+        size -= written;
+    }
+}
+
+/*
+ * Write out the events buffered so far. The trace file is opened for
+ * appending, so that each flush lands in one piece even when several
+ * launchers share a file.
+ */
+static void
+flush_trace()
+{
+    if (trace.length == 0)
+        return;
+    if (trace_to_stderr) {
+        fflush(stderr);
+        write_data(GetStdHandle(STD_ERROR_HANDLE), trace.data, trace.length);
+    }
+    else if (trace_path[0]) {
+        if (trace_handle == INVALID_HANDLE_VALUE)
+            trace_handle = CreateFileW(trace_path, FILE_APPEND_DATA,
+                                       FILE_SHARE_READ | FILE_SHARE_WRITE |
+                                       FILE_SHARE_DELETE, NULL, OPEN_ALWAYS,
+                                       FILE_ATTRIBUTE_NORMAL, NULL);
+        if (trace_handle != INVALID_HANDLE_VALUE)
+            write_data(trace_handle, trace.data, trace.length);
+    }
+    trace_clear(&trace);
+}
+
+/*
+ * Append a line to the summary log, first rotating it if it has grown too
+ * big. Rotation is best effort: if two launchers rotate at once, a few
+ * summaries may be lost.
+ */
+static void
+append_summary(const char * data, size_t size)
+{
+    WIN32_FILE_ATTRIBUTE_DATA info;
+    wchar_t old_path[MAX_PATH + 2];
+    HANDLE h;
+
+    if (GetFileAttributesExW(trace_summary_path, GetFileExInfoStandard,
+                             &info) &&
+        (info.nFileSizeHigh || (info.nFileSizeLow >= TRACE_SUMMARY_SIZE))) {
+        _snwprintf_s(old_path, MAX_PATH + 2, _TRUNCATE, L"%ls.1",
+                     trace_summary_path);
+        MoveFileExW(trace_summary_path, old_path, MOVEFILE_REPLACE_EXISTING);
+    }
+    h = CreateFileW(trace_summary_path, FILE_APPEND_DATA,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_ALWAYS, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h != INVALID_HANDLE_VALUE) {
+        write_data(h, data, size);
+        CloseHandle(h);
+    }
+}
+
+/* Called at exit: add the summary, and write everything out. */
+static void
+finish_trace()
+{
+    size_t start = trace.length;
+    char name[32];
+    int i;
+
+    trace_begin(&trace, "summary", ticks_to_us(get_ticks() - launch_start));
+    trace_launch();
+    trace_integer(&trace, "rc", launch_rc);
+    trace_number(&trace, "total_us",
+                 ticks_to_us(get_ticks() - launch_start));
+    for (i = 0; i < NUM_TIMINGS; i++) {
+        _snprintf_s(name, sizeof(name), _TRUNCATE, "%ls_us",
+                    timing_names[i]);
+        trace_number(&trace, name, ticks_to_us(timings[i]));
+    }
+    for (i = 0; i < NUM_EVENTS; i++) {
+        if (event_times[i].count)
+            trace_histogram(&trace, event_names[i], &event_times[i]);
+    }
+    trace_integer(&trace, "dropped", trace.dropped);
+    trace_end(&trace);
+    if (trace_summary_path[0] && (trace.length > start))
+        append_summary(&trace.data[start], trace.length - start);
+    if (!trace_to_stderr && !trace_path[0])
+        trace_clear(&trace);
+    flush_trace();
+    if (trace_handle != INVALID_HANDLE_VALUE)
+        CloseHandle(trace_handle);
+    trace_free(&trace);
+}
+
 static void
 winerror(int rc, wchar_t * message, int size)
 {
@@ -113,6 +370,12 @@ error(int rc, wchar_t * format, ... )
                          win_message);
         }
     }
+    launch_rc = rc;
+    if (trace_event(EVENT_ERROR, get_ticks())) {
+        trace_integer(&trace, "rc", rc);
+        trace_string(&trace, "message", message);
+        trace_end(&trace);
+    }
 
 #if !defined(_WINDOWS)
     fwprintf(stderr, L"%ls\n", message);
@@ -158,350 +421,1215 @@ static wchar_t * get_env(wchar_t * key)
 
 #if defined(_WINDOWS)
 
+#define PYTHON_STEM L"pythonw"
 #define PYTHON_EXECUTABLE L"pythonw.exe"
 
 #else
 
+#define PYTHON_STEM L"python"
 #define PYTHON_EXECUTABLE L"python.exe"
 
 #endif
 
-#define MAX_VERSION_SIZE    4
-
-typedef struct {
-    wchar_t version[MAX_VERSION_SIZE]; /* m.n */
-    int bits;   /* 32 or 64 */
-    wchar_t executable[MAX_PATH];
-} INSTALLED_PYTHON;
+#if defined(_M_X64)
+#define LAUNCHER_BITS   64
+#else
+#define LAUNCHER_BITS   32
+#endif
 
 /*
- * To avoid messing about with heap allocations, just assume we can allocate
- * statically and never have to deal with more versions than this.
+ * The table of installed Pythons grows as needed. Once discovery is complete
+ * it is sorted with compare_installed(), and version_index maps each version
+ * request to the best entry for it.
  */
-#define MAX_INSTALLED_PYTHONS   100
-
-static INSTALLED_PYTHON installed_pythons[MAX_INSTALLED_PYTHONS];
-
+static INSTALLED_PYTHON * installed_pythons = NULL;
 static size_t num_installed_pythons = 0;
+static size_t max_installed_pythons = 0;
+static VERSION_INDEX version_index;
 
-/* to hold SOFTWARE\Python\PythonCore\X.Y\InstallPath */
-#define IP_BASE_SIZE 40
-#define IP_VERSION_SIZE 8
-#define IP_SIZE (IP_BASE_SIZE + IP_VERSION_SIZE)
-#define CORE_PATH L"SOFTWARE\\Python\\PythonCore"
-
-static wchar_t * location_checks[] = {
-    L"\\",
-    L"\\PCBuild\\win32\\",
-    L"\\PCBuild\\amd64\\",
-    // To support early 32bit versions of Python that stuck the build binaries
-    // directly in PCBuild...
-    L"\\PCBuild\\",
-    NULL
-};
+/* A sanity limit on the size of a discovery cache we'll read. */
+#define MAX_CACHED_PYTHONS  4096
+
+#define PYTHON_PATH L"SOFTWARE\\Python"
 
+/*
+ * Append a copy of *ip to installed_pythons, returning the copy.
+ */
 static INSTALLED_PYTHON *
-find_existing_python(wchar_t * path)
+add_installed_python(const INSTALLED_PYTHON * ip)
 {
-    INSTALLED_PYTHON * result = NULL;
-    size_t i;
-    INSTALLED_PYTHON * ip;
+    INSTALLED_PYTHON * p;
+    size_t n;
 
-    for (i = 0, ip = installed_pythons; i < num_installed_pythons; i++, ip++) {
-        if (_wcsicmp(path, ip->executable) == 0) {
-            result = ip;
-            break;
-        }
+    if (num_installed_pythons == max_installed_pythons) {
+        n = max_installed_pythons ? 2 * max_installed_pythons : 16;
+        p = realloc(installed_pythons, n * sizeof(INSTALLED_PYTHON));
+        if (p == NULL)
+            error(RC_NO_MEMORY, L"Could not allocate table of installed \
+Pythons");
+        installed_pythons = p;
+        max_installed_pythons = n;
     }
+    p = &installed_pythons[num_installed_pythons];
+    *p = *ip;
+    p->order = (unsigned int) num_installed_pythons++;
+    return p;
+}
+
+static void
+index_installed_pythons()
+{
+    version_index_free(&version_index);
+    if (!version_index_build(&version_index, installed_pythons,
+                             num_installed_pythons))
+        error(RC_NO_MEMORY, L"Could not allocate version index");
+}
+
+/*
+ * The registry views to scan, in priority order. Each view is encoded as a
+ * small integer so that it can be recorded in the discovery cache.
+ */
+#define VIEW_HKLM       1
+#define VIEW_WOW64_32   2
+#define VIEW_WOW64_64   4
+
+static int registry_views[CACHE_MAX_VIEWS];
+static int num_registry_views = 0;
+
+static wchar_t *
+view_root_name(int view)
+{
+    return (view & VIEW_HKLM) ? L"HKLM" : L"HKCU";
+}
+
+static wchar_t *
+view_name(int view)
+{
+    return (view & VIEW_WOW64_32) ? L"32bit" :
+           (view & VIEW_WOW64_64) ? L"64bit" : L"native";
+}
+
+static HKEY
+view_root(int view)
+{
+    return (view & VIEW_HKLM) ? HKEY_LOCAL_MACHINE : HKEY_CURRENT_USER;
+}
+
+static REGSAM
+view_flags(int view)
+{
+    REGSAM result = KEY_READ;
+
+    if (view & VIEW_WOW64_32)
+        result |= KEY_WOW64_32KEY;
+    if (view & VIEW_WOW64_64)
+        result |= KEY_WOW64_64KEY;
     return result;
 }
 
+/*
+ * The registry and file system, as seen by discovery (see discovery.h). These
+ * are called from discovery's worker threads, so they mustn't trace.
+ */
+
+static void *
+registry_open_key(void * context, int view, const wchar_t * company)
+{
+    wchar_t path[MAX_PATH];
+    HKEY key;
+
+    if (company == NULL)
+        wcscpy_s(path, MAX_PATH, PYTHON_PATH);
+    else
+        _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\%ls", PYTHON_PATH,
+                     company);
+    if (RegOpenKeyExW(view_root(view), path, 0, view_flags(view),
+                      &key) != ERROR_SUCCESS)
+        return NULL;
+    return key;
+}
+
+static BOOL
+registry_enum_key(void * context, void * key, unsigned long index,
+                  wchar_t * name, size_t size)
+{
+    LSTATUS status = RegEnumKeyW((HKEY) key, index, name, (DWORD) size);
+
+    if ((status != ERROR_SUCCESS) && (status != ERROR_NO_MORE_ITEMS))
+        debug(L"Can't enumerate registry key %lu: error %ld\n", index,
+              status);
+    return status == ERROR_SUCCESS;
+}
+
 static void
-locate_pythons_for_key(HKEY root, REGSAM flags)
+registry_close_key(void * context, void * key)
 {
-    HKEY core_root, ip_key;
-    LSTATUS status = RegOpenKeyExW(root, CORE_PATH, 0, flags, &core_root);
-    wchar_t message[MSGSIZE];
-    DWORD i;
-    size_t n;
-    BOOL ok;
-    DWORD type, data_size, attrs;
-    INSTALLED_PYTHON * ip, * pip;
-    wchar_t ip_version[IP_VERSION_SIZE];
-    wchar_t ip_path[IP_SIZE];
-    wchar_t * check;
-    wchar_t ** checkp;
-    wchar_t *key_name = (root == HKEY_LOCAL_MACHINE) ? L"HKLM" : L"HKCU";
-
-    if (status != ERROR_SUCCESS)
-        debug(L"locate_pythons_for_key: unable to open PythonCore key in %ls\n",
-              key_name);
-    else {
-        ip = &installed_pythons[num_installed_pythons];
-        for (i = 0; num_installed_pythons < MAX_INSTALLED_PYTHONS; i++) {
-            status = RegEnumKeyW(core_root, i, ip_version, IP_VERSION_SIZE);
-            if (status != ERROR_SUCCESS) {
-                if (status != ERROR_NO_MORE_ITEMS) {
-                    /* unexpected error */
-                    winerror(status, message, MSGSIZE);
-                    debug(L"Can't enumerate registry key for version %ls: %ls\n",
-                          ip_version, message);
-                }
-                break;
-            }
-            else {
-                wcsncpy_s(ip->version, MAX_VERSION_SIZE, ip_version,
-                          MAX_VERSION_SIZE-1);
-                _snwprintf_s(ip_path, IP_SIZE, _TRUNCATE,
-                             L"%ls\\%ls\\InstallPath", CORE_PATH, ip_version);
-                status = RegOpenKeyExW(root, ip_path, 0, flags, &ip_key);
-                if (status != ERROR_SUCCESS) {
-                    winerror(status, message, MSGSIZE);
-                    // Note: 'message' already has a trailing \n
-                    debug(L"%ls\\%ls: %ls", key_name, ip_path, message);
-                    continue;
-                }
-                data_size = sizeof(ip->executable) - 1;
-                status = RegQueryValueExW(ip_key, NULL, NULL, &type,
-                                          (LPBYTE)ip->executable, &data_size);
-                RegCloseKey(ip_key);
-                if (status != ERROR_SUCCESS) {
-                    winerror(status, message, MSGSIZE);
-                    debug(L"%ls\\%ls: %ls\n", key_name, ip_path, message);
-                    continue;
-                }
-                if (type == REG_SZ) {
-                    data_size = data_size / sizeof(wchar_t) - 1;  /* for NUL */
-                    if (ip->executable[data_size - 1] == L'\\')
-                        --data_size; /* reg value ended in a backslash */
-                    /* ip->executable is data_size long */
-                    for (checkp = location_checks; *checkp; ++checkp) {
-                        check = *checkp;
-                        _snwprintf_s(&ip->executable[data_size],
-                                     MAX_PATH - data_size,
-                                     MAX_PATH - data_size,
-                                     L"%ls%ls", check, PYTHON_EXECUTABLE);
-                        attrs = GetFileAttributesW(ip->executable);
-                        if (attrs == INVALID_FILE_ATTRIBUTES) {
-                            winerror(GetLastError(), message, MSGSIZE);
-                            debug(L"locate_pythons_for_key: %ls: %ls",
-                                  ip->executable, message);
-                        }
-                        else if (attrs & FILE_ATTRIBUTE_DIRECTORY) {
-                            debug(L"locate_pythons_for_key: '%ls' is a \
-directory\n",
-                                  ip->executable);
-                        }
-                        else if (find_existing_python(ip->executable)) {
-                            debug(L"locate_pythons_for_key: %ls: already \
-found\n", ip->executable);
-                        }
-                        else {
-                            /* check the executable type. */
-                            ok = GetBinaryTypeW(ip->executable, &attrs);
-                            if (!ok) {
-                                debug(L"Failure getting binary type: %ls\n",
-                                      ip->executable);
-                            }
-                            else {
-                                if (attrs == SCS_64BIT_BINARY)
-                                    ip->bits = 64;
-                                else if (attrs == SCS_32BIT_BINARY)
-                                    ip->bits = 32;
-                                else
-                                    ip->bits = 0;
-                                if (ip->bits == 0) {
-                                    debug(L"locate_pythons_for_key: %ls: \
-invalid binary type: %X\n",
-                                          ip->executable, attrs);
-                                }
-                                else {
-                                    if (wcschr(ip->executable, L' ') != NULL) {
-                                        /* has spaces, so quote */
-                                        n = wcslen(ip->executable);
-                                        memmove(&ip->executable[1],
-                                                ip->executable, n * sizeof(wchar_t));
-                                        ip->executable[0] = L'\"';
-                                        ip->executable[n + 1] = L'\"';
-                                        ip->executable[n + 2] = L'\0';
-                                    }
-                                    debug(L"locate_pythons_for_key: %ls \
-is a %dbit executable\n",
-                                          ip->executable, ip->bits);
-                                    ++num_installed_pythons;
-                                    pip = ip++;
-                                    if (num_installed_pythons >=
-                                        MAX_INSTALLED_PYTHONS)
-                                        break;
-                                    /* Copy over the attributes for the next */
-                                    *ip = *pip;
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
-        RegCloseKey(core_root);
+    RegCloseKey((HKEY) key);
+}
+
+/* Read a string value, which is left empty if it isn't one. */
+static BOOL
+query_string(HKEY key, wchar_t * name, wchar_t * value, DWORD size)
+{
+    DWORD type;
+    DWORD data_size = (size - 1) * sizeof(wchar_t);
+    LSTATUS status = RegQueryValueExW(key, name, NULL, &type, (LPBYTE) value,
+                                      &data_size);
+
+    if ((status != ERROR_SUCCESS) || (type != REG_SZ)) {
+        value[0] = L'\0';
+        return FALSE;
+    }
+    value[data_size / sizeof(wchar_t)] = L'\0';
+    return TRUE;
+}
+
+static BOOL
+registry_read_install(void * context, int view, const wchar_t * company,
+                      const wchar_t * tag, DISCOVERY_INSTALL * install)
+{
+    wchar_t path[MAX_PATH];
+    HKEY key;
+    BOOL result;
+
+    _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\%ls\\%ls", PYTHON_PATH,
+                 company, tag);
+    if (RegOpenKeyExW(view_root(view), path, 0, view_flags(view),
+                      &key) != ERROR_SUCCESS)
+        return FALSE;
+    query_string(key, L"SysVersion", install->sys_version, MAX_VERSION_SIZE);
+    RegCloseKey(key);
+    wcscat_s(path, MAX_PATH, L"\\InstallPath");
+    if (RegOpenKeyExW(view_root(view), path, 0, view_flags(view),
+                      &key) != ERROR_SUCCESS) {
+        debug(L"%ls\\%ls: not found\n", view_root_name(view), path);
+        return FALSE;
     }
+    result = query_string(key, NULL, install->install_path, MAX_PATH);
+    query_string(key, L"ExecutablePath", install->executable_path, MAX_PATH);
+    query_string(key, L"WindowedExecutablePath", install->windowed_path,
+                 MAX_PATH);
+    RegCloseKey(key);
+    return result;
 }
 
 static int
-compare_pythons(const void * p1, const void * p2)
+registry_probe(void * context, const wchar_t * path, int * bits)
 {
-    INSTALLED_PYTHON * ip1 = (INSTALLED_PYTHON *) p1;
-    INSTALLED_PYTHON * ip2 = (INSTALLED_PYTHON *) p2;
-    /* note reverse sorting on version */
-    int result = wcscmp(ip2->version, ip1->version);
+    DWORD attrs = GetFileAttributesW(path);
+
+    if (attrs == INVALID_FILE_ATTRIBUTES)
+        return PROBE_MISSING;
+    if (attrs & FILE_ATTRIBUTE_DIRECTORY)
+        return PROBE_DIRECTORY;
+    if (!GetBinaryTypeW(path, &attrs))
+        return PROBE_UNKNOWN_TYPE;
+    if (attrs == SCS_64BIT_BINARY)
+        *bits = 64;
+    else if (attrs == SCS_32BIT_BINARY)
+        *bits = 32;
+    else
+        return PROBE_INVALID_TYPE;
+    return PROBE_FOUND;
+}
 
-    if (result == 0)
-        result = ip2->bits - ip1->bits; /* 64 before 32 */
-    return result;
+static long long
+registry_now(void * context)
+{
+    return get_ticks();
 }
 
+static DISCOVERY_BACKEND registry_backend = {
+    NULL, registry_open_key, registry_enum_key, registry_close_key,
+    registry_read_install, registry_probe, registry_now
+};
+
 static void
-locate_all_pythons()
+get_registry_views()
 {
+#if !defined(_M_X64)
+    BOOL f64 = FALSE;
+#endif
+
+    if (num_registry_views)
+        return;
 #if defined(_M_X64)
     // If we are a 64bit process, first hit the 32bit keys.
-    debug(L"locating Pythons in 32bit registry\n");
-    locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ | KEY_WOW64_32KEY);
-    locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ | KEY_WOW64_32KEY);
+    registry_views[num_registry_views++] = VIEW_WOW64_32;
+    registry_views[num_registry_views++] = VIEW_HKLM | VIEW_WOW64_32;
 #else
     // If we are a 32bit process on a 64bit Windows, first hit the 64bit keys.
-    BOOL f64 = FALSE;
     if (IsWow64Process(GetCurrentProcess(), &f64) && f64) {
-        debug(L"locating Pythons in 64bit registry\n");
-        locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ | KEY_WOW64_64KEY);
-        locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ | KEY_WOW64_64KEY);
+        registry_views[num_registry_views++] = VIEW_WOW64_64;
+        registry_views[num_registry_views++] = VIEW_HKLM | VIEW_WOW64_64;
     }
 #endif
     // now hit the "native" key for this process bittedness.
-    debug(L"locating Pythons in native registry\n");
-    locate_pythons_for_key(HKEY_CURRENT_USER, KEY_READ);
-    locate_pythons_for_key(HKEY_LOCAL_MACHINE, KEY_READ);
-    qsort(installed_pythons, num_installed_pythons, sizeof(INSTALLED_PYTHON),
-          compare_pythons);
+    registry_views[num_registry_views++] = 0;
+    registry_views[num_registry_views++] = VIEW_HKLM;
 }
 
-static INSTALLED_PYTHON *
-find_python_by_version(wchar_t const * wanted_ver)
+/*
+ * Discovery cache support. The cache lives under the local application data
+ * folder and is keyed on the registry views scanned and the executables
+ * found, so it's never used once the set of installed Pythons has changed.
+ */
+
+static wchar_t cache_path[MAX_PATH];
+
+/*
+ * The local (non-roaming) application data folder, which holds the per-user
+ * py.ini and the discovery cache. It's looked up on first use, and as the
+ * LOCALAPPDATA environment variable normally names it, shell32 (which is
+ * delay-loaded) seldom needs to be asked.
+ */
+static wchar_t *
+get_appdata_dir()
 {
-    INSTALLED_PYTHON * result = NULL;
-    INSTALLED_PYTHON * ip = installed_pythons;
-    size_t i, n;
-    size_t wlen = wcslen(wanted_ver);
-    int bits = 0;
-
-    if (wcsstr(wanted_ver, L"-32"))
-        bits = 32;
-    for (i = 0; i < num_installed_pythons; i++, ip++) {
-        n = wcslen(ip->version);
-        if (n > wlen)
-            n = wlen;
-        if ((wcsncmp(ip->version, wanted_ver, n) == 0) &&
-            /* bits == 0 => don't care */
-            ((bits == 0) || (ip->bits == bits))) {
-            result = ip;
-            break;
+    static wchar_t appdata_dir[MAX_PATH];
+    static BOOL looked = FALSE;
+    wchar_t * wp;
+    HRESULT hr;
+
+    if (!looked) {
+        looked = TRUE;
+        wp = get_env(L"LOCALAPPDATA");
+        if ((wp != NULL) && (wcslen(wp) < MAX_PATH)) {
+            wcscpy_s(appdata_dir, MAX_PATH, wp);
+        }
+        else {
+            hr = SHGetFolderPathW(NULL, CSIDL_LOCAL_APPDATA, NULL, 0,
+                                  appdata_dir);
+            if (hr != S_OK) {
+                debug(L"SHGetFolderPath failed: %X\n", hr);
+                appdata_dir[0] = L'\0';
+            }
         }
     }
-    return result;
+    return appdata_dir[0] ? appdata_dir : NULL;
 }
 
-static wchar_t *
-find_python_by_venv()
+/* Work out the cache's path, unless caching is turned off. */
+static void
+find_cache_path()
 {
-    static wchar_t venv_python[MAX_PATH];
-    wchar_t *virtual_env = get_env(L"VIRTUAL_ENV");
-    DWORD attrs;
+    static BOOL found = FALSE;
+    wchar_t * appdata_dir;
+
+    if (found)
+        return;
+    found = TRUE;
+    if (get_env(L"PYLAUNCH_NO_CACHE") != NULL)
+        return;
+    appdata_dir = get_appdata_dir();
+    if (appdata_dir != NULL)
+        _snwprintf_s(cache_path, MAX_PATH, _TRUNCATE,
+                     L"%ls\\pylauncher\\discovery-%ls-%d.cache",
+                     appdata_dir, PYTHON_EXECUTABLE, LAUNCHER_BITS);
+}
 
-    /* Check for VIRTUAL_ENV environment variable */
-    if (virtual_env == NULL || virtual_env[0] == L'\0') {
-        return NULL;
-    }
+/*
+ * The registry as seen by cache_stamp_registry(), which stamps the views for
+ * the caches. Unlike discovery's, these are only called from the launcher's
+ * own thread.
+ */
 
-    /* Check for a python executable in the venv */
-    debug(L"Checking for Python executable in virtual env '%ls'\n", virtual_env);
-    _snwprintf_s(venv_python, MAX_PATH, _TRUNCATE,
-                 L"%ls\\Scripts\\%ls", virtual_env, PYTHON_EXECUTABLE);
-    attrs = GetFileAttributesW(venv_python);
-    if (attrs == INVALID_FILE_ATTRIBUTES) {
-        debug(L"Python executable %ls missing from virtual env\n", venv_python);
+static void *
+registry_open_subkey(void * context, int view, void * parent,
+                     const wchar_t * name)
+{
+    HKEY key;
+
+    if (parent == NULL)
+        return registry_open_key(context, view, NULL);
+    if (RegOpenKeyExW((HKEY) parent, name, 0, view_flags(view),
+                      &key) != ERROR_SUCCESS)
         return NULL;
-    }
-    return venv_python;
+    return key;
 }
 
-static wchar_t appdata_ini_path[MAX_PATH];
-static wchar_t launcher_ini_path[MAX_PATH];
-
-/*
- * Get a value either from the environment or a configuration file.
- * The key passed in will either be "python", "python2" or "python3".
- */
-static wchar_t *
-get_configured_value(wchar_t * key)
+static BOOL
+registry_key_stamp(void * context, void * key, CACHE_STAMP * stamp)
 {
-/*
- * Note: this static value is used to return a configured value
- * obtained either from the environment or configuration file.
- * This should be OK since there wouldn't be any concurrent calls.
- */
-    static wchar_t configured_value[MSGSIZE];
-    wchar_t * result = NULL;
-    wchar_t * found_in = L"environment";
-    DWORD size;
+    DWORD subkeys;
+    FILETIME last_write;
 
-    /* First, search the environment. */
-    _snwprintf_s(configured_value, MSGSIZE, _TRUNCATE, L"py_%ls", key);
-    result = get_env(configured_value);
-    if (result == NULL && appdata_ini_path[0]) {
-        /* Not in environment: check local configuration. */
-        size = GetPrivateProfileStringW(L"defaults", key, NULL,
-                                        configured_value, MSGSIZE,
-                                        appdata_ini_path);
-        if (size > 0) {
-            result = configured_value;
-            found_in = appdata_ini_path;
-        }
-    }
-    if (result == NULL && launcher_ini_path[0]) {
-        /* Not in environment or local: check global configuration. */
-        size = GetPrivateProfileStringW(L"defaults", key, NULL,
-                                        configured_value, MSGSIZE,
-                                        launcher_ini_path);
-        if (size > 0) {
-            result = configured_value;
-            found_in = launcher_ini_path;
-        }
-    }
-    if (result) {
-        debug(L"found configured value '%ls=%ls' in %ls\n",
-              key, result, found_in ? found_in : L"(unknown)");
-    } else {
-        debug(L"found no configured value for '%ls'\n", key);
-    }
-    return result;
+    if (RegQueryInfoKeyW((HKEY) key, NULL, NULL, NULL, &subkeys, NULL, NULL,
+                         NULL, NULL, NULL, NULL,
+                         &last_write) != ERROR_SUCCESS)
+        return FALSE;
+    stamp->time = ((unsigned long long) last_write.dwHighDateTime << 32) |
+                  last_write.dwLowDateTime;
+    stamp->size = subkeys;
+    return TRUE;
 }
 
-static INSTALLED_PYTHON *
-locate_python(wchar_t * wanted_ver, BOOL from_shebang)
+static CACHE_REGISTRY stamp_registry = {
+    NULL, registry_open_subkey, registry_enum_key, registry_key_stamp,
+    registry_close_key
+};
+
+static BOOL
+registry_view_stamp(void * context, int view, CACHE_STAMP * stamp)
 {
-    static wchar_t config_key [] = { L"pythonX" };
-    static wchar_t * last_char = &config_key[sizeof(config_key) /
-                                             sizeof(wchar_t) - 2];
-    INSTALLED_PYTHON * result = NULL;
-    size_t n = wcslen(wanted_ver);
-    wchar_t * configured_value;
+    return cache_stamp_registry(&stamp_registry, view, stamp);
+}
 
-    if (num_installed_pythons == 0)
-        locate_all_pythons();
+static BOOL
+file_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    WIN32_FILE_ATTRIBUTE_DATA data;
 
-    if (n == 1) {   /* just major version specified */
-        *last_char = *wanted_ver;
-        configured_value = get_configured_value(config_key);
-        if (configured_value != NULL)
+    if (!GetFileAttributesExW(path, GetFileExInfoStandard, &data))
+        return FALSE;
+    stamp->time = ((unsigned long long) data.ftLastWriteTime.dwHighDateTime
+                   << 32) | data.ftLastWriteTime.dwLowDateTime;
+    stamp->size = ((unsigned long long) data.nFileSizeHigh << 32) |
+                  data.nFileSizeLow;
+    return TRUE;
+}
+
+static CACHE_BACKEND windows_backend = {
+    NULL, registry_view_stamp, file_stamp
+};
+
+static void
+trace_discovery_cache(LONGLONG t0, wchar_t * status, long pythons)
+{
+    if (trace_event(EVENT_DISCOVERY_CACHE, t0)) {
+        trace_string(&trace, "path", cache_path);
+        trace_string(&trace, "status", status);
+        trace_integer(&trace, "pythons", pythons);
+        trace_end(&trace);
+    }
+}
+
+static BOOL
+read_discovery_cache()
+{
+    HANDLE h;
+    LARGE_INTEGER size;
+    DWORD nread;
+    void * data = NULL;
+    INSTALLED_PYTHON ip;
+    long n = -1;
+    long i;
+    LONGLONG t0 = get_ticks();
+
+    if (!cache_path[0])
+        return FALSE;
+    /* FILE_SHARE_DELETE lets writers replace the file while we read it. */
+    h = CreateFileW(cache_path, GENERIC_READ,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE) {
+        debug(L"discovery cache '%ls' not found\n", cache_path);
+        trace_discovery_cache(t0, L"missing", 0);
+        return FALSE;
+    }
+    if (GetFileSizeEx(h, &size) &&
+        (size.QuadPart <= (LONGLONG) cache_size(MAX_CACHED_PYTHONS)) &&
+        ((data = malloc((size_t) size.QuadPart)) != NULL) &&
+        ReadFile(h, data, (DWORD) size.QuadPart, &nread, NULL) &&
+        (nread == size.QuadPart)) {
+        n = cache_validate(&windows_backend, registry_views,
+                           num_registry_views, data, nread);
+    }
+    CloseHandle(h);
+    if (n < 0) {
+        debug(L"discovery cache '%ls' is out of date\n", cache_path);
+    }
+    else {
+        num_installed_pythons = 0;
+        for (i = 0; i < n; i++) {
+            cache_get(data, i, &ip);
+            add_installed_python(&ip);
+        }
+        index_installed_pythons();
+        debug(L"read %ld Pythons from discovery cache '%ls'\n", n,
+              cache_path);
+    }
+    free(data);
+    trace_discovery_cache(t0, (n < 0) ? L"stale" : L"read", (n < 0) ? 0 : n);
+    return n >= 0;
+}
+
+/*
+ * Write a file by writing a temporary file and renaming it into place, so
+ * that concurrent launchers only ever see it complete. Its folder must
+ * exist.
+ */
+static BOOL
+replace_file(wchar_t * path, void * data, size_t size)
+{
+    wchar_t temp_path[MAX_PATH];
+    HANDLE h;
+    DWORD written;
+    BOOL ok = FALSE;
+
+    _snwprintf_s(temp_path, MAX_PATH, _TRUNCATE, L"%ls.%lu.tmp", path,
+                 GetCurrentProcessId());
+    h = CreateFileW(temp_path, GENERIC_WRITE, 0, NULL, CREATE_ALWAYS,
+                    FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h != INVALID_HANDLE_VALUE) {
+        ok = WriteFile(h, data, (DWORD) size, &written, NULL) &&
+             (written == size);
+        CloseHandle(h);
+        if (ok)
+            ok = MoveFileExW(temp_path, path, MOVEFILE_REPLACE_EXISTING);
+        if (!ok)
+            DeleteFileW(temp_path);
+    }
+    return ok;
+}
+
+static void
+write_discovery_cache(CACHE_STAMP * view_stamps)
+{
+    wchar_t temp_path[MAX_PATH];
+    wchar_t * p;
+    void * data;
+    size_t size;
+    BOOL ok;
+    LONGLONG t0 = get_ticks();
+
+    if (!cache_path[0])
+        return;
+    size = cache_build(&windows_backend, registry_views, view_stamps,
+                       num_registry_views, installed_pythons,
+                       num_installed_pythons, &data);
+    if (size == 0) {
+        debug(L"unable to build discovery cache\n");
+        return;
+    }
+    wcsncpy_s(temp_path, MAX_PATH, cache_path, _TRUNCATE);
+    p = wcsrchr(temp_path, L'\\');
+    if (p != NULL) {
+        *p = L'\0';
+        CreateDirectoryW(temp_path, NULL);  /* may already exist */
+    }
+    ok = replace_file(cache_path, data, size);
+    if (ok)
+        debug(L"wrote discovery cache '%ls'\n", cache_path);
+    else
+        debug(L"unable to write discovery cache '%ls': %X\n", cache_path,
+              GetLastError());
+    free(data);
+    trace_discovery_cache(t0, ok ? L"written" : L"write_failed",
+                          (long) num_installed_pythons);
+}
+
+/*
+ * Discovery is incremental: discover_step() merges one candidate executable
+ * at a time, in a fixed order, while worker threads scan the registry views
+ * and probe candidates ahead of it (see discovery.h). A request which can
+ * be satisfied by an early candidate needn't wait for the whole registry to
+ * be scanned. installed_pythons is only sorted and indexed once discovery
+ * is complete.
+ */
+static BOOL discovery_started = FALSE;
+static BOOL discovery_complete = FALSE;
+static wchar_t * discovery_source;  /* "cache" or "registry", once complete */
+static CACHE_STAMP discovery_stamps[CACHE_MAX_VIEWS];
+static DISCOVERY discovery;
+static BOOL discovery_running = FALSE;  /* discovery has been started */
+static int traced_views;            /* views whose scans have been traced */
+
+#define DEFAULT_DISCOVERY_THREADS   4
+
+/* The number of worker threads, which PYLAUNCH_DISCOVERY_THREADS can set. */
+static int
+discovery_threads()
+{
+    wchar_t * wp = get_env(L"PYLAUNCH_DISCOVERY_THREADS");
+    long n;
+
+    if (wp == NULL)
+        return DEFAULT_DISCOVERY_THREADS;
+    n = wcstol(wp, NULL, 10);
+    if (n < 0)
+        return 0;
+    return (n > DISCOVERY_MAX_WORKERS) ? DISCOVERY_MAX_WORKERS : (int) n;
+}
+
+static void
+stop_discovery()
+{
+    if (discovery_running)
+        discovery_free(&discovery);
+    discovery_running = FALSE;
+}
+
+static void
+reset_discovery()
+{
+#if defined(_WINDOWS)
+    BOOL windowed = TRUE;
+#else
+    BOOL windowed = FALSE;
+#endif
+
+    stop_discovery();
+    num_installed_pythons = 0;
+    version_index_free(&version_index);
+    discovery_started = TRUE;
+    discovery_complete = FALSE;
+    traced_views = 0;
+    /* Stamp before scanning, so changes made during the scan are noticed. */
+    if (cache_path[0])
+        cache_stamp_views(&windows_backend, registry_views,
+                          num_registry_views, discovery_stamps);
+    discovery_start(&discovery, &registry_backend, windowed, registry_views,
+                    num_registry_views, discovery_threads());
+    discovery_running = TRUE;
+}
+
+static void
+start_discovery()
+{
+    if (discovery_started)
+        return;
+    get_registry_views();
+    find_cache_path();
+    if (read_discovery_cache()) {
+        discovery_started = discovery_complete = TRUE;
+        discovery_source = L"cache";
+        return;
+    }
+    reset_discovery();
+}
+
+static void
+trace_registry_view(DISCOVERY_VIEW * v)
+{
+    if (!v->opened)
+        debug(L"unable to open Python key in %ls %ls registry\n",
+              view_root_name(v->view), view_name(v->view));
+    if (trace_span(EVENT_REGISTRY_VIEW, v->start, v->end)) {
+        trace_string(&trace, "root", view_root_name(v->view));
+        trace_string(&trace, "view", view_name(v->view));
+        trace_integer(&trace, "opened", v->opened);
+        trace_integer(&trace, "keys", v->keys);
+        trace_integer(&trace, "found", v->found);
+        trace_end(&trace);
+    }
+}
+
+static wchar_t * probe_outcomes[] = {
+    L"pending", L"found", L"missing", L"directory", L"unknown_type",
+    L"invalid_type", L"duplicate"
+};
+
+/*
+ * Merge the next candidate executable. Returns FALSE once there are none
+ * left.
+ */
+static BOOL
+discover_step()
+{
+    DISCOVERY_CANDIDATE * c = discovery_next(&discovery);
+    INSTALLED_PYTHON * ip;
+    size_t n;
+
+    /* Views are traced once the merge is done with them. */
+    while (traced_views < discovery.merged_views)
+        trace_registry_view(&discovery.views[traced_views++]);
+    if (c == NULL)
+        return FALSE;
+    switch (c->outcome) {
+    case PROBE_FOUND:
+        c->python.probe_us = (unsigned int) ticks_to_us(c->end - c->start);
+        ip = add_installed_python(&c->python);
+        if (wcschr(ip->executable, L' ') != NULL) {
+            /* has spaces, so quote */
+            n = wcslen(ip->executable);
+            memmove(&ip->executable[1], ip->executable, n * sizeof(wchar_t));
+            ip->executable[0] = L'\"';
+            ip->executable[n + 1] = L'\"';
+            ip->executable[n + 2] = L'\0';
+        }
+        debug(L"discover_step: %ls is a %dbit executable\n", ip->executable,
+              ip->bits);
+        break;
+    case PROBE_DUPLICATE:
+        debug(L"discover_step: %ls: already found\n", c->python.executable);
+        break;
+    default:
+        debug(L"discover_step: %ls: %ls\n", c->python.executable,
+              probe_outcomes[c->outcome]);
+        break;
+    }
+    if (trace_span(EVENT_PROBE, c->start, c->end)) {
+        trace_string(&trace, "company", c->python.company);
+        trace_string(&trace, "tag", c->python.version);
+        trace_string(&trace, "path", c->python.executable);
+        trace_string(&trace, "outcome", probe_outcomes[c->outcome]);
+        trace_end(&trace);
+    }
+    return TRUE;
+}
+
+/*
+ * Finish discovery, if necessary, leaving installed_pythons sorted. Any
+ * pointers into installed_pythons from before this call are invalidated.
+ */
+static void
+locate_all_pythons()
+{
+    LONGLONG t0 = get_ticks();
+
+    start_discovery();
+    if (discovery_complete) {
+        timings[TIMING_DISCOVERY] += get_ticks() - t0;
+        return;
+    }
+    while (discover_step())
+        ;
+    if (discovery.failed)
+        error(RC_NO_MEMORY, L"Could not allocate discovery tables");
+    stop_discovery();
+    if (num_installed_pythons)
+        qsort(installed_pythons, num_installed_pythons,
+              sizeof(INSTALLED_PYTHON), compare_installed);
+    index_installed_pythons();
+    discovery_complete = TRUE;
+    discovery_source = L"registry";
+    write_discovery_cache(discovery_stamps);
+    timings[TIMING_DISCOVERY] += get_ticks() - t0;
+}
+
+static void
+scan_all_pythons()
+{
+    get_registry_views();
+    find_cache_path();
+    reset_discovery();
+    locate_all_pythons();
+}
+
+/*
+ * Try to satisfy a request for a specific version (X.Y or more) while
+ * discovery is still in progress. Once a Python has been found which
+ * nothing found later could be preferred to - see version_is_best() - the
+ * rest of the registry needn't be looked at. Returns NULL if the whole
+ * registry had to be scanned.
+ */
+static INSTALLED_PYTHON *
+find_exact_python(const PY_VERSION * wanted)
+{
+    size_t i = 0;
+    LONGLONG t0 = get_ticks();
+    INSTALLED_PYTHON * result = NULL;
+
+    start_discovery();
+    while (!discovery_complete && (result == NULL)) {
+        for (; i < num_installed_pythons; i++) {
+            if (is_core_python(&installed_pythons[i]) &&
+                version_is_best(wanted, &installed_pythons[i].parsed)) {
+                debug(L"found '%ls' without a full scan\n",
+                      installed_pythons[i].executable);
+                result = &installed_pythons[i];
+                break;
+            }
+        }
+        if ((result == NULL) && !discover_step())
+            break;
+    }
+    timings[TIMING_DISCOVERY] += get_ticks() - t0;
+    return result;
+}
+
+static INSTALLED_PYTHON *
+find_python_by_version(wchar_t const * wanted_ver)
+{
+    INSTALLED_PYTHON * result;
+    PY_VERSION wanted;
+    long i;
+
+    if (!parse_version(wanted_ver, &wanted, TRUE)) {
+        debug(L"invalid version request '%ls'\n", wanted_ver);
+        return NULL;
+    }
+    if (wanted.minor >= 0) {
+        result = find_exact_python(&wanted);
+        if (result != NULL)
+            return result;
+    }
+    locate_all_pythons();
+    i = version_index_find(&version_index, &wanted);
+    return (i < 0) ? NULL : &installed_pythons[i];
+}
+
+/*
+ * Find the Python registered by another company (see PEP 514) with a tag,
+ * given as COMPANY/TAG. Those Pythons are only used when asked for by name.
+ */
+static INSTALLED_PYTHON *
+find_python_by_tag(wchar_t const * wanted)
+{
+    wchar_t const * tag = wcschr(wanted, L'/') + 1;
+    size_t n = tag - wanted - 1;
+    INSTALLED_PYTHON * ip;
+    size_t i;
+
+    locate_all_pythons();
+    for (i = 0, ip = installed_pythons; i < num_installed_pythons; i++, ip++) {
+        if ((wcslen(ip->company) == n) &&
+            (_wcsnicmp(ip->company, wanted, n) == 0) &&
+            (_wcsicmp(ip->version, tag) == 0))
+            return ip;
+    }
+    debug(L"no Python registered as '%ls'\n", wanted);
+    return NULL;
+}
+
+/*
+ * Project context (see project.h): the virtual environment, pinned version
+ * and py.ini of the project a script is in, found by walking up from the
+ * script's directory. What each directory held is saved in the local
+ * application data folder, so that a later launch usually needs just one
+ * call to stamp each directory it walks through. PYLAUNCH_NO_PROJECT turns
+ * this off.
+ */
+static PROJECT_BACKEND project_backend = { NULL, file_stamp };
+static PROJECT_INDEX project_index;
+static BOOL project_index_loaded = FALSE;
+static BOOL project_save_deferred = FALSE;  /* py --resolve saves at the end */
+static wchar_t project_cache_path[MAX_PATH];
+static PROJECT project;                     /* the current script's */
+static wchar_t project_pin[MAX_VERSION_SIZE];   /* the version pinned */
+static wchar_t project_ini_path[MAX_PATH];  /* the project py.ini read */
+
+/*
+ * The Python of the active virtual environment or, if there isn't one, of
+ * the script's project. *in_project says which.
+ */
+static wchar_t *
+find_python_by_venv(BOOL * in_project)
+{
+    static wchar_t venv_python[MAX_PATH];
+    wchar_t *virtual_env = get_env(L"VIRTUAL_ENV");
+    DWORD attrs;
+
+    /* Check for VIRTUAL_ENV environment variable, then the project's */
+    *in_project = FALSE;
+    if (virtual_env == NULL || virtual_env[0] == L'\0') {
+        if (!project.venv[0])
+            return NULL;
+        virtual_env = project.venv;
+        *in_project = TRUE;
+    }
+
+    /* Check for a python executable in the venv */
+    debug(L"Checking for Python executable in virtual env '%ls'\n", virtual_env);
+    _snwprintf_s(venv_python, MAX_PATH, _TRUNCATE,
+                 L"%ls\\Scripts\\%ls", virtual_env, PYTHON_EXECUTABLE);
+    attrs = GetFileAttributesW(venv_python);
+    if (attrs == INVALID_FILE_ATTRIBUTES) {
+        debug(L"Python executable %ls missing from virtual env\n", venv_python);
+        return NULL;
+    }
+    return venv_python;
+}
+
+static wchar_t appdata_ini_path[MAX_PATH];
+static wchar_t launcher_ini_path[MAX_PATH];
+
+/*
+ * Both ini files are read once, into one configuration in which the
+ * per-user file overrides the global one.
+ */
+static CONFIG config;
+static BOOL config_read = FALSE;
+
+static void
+trace_config_read(wchar_t * config_path, LONGLONG t0, wchar_t * encoding,
+                  DWORD size)
+{
+    if (trace_event(EVENT_CONFIG_READ, t0)) {
+        trace_string(&trace, "path", config_path);
+        trace_string(&trace, "encoding", encoding);
+        trace_integer(&trace, "bytes", size);
+        trace_end(&trace);
+    }
+}
+
+/*
+ * Read an ini file and parse it into the configuration. Like the profile
+ * API, this takes a file starting with a UTF-16LE BOM to be UTF-16 and any
+ * other file to be in the ANSI code page - apart from one starting with a
+ * UTF-8 BOM, which is taken to be UTF-8.
+ */
+static void
+read_config_file(wchar_t * config_path)
+{
+    HANDLE h;
+    LARGE_INTEGER size;
+    DWORD nread;
+    unsigned char * data = NULL;
+    wchar_t * text = NULL;
+    int nchars = -1;
+    UINT cp = CP_ACP;
+    BOOL utf16 = FALSE;
+    DWORD offset = 0;
+    LONGLONG t0 = get_ticks();
+
+    h = CreateFileW(config_path, GENERIC_READ,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE) {
+        debug(L"read_config_file: unable to open '%ls': %X\n", config_path,
+              GetLastError());
+        trace_config_read(config_path, t0, NULL, 0);
+        return;
+    }
+    if (GetFileSizeEx(h, &size) && (size.QuadPart < 0x40000000) &&
+        ((data = malloc((size_t) size.QuadPart + sizeof(wchar_t))) != NULL) &&
+        ReadFile(h, data, (DWORD) size.QuadPart, &nread, NULL) &&
+        (nread == size.QuadPart)) {
+        if ((nread >= 2) && (data[0] == 0xFF) && (data[1] == 0xFE)) {
+            utf16 = TRUE;
+            text = (wchar_t *) &data[2];
+            nchars = (nread - 2) / sizeof(wchar_t);
+        }
+        else {
+            if ((nread >= 3) && !memcmp(data, "\xEF\xBB\xBF", 3)) {
+                cp = CP_UTF8;
+                offset = 3;
+            }
+            nchars = 0;
+            if (nread > offset)
+                nchars = MultiByteToWideChar(cp, 0, (char *) &data[offset],
+                                             nread - offset, NULL, 0);
+            text = malloc((nchars + 1) * sizeof(wchar_t));
+            if ((text == NULL) ||
+                ((nchars > 0) &&
+                 !MultiByteToWideChar(cp, 0, (char *) &data[offset],
+                                      nread - offset, text, nchars)))
+                nchars = -1;
+        }
+    }
+    CloseHandle(h);
+    if (nchars < 0)
+        debug(L"read_config_file: unable to read '%ls'\n", config_path);
+    else if (!config_parse(&config, text, nchars, config_path))
+        error(RC_NO_MEMORY, L"Could not allocate memory for '%ls'",
+              config_path);
+    else if (utf16)
+        debug(L"read_config_file: read '%ls' (UTF-16)\n", config_path);
+    else
+        debug(L"read_config_file: read '%ls' (code page %u)\n", config_path,
+              cp);
+    trace_config_read(config_path, t0, (nchars < 0) ? NULL : utf16 ?
+                      L"utf-16" : (cp == CP_UTF8) ? L"utf-8" : L"ansi",
+                      (nchars < 0) ? 0 : nread);
+    if (!utf16)
+        free(text);
+    free(data);
+}
+
+/*
+ * Where the per-user and global ini files would be, whether or not they
+ * exist. A path is left empty if it can't be worked out. Either can be
+ * overridden with an environment variable - PYLAUNCH_LOCAL_INI or
+ * PYLAUNCH_GLOBAL_INI, naming the file to use instead - so that tests can
+ * give each launcher its own configuration.
+ */
+static void
+get_config_paths(wchar_t * local_path, wchar_t * global_path)
+{
+    wchar_t * appdata_dir;
+    wchar_t * p;
+
+    local_path[0] = L'\0';
+    p = get_env(L"PYLAUNCH_LOCAL_INI");
+    if (p != NULL)
+        wcsncpy_s(local_path, MAX_PATH, p, _TRUNCATE);
+    else if ((appdata_dir = get_appdata_dir()) != NULL)
+        _snwprintf_s(local_path, MAX_PATH, _TRUNCATE, L"%ls\\py.ini",
+                     appdata_dir);
+    p = get_env(L"PYLAUNCH_GLOBAL_INI");
+    if (p != NULL) {
+        wcsncpy_s(global_path, MAX_PATH, p, _TRUNCATE);
+        return;
+    }
+    GetModuleFileNameW(NULL, global_path, MAX_PATH);
+    p = wcsrchr(global_path, L'\\');
+    if (p == NULL) {
+        debug(L"GetModuleFileNameW returned value has no backslash: %ls\n",
+              global_path);
+        global_path[0] = L'\0';
+    }
+    else {
+        wcsncpy_s(p, MAX_PATH - (p - global_path), L"\\py.ini", _TRUNCATE);
+    }
+}
+
+/*
+ * Find the per-user and global ini files, leaving the path of either empty
+ * if there's no such file.
+ */
+static void
+locate_config_files()
+{
+    DWORD attrs;
+    LONGLONG t0 = get_ticks();
+
+    get_config_paths(appdata_ini_path, launcher_ini_path);
+    if (appdata_ini_path[0]) {
+        attrs = GetFileAttributesW(appdata_ini_path);
+        if (attrs == INVALID_FILE_ATTRIBUTES) {
+            debug(L"File '%ls' non-existent\n", appdata_ini_path);
+            appdata_ini_path[0] = L'\0';
+        } else {
+            debug(L"Using local configuration file '%ls'\n", appdata_ini_path);
+        }
+    }
+    if (trace_event(EVENT_CONFIG_LOCATE, t0)) {
+        trace_string(&trace, "scope", L"local");
+        trace_string(&trace, "path",
+                     appdata_ini_path[0] ? appdata_ini_path : NULL);
+        trace_end(&trace);
+    }
+    t0 = get_ticks();
+    if (launcher_ini_path[0]) {
+        attrs = GetFileAttributesW(launcher_ini_path);
+        if (attrs == INVALID_FILE_ATTRIBUTES) {
+            debug(L"File '%ls' non-existent\n", launcher_ini_path);
+            launcher_ini_path[0] = L'\0';
+        } else {
+            debug(L"Using global configuration file '%ls'\n", launcher_ini_path);
+        }
+    }
+    if (trace_event(EVENT_CONFIG_LOCATE, t0)) {
+        trace_string(&trace, "scope", L"global");
+        trace_string(&trace, "path",
+                     launcher_ini_path[0] ? launcher_ini_path : NULL);
+        trace_end(&trace);
+    }
+}
+
+static void
+read_config()
+{
+    LONGLONG t0 = get_ticks();
+
+    if (config_read)
+        return;
+    config_read = TRUE;
+    locate_config_files();
+    if (launcher_ini_path[0])
+        read_config_file(launcher_ini_path);
+    if (appdata_ini_path[0])
+        read_config_file(appdata_ini_path);
+    /* The project's py.ini overrides both, unless it's one of them. */
+    if (project_ini_path[0] && _wcsicmp(project_ini_path, launcher_ini_path) &&
+        _wcsicmp(project_ini_path, appdata_ini_path))
+        read_config_file(project_ini_path);
+    timings[TIMING_CONFIG] += get_ticks() - t0;
+}
+
+static void
+load_project_index()
+{
+    wchar_t * appdata_dir;
+    HANDLE h;
+    LARGE_INTEGER size;
+    DWORD nread;
+    void * data = NULL;
+
+    project_index_loaded = TRUE;
+    project_index_init(&project_index, &project_backend);
+    if ((get_env(L"PYLAUNCH_NO_CACHE") != NULL) ||
+        ((appdata_dir = get_appdata_dir()) == NULL))
+        return;
+    _snwprintf_s(project_cache_path, MAX_PATH, _TRUNCATE,
+                 L"%ls\\pylauncher\\project.cache", appdata_dir);
+    h = CreateFileW(project_cache_path, GENERIC_READ,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE)
+        return;
+    if (GetFileSizeEx(h, &size) && (size.QuadPart < 0x10000000) &&
+        ((data = malloc((size_t) size.QuadPart)) != NULL) &&
+        ReadFile(h, data, (DWORD) size.QuadPart, &nread, NULL) &&
+        (nread == size.QuadPart)) {
+        if (!project_index_load(&project_index, data, nread))
+            debug(L"project cache '%ls' not usable\n", project_cache_path);
+    }
+    else {
+        free(data);
+    }
+    CloseHandle(h);
+}
+
+static void
+save_project_index()
+{
+    void * data;
+    size_t size;
+    wchar_t * p;
+
+    project_index.dirty = FALSE;
+    if (!project_cache_path[0] || project_index.failed)
+        return;
+    size = project_index_save(&project_index, &data);
+    if (size == 0)
+        return;
+    p = wcsrchr(project_cache_path, L'\\');
+    *p = L'\0';
+    CreateDirectoryW(project_cache_path, NULL);     /* may already exist */
+    *p = L'\\';
+    if (replace_file(project_cache_path, data, size))
+        debug(L"wrote project cache '%ls'\n", project_cache_path);
+    free(data);
+}
+
+/*
+ * Read the version pinned by the project's .python-version file. Only the
+ * start of the file is read: the version is on its first line which isn't
+ * blank or a comment.
+ */
+static void
+read_project_pin()
+{
+    char data[1024];
+    HANDLE h;
+    DWORD nread = 0;
+    PY_VERSION v;
+
+    project_pin[0] = L'\0';
+    if (!project.pin[0])
+        return;
+    h = CreateFileW(project.pin, GENERIC_READ,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE)
+        return;
+    if (!ReadFile(h, data, sizeof(data), &nread, NULL))
+        nread = 0;
+    CloseHandle(h);
+    if (!project_parse_pin(data, nread, project_pin, MAX_VERSION_SIZE) ||
+        !parse_version(project_pin, &v, TRUE)) {
+        debug(L"'%ls' pins no version the launcher can use\n", project.pin);
+        project_pin[0] = L'\0';
+    }
+}
+
+static void
+trace_project(LONGLONG t0, wchar_t * dir)
+{
+    if (trace_event(EVENT_PROJECT, t0)) {
+        trace_string(&trace, "dir", dir);
+        trace_integer(&trace, "dirs", project.dirs);
+        trace_integer(&trace, "stats", project.stats);
+        trace_integer(&trace, "reused", project.reused);
+        trace_integer(&trace, "capped", project.capped);
+        trace_string(&trace, "venv", project.venv[0] ? project.venv : NULL);
+        trace_string(&trace, "pin", project_pin[0] ? project_pin : NULL);
+        trace_string(&trace, "ini", project.ini[0] ? project.ini : NULL);
+        trace_end(&trace);
+    }
+}
+
+/*
+ * Find the project a script is in. If its py.ini isn't the one already in
+ * the configuration, the configuration is read again when next needed.
+ */
+static void
+find_project(wchar_t * script)
+{
+    wchar_t dir[MAX_PATH];
+    wchar_t * name = NULL;
+    DWORD n;
+    LONGLONG t0 = get_ticks();
+
+    memset(&project, 0, sizeof(project));
+    project_pin[0] = L'\0';
+    if (get_env(L"PYLAUNCH_NO_PROJECT") == NULL) {
+        n = GetFullPathNameW(script, MAX_PATH, dir, &name);
+        if ((n > 0) && (n < MAX_PATH) && (name != NULL)) {
+            *name = L'\0';
+            if (!project_index_loaded)
+                load_project_index();
+            project_find(&project_index, dir, &project);
+            if (project_index.dirty && !project_save_deferred)
+                save_project_index();
+            read_project_pin();
+            debug(L"project of '%ls': venv '%ls', pin '%ls', ini '%ls' \
+(%d directories, %d calls, %d reused%ls)\n", script, project.venv,
+                  project_pin, project.ini, project.dirs, project.stats,
+                  project.reused, project.capped ? L", capped" : L"");
+            trace_project(t0, dir);
+        }
+    }
+    if (wcscmp(project.ini, project_ini_path)) {
+        if (config_read) {
+            config_free(&config);
+            config_read = FALSE;
+        }
+        wcscpy_s(project_ini_path, MAX_PATH, project.ini);
+    }
+    timings[TIMING_CONFIG] += get_ticks() - t0;
+}
+
+/*
+ * Get a value either from the environment or a configuration file.
+ * The key passed in will either be "python", "python2" or "python3".
+ */
+static wchar_t *
+get_configured_value(wchar_t * key)
+{
+    static wchar_t name[MSGSIZE];
+    const CONFIG_ENTRY * entry;
+    wchar_t * result;
+    wchar_t * found_in = L"environment";
+
+    /* First, search the environment. */
+    _snwprintf_s(name, MSGSIZE, _TRUNCATE, L"py_%ls", key);
+    result = get_env(name);
+    /*
+     * Then the project's pinned version: for "python", or for "pythonX"
+     * if it's a version of Python X more precise than that.
+     */
+    if ((result == NULL) && project_pin[0] &&
+        ((key[6] == L'\0') ||
+         ((project_pin[0] == key[6]) && (project_pin[1] == L'.')))) {
+        result = project_pin;
+        found_in = project.pin;
+    }
+    if (result == NULL) {
+        /* Not in environment: check the configuration files. */
+        read_config();
+        entry = config_find(&config, L"defaults", key);
+        if (entry != NULL) {
+            result = entry->value;
+            found_in = (wchar_t *) entry->source;
+        }
+    }
+    if (result) {
+        debug(L"found configured value '%ls=%ls' in %ls\n",
+              key, result, found_in);
+    } else {
+        debug(L"found no configured value for '%ls'\n", key);
+    }
+    return result;
+}
+
+static INSTALLED_PYTHON *
+locate_python(wchar_t * wanted_ver, BOOL from_shebang)
+{
+    static wchar_t config_key [] = { L"pythonX" };
+    static wchar_t * last_char = &config_key[sizeof(config_key) /
+                                             sizeof(wchar_t) - 2];
+    INSTALLED_PYTHON * result = NULL;
+    size_t n = wcslen(wanted_ver);
+    wchar_t * configured_value;
+
+    if (n == 1) {   /* just major version specified */
+        *last_char = *wanted_ver;
+        configured_value = get_configured_value(config_key);
+        if (configured_value != NULL)
             wanted_ver = configured_value;
     }
     if (*wanted_ver) {
@@ -553,11 +1681,50 @@ locate_python(wchar_t * wanted_ver, BOOL from_shebang)
 
 static wchar_t wrapped_script_path[MAX_PATH];
 
+/*
+ * The wrapper itself, open at the start of a script appended to it (see
+ * wrapper_archive.h), for read_header() to read its shebang line from.
+ */
+static FILE * wrapped_fp = NULL;
+
+/* Whether the script is appended to the wrapper, rather than beside it. */
+static BOOL wrapped_appended = FALSE;
+
+static BOOL
+open_appended_script(wchar_t * path)
+{
+    FILE * fp;
+    unsigned char trailer[ARCHIVE_TRAILER_SIZE];
+    ARCHIVE_INFO info;
+    long long size;
+
+    /* not inherited by the child, which opens the file for itself */
+    if (_wfopen_s(&fp, path, L"rbN") != 0)
+        return FALSE;
+    /* One seek, to the trailer, and one read tell us all we need. */
+    if ((_fseeki64(fp, -ARCHIVE_TRAILER_SIZE, SEEK_END) == 0) &&
+        ((size = _ftelli64(fp)) >= 0) &&
+        (fread(trailer, 1, ARCHIVE_TRAILER_SIZE, fp) ==
+         ARCHIVE_TRAILER_SIZE) &&
+        archive_parse_trailer(trailer, size + ARCHIVE_TRAILER_SIZE, &info) &&
+        (_fseeki64(fp, info.offset, SEEK_SET) == 0)) {
+        debug(L"Script of %lld bytes appended at offset %lld\n",
+              (long long) info.size, (long long) info.offset);
+        wrapped_fp = fp;
+        wrapped_appended = TRUE;
+        return TRUE;
+    }
+    fclose(fp);
+    return FALSE;
+}
+
 /* Locate the script being wrapped.
  *
  * This code should store the name of the wrapped script in
  * wrapped_script_path, or terminate the program with an error if there is no
- * valid wrapped script file.
+ * valid wrapped script file. A script appended to the wrapper is preferred,
+ * in which case the wrapper itself is the script (a zip application), and
+ * nothing else need be looked for.
  */
 static void
 locate_wrapped_script()
@@ -567,6 +1734,10 @@ locate_wrapped_script()
     DWORD attrs;
 
     plen = GetModuleFileNameW(NULL, wrapped_script_path, MAX_PATH);
+    if (open_appended_script(wrapped_script_path)) {
+        debug(L"Using script appended to '%ls'\n", wrapped_script_path);
+        return;
+    }
     p = wcsrchr(wrapped_script_path, L'.');
     if (p == NULL) {
         debug(L"GetModuleFileNameW returned value has no extension: %ls\n",
@@ -627,6 +1798,7 @@ run_child(wchar_t * cmdline)
     BOOL ok;
     STARTUPINFOW si;
     PROCESS_INFORMATION pi;
+    LONGLONG t0;
 
 #if defined(_WINDOWS)
     // When explorer launches a Windows (GUI) application, it displays
@@ -672,132 +1844,591 @@ run_child(wchar_t * cmdline)
         error(RC_CREATE_PROCESS, L"control handler setting failed");
 
     si.dwFlags = STARTF_USESTDHANDLES;
+    fflush(stderr);     /* so our output comes before the child's */
+    t0 = get_ticks();
     ok = CreateProcessW(NULL, cmdline, NULL, NULL, TRUE,
                         0, NULL, NULL, &si, &pi);
     if (!ok)
         error(RC_CREATE_PROCESS, L"Unable to create process using '%ls'", cmdline);
+    timings[TIMING_CHILD] += get_ticks() - t0;
+    report_timings();
+    if (trace_event(EVENT_CREATE_PROCESS, t0)) {
+        trace_string(&trace, "command_line", cmdline);
+        trace_integer(&trace, "pid", pi.dwProcessId);
+        trace_end(&trace);
+    }
+    flush_trace();
     AssignProcessToJobObject(job, pi.hProcess);
     CloseHandle(pi.hThread);
+    t0 = get_ticks();
     WaitForSingleObjectEx(pi.hProcess, INFINITE, FALSE);
     ok = GetExitCodeProcess(pi.hProcess, &rc);
     if (!ok)
         error(RC_CREATE_PROCESS, L"Failed to get exit code of process");
     debug(L"child process exit code: %d\n", rc);
+    launch_rc = rc;
+    if (trace_event(EVENT_CHILD_EXIT, t0)) {
+        trace_integer(&trace, "rc", rc);
+        trace_end(&trace);
+    }
     /* ExitProcess(rc); */
     exit(rc);
 }
 
+/*
+ * Launch server. With PYLAUNCH_SERVER set to the address file written by
+ * launchserver.py, a script which is to be run with a Python the launcher
+ * chose, with no interpreter options, is handed to the server instead, to
+ * run with an interpreter it started earlier; the script's standard streams
+ * are relayed over the connection (see launch_server.h). If the server
+ * can't be reached, or won't take the script, it's run as usual.
+ */
+static BOOL
+send_all(SOCKET s, const void * data, size_t size)
+{
+    const char * p = data;
+    int n;
+
+    while (size > 0) {
+        n = send(s, p, (size > 65536) ? 65536 : (int) size, 0);
+        if (n <= 0)
+            return FALSE;
+        p += n;
+        size -= n;
+    }
+    return TRUE;
+}
+
+static BOOL
+recv_all(SOCKET s, void * data, size_t size)
+{
+    char * p = data;
+    int n;
+
+    while (size > 0) {
+        n = recv(s, p, (size > 65536) ? 65536 : (int) size, 0);
+        if (n <= 0)
+            return FALSE;
+        p += n;
+        size -= n;
+    }
+    return TRUE;
+}
+
+static BOOL
+send_frame(SOCKET s, int type, const void * data, size_t size)
+{
+    unsigned char header[SERVER_HEADER_SIZE];
+
+    server_make_header(type, size, header);
+    return send_all(s, header, SERVER_HEADER_SIZE) &&
+           ((size == 0) || send_all(s, data, size));
+}
+
+/*
+ * Read a frame, into a malloc'd block which *payload is set to, and which
+ * is grown as needed. Returns the frame's type, or -1 if there isn't one.
+ */
+static int
+recv_frame(SOCKET s, unsigned char ** payload, size_t * payload_size,
+           size_t * length)
+{
+    unsigned char header[SERVER_HEADER_SIZE];
+    unsigned char * p;
+    int type;
+
+    if (!recv_all(s, header, SERVER_HEADER_SIZE) ||
+        !server_parse_header(header, &type, length))
+        return -1;
+    if (*length > *payload_size) {
+        p = realloc(*payload, *length);
+        if (p == NULL)
+            return -1;
+        *payload = p;
+        *payload_size = *length;
+    }
+    if (!recv_all(s, *payload, *length))
+        return -1;
+    return type;
+}
+
+/* Relay stdin to the server, on a thread of its own. */
+static DWORD WINAPI
+relay_stdin(LPVOID param)
+{
+    SOCKET s = (SOCKET) param;
+    HANDLE in = GetStdHandle(STD_INPUT_HANDLE);
+    char buffer[4096];
+    DWORD n;
+
+    if ((in != NULL) && (in != INVALID_HANDLE_VALUE)) {
+        while (ReadFile(in, buffer, sizeof(buffer), &n, NULL) && (n > 0)) {
+            if (!send_frame(s, SERVER_STDIN, buffer, n))
+                return 0;
+        }
+    }
+    send_frame(s, SERVER_STDIN, NULL, 0);   /* the end of it */
+    return 0;
+}
+
+static void
+trace_launch_server(LONGLONG t0, wchar_t * status)
+{
+    if (trace_event(EVENT_LAUNCH_SERVER, t0)) {
+        trace_string(&trace, "status", status);
+        trace_end(&trace);
+    }
+}
+
+/*
+ * Connect to the launch server, returning the socket, or INVALID_SOCKET if
+ * there's no server to connect to. The token is read into token.
+ */
+static SOCKET
+connect_server(wchar_t * address_file, char * token, size_t token_size)
+{
+    FILE * fp;
+    char line[128];
+    char * p;
+    unsigned long port;
+    size_t n;
+    WSADATA wsa;
+    struct sockaddr_in address;
+    SOCKET s;
+
+    if (_wfopen_s(&fp, address_file, L"r") != 0)
+        return INVALID_SOCKET;
+    line[0] = '\0';
+    fgets(line, sizeof(line), fp);
+    fclose(fp);
+    /* "<port> <token>" */
+    port = strtoul(line, &p, 10);
+    while (*p == ' ')
+        ++p;
+    n = strcspn(p, " \r\n");
+    if ((port == 0) || (port > 65535) || (n == 0) || (n >= token_size))
+        return INVALID_SOCKET;
+    memcpy(token, p, n);
+    token[n] = '\0';
+    if (WSAStartup(MAKEWORD(2, 2), &wsa) != 0)
+        return INVALID_SOCKET;
+    s = socket(AF_INET, SOCK_STREAM, IPPROTO_TCP);
+    if (s == INVALID_SOCKET)
+        return INVALID_SOCKET;
+    memset(&address, 0, sizeof(address));
+    address.sin_family = AF_INET;
+    address.sin_port = htons((unsigned short) port);
+    address.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    if (connect(s, (struct sockaddr *) &address, sizeof(address)) != 0) {
+        closesocket(s);
+        return INVALID_SOCKET;
+    }
+    return s;
+}
+
+/*
+ * Have the launch server run cmdline (the script and its arguments) with
+ * executable, version being the tag of that Python, or empty if it isn't
+ * known, or NULL if executable mightn't be a Python at all. If the server
+ * takes it, this doesn't return; else it returns, so that the script can be
+ * run as usual.
+ */
+static void
+serve_child(wchar_t * executable, wchar_t * version, wchar_t * suffix,
+            wchar_t * cmdline)
+{
+    wchar_t * address_file = get_env(L"PYLAUNCH_SERVER");
+    wchar_t * line;
+    wchar_t ** args = NULL;
+    wchar_t cwd[MAX_PATH];
+    wchar_t * env = NULL;
+    char token[64];
+    SERVER_REQUEST_INFO request;
+    unsigned char * payload = NULL;
+    size_t size, length, payload_size = 0;
+    SOCKET s = INVALID_SOCKET;
+    wchar_t * status = L"ineligible";
+    int argc = 0;
+    int type;
+    int rc;
+    HANDLE out;
+    DWORD written;
+    LONGLONG t0 = get_ticks();
+
+    if ((address_file == NULL) || (version == NULL) ||
+        ((suffix != NULL) && *suffix))
+        return;
+    /* The script must come first: interpreter options need a new process.
+     * A dummy program name is put in front, as CommandLineToArgvW parses
+     * that differently. */
+    size = wcslen(cmdline) + 3;
+    line = malloc(size * sizeof(wchar_t));
+    if (line != NULL) {
+        _snwprintf_s(line, size, _TRUNCATE, L"x %ls", cmdline);
+        args = CommandLineToArgvW(line, &argc);
+        free(line);
+    }
+    if ((args == NULL) || (argc < 2) || (args[1][0] == L'-') ||
+        !GetCurrentDirectoryW(MAX_PATH, cwd))
+        goto fallback;
+    status = L"unavailable";
+    s = connect_server(address_file, token, sizeof(token));
+    if (s == INVALID_SOCKET)
+        goto fallback;
+    env = GetEnvironmentStringsW();
+    request.token = token;
+    request.version = version;
+    request.executable = executable;
+    request.cwd = cwd;
+    request.argc = argc - 1;
+    request.argv = &args[1];
+    request.environment = env;
+    size = server_encode_request(&request, NULL, 0);
+    payload = malloc(size);
+    if (payload == NULL)
+        goto fallback;
+    payload_size = size;
+    server_encode_request(&request, payload, size);
+    if (!send_all(s, payload, size))
+        goto fallback;
+    type = recv_frame(s, &payload, &payload_size, &length);
+    if (type != SERVER_ACCEPT) {
+        status = L"refused";
+        if (type == SERVER_REFUSE)
+            debug(L"launch server refused: %.*hs\n", (int) length, payload);
+        goto fallback;
+    }
+    /* From here, the script is the server's to run. */
+    debug(L"launch server is running '%ls' with %ls\n", cmdline, executable);
+    timings[TIMING_CHILD] += get_ticks() - t0;
+    trace_launch_server(t0, L"accepted");
+    fflush(stderr);     /* so our output comes before the script's */
+    report_timings();
+    flush_trace();
+    CloseHandle(CreateThread(NULL, 0, relay_stdin, (LPVOID) s, 0, NULL));
+    t0 = get_ticks();
+    for (;;) {
+        type = recv_frame(s, &payload, &payload_size, &length);
+        if ((type == SERVER_STDOUT) || (type == SERVER_STDERR)) {
+            out = GetStdHandle((type == SERVER_STDOUT) ? STD_OUTPUT_HANDLE :
+                               STD_ERROR_HANDLE);
+            WriteFile(out, payload, (DWORD) length, &written, NULL);
+        }
+        else if ((type == SERVER_EXIT) && (length == 4))
+            break;
+        else if (type < 0)
+            error(RC_CREATE_PROCESS, L"Lost the connection to the launch \
+server");
+    }
+    rc = server_exit_code(payload);
+    debug(L"script exit code: %d\n", rc);
+    launch_rc = rc;
+    if (trace_event(EVENT_CHILD_EXIT, t0)) {
+        trace_integer(&trace, "rc", rc);
+        trace_end(&trace);
+    }
+    exit(rc);
+fallback:
+    trace_launch_server(t0, status);
+    if (s != INVALID_SOCKET)
+        closesocket(s);
+    if (env != NULL)
+        FreeEnvironmentStringsW(env);
+    if (args != NULL)
+        LocalFree(args);
+    free(payload);
+}
+
+/*
+ * Run executable (perhaps with a suffix of arguments from a shebang line)
+ * on cmdline. version is as for serve_child().
+ */
 static void
-invoke_child(wchar_t * executable, wchar_t * suffix, wchar_t * cmdline)
+invoke_child(wchar_t * executable, wchar_t * suffix, wchar_t * cmdline,
+             wchar_t * version)
 {
     wchar_t * child_command;
-    size_t child_command_size;
-    BOOL no_suffix = (suffix == NULL) || (*suffix == L'\0');
-    BOOL no_cmdline = (*cmdline == L'\0');
 
-    if (no_suffix && no_cmdline)
-        run_child(executable);
-    else {
-        if (no_suffix) {
-            /* add 2 for space separator + terminating NUL. */
-            child_command_size = wcslen(executable) + wcslen(cmdline) + 2;
-        }
-        else {
-            /* add 3 for 2 space separators + terminating NUL. */
-            child_command_size = wcslen(executable) + wcslen(suffix) +
-                                    wcslen(cmdline) + 3;
-        }
-        child_command = calloc(child_command_size, sizeof(wchar_t));
-        if (child_command == NULL)
-            error(RC_CREATE_PROCESS, L"unable to allocate %d bytes for child command.",
-                  child_command_size);
-        if (no_suffix)
-            _snwprintf_s(child_command, child_command_size,
-                         child_command_size - 1, L"%ls %ls",
-                         executable, cmdline);
-        else
-            _snwprintf_s(child_command, child_command_size,
-                         child_command_size - 1, L"%ls %ls %ls",
-                         executable, suffix, cmdline);
-        run_child(child_command);
-        free(child_command);
-    }
+    serve_child(executable, version, suffix, cmdline);
+    child_command = shebang_child_command(executable, suffix, cmdline);
+    if (child_command == NULL)
+        error(RC_CREATE_PROCESS, L"unable to allocate memory for child \
+command.");
+    run_child(child_command);
+    free(child_command);
 }
 
-typedef struct {
-    wchar_t *shebang;
-    BOOL search;
-} SHEBANG;
-
-static SHEBANG builtin_virtual_paths [] = {
-    { L"/usr/bin/env python", TRUE },
-    { L"/usr/bin/python", FALSE },
-    { L"/usr/local/bin/python", FALSE },
-    { L"python", FALSE },
-    { NULL, FALSE },
-};
+#if defined(SEARCH_PATH)
 
-/* For now, a static array of commands. */
+static unsigned long path_searches = 0;  /* so far, for the plan cache */
+static wchar_t path_command_key[MAX_PATH];
+static wchar_t path_command_value[MSGSIZE];
+static CONFIG_ENTRY path_command = {
+    NULL, 0, 0, NULL, NULL, path_command_key, path_command_value
+};
 
-#define MAX_COMMANDS 100
+/*
+ * Commands without an extension are looked for with each extension in
+ * PATHEXT in turn, so that an earlier extension anywhere on the path beats
+ * a later one in the first directory. Rather than ask SearchPathW to probe
+ * every directory for every extension, the directories it would search are
+ * listed (each at most once, and only as far as needed) into an index - see
+ * path_index.h. With PYLAUNCH_PATH_CACHE set, the listings are saved, so
+ * that later launches only have to check that the directories are
+ * unchanged.
+ */
+static PATH_INDEX path_index;
+static BOOL path_index_built = FALSE;
+static BOOL path_index_usable = FALSE;
+static wchar_t path_cache_path[MAX_PATH];
 
-typedef struct {
-    wchar_t key[MAX_PATH];
-    wchar_t value[MSGSIZE];
-} COMMAND;
+static BOOL
+list_dir(void * context, const wchar_t * dir, PATH_ADD add, void * arg)
+{
+    wchar_t pattern[MAX_PATH];
+    WIN32_FIND_DATAW found;
+    HANDLE h;
 
-static COMMAND commands[MAX_COMMANDS];
-static int num_commands = 0;
+    if (_snwprintf_s(pattern, MAX_PATH, _TRUNCATE, L"%ls\\*", dir) < 0)
+        return FALSE;
+    /* Short names aren't needed, and fetching them is slow. */
+    h = FindFirstFileExW(pattern, FindExInfoBasic, &found,
+                         FindExSearchNameMatch, NULL,
+                         FIND_FIRST_EX_LARGE_FETCH);
+    if (h == INVALID_HANDLE_VALUE)
+        return GetLastError() == ERROR_FILE_NOT_FOUND;  /* empty */
+    do {
+        add(arg, found.cFileName);
+    } while (FindNextFileW(h, &found));
+    FindClose(h);
+    return TRUE;
+}
 
-#if defined(SKIP_PREFIX)
+static PATH_BACKEND path_backend = { NULL, list_dir, file_stamp };
 
-static wchar_t * builtin_prefixes [] = {
-    /* These must be in an order that the longest matches should be found,
-     * i.e. if the prefix is "/usr/bin/env ", it should match that entry
-     * *before* matching "/usr/bin/".
-     */
-    L"/usr/bin/env ",
-    L"/usr/bin/",
-    L"/usr/local/bin/",
-    NULL
-};
+/* Add a directory to those searched, unless there's no room for it. */
+static void
+add_search_dir(wchar_t ** dirs, int * num_dirs, int max_dirs, wchar_t * dir)
+{
+    if (*dir && (*num_dirs < max_dirs))
+        dirs[(*num_dirs)++] = dir;
+}
 
-static wchar_t * skip_prefix(wchar_t * name)
+/*
+ * Work out the directories SearchPathW would search, in order: the
+ * launcher's own, the system directories, the current one (before them,
+ * if safe process search mode has been turned off) and those on PATH.
+ * Returns a malloc'd block holding them all, or NULL.
+ */
+static wchar_t *
+get_search_dirs(wchar_t *** dirs, int * num_dirs)
 {
-    wchar_t ** pp = builtin_prefixes;
-    wchar_t * result = name;
+    wchar_t * block;
     wchar_t * p;
-    size_t n;
-
-    for (; p = *pp; pp++) {
-        n = wcslen(p);
-        if (_wcsnicmp(p, name, n) == 0) {
-            result += n;   /* skip the prefix */
-            if (p[n - 1] == L' ') /* No empty strings in table, so n > 1 */
-                result = skip_whitespace(result);
-            break;
+    wchar_t * path = get_env(L"PATH");
+    size_t path_size = (path == NULL) ? 1 : wcslen(path) + 1;
+    int max_dirs = (int) path_size / 2 + 6;  /* at most one per ';' */
+    DWORD safe_mode = 1;
+    DWORD size = sizeof(safe_mode);
+    wchar_t * app_dir;
+    wchar_t * current_dir;
+    wchar_t * system_dir;
+    wchar_t * system16_dir;
+    wchar_t * windows_dir;
+
+    *num_dirs = 0;
+    block = malloc(5 * MAX_PATH * sizeof(wchar_t) +
+                   path_size * sizeof(wchar_t));
+    *dirs = malloc(max_dirs * sizeof(wchar_t *));
+    if ((block == NULL) || (*dirs == NULL)) {
+        free(block);
+        free(*dirs);
+        return NULL;
+    }
+    app_dir = block;
+    current_dir = app_dir + MAX_PATH;
+    system_dir = current_dir + MAX_PATH;
+    system16_dir = system_dir + MAX_PATH;
+    windows_dir = system16_dir + MAX_PATH;
+    p = windows_dir + MAX_PATH;
+    if (GetModuleFileNameW(NULL, app_dir, MAX_PATH) &&
+        (wcsrchr(app_dir, L'\\') != NULL))
+        *wcsrchr(app_dir, L'\\') = L'\0';
+    else
+        *app_dir = L'\0';
+    if (!GetCurrentDirectoryW(MAX_PATH, current_dir))
+        *current_dir = L'\0';
+    if (!GetSystemDirectoryW(system_dir, MAX_PATH))
+        *system_dir = L'\0';
+    if (!GetWindowsDirectoryW(windows_dir, MAX_PATH))
+        *windows_dir = L'\0';
+    _snwprintf_s(system16_dir, MAX_PATH, _TRUNCATE, L"%ls\\System",
+                 windows_dir);
+    RegGetValueW(HKEY_LOCAL_MACHINE,
+                 L"SYSTEM\\CurrentControlSet\\Control\\Session Manager",
+                 L"SafeProcessSearchMode", RRF_RT_REG_DWORD, NULL,
+                 &safe_mode, &size);
+    add_search_dir(*dirs, num_dirs, max_dirs, app_dir);
+    if (!safe_mode)
+        add_search_dir(*dirs, num_dirs, max_dirs, current_dir);
+    add_search_dir(*dirs, num_dirs, max_dirs, system_dir);
+    if (*windows_dir)
+        add_search_dir(*dirs, num_dirs, max_dirs, system16_dir);
+    add_search_dir(*dirs, num_dirs, max_dirs, windows_dir);
+    if (safe_mode)
+        add_search_dir(*dirs, num_dirs, max_dirs, current_dir);
+    if (path != NULL) {
+        wcscpy_s(p, path_size, path);
+        for (;;) {
+            add_search_dir(*dirs, num_dirs, max_dirs, p);
+            p = wcschr(p, L';');
+            if (p == NULL)
+                break;
+            *p++ = L'\0';
         }
     }
-    return result;
+    return block;
 }
 
-#endif
+static void
+build_path_index()
+{
+    wchar_t ** dirs;
+    int num_dirs;
+    wchar_t * block;
+    wchar_t * pathext;
+    wchar_t * appdata_dir;
+    HANDLE h;
+    LARGE_INTEGER size;
+    DWORD nread;
+    void * data = NULL;
+
+    path_index_built = TRUE;
+    block = get_search_dirs(&dirs, &num_dirs);
+    if (block == NULL)
+        return;
+    pathext = get_env(L"PATHEXT");
+    path_index_usable = path_index_init(&path_index, &path_backend,
+                                        (const wchar_t * const *) dirs,
+                                        num_dirs, pathext ? pathext : L"");
+    free(dirs);
+    free(block);
+    if (!path_index_usable) {
+        debug(L"unable to index PATH\n");
+        return;
+    }
+    if ((get_env(L"PYLAUNCH_PATH_CACHE") == NULL) ||
+        (get_env(L"PYLAUNCH_NO_CACHE") != NULL) ||
+        ((appdata_dir = get_appdata_dir()) == NULL))
+        return;
+    _snwprintf_s(path_cache_path, MAX_PATH, _TRUNCATE,
+                 L"%ls\\pylauncher\\path-index.cache", appdata_dir);
+    h = CreateFileW(path_cache_path, GENERIC_READ,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE)
+        return;
+    if (GetFileSizeEx(h, &size) && (size.QuadPart < 0x10000000) &&
+        ((data = malloc((size_t) size.QuadPart)) != NULL) &&
+        ReadFile(h, data, (DWORD) size.QuadPart, &nread, NULL) &&
+        (nread == size.QuadPart)) {
+        if (!path_index_load(&path_index, data, nread))
+            debug(L"PATH index cache '%ls' not usable\n", path_cache_path);
+    }
+    else {
+        free(data);
+    }
+    CloseHandle(h);
+}
 
-#if defined(SEARCH_PATH)
+static void
+save_path_index()
+{
+    void * data;
+    size_t size;
+    wchar_t * p;
 
-static COMMAND path_command;
+    path_index.dirty = FALSE;
+    size = path_index_save(&path_index, &data);
+    if (size == 0)
+        return;
+    p = wcsrchr(path_cache_path, L'\\');
+    *p = L'\0';
+    CreateDirectoryW(path_cache_path, NULL);    /* may already exist */
+    *p = L'\\';
+    if (replace_file(path_cache_path, data, size))
+        debug(L"wrote PATH index cache '%ls'\n", path_cache_path);
+    free(data);
+}
 
-static COMMAND * find_on_path(wchar_t * name)
+/* Look for name with each extension in turn, the old way. */
+static BOOL
+probe_path(wchar_t * name)
 {
     wchar_t * pathext;
     size_t    varsize;
     wchar_t * context = NULL;
     wchar_t * extension;
-    COMMAND * result = NULL;
-    DWORD     len;
+    BOOL      found = FALSE;
     errno_t   rc;
 
-    wcscpy_s(path_command.key, MAX_PATH, name);
+    rc = _wdupenv_s(&pathext, &varsize, L"PATHEXT");
+    if ((rc == 0) && (pathext != NULL)) {
+        extension = wcstok_s(pathext, L";", &context);
+        while (extension) {
+            if (SearchPathW(NULL, name, extension, MSGSIZE, path_command.value,
+                            NULL)) {
+                found = TRUE;
+                break;
+            }
+            extension = wcstok_s(NULL, L";", &context);
+        }
+        free(pathext);
+    }
+    return found;
+}
+
+/* Look for name, which has no extension, using the index. */
+static BOOL
+find_indexed(wchar_t * name)
+{
+    wchar_t path[MSGSIZE];
+    const wchar_t * extension;
+    const wchar_t * dir;
+    size_t n;
+    int d;
+
+    if (!path_index_built)
+        build_path_index();
+    /* Names with a path of their own are relative to the directories. */
+    if (!path_index_usable || wcspbrk(name, L"\\/:"))
+        return probe_path(name);
+    d = path_index_find(&path_index, name, &extension);
+    if (path_index.dirty && path_cache_path[0] && !path_index.failed)
+        save_path_index();
+    if (path_index.failed)
+        return probe_path(name);
+    if (d < 0)
+        return FALSE;
+    dir = path_index.dirs[d].path;
+    n = wcslen(dir);
+    /* SearchPathW gives the name and extension as asked for, in full. */
+    if ((_snwprintf_s(path, MSGSIZE, _TRUNCATE, L"%ls%ls%ls%ls", dir,
+                      ((dir[n - 1] == L'\\') || (dir[n - 1] == L'/')) ?
+                      L"" : L"\\", name, extension) < 0) ||
+        !GetFullPathNameW(path, MSGSIZE, path_command.value, NULL))
+        return probe_path(name);
+    return TRUE;
+}
+
+static const CONFIG_ENTRY * find_on_path(wchar_t * name)
+{
+    const CONFIG_ENTRY * result = NULL;
+    DWORD     len;
+    LONGLONG  t0 = get_ticks();
+
+    ++path_searches;
+    wcsncpy_s(path_command.key, MAX_PATH, name, _TRUNCATE);
     if (wcschr(name, L'.') != NULL) {
         /* assume it has an extension. */
         len = SearchPathW(NULL, name, NULL, MSGSIZE, path_command.value, NULL);
@@ -805,539 +2436,971 @@ static COMMAND * find_on_path(wchar_t * name)
             result = &path_command;
         }
     }
-    else {
+    else if (find_indexed(name)) {
         /* No extension - search using registered extensions. */
-        rc = _wdupenv_s(&pathext, &varsize, L"PATHEXT");
-        if (rc == 0) {
-            extension = wcstok_s(pathext, L";", &context);
-            while (extension) {
-                len = SearchPathW(NULL, name, extension, MSGSIZE, path_command.value, NULL);
-                if (len) {
-                    result = &path_command;
-                    break;
-                }
-                extension = wcstok_s(NULL, L";", &context);
-            }
-            free(pathext);
-        }
+        result = &path_command;
     }
+    if (trace_event(EVENT_PATH_SEARCH, t0)) {
+        trace_string(&trace, "name", name);
+        trace_string(&trace, "found", result ? result->value : NULL);
+        trace_integer(&trace, "dirs_listed", path_index.listings);
+        trace_integer(&trace, "dirs_reused", path_index.reused);
+        trace_end(&trace);
+    }
+    timings[TIMING_PATH] += get_ticks() - t0;
     return result;
 }
 
 #endif
 
-static COMMAND *
-find_command_in_config(wchar_t * name)
-{
-    COMMAND * result = NULL;
-    COMMAND * cp = commands;
-    int i;
-
-    for (i = 0; i < num_commands; i++, cp++) {
-        if (_wcsicmp(cp->key, name) == 0) {
-            result = cp;
-            break;
-        }
-    }
-    return result;    
-}
-
-static COMMAND *
+static const CONFIG_ENTRY *
 find_command(wchar_t * name)
 {
-    COMMAND * result = find_command_in_config(name);
+    const CONFIG_ENTRY * result;
+    LONGLONG t0 = get_ticks();
+
+    read_config();
+    result = config_find(&config, L"commands", name);
 #if defined(SEARCH_PATH)
     if (result == NULL)
         result = find_on_path(name);
 #endif
+    if (trace_event(EVENT_COMMAND, t0)) {
+        trace_string(&trace, "name", name);
+        trace_string(&trace, "value", result ? result->value : NULL);
+        /* the ini file it came from, or NULL for PATH */
+        trace_string(&trace, "source", result ? result->source : NULL);
+        trace_end(&trace);
+    }
     return result;
 }
 
+static wchar_t *
+lookup_command(void * context, const wchar_t * name)
+{
+    const CONFIG_ENTRY * cp = find_command((wchar_t *) name);
+
+    return (cp == NULL) ? NULL : cp->value;
+}
+
+static SHEBANG_BACKEND shebang_backend = {
+    NULL, lookup_command,
+#if defined(SKIP_PREFIX)
+    TRUE
+#else
+    FALSE
+#endif
+};
+
+static BOOL
+validate_version(wchar_t * p)
+{
+    PY_VERSION v;
+
+    return parse_version(p, &v, TRUE);
+}
+
+/*
+ * How the launcher decided what to run for a script. The executable and
+ * suffix may point into the shebang line held here, or into static storage
+ * which is only valid until the next lookup. A non-zero rc means that the
+ * launcher would exit with that error code and message.
+ */
+
+#define RULE_MAGIC      L"magic"    /* compiled file's magic number */
+#define RULE_VIRTUAL    L"virtual"  /* builtin virtual path */
+#define RULE_COMMAND    L"command"  /* [commands] entry in py.ini */
+#define RULE_PATH       L"path"     /* search of PATH */
+#define RULE_SHEBANG    L"shebang"  /* shebang line used verbatim */
+#define RULE_VENV       L"venv"     /* active virtual environment */
+#define RULE_PROJECT    L"project"  /* the script's project's .venv */
+#define RULE_DEFAULT    L"default"  /* default Python */
+
+#define PHASE_READ      0
+#define PHASE_PARSE     1
+#define PHASE_LOCATE    2
+#define NUM_PHASES      3
+
+static wchar_t * phase_names[NUM_PHASES] = {
+    L"read", L"parse", L"locate"
+};
+
+typedef struct {
+    wchar_t * executable;
+    wchar_t * suffix;
+    wchar_t * rule;
+    INSTALLED_PYTHON * ip;
+    int rc;
+    wchar_t message[MSGSIZE];
+    wchar_t shebang_line[BUFSIZE + 1];
+    LONGLONG ticks[NUM_PHASES];
+} RESOLUTION;
+
+/*
+ * The version of the Python a script is to be run with, as serve_child()
+ * wants it: empty if the rule means the executable is a Python, but not
+ * which, or NULL if it mightn't be a Python at all.
+ */
+static wchar_t *
+child_version(const wchar_t * rule, INSTALLED_PYTHON * ip)
+{
+    if (ip != NULL)
+        return ip->version;
+    if (!wcscmp(rule, RULE_MAGIC) || !wcscmp(rule, RULE_VIRTUAL) ||
+        !wcscmp(rule, RULE_VENV) || !wcscmp(rule, RULE_PROJECT) ||
+        !wcscmp(rule, RULE_DEFAULT))
+        return L"";
+    return NULL;
+}
+
 static void
-update_command(COMMAND * cp, wchar_t * name, wchar_t * cmdline)
+resolution_error(RESOLUTION * r, int rc, wchar_t * format, ...)
 {
-    wcsncpy_s(cp->key, MAX_PATH, name, _TRUNCATE);
-    wcsncpy_s(cp->value, MSGSIZE, cmdline, _TRUNCATE);
+    va_list va;
+
+    va_start(va, format);
+    _vsnwprintf_s(r->message, MSGSIZE, _TRUNCATE, format, va);
+    va_end(va);
+    r->rc = rc;
 }
 
 static void
-add_command(wchar_t * name, wchar_t * cmdline)
+init_resolution(RESOLUTION * r)
 {
-    if (num_commands >= MAX_COMMANDS) {
-        debug(L"can't add %ls = '%ls': no room\n", name, cmdline);
-    }
-    else {
-        COMMAND * cp = &commands[num_commands++];
+    r->executable = r->suffix = r->rule = NULL;
+    r->ip = NULL;
+    r->rc = 0;
+    r->message[0] = L'\0';
+    memset(r->ticks, 0, sizeof(r->ticks));
+}
 
-        update_command(cp, name, cmdline);
-    }
+static void
+resolved(RESOLUTION * r, wchar_t * executable, wchar_t * suffix,
+         wchar_t * rule, INSTALLED_PYTHON * ip)
+{
+    r->executable = executable;
+    r->suffix = suffix;
+    r->rule = rule;
+    r->ip = ip;
+#if defined(SCRIPT_WRAPPER)
+    /*
+     * A Python too old to run a script appended to the wrapper would fail
+     * with a SyntaxError, reading the wrapper as source (see
+     * wrapper_archive.h), so say why instead. One not known to be too old -
+     * named by its path, say - is left to try.
+     */
+    if (wrapped_appended && (ip != NULL) &&
+        !archive_python_supported(&ip->parsed))
+        resolution_error(r, RC_NO_PYTHON, L"Python %ls can't run a script \
+appended to its wrapper: Python %d.%d or later is needed.", ip->version,
+                         ARCHIVE_MIN_MAJOR, ARCHIVE_MIN_MINOR);
+#endif
 }
 
 static void
-read_config_file(wchar_t * config_path)
+trace_shebang(wchar_t * path, LONGLONG t0, size_t read,
+              SCRIPT_HEADER * header, wchar_t * line)
+{
+    static wchar_t * kinds[] = { L"none", L"text", L"pyc", L"zipapp" };
+
+    if (trace_event(EVENT_SHEBANG, t0)) {
+        trace_string(&trace, "script", path);
+        trace_string(&trace, "kind", kinds[header->kind]);
+        trace_integer(&trace, "bytes", (long long) read);
+        trace_integer(&trace, "code_page", header->code_page);
+        trace_string(&trace, "line", line);
+        trace_end(&trace);
+    }
+}
+
+/*
+ * Read the start of a script - HEADER_READ_SIZE bytes, and more only if
+ * header_classify() asks for them - and classify it. *data is set to buffer,
+ * or to a malloc'd block if more was read, and *size to the bytes in it.
+ * Returns FALSE if the script couldn't be opened.
+ */
+static BOOL
+read_header(wchar_t * path, unsigned char * buffer, unsigned char ** data,
+            size_t * size, SCRIPT_HEADER * header)
 {
-    wchar_t keynames[MSGSIZE];
-    wchar_t value[MSGSIZE];
-    DWORD read;
-    wchar_t * key;
-    COMMAND * cp;
-    wchar_t * cmdp;
-
-    read = GetPrivateProfileStringW(L"commands", NULL, NULL, keynames, MSGSIZE,
-                                    config_path);
-    if (read == MSGSIZE - 1) {
-        debug(L"read_commands: %ls: not enough space for names\n", config_path);
-    }
-    key = keynames;
-    while (*key) {
-        read = GetPrivateProfileStringW(L"commands", key, NULL, value, MSGSIZE,
-                                       config_path);
-        if (read == MSGSIZE - 1) {
-            debug(L"read_commands: %ls: not enough space for %ls\n",
-                  config_path, key);
+    FILE * fp;
+    unsigned char * p;
+    size_t wanted, got;
+    BOOL at_end;
+
+    *data = buffer;
+    *size = 0;
+#if defined(SCRIPT_WRAPPER)
+    if ((wrapped_fp != NULL) && (path == wrapped_script_path)) {
+        /* already open, at the appended script: only read it once */
+        fp = wrapped_fp;
+        wrapped_fp = NULL;
+    }
+    else
+#endif
+    if (_wfopen_s(&fp, path, L"rb") != 0)
+        return FALSE;
+    *size = fread(buffer, sizeof(char), HEADER_READ_SIZE, fp);
+    at_end = (*size < HEADER_READ_SIZE);
+    while ((wanted = header_classify(*data, *size, at_end, header)) != 0) {
+        if (*data == buffer) {
+            p = malloc(wanted);
+            if (p != NULL)
+                memcpy(p, buffer, *size);
         }
-        cmdp = skip_whitespace(value);
-        if (*cmdp) {
-            cp = find_command_in_config(key);
-            if (cp == NULL)
-                add_command(key, value);
-            else
-                update_command(cp, key, value);
+        else
+            p = realloc(*data, wanted);
+        if (p == NULL) {
+            /* make do with what has been read */
+            at_end = TRUE;
+            continue;
         }
-        key += wcslen(key) + 1;
+        *data = p;
+        got = fread(p + *size, sizeof(char), wanted - *size, fp);
+        at_end = (got < wanted - *size);
+        *size += got;
     }
+    fclose(fp);
+    debug(L"read_header: read %d bytes\n", *size);
+    return TRUE;
 }
 
-static void read_commands()
+/*
+ * Decode the first line of a script, less its terminator, returning the
+ * number of characters, or -1 if there isn't one. Lines longer than BUFSIZE
+ * characters are decoded into static storage, which *line is then set to
+ * point to.
+ */
+static int
+decode_line(unsigned char * data, SCRIPT_HEADER * header, wchar_t ** line)
 {
-    if (launcher_ini_path[0])
-        read_config_file(launcher_ini_path);
-    if (appdata_ini_path[0])
-        read_config_file(appdata_ini_path);
+    static wchar_t * long_line = NULL;
+    static size_t long_line_size = 0;
+    size_t needed = header->line_length + 1;
+    wchar_t * p;
+
+    if (needed > BUFSIZE + 1) {
+        if (needed > long_line_size) {
+            p = realloc(long_line, needed * sizeof(wchar_t));
+            if (p == NULL)
+                return -1;
+            long_line = p;
+            long_line_size = needed;
+        }
+        *line = long_line;
+    }
+    return header_decode_line(data, header, *line);
 }
 
+/*
+ * Look at a script's magic number or shebang line to decide what to run it
+ * with. Returns TRUE if a decision was made (or an error found), FALSE if
+ * the launcher should go on to its default processing.
+ */
 static BOOL
-parse_shebang(wchar_t * shebang_line, int nchars, wchar_t ** command,
-              wchar_t ** suffix, BOOL *search)
+resolve_shebang(wchar_t * path, RESOLUTION * r)
 {
-    BOOL rc = FALSE;
-    SHEBANG * vpp;
-    size_t plen;
-    wchar_t * p;
-    wchar_t zapped;
-    wchar_t * endp = shebang_line + nchars - 1;
-    COMMAND * cp;
-    wchar_t * skipped;
-
-    *command = NULL;    /* failure return */
-    *suffix = NULL;
-    *search = FALSE;
-
-    if ((*shebang_line++ == L'#') && (*shebang_line++ == L'!')) {
-        shebang_line = skip_whitespace(shebang_line);
-        if (*shebang_line) {
-            *command = shebang_line;
-            for (vpp = builtin_virtual_paths; vpp->shebang; ++vpp) {
-                plen = wcslen(vpp->shebang);
-                if (wcsncmp(shebang_line, vpp->shebang, plen) == 0) {
-                    rc = TRUE;
-                    *search = vpp->search;
-                    /* We can do this because all builtin commands contain
-                     * "python".
-                     */
-                    *command = wcsstr(shebang_line, L"python");
-                    break;
-                }
-            }
-            if (vpp->shebang == NULL) {
-                /*
-                 * Not found in builtins - look in customized commands.
-                 *
-                 * We can't permanently modify the shebang line in case
-                 * it's not a customized command, but we can temporarily
-                 * stick a NUL after the command while searching for it,
-                 * then put back the char we zapped.
-                 */
-#if defined(SKIP_PREFIX)
-                skipped = skip_prefix(shebang_line);
-#else
-                skipped = shebang_line;
+    unsigned char buffer[HEADER_READ_SIZE];
+    unsigned char * data;
+    SCRIPT_HEADER header;
+    wchar_t * shebang_line = r->shebang_line;
+    size_t read;
+    int nchars;
+    BOOL is_virt;
+    BOOL search;
+    wchar_t * command;
+    wchar_t * suffix;
+    wchar_t * rule;
+    const CONFIG_ENTRY * cmd = NULL;
+    INSTALLED_PYTHON * ip;
+    LONGLONG t, t0 = get_ticks();
+    LONGLONG read_start = t0;
+
+    init_resolution(r);
+    if (!read_header(path, buffer, &data, &read, &header)) {
+        r->ticks[PHASE_READ] = get_ticks() - t0;
+        return FALSE;
+    }
+    t = get_ticks();
+    r->ticks[PHASE_READ] = t - t0;
+    t0 = t;
+
+    if (header.kind == HEADER_PYC) {
+        ip = locate_python((wchar_t *) header.version, FALSE);
+        if (ip != NULL) {
+            debug(L"script file is compiled against Python %ls\n",
+                  ip->version);
+            if (data != buffer)
+                free(data);
+            resolved(r, ip->executable, NULL, RULE_MAGIC, ip);
+            r->ticks[PHASE_LOCATE] = get_ticks() - t0;
+            return TRUE;
+        }
+    }
+    debug(L"maybe_handle_shebang: code page %d\n", header.code_page);
+    /*
+     * If no CR or LF was found in the heading, we assume it's not a
+     * shebang file; nor is a zip file with nothing in front of it.
+     */
+    if (header.line_length == 0)
+        debug(L"maybe_handle_shebang: No line terminator found\n");
+    nchars = decode_line(data, &header, &shebang_line);
+    if (data != buffer)
+        free(data);
+    trace_shebang(path, read_start, read, &header,
+                  (nchars >= 0) ? shebang_line : NULL);
+    if (nchars < 0) {
+        r->ticks[PHASE_PARSE] = get_ticks() - t0;
+        return FALSE;
+    }
+    is_virt = shebang_parse(&shebang_backend, shebang_line, nchars,
+                            &command, &suffix, &search);
+    t = get_ticks();
+    r->ticks[PHASE_PARSE] = t - t0;
+    t0 = t;
+    if (command == NULL)
+        return FALSE;
+    debug(L"shebang_parse: found command: %ls\n", command);
+    if (!is_virt) {
+        /* Work out where shebang_parse() got the command from. */
+        if ((command >= shebang_line) && (command <= &shebang_line[nchars]))
+            rule = RULE_SHEBANG;
+#if defined(SEARCH_PATH)
+        else if (command == path_command.value)
+            rule = RULE_PATH;
 #endif
-                p = wcspbrk(skipped, L" \t\r\n");
-                if (p != NULL) {
-                    zapped = *p;
-                    *p = L'\0';
-                }
-                cp = find_command(skipped);
-                if (p != NULL)
-                    *p = zapped;
-                if (cp != NULL) {
-                    *command = cp->value;
-                    if (p != NULL)
-                        *suffix = skip_whitespace(p);
-                }
-            }
-            /* remove trailing whitespace */
-            while ((endp > shebang_line) && iswspace(*endp))
-                --endp;
-            if (endp > shebang_line)
-                endp[1] = L'\0';
+        else
+            rule = RULE_COMMAND;
+        resolved(r, command, suffix, rule, NULL);
+        return TRUE;
+    }
+    suffix = wcschr(command, L' ');
+    if (suffix != NULL) {
+        *suffix++ = L'\0';
+        suffix = skip_whitespace(suffix);
+    }
+    if (wcsncmp(command, L"python", 6)) {
+        resolution_error(r, RC_BAD_VIRTUAL_PATH,
+                         L"Unknown virtual path '%ls'", command);
+        return TRUE;
+    }
+    command += 6;   /* skip past "python" */
+    if (search && ((*command == L'\0') || iswspace(*command))) {
+        /* Command is eligible for path search, and there
+         * is no version specification.
+         */
+#if defined(SUPPORT_VENV) && defined(SUPPORT_VENV_IN_SHEBANG)
+        /* Look for an active virtualenv, or the project's */
+        BOOL in_project;
+        wchar_t * venv_command = find_python_by_venv(&in_project);
+        if (venv_command != NULL) {
+            debug(L"Python in venv: %ls\n", venv_command);
+            resolved(r, venv_command, suffix,
+                     in_project ? RULE_PROJECT : RULE_VENV, NULL);
+            r->ticks[PHASE_LOCATE] = get_ticks() - t0;
+            return TRUE;
+        }
+#endif
+        debug(L"searching PATH for python executable\n");
+        cmd = find_on_path(PYTHON_EXECUTABLE);
+        debug(L"Python on path: %ls\n", cmd ? cmd->value : L"<not found>");
+        if (cmd) {
+            debug(L"located python on PATH: %ls\n", cmd->value);
+            resolved(r, cmd->value, suffix, RULE_PATH, NULL);
+            r->ticks[PHASE_LOCATE] = get_ticks() - t0;
+            return TRUE;
+        }
+        /* FALL THROUGH: No python found on PATH, so fall
+         * back to locating the correct installed python.
+         */
+    }
+    if (*command && !validate_version(command)) {
+        resolution_error(r, RC_BAD_VIRTUAL_PATH, L"Invalid version \
+specification: '%ls'.\nIn the first line of the script, 'python' needs to be \
+followed by a valid version specifier.\nPlease check the documentation.",
+                         command);
+    }
+    else {
+        ip = locate_python(command, TRUE);
+        if (ip == NULL) {
+            resolution_error(r, RC_NO_PYTHON, L"Requested Python version \
+(%ls) is not installed", command);
+        }
+        else {
+            resolved(r, ip->executable, suffix, RULE_VIRTUAL, ip);
+        }
+    }
+    r->ticks[PHASE_LOCATE] = get_ticks() - t0;
+    return TRUE;
+}
+
+/*
+ * Decide what to run when a script doesn't say: the Python of the active
+ * virtual environment or the project's, or else the default Python.
+ */
+static void
+resolve_default(RESOLUTION * r)
+{
+    INSTALLED_PYTHON * ip;
+    LONGLONG t0 = get_ticks();
+#if defined(SUPPORT_VENV)
+    /* Look for an active virtualenv, or the project's */
+    BOOL in_project;
+    wchar_t * executable = find_python_by_venv(&in_project);
+
+    if (executable != NULL) {
+        resolved(r, executable, NULL, in_project ? RULE_PROJECT : RULE_VENV,
+                 NULL);
+        r->ticks[PHASE_LOCATE] += get_ticks() - t0;
+        return;
+    }
+#endif
+    /* If we didn't find one, look for the default Python */
+    ip = locate_python(L"", FALSE);
+    if (ip == NULL)
+        resolution_error(r, RC_NO_PYTHON, L"Can't find a default Python.");
+    else
+        resolved(r, ip->executable, NULL, RULE_DEFAULT, ip);
+    r->ticks[PHASE_LOCATE] += get_ticks() - t0;
+}
+
+/*
+ * Launch-plan cache. With PYLAUNCH_PLAN_CACHE set to the number of plans to
+ * keep, what a script was run with is saved (see plan_cache.h), one file
+ * per script in the local application data folder, so that running it again
+ * needn't read it, the configuration or the registry. The least recently
+ * used plans are deleted once there are more than that. Plans are written
+ * to a temporary file and renamed into place, so concurrent launchers only
+ * ever see complete plans.
+ *
+ * Besides the files and registry views a plan records, it depends on the
+ * py.ini locations, the script's project and the variables below, which
+ * are fingerprinted. A plan
+ * which involved searching PATH isn't saved, as it would also depend on
+ * the contents of every directory searched.
+ */
+#define PLAN_CACHE_DEFAULT_SIZE 256
+
+static wchar_t plan_dir[MAX_PATH];
+static size_t plan_cache_size;
+
+static void
+find_plan_dir()
+{
+    wchar_t * wp = get_env(L"PYLAUNCH_PLAN_CACHE");
+    wchar_t * appdata_dir;
+    long n;
+
+    if ((wp == NULL) || (get_env(L"PYLAUNCH_NO_CACHE") != NULL))
+        return;
+    n = wcstol(wp, NULL, 10);
+    plan_cache_size = (n > 0) ? n : PLAN_CACHE_DEFAULT_SIZE;
+    appdata_dir = get_appdata_dir();
+    if (appdata_dir != NULL)
+        _snwprintf_s(plan_dir, MAX_PATH, _TRUNCATE,
+                     L"%ls\\pylauncher\\plans-%ls-%d", appdata_dir,
+                     PYTHON_EXECUTABLE, LAUNCHER_BITS);
+}
+
+static unsigned long long
+plan_fingerprint(wchar_t * local_ini, wchar_t * global_ini)
+{
+    unsigned long long hash = PLAN_HASH_INIT;
+    wchar_t * env;
+    wchar_t * p;
+
+    hash = plan_hash(hash, local_ini);
+    hash = plan_hash(hash, global_ini);
+    hash = plan_hash(hash, get_env(L"VIRTUAL_ENV"));
+    hash = plan_hash(hash, project.venv);
+    hash = plan_hash(hash, project_pin);
+    hash = plan_hash(hash, project_ini_path);
+    /* PY_PYTHON, PY_PYTHON3 and so on, in the block's (sorted) order */
+    env = GetEnvironmentStringsW();
+    if (env != NULL) {
+        for (p = env; *p; p += wcslen(p) + 1) {
+            if (_wcsnicmp(p, L"PY_PYTHON", 9) == 0)
+                hash = plan_hash(hash, p);
+        }
+        FreeEnvironmentStringsW(env);
+    }
+    return hash;
+}
+
+static void
+trace_plan_cache(LONGLONG t0, wchar_t * script, wchar_t * status)
+{
+    if (trace_event(EVENT_PLAN_CACHE, t0)) {
+        trace_string(&trace, "script", script);
+        trace_string(&trace, "status", status);
+        trace_end(&trace);
+    }
+}
+
+/*
+ * Read the plan for a script, returning a malloc'd block which *plan points
+ * into if there's one which is still valid, else NULL.
+ */
+static void *
+read_plan(wchar_t * script, unsigned long long fingerprint, PLAN * plan)
+{
+    wchar_t path[MAX_PATH];
+    wchar_t name[PLAN_NAME_SIZE];
+    HANDLE h;
+    LARGE_INTEGER size;
+    DWORD nread;
+    FILETIME now;
+    void * data = NULL;
+    BOOL ok = FALSE;
+
+    plan_file_name(script, name);
+    _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\%ls", plan_dir, name);
+    /* FILE_SHARE_DELETE lets writers replace the file while we read it. */
+    h = CreateFileW(path, GENERIC_READ | FILE_WRITE_ATTRIBUTES,
+                    FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE,
+                    NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (h == INVALID_HANDLE_VALUE) {
+        debug(L"no launch plan '%ls'\n", path);
+        return NULL;
+    }
+    if (GetFileSizeEx(h, &size) && (size.QuadPart <= PLAN_MAX_SIZE) &&
+        ((data = malloc((size_t) size.QuadPart)) != NULL) &&
+        ReadFile(h, data, (DWORD) size.QuadPart, &nread, NULL) &&
+        (nread == size.QuadPart)) {
+        ok = plan_validate(&windows_backend, script, fingerprint,
+                           registry_views, num_registry_views, data, nread,
+                           plan);
+    }
+    if (ok) {
+        /* The last-write time is what eviction goes by. */
+        GetSystemTimeAsFileTime(&now);
+        SetFileTime(h, NULL, NULL, &now);
+        debug(L"using launch plan '%ls'\n", path);
+    }
+    else {
+        debug(L"launch plan '%ls' is out of date\n", path);
+        free(data);
+        data = NULL;
+    }
+    CloseHandle(h);
+    return data;
+}
+
+/* Delete the least recently used plans, if there are too many. */
+static void
+evict_plans()
+{
+    wchar_t path[MAX_PATH];
+    WIN32_FIND_DATAW found;
+    HANDLE h;
+    PLAN_ENTRY * entries = NULL;
+    PLAN_ENTRY * p;
+    size_t n = 0, capacity = 0;
+    size_t victims, i;
+
+    _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\*.plan", plan_dir);
+    h = FindFirstFileW(path, &found);
+    if (h == INVALID_HANDLE_VALUE)
+        return;
+    do {
+        if (wcslen(found.cFileName) >= PLAN_NAME_SIZE)
+            continue;   /* not one of ours */
+        if (n == capacity) {
+            capacity = capacity ? capacity * 2 : 64;
+            p = realloc(entries, capacity * sizeof(PLAN_ENTRY));
+            if (p == NULL)
+                break;
+            entries = p;
         }
+        wcscpy_s(entries[n].name, PLAN_NAME_SIZE, found.cFileName);
+        entries[n].last_used =
+            ((unsigned long long) found.ftLastWriteTime.dwHighDateTime
+             << 32) | found.ftLastWriteTime.dwLowDateTime;
+        ++n;
+    } while (FindNextFileW(h, &found));
+    FindClose(h);
+    victims = plan_evict(entries, n, plan_cache_size);
+    for (i = 0; i < victims; i++) {
+        _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\%ls", plan_dir,
+                     entries[i].name);
+        debug(L"evicting launch plan '%ls'\n", path);
+        DeleteFileW(path);  /* another launcher may have got there first */
     }
-    return rc;
+    free(entries);
 }
 
-/* #define CP_UTF8             65001 defined in winnls.h */
-#define CP_UTF16LE          1200
-#define CP_UTF16BE          1201
-#define CP_UTF32LE          12000
-#define CP_UTF32BE          12001
+/*
+ * Save a plan, with the stamps of the files it depends on (taken before the
+ * decision was made) and the executable decided on.
+ */
+static BOOL
+write_plan(wchar_t * script, unsigned long long fingerprint,
+           CACHE_STAMP * view_stamps, PLAN_FILE * files, int num_files,
+           RESOLUTION * r)
+{
+    wchar_t path[MAX_PATH];
+    wchar_t temp_path[MAX_PATH];
+    wchar_t name[PLAN_NAME_SIZE];
+    PLAN plan;
+    void * data;
+    size_t size;
+    BOOL ok;
 
-typedef struct {
-    int length;
-    char sequence[4];
-    UINT code_page;
-} BOM;
+    plan.executable = r->executable;
+    plan.suffix = r->suffix;
+    plan.rule = r->rule;
+    files[num_files].path = r->executable;
+    cache_stamp_file(&windows_backend, r->executable,
+                     &files[num_files].stamp);
+    size = plan_build(script, fingerprint, registry_views, view_stamps,
+                      num_registry_views, files, num_files + 1, &plan, &data);
+    if (size == 0)
+        return FALSE;
+    /* The folders may not exist yet. */
+    wcsncpy_s(temp_path, MAX_PATH, plan_dir, _TRUNCATE);
+    *wcsrchr(temp_path, L'\\') = L'\0';
+    CreateDirectoryW(temp_path, NULL);
+    CreateDirectoryW(plan_dir, NULL);
+    plan_file_name(script, name);
+    _snwprintf_s(path, MAX_PATH, _TRUNCATE, L"%ls\\%ls", plan_dir, name);
+    ok = replace_file(path, data, size);
+    free(data);
+    if (!ok) {
+        debug(L"unable to write launch plan '%ls': %X\n", path,
+              GetLastError());
+        return FALSE;
+    }
+    debug(L"wrote launch plan '%ls'\n", path);
+    evict_plans();
+    return TRUE;
+}
 
 /*
- * Strictly, we don't need to handle UTF-16 and UTF-32, since Python itself
- * doesn't. Never mind, one day it might - there's no harm leaving it in.
+ * Run a script, by its plan if there's a valid one, else by deciding as
+ * usual - with its shebang line, or the default Python - and then saving
+ * the plan. This never returns.
  */
-static BOM BOMs[] = {
-    { 3, { 0xEF, 0xBB, 0xBF }, CP_UTF8 },           /* UTF-8 - keep first */
-    /* Test UTF-32LE before UTF-16LE since UTF-16LE BOM is a prefix
-     * of UTF-32LE BOM. */
-    { 4, { 0xFF, 0xFE, 0x00, 0x00 }, CP_UTF32LE },  /* UTF-32LE */
-    { 4, { 0x00, 0x00, 0xFE, 0xFF }, CP_UTF32BE },  /* UTF-32BE */
-    { 2, { 0xFF, 0xFE }, CP_UTF16LE },              /* UTF-16LE */
-    { 2, { 0xFE, 0xFF }, CP_UTF16BE },              /* UTF-16BE */
-    { 0 }                                           /* sentinel */
-};
+static void
+run_planned(wchar_t * script, wchar_t * cmdline)
+{
+    wchar_t full_path[MAX_PATH];
+    wchar_t local_ini[MAX_PATH];
+    wchar_t global_ini[MAX_PATH];
+    wchar_t venv_python[MAX_PATH];
+    wchar_t project_python[MAX_PATH];
+    wchar_t * virtual_env;
+    CACHE_STAMP view_stamps[CACHE_MAX_VIEWS];
+    PLAN_FILE files[PLAN_MAX_FILES];
+    int num_files = 0;
+    int i;
+    BOOL cacheable = FALSE;
+    unsigned long long fingerprint;
+    unsigned long searches;
+    RESOLUTION r;
+    PLAN plan;
+    void * data;
+    wchar_t * status;
+    LONGLONG t0 = get_ticks();
+    DWORD n = GetFullPathNameW(script, MAX_PATH, full_path, NULL);
+
+    init_resolution(&r);
+    if ((n == 0) || (n >= MAX_PATH))
+        full_path[0] = L'\0';
+    get_registry_views();
+    get_config_paths(local_ini, global_ini);
+    fingerprint = plan_fingerprint(local_ini, global_ini);
+    if (full_path[0]) {
+        data = read_plan(full_path, fingerprint, &plan);
+        if (data != NULL) {
+            trace_plan_cache(t0, full_path, L"hit");
+            invoke_child((wchar_t *) plan.executable, (wchar_t *) plan.suffix,
+                         cmdline, child_version(plan.rule, NULL));
+        }
+        /* Stamp everything before deciding, so changes made meanwhile
+         * invalidate the plan. */
+        files[num_files++].path = full_path;
+        files[num_files++].path = local_ini;
+        files[num_files++].path = global_ini;
+        virtual_env = get_env(L"VIRTUAL_ENV");
+        if ((virtual_env != NULL) && *virtual_env) {
+            _snwprintf_s(venv_python, MAX_PATH, _TRUNCATE,
+                         L"%ls\\Scripts\\%ls", virtual_env,
+                         PYTHON_EXECUTABLE);
+            files[num_files++].path = venv_python;
+        }
+        if (project_ini_path[0])
+            files[num_files++].path = project_ini_path;
+        if (project.pin[0])
+            files[num_files++].path = project.pin;
+        if (project.venv[0]) {
+            _snwprintf_s(project_python, MAX_PATH, _TRUNCATE,
+                         L"%ls\\Scripts\\%ls", project.venv,
+                         PYTHON_EXECUTABLE);
+            files[num_files++].path = project_python;
+        }
+        /* A script which doesn't exist is left for Python to report. */
+        cacheable = cache_stamp_file(&windows_backend, full_path,
+                                     &files[0].stamp);
+        for (i = 1; i < num_files; i++)
+            cache_stamp_file(&windows_backend, files[i].path,
+                             &files[i].stamp);
+        cache_stamp_views(&windows_backend, registry_views,
+                          num_registry_views, view_stamps);
+    }
+    searches = path_searches;
+    if (!resolve_shebang(script, &r))
+        resolve_default(&r);
+    timings[TIMING_SHEBANG] += r.ticks[PHASE_READ] + r.ticks[PHASE_PARSE];
+    if (r.rc)
+        error(r.rc, L"%ls", r.message);
+    t0 = get_ticks();
+    if (!cacheable || (path_searches != searches))
+        status = L"uncacheable";
+    else if (write_plan(full_path, fingerprint, view_stamps, files,
+                        num_files, &r))
+        status = L"written";
+    else
+        status = L"write_failed";
+    trace_plan_cache(t0, full_path[0] ? full_path : script, status);
+    invoke_child(r.executable, r.suffix, cmdline,
+                 child_version(r.rule, r.ip));
+}
 
-static BOM *
-find_BOM(char * buffer)
+static void
+maybe_handle_shebang(wchar_t ** argv, wchar_t * cmdline)
 {
 /*
- * Look for a BOM in the input and return a pointer to the
- * corresponding structure, or NULL if not found.
+ * Look for a shebang line in the first argument.  If found
+ * and we spawn a child process, this never returns.  If it
+ * does return then we process the args "normally".
+ *
+ * argv[0] might be a filename with a shebang.
  */
-    BOM * result = NULL;
-    BOM *bom;
+    RESOLUTION r;
+    BOOL found;
+
+    find_project(*argv);
+    find_plan_dir();
+    if (plan_dir[0])
+        run_planned(*argv, cmdline);
+    found = resolve_shebang(*argv, &r);
+    timings[TIMING_SHEBANG] += r.ticks[PHASE_READ] + r.ticks[PHASE_PARSE];
+    if (found) {
+        if (r.rc)
+            error(r.rc, L"%ls", r.message);
+        invoke_child(r.executable, r.suffix, cmdline,
+                     child_version(r.rule, r.ip));
+    }
+}
 
-    for (bom = BOMs; bom->length; bom++) {
-        if (strncmp(bom->sequence, buffer, bom->length) == 0) {
-            result = bom;
-            break;
-        }
+#if !defined(SCRIPT_WRAPPER)
+
+/*
+ * Batch resolution: "py --resolve [script ...]" reports what would be run
+ * for each script, without running anything. Scripts are named on the
+ * command line or, if there are none, read from stdin (one UTF-8 path per
+ * line). Each result is printed as a line of JSON; non-ASCII characters are
+ * escaped, so the output is plain ASCII.
+ */
+
+static void
+json_string(wchar_t * s)
+{
+    if (s == NULL) {
+        fputws(L"null", stdout);
+        return;
     }
-    return result;
+    fputwc(L'"', stdout);
+    for (; *s; s++) {
+        if ((*s == L'"') || (*s == L'\\'))
+            fwprintf(stdout, L"\\%lc", *s);
+        else if ((*s < 0x20) || (*s > 0x7E))
+            fwprintf(stdout, L"\\u%04x", (unsigned int) *s);
+        else
+            fputwc(*s, stdout);
+    }
+    fputwc(L'"', stdout);
 }
 
-static char *
-find_terminator(char * buffer, int len, BOM *bom)
+static void
+print_resolution(wchar_t * path, RESOLUTION * r)
 {
-    char * result = NULL;
-    char * end = buffer + len;
-    char  * p;
-    char c;
-    int cp;
+    int i;
 
-    for (p = buffer; p < end; p++) {
-        c = *p;
-        if (c == '\r') {
-            result = p;
-            break;
-        }
-        if (c == '\n') {
-            result = p;
-            break;
-        }
+    fputws(L"{\"script\": ", stdout);
+    json_string(path);
+    if (r->rc) {
+        fwprintf(stdout, L", \"rc\": %d, \"error\": ", r->rc);
+        json_string(r->message);
     }
-    if (result != NULL) {
-        cp = bom->code_page;
-
-        /* adjustments to include all bytes of the char */
-        /* no adjustment needed for UTF-8 or big endian */
-        if (cp == CP_UTF16LE)
-            ++result;
-        else if (cp == CP_UTF32LE)
-            result += 3;
-        ++result; /* point just past terminator */
+    else {
+        fputws(L", \"interpreter\": ", stdout);
+        json_string(r->executable);
+        fputws(L", \"suffix\": ", stdout);
+        json_string((r->suffix && *r->suffix) ? r->suffix : NULL);
+        fputws(L", \"version\": ", stdout);
+        json_string(r->ip ? r->ip->version : NULL);
+        if (r->ip)
+            fwprintf(stdout, L", \"bits\": %d", r->ip->bits);
+        else
+            fputws(L", \"bits\": null", stdout);
+        fputws(L", \"rule\": ", stdout);
+        json_string(r->rule);
     }
-    return result;
+    fputws(L", \"timings_us\": {", stdout);
+    for (i = 0; i < NUM_PHASES; i++)
+        fwprintf(stdout, L"%ls\"%ls\": %.1f", i ? L", " : L"",
+                 phase_names[i], ticks_to_us(r->ticks[i]));
+    fputws(L"}}\n", stdout);
 }
 
 static BOOL
-validate_version(wchar_t * p)
+resolve_one(wchar_t * path)
 {
-    BOOL result = TRUE;
+    RESOLUTION r;
 
-    if (!isdigit(*p))               /* expect major version */
-        result = FALSE;
-    else if (*++p) {                /* more to do */
-        if (*p != L'.')             /* major/minor separator */
-            result = FALSE;
-        else {
-            ++p;
-            if (!isdigit(*p))       /* expect minor version */
-                result = FALSE;
-            else {
-                ++p;
-                if (*p) {           /* more to do */
-                    if (*p != L'-')
-                        result = FALSE;
-                    else {
-                        ++p;
-                        if ((*p != '3') && (*++p != '2') && !*++p)
-                            result = FALSE;
-                    }
-                }
+    find_project(path);
+    if (!resolve_shebang(path, &r))
+        resolve_default(&r);
+    print_resolution(path, &r);
+    return r.rc == 0;
+}
+
+static int
+resolve_batch(int argc, wchar_t ** argv)
+{
+    char line[MSGSIZE * 3];
+    wchar_t path[MSGSIZE];
+    size_t n;
+    int i;
+    int count = 0, errors = 0;
+    LONGLONG t, start = get_ticks();
+    double discovery_time, config_time;
+
+    /* Do the work common to all scripts once, up front. */
+    project_save_deferred = TRUE;
+    locate_all_pythons();
+    t = get_ticks();
+    discovery_time = ticks_to_us(t - start);
+    read_config();
+    config_time = ticks_to_us(get_ticks() - t);
+
+    if (argc > 0) {
+        for (i = 0; i < argc; i++, count++) {
+            if (!resolve_one(argv[i]))
+                ++errors;
+        }
+    }
+    else {
+        while (fgets(line, sizeof(line), stdin) != NULL) {
+            n = strlen(line);
+            while ((n > 0) && ((line[n - 1] == '\n') ||
+                               (line[n - 1] == '\r')))
+                line[--n] = '\0';
+            if (n == 0)
+                continue;
+            if (!MultiByteToWideChar(CP_UTF8, 0, line, -1, path, MSGSIZE)) {
+                debug(L"resolve_batch: can't decode '%hs'\n", line);
+                continue;
             }
+            ++count;
+            if (!resolve_one(path))
+                ++errors;
         }
     }
-    return result;
+    fwprintf(stdout, L"{\"summary\": {\"scripts\": %d, \"errors\": %d, \
+\"pythons\": %d, \"timings_us\": {\"discovery\": %.1f, \"config\": %.1f, \
+\"total\": %.1f}}}\n", count, errors, (int) num_installed_pythons,
+             discovery_time, config_time, ticks_to_us(get_ticks() - start));
+    if (project_index.dirty)
+        save_project_index();
+    return 0;
 }
 
-typedef struct {
-    unsigned short min;
-    unsigned short max;
-    wchar_t version[MAX_VERSION_SIZE];
-} PYC_MAGIC;
-
-static PYC_MAGIC magic_values[] = {
-    { 50823, 50823, L"2.0" },
-    { 60202, 60202, L"2.1" },
-    { 60717, 60717, L"2.2" },
-    { 62011, 62021, L"2.3" },
-    { 62041, 62061, L"2.4" },
-    { 62071, 62131, L"2.5" },
-    { 62151, 62161, L"2.6" },
-    { 62171, 62211, L"2.7" },
-    { 3000, 3131, L"3.0" },
-    { 3141, 3151, L"3.1" },
-    { 3160, 3180, L"3.2" },
-    { 3190, 3230, L"3.3" },
-    { 3250, 3310, L"3.4" },
-    { 3320, 3351, L"3.5" },
-    { 3360, 3371, L"3.6" },
-    { 0 }
-};
+/*
+ * Listing: "py --list" prints the installed Pythons, in order of
+ * preference, and "py --list --json" prints each as a line of JSON, then a
+ * summary, so that tools needn't scan the registry themselves. Both come
+ * from the discovery cache when it's up to date.
+ */
 
-static INSTALLED_PYTHON *
-find_by_magic(unsigned short magic)
+static wchar_t *
+arch_name(int arch)
 {
-    INSTALLED_PYTHON * result = NULL;
-    PYC_MAGIC * mp;
-
-    for (mp = magic_values; mp->min; mp++) {
-        if ((magic >= mp->min) && (magic <= mp->max)) {
-            result = locate_python(mp->version, FALSE);
-            if (result != NULL)
-                break;
-        }
-    }
-    return result;
+    return (arch == ARCH_ARM64) ? L"arm64" : (arch == ARCH_64) ? L"x64" :
+           L"x86";
 }
 
-static void
-maybe_handle_shebang(wchar_t ** argv, wchar_t * cmdline)
+static int
+list_pythons(BOOL json)
 {
-/*
- * Look for a shebang line in the first argument.  If found
- * and we spawn a child process, this never returns.  If it
- * does return then we process the args "normally".
- *
- * argv[0] might be a filename with a shebang.
- */
-    FILE * fp;
-    errno_t rc = _wfopen_s(&fp, *argv, L"rb");
-    unsigned char buffer[BUFSIZE];
-    wchar_t shebang_line[BUFSIZE + 1];
-    size_t read;
-    char *p;
-    char * start;
-    char * shebang_alias = (char *) shebang_line;
-    BOM* bom;
-    int i, j, nchars = 0;
-    int header_len;
-    BOOL is_virt;
-    BOOL search;
-    wchar_t * command;
-    wchar_t * suffix;
-    COMMAND *cmd = NULL;
     INSTALLED_PYTHON * ip;
-
-    if (rc == 0) {
-        read = fread(buffer, sizeof(char), BUFSIZE, fp);
-        debug(L"maybe_handle_shebang: read %d bytes\n", read);
-        fclose(fp);
-
-        if ((read >= 4) && (buffer[3] == '\n') && (buffer[2] == '\r')) {
-            ip = find_by_magic((buffer[1] << 8 | buffer[0]) & 0xFFFF);
-            if (ip != NULL) {
-                debug(L"script file is compiled against Python %ls\n",
-                      ip->version);
-                invoke_child(ip->executable, NULL, cmdline);
-            }
-        }
-        /* Look for BOM */
-        bom = find_BOM(buffer);
-        if (bom == NULL) {
-            start = buffer;
-            debug(L"maybe_handle_shebang: BOM not found, using UTF-8\n");
-            bom = BOMs; /* points to UTF-8 entry - the default */
-        }
-        else {
-            debug(L"maybe_handle_shebang: BOM found, code page %d\n",
-                  bom->code_page);
-            start = &buffer[bom->length];
-        }
-        p = find_terminator(start, BUFSIZE, bom);
-        /*
-         * If no CR or LF was found in the heading,
-         * we assume it's not a shebang file.
-         */
-        if (p == NULL) {
-            debug(L"maybe_handle_shebang: No line terminator found\n");
+    INSTALLED_PYTHON * default_ip;
+    wchar_t executable[MAX_PATH];
+    wchar_t name[MAX_COMPANY_SIZE + MAX_VERSION_SIZE];
+    size_t i, n;
+    double discovery_time;
+    LONGLONG start = get_ticks();
+
+    locate_all_pythons();
+    discovery_time = ticks_to_us(get_ticks() - start);
+    /* Discovery is complete, so this doesn't reorder installed_pythons. */
+    default_ip = locate_python(L"", FALSE);
+    if (!json)
+        fwprintf(stdout, L"Installed Pythons, in order of preference (from \
+the %ls):\n\n", discovery_source);
+    for (i = 0, ip = installed_pythons; i < num_installed_pythons; i++, ip++) {
+        /* Executables with spaces are kept quoted, for command lines. */
+        wcscpy_s(executable, MAX_PATH, ip->executable);
+        n = wcslen(executable);
+        if ((n > 1) && (executable[0] == L'\"')) {
+            memmove(executable, &executable[1], (n - 2) * sizeof(wchar_t));
+            executable[n - 2] = L'\0';
         }
-        else {
-            /*
-             * Found line terminator - parse the shebang.
-             *
-             * Strictly, we don't need to handle UTF-16 anf UTF-32,
-             * since Python itself doesn't.
-             * Never mind, one day it might.
-             */
-            header_len = (int) (p - start);
-            switch(bom->code_page) {
-            case CP_UTF8:
-                nchars = MultiByteToWideChar(bom->code_page,
-                                             0,
-                                             start, header_len, shebang_line,
-                                             BUFSIZE);
-                break;
-            case CP_UTF16BE:
-                if (header_len % 2 != 0) {
-                    debug(L"maybe_handle_shebang: UTF-16BE, but an odd number \
-of bytes: %d\n", header_len);
-                    /* nchars = 0; Not needed - initialised to 0. */
-                }
-                else {
-                    for (i = header_len; i > 0; i -= 2) {
-                        shebang_alias[i - 1] = start[i - 2];
-                        shebang_alias[i - 2] = start[i - 1];
-                    }
-                    nchars = header_len / sizeof(wchar_t);
-                }
-                break;
-            case CP_UTF16LE:
-                if ((header_len % 2) != 0) {
-                    debug(L"UTF-16LE, but an odd number of bytes: %d\n",
-                          header_len);
-                    /* nchars = 0; Not needed - initialised to 0. */
-                }
-                else {
-                    /* no actual conversion needed. */
-                    memcpy(shebang_line, start, header_len);
-                    nchars = header_len / sizeof(wchar_t);
-                }
-                break;
-            case CP_UTF32BE:
-                if (header_len % 4 != 0) {
-                    debug(L"UTF-32BE, but not divisible by 4: %d\n",
-                          header_len);
-                    /* nchars = 0; Not needed - initialised to 0. */
-                }
-                else {
-                    for (i = header_len, j = header_len / 2; i > 0; i -= 4,
-                                                                    j -= 2) {
-                        shebang_alias[j - 1] = start[i - 2];
-                        shebang_alias[j - 2] = start[i - 1];
-                    }
-                    nchars = header_len / sizeof(wchar_t);
-                }
-                break;
-            case CP_UTF32LE:
-                if (header_len % 4 != 0) {
-                    debug(L"UTF-32LE, but not divisible by 4: %d\n",
-                          header_len);
-                    /* nchars = 0; Not needed - initialised to 0. */
-                }
-                else {
-                    for (i = header_len, j = header_len / 2; i > 0; i -= 4,
-                                                                    j -= 2) {
-                        shebang_alias[j - 1] = start[i - 3];
-                        shebang_alias[j - 2] = start[i - 4];
-                    }
-                    nchars = header_len / sizeof(wchar_t);
-                }
-                break;
-            }
-            if (nchars > 0) {
-                shebang_line[--nchars] = L'\0';
-                is_virt = parse_shebang(shebang_line, nchars, &command,
-                                        &suffix, &search);
-                if (command != NULL) {
-                    debug(L"parse_shebang: found command: %ls\n", command);
-                    if (!is_virt) {
-                        invoke_child(command, suffix, cmdline);
-                    }
-                    else {
-                        suffix = wcschr(command, L' ');
-                        if (suffix != NULL) {
-                            *suffix++ = L'\0';
-                            suffix = skip_whitespace(suffix);
-                        }
-                        if (wcsncmp(command, L"python", 6))
-                            error(RC_BAD_VIRTUAL_PATH, L"Unknown virtual \
-path '%ls'", command);
-                        command += 6;   /* skip past "python" */
-                        if (search && ((*command == L'\0') || iswspace(*command))) {
-                            /* Command is eligible for path search, and there
-                             * is no version specification.
-                             */
-#if defined(SUPPORT_VENV) && defined(SUPPORT_VENV_IN_SHEBANG)
-                            /* Look for an active virtualenv */
-                            wchar_t * venv_command = find_python_by_venv();
-                            if (venv_command != NULL) {
-                                debug(L"Python in venv: %ls\n", venv_command);
-                                invoke_child(venv_command, suffix, cmdline);
-                            }
-#endif
-                            debug(L"searching PATH for python executable\n");
-                            cmd = find_on_path(PYTHON_EXECUTABLE);
-                            debug(L"Python on path: %ls\n", cmd ? cmd->value : L"<not found>");
-                            if (cmd) {
-                                debug(L"located python on PATH: %ls\n", cmd->value);
-                                invoke_child(cmd->value, suffix, cmdline);
-                                /* Exit here, as we have found the command */
-                                return;
-                            }
-                            /* FALL THROUGH: No python found on PATH, so fall
-                             * back to locating the correct installed python.
-                             */
-                        }
-                        if (*command && !validate_version(command))
-                            error(RC_BAD_VIRTUAL_PATH, L"Invalid version \
-specification: '%ls'.\nIn the first line of the script, 'python' needs to be \
-followed by a valid version specifier.\nPlease check the documentation.",
-                                  command);
-                        /* TODO could call validate_version(command) */
-                        ip = locate_python(command, TRUE);
-                        if (ip == NULL) {
-                            error(RC_NO_PYTHON, L"Requested Python version \
-(%ls) is not installed", command);
-                        }
-                        else {
-                            invoke_child(ip->executable, suffix, cmdline);
-                        }
-                    }
-                }
-            }
+        if (!json) {
+            /* Other companies' Pythons can only be asked for by name. */
+            if (is_core_python(ip))
+                wcscpy_s(name, MAX_COMPANY_SIZE + MAX_VERSION_SIZE,
+                         ip->version);
+            else
+                _snwprintf_s(name, MAX_COMPANY_SIZE + MAX_VERSION_SIZE,
+                             _TRUNCATE, L"%ls/%ls", ip->company,
+                             ip->version);
+            fwprintf(stdout, L" -V:%-12ls %-6ls %ls %-7ls %ls%ls\n",
+                     name, arch_name(ip->parsed.arch),
+                     view_root_name(ip->view), view_name(ip->view),
+                     executable, (ip == default_ip) ? L" *" : L"");
+            continue;
         }
+        fputws(L"{\"company\": ", stdout);
+        json_string(ip->company);
+        fputws(L", \"version\": ", stdout);
+        json_string(ip->version);
+        fwprintf(stdout, L", \"major\": %d, \"minor\": %d, \
+\"freethreaded\": %ls, \"arch\": \"%ls\", \"bits\": %d, \"executable\": ",
+                 ip->parsed.major, ip->parsed.minor,
+                 ip->parsed.freethreaded ? L"true" : L"false",
+                 arch_name(ip->parsed.arch), ip->bits);
+        json_string(executable);
+        fwprintf(stdout, L", \"root\": \"%ls\", \"view\": \"%ls\", \
+\"probe_us\": %u, \"default\": %ls}\n", view_root_name(ip->view),
+                 view_name(ip->view), ip->probe_us,
+                 (ip == default_ip) ? L"true" : L"false");
     }
+    if (json)
+        fwprintf(stdout, L"{\"summary\": {\"pythons\": %d, \"source\": \
+\"%ls\", \"timings_us\": {\"discovery\": %.1f, \"total\": %.1f}}}\n",
+                 (int) num_installed_pythons, discovery_source,
+                 discovery_time, ticks_to_us(get_ticks() - start));
+    else if (num_installed_pythons == 0)
+        fputws(L" (none)\n", stdout);
+    else if (default_ip != NULL)
+        fputws(L"\n * the default Python\n", stdout);
+    return 0;
 }
 
+#endif
+
 static wchar_t *
 skip_me(wchar_t * cmdline)
 {
@@ -1365,11 +3428,57 @@ skip_me(wchar_t * cmdline)
 static DWORD version_high = 0;
 static DWORD version_low = 0;
 
+/* Read the launcher's version resource, which only -h needs. */
+static void
+read_version_info()
+{
+    wchar_t path[MAX_PATH];
+    wchar_t message[MSGSIZE];
+    DWORD size;
+    BOOL valid;
+    void * version_data;
+    VS_FIXEDFILEINFO * file_info;
+    UINT block_size;
+
+    GetModuleFileNameW(NULL, path, MAX_PATH);
+    size = GetFileVersionInfoSizeW(path, &size);
+    if (size == 0) {
+        winerror(GetLastError(), message, MSGSIZE);
+        debug(L"GetFileVersionInfoSize failed: %ls\n", message);
+    }
+    else {
+        version_data = malloc(size);
+        if (version_data) {
+            valid = GetFileVersionInfoW(path, 0, size, version_data);
+            if (!valid)
+                debug(L"GetFileVersionInfo failed: %X\n", GetLastError());
+            else {
+                valid = VerQueryValueW(version_data, L"\\",
+                                       (LPVOID *) &file_info, &block_size);
+                if (!valid)
+                    debug(L"VerQueryValue failed: %X\n", GetLastError());
+                else {
+                    version_high = file_info->dwFileVersionMS;
+                    version_low = file_info->dwFileVersionLS;
+                }
+            }
+            free(version_data);
+        }
+    }
+}
+
 static void
 get_version_info(wchar_t * version_text, size_t size)
 {
+    static BOOL version_read = FALSE;
+    BOOL first = !version_read;
     WORD maj, min, rel, bld;
+    LONGLONG t0 = get_ticks();
 
+    if (first) {
+        version_read = TRUE;
+        read_version_info();
+    }
     if (!version_high && !version_low)
         wcsncpy_s(version_text, size, L"0.1", _TRUNCATE);   /* fallback */
     else {
@@ -1380,12 +3489,46 @@ get_version_info(wchar_t * version_text, size_t size)
         _snwprintf_s(version_text, size, _TRUNCATE, L"%d.%d.%d.%d", maj,
                      min, rel, bld);
     }
+    if (first) {
+        if (trace_event(EVENT_VERSION_INFO, t0)) {
+            trace_string(&trace, "version", version_text);
+            trace_end(&trace);
+        }
+        timings[TIMING_VERSION] += get_ticks() - t0;
+    }
+}
+
+static void
+start_trace()
+{
+    wchar_t * wp = get_env(L"PYLAUNCH_TRACE");
+
+    if (wp != NULL) {
+        if (_wcsicmp(wp, L"stderr") == 0)
+            trace_to_stderr = TRUE;
+        else
+            wcsncpy_s(trace_path, MAX_PATH, wp, _TRUNCATE);
+        tracing = TRUE;
+    }
+    wp = get_env(L"PYLAUNCH_TRACE_SUMMARY");
+    if (wp != NULL) {
+        wcsncpy_s(trace_summary_path, MAX_PATH, wp, _TRUNCATE);
+        tracing = TRUE;
+    }
+    if (!tracing)
+        return;
+    atexit(finish_trace);
+    if (trace_event(EVENT_START, launch_start)) {
+        trace_launch();
+        trace_integer(&trace, "bits", LAUNCHER_BITS);
+        trace_end(&trace);
+    }
 }
 
 static int
 maybe_command(wchar_t * candidate, wchar_t ** user_cmd, wchar_t ** command)
 {
-    COMMAND * c = find_command(&candidate[1]);
+    const CONFIG_ENTRY * c = find_command(&candidate[1]);
     if (c == NULL) {
         return FALSE;
     }
@@ -1403,28 +3546,29 @@ process(int argc, wchar_t ** argv)
     wchar_t * executable;
     wchar_t * p;
     int rc = 0;
-    size_t plen;
     INSTALLED_PYTHON * ip;
+    RESOLUTION resolution;
     BOOL valid;
-    DWORD size, attrs;
-    HRESULT hr;
-    wchar_t message[MSGSIZE];
+    wchar_t * version = NULL;   /* of the Python to run, for serve_child() */
     wchar_t version_text [MAX_PATH];
-    void * version_data;
-    VS_FIXEDFILEINFO * file_info;
-    UINT block_size;
 #if !defined(SCRIPT_WRAPPER)
     int index;
+    wchar_t * tag;
 #else
     size_t newlen;
     wchar_t * newcommand;
+    wchar_t * quote;
     wchar_t * av[2];
 #endif
 
-    setvbuf(stderr, (char *)NULL, _IONBF, 0);
+    launch_start = get_ticks();
+    /* Buffered, so that debug output isn't a write per line: it's flushed
+     * before the child is created, and at exit. */
+    setvbuf(stderr, (char *)NULL, _IOFBF, 4 * MSGSIZE);
     wp = get_env(L"PYLAUNCH_DEBUG");
     if ((wp != NULL) && (*wp != L'\0'))
         log_fp = stderr;
+    start_trace();
 
 #if defined(_M_X64)
     debug(L"launcher build: 64bit\n");
@@ -1436,76 +3580,31 @@ process(int argc, wchar_t ** argv)
 #else
     debug(L"launcher executable: Console\n");
 #endif
-    /* Get the local appdata folder (non-roaming) */
-    hr = SHGetFolderPathW(NULL, CSIDL_LOCAL_APPDATA,
-                          NULL, 0, appdata_ini_path);
-    if (hr != S_OK) {
-        debug(L"SHGetFolderPath failed: %X\n", hr);
-        appdata_ini_path[0] = L'\0';
-    }
-    else {
-        plen = wcslen(appdata_ini_path);
-        p = &appdata_ini_path[plen];
-        wcsncpy_s(p, MAX_PATH - plen, L"\\py.ini", _TRUNCATE);
-        attrs = GetFileAttributesW(appdata_ini_path);
-        if (attrs == INVALID_FILE_ATTRIBUTES) {
-            debug(L"File '%ls' non-existent\n", appdata_ini_path);
-            appdata_ini_path[0] = L'\0';
-        } else {
-            debug(L"Using local configuration file '%ls'\n", appdata_ini_path);
-        }
-    }
-    plen = GetModuleFileNameW(NULL, launcher_ini_path, MAX_PATH);
-    size = GetFileVersionInfoSizeW(launcher_ini_path, &size);
-    if (size == 0) {
-        winerror(GetLastError(), message, MSGSIZE);
-        debug(L"GetFileVersionInfoSize failed: %ls\n", message);
-    }
-    else {
-        version_data = malloc(size);
-        if (version_data) {
-            valid = GetFileVersionInfoW(launcher_ini_path, 0, size,
-                                        version_data);
-            if (!valid)
-                debug(L"GetFileVersionInfo failed: %X\n", GetLastError());
-            else {
-                valid = VerQueryValueW(version_data, L"\\",
-                                       (LPVOID *) &file_info, &block_size);
-                if (!valid)
-                    debug(L"VerQueryValue failed: %X\n", GetLastError());
-                else {
-                    version_high = file_info->dwFileVersionMS;
-                    version_low = file_info->dwFileVersionLS;
-                }
-            }
-            free(version_data);
-        }
-    }
-    p = wcsrchr(launcher_ini_path, L'\\');
-    if (p == NULL) {
-        debug(L"GetModuleFileNameW returned value has no backslash: %ls\n",
-              launcher_ini_path);
-        launcher_ini_path[0] = L'\0';
-    }
-    else {
-        wcsncpy_s(p, MAX_PATH - (p - launcher_ini_path), L"\\py.ini",
-                  _TRUNCATE);
-        attrs = GetFileAttributesW(launcher_ini_path);
-        if (attrs == INVALID_FILE_ATTRIBUTES) {
-            debug(L"File '%ls' non-existent\n", launcher_ini_path);
-            launcher_ini_path[0] = L'\0';
-        } else {
-            debug(L"Using global configuration file '%ls'\n", launcher_ini_path);
-        }
-    }
-
     command = skip_me(GetCommandLineW());
     debug(L"Called with command line: %ls\n", command);
 
+#if !defined(SCRIPT_WRAPPER)
+    if ((argc == 2) && !wcscmp(argv[1], L"--rebuild-cache")) {
+        get_registry_views();
+        scan_all_pythons();
+        if (cache_path[0])
+            fwprintf(stdout, L"Found %d Pythons; cache written to '%ls'\n",
+                     (int) num_installed_pythons, cache_path);
+        else
+            fwprintf(stdout, L"Found %d Pythons; caching is disabled\n",
+                     (int) num_installed_pythons);
+        return rc;
+    }
+    if ((argc >= 2) && !wcscmp(argv[1], L"--resolve"))
+        return resolve_batch(argc - 2, &argv[2]);
+    if ((argc >= 2) && !wcscmp(argv[1], L"--list"))
+        return list_pythons((argc > 2) && !wcscmp(argv[2], L"--json"));
+#endif
+
 #if defined(SCRIPT_WRAPPER)
     /* The launcher is being used in "script wrapper" mode.
-     * There should therefore be a Python script named <exename>-script.py in
-     * the same directory as the launcher executable.
+     * There should therefore be a Python script appended to the launcher
+     * executable, or named <exename>-script.py in the same directory.
      * Put the script name into argv as the first (script name) argument.
      */
 
@@ -1514,18 +3613,18 @@ process(int argc, wchar_t ** argv)
      */
     locate_wrapped_script();
 
-    /* Add the wrapped script to the start of command */
-    newlen = wcslen(wrapped_script_path) + wcslen(command) + 2; /* ' ' + NUL */
+    /* Add the wrapped script to the start of command, quoted if need be */
+    quote = (wcschr(wrapped_script_path, L' ') != NULL) ? L"\"" : L"";
+    /* ' ' + NUL + quotes */
+    newlen = wcslen(wrapped_script_path) + wcslen(command) + 4;
     newcommand = malloc(sizeof(wchar_t) * newlen);
     if (!newcommand) {
         error(RC_NO_MEMORY, L"Could not allocate new command line");
     }
     else {
-        wcscpy_s(newcommand, newlen, wrapped_script_path);
-        wcscat_s(newcommand, newlen, L" ");
-        wcscat_s(newcommand, newlen, command);
+        _snwprintf_s(newcommand, newlen, _TRUNCATE, L"%ls%ls%ls %ls", quote,
+                     wrapped_script_path, quote, command);
         debug(L"Running wrapped script with command line '%ls'\n", newcommand);
-        read_commands();
         av[0] = wrapped_script_path;
         av[1] = NULL;
         maybe_handle_shebang(av, newcommand);
@@ -1540,24 +3639,49 @@ process(int argc, wchar_t ** argv)
     }
     else {
         wchar_t * cfgcommand = NULL;
-        read_commands();
         p = argv[1];
-        if (*p == '-' && maybe_command(p, &cfgcommand, &command)) {
-            debug(L"Identified: %ls\n", cfgcommand);
-            invoke_child((wchar_t *)cfgcommand, NULL, command);
+        /*
+         * Version options are recognised before [commands] entries, so that
+         * they don't need the configuration to be read.
+         */
+        if (wcsncmp(p, L"-V:", 3) == 0) {
+            /* an exact tag, with or without the company */
+            tag = &p[3];
+            if (_wcsnicmp(tag, L"PythonCore/", 11) == 0)
+                tag += 11;
+            if (wcschr(tag, L'/') != NULL) {
+                /* another company's, whose tags needn't be versions */
+                valid = TRUE;
+                ip = find_python_by_tag(tag);
+            }
+            else {
+                valid = validate_version(tag);
+                if (!valid)
+                    error(RC_NO_PYTHON, L"Invalid version tag '%ls'",
+                          &p[3]);
+                ip = find_python_by_version(tag);
+            }
+        }
+        else {
+            tag = &p[1];
+            valid = (*p == L'-') && validate_version(tag);
+            if (valid)
+                ip = locate_python(tag, FALSE);
         }
-        plen = wcslen(p);
-        valid = (*p == L'-') && validate_version(&p[1]);
         if (valid) {
-            ip = locate_python(&p[1], FALSE);
             if (ip == NULL)
                 error(RC_NO_PYTHON, L"Requested Python version (%ls) not \
-installed", &p[1]);
+installed", tag);
             executable = ip->executable;
+            version = ip->version;
             command += wcslen(p);
             command = skip_whitespace(command);
         }
         else {
+            if (*p == '-' && maybe_command(p, &cfgcommand, &command)) {
+                debug(L"Identified: %ls\n", cfgcommand);
+                invoke_child((wchar_t *)cfgcommand, NULL, command, NULL);
+            }
             for (index = 1; index < argc; ++index) {
                 if (*argv[index] != L'-')
                     break;
@@ -1570,23 +3694,12 @@ installed", &p[1]);
 #endif
 
     if (!valid) {
-#if defined(SUPPORT_VENV)
-        /* Look for an active virtualenv */
-        executable = find_python_by_venv();
-
-        /* If we didn't find one, look for the default Python */
-        if (executable == NULL) {
-            ip = locate_python(L"", FALSE);
-            if (ip == NULL)
-                error(RC_NO_PYTHON, L"Can't find a default Python.");
-            executable = ip->executable;
-        }
-#else
-        ip = locate_python(L"", FALSE);
-        if (ip == NULL)
-            error(RC_NO_PYTHON, L"Can't find a default Python.");
-        executable = ip->executable;
-#endif
+        init_resolution(&resolution);
+        resolve_default(&resolution);
+        if (resolution.rc)
+            error(resolution.rc, L"%ls", resolution.message);
+        executable = resolution.executable;
+        version = child_version(resolution.rule, resolution.ip);
         if ((argc == 2) && (!_wcsicmp(p, L"-h") || !_wcsicmp(p, L"--help"))) {
 #if defined(_M_X64)
             BOOL canDo64bit = TRUE;
@@ -1605,17 +3718,27 @@ usage: %ls [ launcher-arguments ] [ python-arguments ] script [ script-arguments
 Launcher arguments:\n\n\
 -2     : Launch the latest Python 2.x version\n\
 -3     : Launch the latest Python 3.x version\n\
--X.Y   : Launch the specified Python version\n", stdout);
+-X.Y   : Launch the specified Python version\n\
+-X.Yt  : Launch the specified free-threaded Python version\n", stdout);
             if (canDo64bit) {
                 fputws(L"\
--X.Y-32: Launch the specified 32bit Python version\n", stdout);
+-X.Y-32: Launch the specified 32bit Python version\n\
+-X.Y-64: Launch the specified 64bit Python version\n", stdout);
             }
+            fputws(L"\
+-V:TAG : Launch the Python registered with the specified tag,\n\
+         such as 3.12-arm64, PythonCore/3.13t or ContosoPython/3.12\n",
+                   stdout);
             fputws(L"-<cfg> : Launch the specified entry from a configuration file.\n", stdout);
+            fputws(L"\
+--list : List the installed Pythons (with --json, as lines of JSON)\n\
+--resolve [script ...]: Print the Python each script would be run with\n",
+                   stdout);
             fputws(L"\nThe following help text is from Python:\n\n", stdout);
             fflush(stdout);
         }
     }
-    invoke_child(executable, NULL, command);
+    invoke_child(executable, NULL, command, version);
     return rc;
 }
 
@@ -0,0 +1,66 @@
+/*
+ * Declarations shared between launcher.c and the portable support modules
+ * which live alongside it.
+ *
+ * The support modules make no Windows API calls of their own: anything that
+ * needs the registry, the file system or the environment is reached through
+ * a backend structure of function pointers supplied by the caller. This
+ * means they can be built and unit-tested with gcc or clang on other
+ * platforms - see the Makefile in this directory.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef LAUNCHER_H
+#define LAUNCHER_H
+
+#include <stddef.h>
+#include <wchar.h>
+
+#if defined(_WIN32)
+
+#include <windows.h>
+
+#else
+
+typedef int BOOL;
+#define TRUE    1
+#define FALSE   0
+#define MAX_PATH    260
+#define _wcsicmp    wcscasecmp
+#define _wcsnicmp   wcsncasecmp
+
+#endif
+
+#define MAX_VERSION_SIZE    32
+#define MAX_COMPANY_SIZE    64
+
+/* The company (as in PEP 514) of the python.org builds. */
+#define CORE_COMPANY    L"PythonCore"
+
+/* Architectures. ARCH_ANY only appears in requests. */
+#define ARCH_ANY    0
+#define ARCH_32     1   /* x86 */
+#define ARCH_64     2   /* x64 - or in a request, any 64-bit architecture */
+#define ARCH_ARM64  3
+
+/* A version, parsed from a tag such as "3.12", "3.13t" or "3.12-arm64". */
+typedef struct {
+    int major;          /* -1 if the tag couldn't be parsed */
+    int minor;          /* -1 if not given */
+    int freethreaded;   /* TRUE for a free-threaded ('t') build */
+    int arch;           /* one of the ARCH_* values */
+} PY_VERSION;
+
+typedef struct {
+    wchar_t version[MAX_VERSION_SIZE]; /* the registry tag, e.g. 3.12-32 */
+    int bits;   /* 32 or 64 */
+    wchar_t executable[MAX_PATH];
+    PY_VERSION parsed;
+    int view;           /* the registry view it was found in */
+    unsigned int probe_us;  /* how long finding it took, in microseconds */
+    unsigned int order; /* position in discovery order, to break ties */
+    wchar_t company[MAX_COMPANY_SIZE];  /* as in PEP 514, e.g. PythonCore */
+} INSTALLED_PYTHON;
+
+#endif
@@ -0,0 +1,538 @@
+/*
+ * An index of the commands on a search path.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+#include <wctype.h>
+
+#include "path_index.h"
+
+#define DIR_UNLISTED    0
+#define DIR_MISSING     1       /* doesn't exist, or can't be listed */
+#define DIR_LISTED      2       /* listed through the backend */
+#define DIR_REUSED      3       /* listing taken from a saved index */
+
+#define MIN_BUCKETS     64
+#define MIN_NAMES       256     /* characters allocated for a listing */
+
+#define FNV_BASIS       2166136261U
+#define FNV_PRIME       16777619U
+#define FNV64_BASIS     14695981039346656037ULL
+#define FNV64_PRIME     1099511628211ULL
+
+typedef struct {
+    unsigned int magic;
+    unsigned int format;
+    unsigned int char_size;     /* sizeof(wchar_t) of the writer */
+    unsigned int num_dirs;
+    unsigned int checksum;      /* over everything, with this field zero */
+    unsigned int reserved;
+    unsigned long long extensions_hash;
+} SAVED_HEADER;
+
+/* Followed by the characters of each directory's path, then its names. */
+typedef struct {
+    CACHE_STAMP stamp;
+    unsigned int path_length;   /* in characters, including the NUL */
+    unsigned int names_length;  /* in characters */
+} SAVED_DIR;
+
+/* A listing in progress. */
+typedef struct {
+    PATH_INDEX * index;
+    PATH_DIR * dir;
+    int position;
+} LISTING;
+
+static wchar_t
+fold(wchar_t c)
+{
+    return (wchar_t) towlower(c);
+}
+
+static unsigned int
+hash_name(const wchar_t * s, size_t n)
+{
+    unsigned int h = FNV_BASIS;
+
+    while (n--) {
+        h ^= (unsigned int) *s++;
+        h *= FNV_PRIME;
+    }
+    return h;
+}
+
+static wchar_t *
+copy_string(const wchar_t * s)
+{
+    size_t n = wcslen(s) + 1;
+    wchar_t * result = malloc(n * sizeof(wchar_t));
+
+    if (result != NULL)
+        memcpy(result, s, n * sizeof(wchar_t));
+    return result;
+}
+
+static BOOL
+grow_table(PATH_INDEX * index)
+{
+    size_t num_buckets = index->num_buckets * 2;
+    PATH_NAME ** buckets = calloc(num_buckets, sizeof(PATH_NAME *));
+    PATH_NAME * entry;
+    PATH_NAME * next;
+    size_t i;
+
+    if (buckets == NULL)
+        return FALSE;
+    for (i = 0; i < index->num_buckets; i++) {
+        for (entry = index->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            entry->next = buckets[entry->hash & (num_buckets - 1)];
+            buckets[entry->hash & (num_buckets - 1)] = entry;
+        }
+    }
+    free(index->buckets);
+    index->buckets = buckets;
+    index->num_buckets = num_buckets;
+    return TRUE;
+}
+
+static PATH_NAME *
+lookup(const PATH_INDEX * index, const wchar_t * name, size_t n,
+       unsigned int hash)
+{
+    PATH_NAME * entry = index->buckets[hash & (index->num_buckets - 1)];
+
+    for (; entry != NULL; entry = entry->next) {
+        if ((entry->hash == hash) && !wcsncmp(entry->name, name, n) &&
+            (entry->name[n] == L'\0'))
+            break;
+    }
+    return entry;
+}
+
+/*
+ * Keep a folded name from the directory at position. As directories are
+ * looked at in order, the first directory to add a name is the one where a
+ * search would find it.
+ */
+static void
+keep_name(PATH_INDEX * index, PATH_DIR * dir, int position,
+          const wchar_t * name, size_t n)
+{
+    unsigned int hash = hash_name(name, n);
+    PATH_NAME * entry;
+    wchar_t * names;
+    size_t capacity;
+
+    if (dir->names_length + n + 1 > dir->names_capacity) {
+        capacity = dir->names_capacity ? dir->names_capacity : MIN_NAMES;
+        while (capacity < dir->names_length + n + 1)
+            capacity *= 2;
+        names = realloc(dir->names, capacity * sizeof(wchar_t));
+        if (names == NULL) {
+            index->failed = TRUE;
+            return;
+        }
+        dir->names = names;
+        dir->names_capacity = capacity;
+    }
+    memcpy(&dir->names[dir->names_length], name, n * sizeof(wchar_t));
+    dir->names[dir->names_length + n] = L'\0';
+    dir->names_length += n + 1;
+    if (lookup(index, name, n, hash) != NULL)
+        return;
+    if ((index->num_names >= index->num_buckets) && !grow_table(index)) {
+        index->failed = TRUE;
+        return;
+    }
+    entry = malloc(offsetof(PATH_NAME, name) + (n + 1) * sizeof(wchar_t));
+    if (entry == NULL) {
+        index->failed = TRUE;
+        return;
+    }
+    entry->hash = hash;
+    entry->dir = position;
+    memcpy(entry->name, name, n * sizeof(wchar_t));
+    entry->name[n] = L'\0';
+    entry->next = index->buckets[hash & (index->num_buckets - 1)];
+    index->buckets[hash & (index->num_buckets - 1)] = entry;
+    ++index->num_names;
+}
+
+/* Does a name end with one of the extensions? */
+static BOOL
+has_extension(const PATH_INDEX * index, const wchar_t * name, size_t n)
+{
+    size_t length;
+    int i;
+
+    for (i = 0; i < index->num_extensions; i++) {
+        length = wcslen(index->extensions[i]);
+        if ((n >= length) &&
+            !_wcsicmp(&name[n - length], index->extensions[i]))
+            return TRUE;
+    }
+    return FALSE;
+}
+
+/* The backend's callback for each entry in a directory. */
+static void
+add_entry(void * arg, const wchar_t * name)
+{
+    LISTING * listing = arg;
+    wchar_t folded[MAX_PATH];
+    size_t i, n = wcslen(name);
+
+    if ((n >= MAX_PATH) || !has_extension(listing->index, name, n))
+        return;
+    for (i = 0; i < n; i++)
+        folded[i] = fold(name[i]);
+    keep_name(listing->index, listing->dir, listing->position, folded, n);
+}
+
+static BOOL
+same_path(const wchar_t * p1, const wchar_t * p2)
+{
+    return _wcsicmp(p1, p2) == 0;
+}
+
+/*
+ * Find a saved listing for a directory. Listings are saved in search order,
+ * so the one at the same position is tried first.
+ */
+static PATH_SAVED *
+find_saved(PATH_INDEX * index, int position)
+{
+    const wchar_t * path = index->dirs[position].path;
+    size_t i;
+
+    if (((size_t) position < index->num_saved) &&
+        !index->saved[position].used &&
+        same_path(index->saved[position].path, path))
+        return &index->saved[position];
+    for (i = 0; i < index->num_saved; i++) {
+        if (!index->saved[i].used && same_path(index->saved[i].path, path))
+            return &index->saved[i];
+    }
+    return NULL;
+}
+
+/* Look at the next directory in search order. */
+static void
+list_next(PATH_INDEX * index)
+{
+    int position = index->num_listed++;
+    PATH_DIR * dir = &index->dirs[position];
+    const PATH_BACKEND * backend = index->backend;
+    PATH_SAVED * saved = find_saved(index, position);
+    const wchar_t * p;
+    const wchar_t * end;
+    LISTING listing;
+    size_t n;
+
+    ++index->stamps;
+    /* Stamp first, so that a change made while listing is noticed. */
+    if (!backend->dir_stamp(backend->context, dir->path, &dir->stamp)) {
+        dir->state = DIR_MISSING;
+        if (saved != NULL)
+            saved->used = TRUE;     /* forget it */
+        return;
+    }
+    if (saved != NULL) {
+        saved->used = TRUE;
+        if (!memcmp(&saved->stamp, &dir->stamp, sizeof(CACHE_STAMP))) {
+            ++index->reused;
+            dir->state = DIR_REUSED;
+            end = saved->names + saved->names_length;
+            for (p = saved->names; p < end; p += n + 1) {
+                n = wcslen(p);
+                keep_name(index, dir, position, p, n);
+            }
+            return;
+        }
+    }
+    ++index->listings;
+    index->dirty = TRUE;
+    listing.index = index;
+    listing.dir = dir;
+    listing.position = position;
+    dir->state = backend->list_dir(backend->context, dir->path, add_entry,
+                                   &listing) ? DIR_LISTED : DIR_MISSING;
+}
+
+BOOL
+path_index_init(PATH_INDEX * index, const PATH_BACKEND * backend,
+                const wchar_t * const * dirs, int num_dirs,
+                const wchar_t * pathext)
+{
+    unsigned long long hash = FNV64_BASIS;
+    const wchar_t * p;
+    const wchar_t * end;
+    wchar_t * extension;
+    size_t n;
+    int i;
+
+    memset(index, 0, sizeof(PATH_INDEX));
+    index->backend = backend;
+    index->num_buckets = MIN_BUCKETS;
+    index->buckets = calloc(MIN_BUCKETS, sizeof(PATH_NAME *));
+    index->dirs = calloc(num_dirs ? num_dirs : 1, sizeof(PATH_DIR));
+    /* Can't have more extensions than separators, plus one. */
+    index->extensions = calloc(wcslen(pathext) / 2 + 1, sizeof(wchar_t *));
+    if ((index->buckets == NULL) || (index->dirs == NULL) ||
+        (index->extensions == NULL))
+        return FALSE;
+    for (i = 0; i < num_dirs; i++) {
+        index->dirs[i].path = copy_string(dirs[i]);
+        if (index->dirs[i].path == NULL)
+            return FALSE;
+        ++index->num_dirs;
+    }
+    for (p = pathext; *p; p = *end ? end + 1 : end) {
+        end = wcschr(p, L';');
+        if (end == NULL)
+            end = p + wcslen(p);
+        n = end - p;
+        if (n == 0)
+            continue;
+        extension = malloc((n + 1) * sizeof(wchar_t));
+        if (extension == NULL)
+            return FALSE;
+        memcpy(extension, p, n * sizeof(wchar_t));
+        extension[n] = L'\0';
+        index->extensions[index->num_extensions++] = extension;
+        while (n--) {
+            hash ^= (unsigned long long) fold(*p++);
+            hash *= FNV64_PRIME;
+        }
+        hash ^= L';';
+        hash *= FNV64_PRIME;
+    }
+    index->extensions_hash = hash;
+    return TRUE;
+}
+
+int
+path_index_find(PATH_INDEX * index, const wchar_t * name,
+                const wchar_t ** extension)
+{
+    wchar_t key[MAX_PATH];
+    size_t i, n = wcslen(name), length;
+    unsigned int hash;
+    PATH_NAME * entry;
+    int e;
+
+    for (i = 0; (i < n) && (i < MAX_PATH); i++)
+        key[i] = fold(name[i]);
+    for (e = 0; (e < index->num_extensions) && !index->failed; e++) {
+        length = wcslen(index->extensions[e]);
+        if (n + length >= MAX_PATH)
+            continue;
+        for (i = 0; i < length; i++)
+            key[n + i] = fold(index->extensions[e][i]);
+        hash = hash_name(key, n + length);
+        for (;;) {
+            entry = lookup(index, key, n + length, hash);
+            if (entry != NULL) {
+                *extension = index->extensions[e];
+                return entry->dir;
+            }
+            /* Not in any directory so far: look in the next one. */
+            if ((index->num_listed == index->num_dirs) || index->failed)
+                break;
+            list_next(index);
+        }
+    }
+    return -1;
+}
+
+/* FNV-1a - only needs to catch truncated or otherwise mangled files. */
+static unsigned int
+checksum(const void * data, size_t size)
+{
+    const unsigned char * p = data;
+    SAVED_HEADER header;
+    unsigned int result = FNV_BASIS;
+    size_t i;
+
+    memcpy(&header, data, sizeof(header));
+    header.checksum = 0;
+    for (i = 0; i < size; i++) {
+        result ^= (i < sizeof(header)) ? ((unsigned char *) &header)[i] : p[i];
+        result *= FNV_PRIME;
+    }
+    return result;
+}
+
+BOOL
+path_index_load(PATH_INDEX * index, void * data, size_t size)
+{
+    SAVED_HEADER header;
+    SAVED_DIR record;
+    const unsigned char * records;
+    const wchar_t * p;
+    const wchar_t * end;
+    PATH_SAVED * saved;
+    unsigned int i;
+
+    free(index->saved_data);
+    free(index->saved);
+    index->saved_data = NULL;
+    index->saved = NULL;
+    index->num_saved = 0;
+    if ((data == NULL) || (size < sizeof(header)))
+        goto fail;
+    memcpy(&header, data, sizeof(header));
+    if ((header.magic != PATH_INDEX_MAGIC) ||
+        (header.format != PATH_INDEX_FORMAT_VERSION) ||
+        (header.char_size != sizeof(wchar_t)) ||
+        (header.num_dirs > PATH_INDEX_MAX_SAVED) ||
+        (header.extensions_hash != index->extensions_hash) ||
+        (size < sizeof(header) + header.num_dirs * sizeof(SAVED_DIR)) ||
+        ((size - sizeof(header)) % sizeof(wchar_t)) ||
+        (header.checksum != checksum(data, size)))
+        goto fail;
+    saved = calloc(header.num_dirs ? header.num_dirs : 1, sizeof(PATH_SAVED));
+    if (saved == NULL)
+        goto fail;
+    records = (const unsigned char *) data + sizeof(header);
+    p = (const wchar_t *) (records + header.num_dirs * sizeof(SAVED_DIR));
+    end = (const wchar_t *) ((const unsigned char *) data + size);
+    for (i = 0; i < header.num_dirs; i++) {
+        memcpy(&record, records + i * sizeof(SAVED_DIR), sizeof(record));
+        if ((record.path_length == 0) ||
+            (record.path_length > (size_t) (end - p)) ||
+            (record.names_length > (size_t) (end - p) - record.path_length) ||
+            p[record.path_length - 1] ||
+            (record.names_length &&
+             p[record.path_length + record.names_length - 1])) {
+            free(saved);
+            goto fail;
+        }
+        saved[i].path = p;
+        saved[i].stamp = record.stamp;
+        saved[i].names = p + record.path_length;
+        saved[i].names_length = record.names_length;
+        p += record.path_length + record.names_length;
+    }
+    if (p != end) {
+        free(saved);
+        goto fail;
+    }
+    index->saved_data = data;
+    index->saved = saved;
+    index->num_saved = header.num_dirs;
+    return TRUE;
+fail:
+    free(data);
+    return FALSE;
+}
+
+size_t
+path_index_save(PATH_INDEX * index, void ** data)
+{
+    SAVED_HEADER * header;
+    SAVED_DIR record;
+    unsigned char * records;
+    wchar_t * p;
+    size_t chars = 0, size, i, n;
+    size_t num_dirs = 0;
+    int d;
+
+    *data = NULL;
+    /* First count what is to be saved, in the order it will be. */
+    for (d = 0; d < index->num_listed; d++) {
+        if (((index->dirs[d].state == DIR_LISTED) ||
+             (index->dirs[d].state == DIR_REUSED)) &&
+            (num_dirs < PATH_INDEX_MAX_SAVED)) {
+            ++num_dirs;
+            chars += wcslen(index->dirs[d].path) + 1 +
+                     index->dirs[d].names_length;
+        }
+    }
+    for (i = 0; i < index->num_saved; i++) {
+        if (!index->saved[i].used && (num_dirs < PATH_INDEX_MAX_SAVED)) {
+            ++num_dirs;
+            chars += wcslen(index->saved[i].path) + 1 +
+                     index->saved[i].names_length;
+        }
+    }
+    size = sizeof(SAVED_HEADER) + num_dirs * sizeof(SAVED_DIR) +
+           chars * sizeof(wchar_t);
+    header = calloc(1, size);   /* zeroes any padding, too */
+    if (header == NULL)
+        return 0;
+    header->magic = PATH_INDEX_MAGIC;
+    header->format = PATH_INDEX_FORMAT_VERSION;
+    header->char_size = sizeof(wchar_t);
+    header->extensions_hash = index->extensions_hash;
+    records = (unsigned char *) &header[1];
+    p = (wchar_t *) (records + num_dirs * sizeof(SAVED_DIR));
+    for (d = 0; (d < index->num_listed) &&
+                (header->num_dirs < num_dirs); d++) {
+        if ((index->dirs[d].state != DIR_LISTED) &&
+            (index->dirs[d].state != DIR_REUSED))
+            continue;
+        n = wcslen(index->dirs[d].path) + 1;
+        record.stamp = index->dirs[d].stamp;
+        record.path_length = (unsigned int) n;
+        record.names_length = (unsigned int) index->dirs[d].names_length;
+        memcpy(records + header->num_dirs++ * sizeof(SAVED_DIR), &record,
+               sizeof(record));
+        memcpy(p, index->dirs[d].path, n * sizeof(wchar_t));
+        p += n;
+        memcpy(p, index->dirs[d].names, record.names_length * sizeof(wchar_t));
+        p += record.names_length;
+    }
+    for (i = 0; (i < index->num_saved) && (header->num_dirs < num_dirs); i++) {
+        if (index->saved[i].used)
+            continue;
+        n = wcslen(index->saved[i].path) + 1;
+        record.stamp = index->saved[i].stamp;
+        record.path_length = (unsigned int) n;
+        record.names_length = (unsigned int) index->saved[i].names_length;
+        memcpy(records + header->num_dirs++ * sizeof(SAVED_DIR), &record,
+               sizeof(record));
+        memcpy(p, index->saved[i].path, n * sizeof(wchar_t));
+        p += n;
+        memcpy(p, index->saved[i].names,
+               record.names_length * sizeof(wchar_t));
+        p += record.names_length;
+    }
+    header->checksum = checksum(header, size);
+    *data = header;
+    return size;
+}
+
+void
+path_index_free(PATH_INDEX * index)
+{
+    PATH_NAME * entry;
+    PATH_NAME * next;
+    size_t i;
+    int d;
+
+    for (i = 0; i < index->num_buckets && index->buckets; i++) {
+        for (entry = index->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            free(entry);
+        }
+    }
+    free(index->buckets);
+    for (d = 0; d < index->num_dirs; d++) {
+        free(index->dirs[d].path);
+        free(index->dirs[d].names);
+    }
+    free(index->dirs);
+    for (d = 0; d < index->num_extensions; d++)
+        free(index->extensions[d]);
+    free(index->extensions);
+    free(index->saved);
+    free(index->saved_data);
+    memset(index, 0, sizeof(PATH_INDEX));
+}
@@ -0,0 +1,132 @@
+/*
+ * An index of the commands on a search path, for finding one the way the
+ * launcher always has - calling SearchPathW for each extension in PATHEXT in
+ * turn, so that an earlier extension anywhere on the path beats a later one
+ * in the first directory - but listing each directory at most once, instead
+ * of probing every directory once per extension.
+ *
+ * Directories are listed lazily, in search order, through a backend, and
+ * only the names ending with one of the extensions are kept, folded to
+ * lower case. A lookup lists directories only until it can be sure of its
+ * answer, so a name found with the first extension needs no more listing
+ * than the directories up to the one it is in; a name which isn't on the
+ * path at all needs every directory listed, once, for all the lookups made.
+ *
+ * Listings can be saved, and loaded by a later launch, which then only has
+ * to stamp a directory rather than list it: a directory's last-write time
+ * changes whenever an entry is added to it, removed or renamed.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef PATH_INDEX_H
+#define PATH_INDEX_H
+
+#include "install_cache.h"
+
+#define PATH_INDEX_MAGIC            0x5850594CU     /* "LPYX" */
+#define PATH_INDEX_FORMAT_VERSION   1
+
+/* The most directory listings saved, including ones not used this time. */
+#define PATH_INDEX_MAX_SAVED        1024
+
+typedef void (*PATH_ADD)(void * arg, const wchar_t * name);
+
+typedef struct {
+    void * context;
+    /*
+     * Call add(arg, name) for each entry in a directory. Returns FALSE if
+     * the directory can't be listed.
+     */
+    BOOL (*list_dir)(void * context, const wchar_t * dir, PATH_ADD add,
+                     void * arg);
+    /* As for CACHE_BACKEND; returns FALSE if the directory doesn't exist. */
+    BOOL (*dir_stamp)(void * context, const wchar_t * dir,
+                      CACHE_STAMP * stamp);
+} PATH_BACKEND;
+
+typedef struct PATH_NAME {
+    struct PATH_NAME * next;        /* next name in the same bucket */
+    unsigned int hash;
+    int dir;                        /* the first directory it is in */
+    wchar_t name[1];                /* allocated to fit */
+} PATH_NAME;
+
+typedef struct {
+    wchar_t * path;
+    CACHE_STAMP stamp;
+    int state;                      /* one of the DIR_* values in the .c */
+    wchar_t * names;                /* the names kept, each NUL-terminated */
+    size_t names_length;            /* in characters */
+    size_t names_capacity;
+} PATH_DIR;
+
+/* A listing loaded from a saved index. */
+typedef struct {
+    const wchar_t * path;
+    CACHE_STAMP stamp;
+    const wchar_t * names;
+    size_t names_length;
+    BOOL used;
+} PATH_SAVED;
+
+typedef struct {
+    const PATH_BACKEND * backend;
+    PATH_DIR * dirs;
+    int num_dirs;
+    int num_listed;                 /* directories looked at, in order */
+    wchar_t ** extensions;          /* as given in pathext */
+    int num_extensions;
+    unsigned long long extensions_hash;
+    PATH_NAME ** buckets;
+    size_t num_buckets;             /* a power of two */
+    size_t num_names;
+    void * saved_data;              /* as passed to path_index_load() */
+    PATH_SAVED * saved;
+    size_t num_saved;
+    BOOL dirty;                     /* a directory had to be listed */
+    BOOL failed;                    /* memory ran out: don't trust it */
+    /* Statistics */
+    unsigned long listings;         /* backend list_dir() calls */
+    unsigned long stamps;           /* backend dir_stamp() calls */
+    unsigned long reused;           /* saved listings used */
+} PATH_INDEX;
+
+/*
+ * Set up an index over the directories in dirs (num_dirs of them, in search
+ * order) for the extensions in pathext, a list separated by semicolons like
+ * PATHEXT. Nothing is listed yet. Returns FALSE if memory runs out.
+ */
+BOOL path_index_init(PATH_INDEX * index, const PATH_BACKEND * backend,
+                     const wchar_t * const * dirs, int num_dirs,
+                     const wchar_t * pathext);
+
+/*
+ * Find a name, which must not have an extension of its own. Returns the
+ * index of the directory it's in, with *extension set to the extension it
+ * has there (as given in pathext), or -1 if it isn't on the path - or if
+ * memory ran out, in which case index->failed is set.
+ */
+int path_index_find(PATH_INDEX * index, const wchar_t * name,
+                    const wchar_t ** extension);
+
+/*
+ * Adopt saved listings, from path_index_save() in an earlier launch. data
+ * must be a malloc'd block, which the index takes over (freeing it if it
+ * can't be used). Listings are only used if they were saved for the same
+ * extensions, and the directory's stamp hasn't changed. Call this before
+ * any lookups. Returns FALSE if data wasn't usable.
+ */
+BOOL path_index_load(PATH_INDEX * index, void * data, size_t size);
+
+/*
+ * Serialize the listings known to the index: those made or used so far,
+ * then any others loaded, up to PATH_INDEX_MAX_SAVED. On success, *data
+ * points to a malloc'd block which the caller must free, and its size is
+ * returned. Returns 0 on failure.
+ */
+size_t path_index_save(PATH_INDEX * index, void ** data);
+
+void path_index_free(PATH_INDEX * index);
+
+#endif
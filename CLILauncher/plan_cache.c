@@ -0,0 +1,243 @@
+/*
+ * On-disk cache of launch plans.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <wctype.h>
+
+#include "plan_cache.h"
+
+#define FNV_PRIME       1099511628211ULL
+#define NULL_MARKER     0x110000UL  /* not a character, so can't collide */
+
+/* The strings stored after the file stamps, before the file paths. */
+#define STRING_SCRIPT       0
+#define STRING_EXECUTABLE   1
+#define STRING_SUFFIX       2
+#define STRING_RULE         3
+#define NUM_FIXED_STRINGS   4
+
+typedef struct {
+    unsigned int magic;
+    unsigned int format;
+    unsigned int char_size;     /* sizeof(wchar_t) of the writer */
+    unsigned int num_views;
+    unsigned int num_files;
+    unsigned int checksum;      /* over everything, with this field zero */
+    unsigned long long fingerprint;
+    int views[CACHE_MAX_VIEWS];
+    CACHE_STAMP view_stamps[CACHE_MAX_VIEWS];
+} PLAN_HEADER;
+
+static unsigned long long
+hash_char(unsigned long long hash, unsigned long c)
+{
+    return (hash ^ c) * FNV_PRIME;
+}
+
+unsigned long long
+plan_hash(unsigned long long hash, const wchar_t * s)
+{
+    if (s == NULL)
+        hash = hash_char(hash, NULL_MARKER);
+    else {
+        for (; *s; s++)
+            hash = hash_char(hash, (unsigned long) *s);
+    }
+    return hash_char(hash, 0);  /* so that "ab", "c" differs from "a", "bc" */
+}
+
+void
+plan_file_name(const wchar_t * script, wchar_t * name)
+{
+    unsigned long long hash = PLAN_HASH_INIT;
+
+    for (; *script; script++)
+        hash = hash_char(hash, (unsigned long) towlower(*script));
+    swprintf(name, PLAN_NAME_SIZE, L"%016llx.plan", hash);
+}
+
+/* FNV-1a - only needs to catch truncated or otherwise mangled files. */
+static unsigned int
+checksum(const void * data, size_t size)
+{
+    const unsigned char * p = data;
+    PLAN_HEADER header;
+    unsigned int result = 2166136261U;
+    size_t i;
+
+    memcpy(&header, data, sizeof(header));
+    header.checksum = 0;
+    for (i = 0; i < size; i++) {
+        result ^= (i < sizeof(header)) ? ((unsigned char *) &header)[i] : p[i];
+        result *= 16777619U;
+    }
+    return result;
+}
+
+static size_t
+strings_offset(size_t num_files)
+{
+    return sizeof(PLAN_HEADER) + num_files * sizeof(CACHE_STAMP);
+}
+
+static wchar_t *
+append_string(wchar_t * p, const wchar_t * s)
+{
+    size_t n = (s == NULL) ? 0 : wcslen(s);
+
+    memcpy(p, s ? s : L"", n * sizeof(wchar_t));
+    p[n] = L'\0';
+    return &p[n + 1];
+}
+
+size_t
+plan_build(const wchar_t * script, unsigned long long fingerprint,
+           const int * views, const CACHE_STAMP * view_stamps,
+           int num_views, const PLAN_FILE * files, int num_files,
+           const PLAN * plan, void ** data)
+{
+    const wchar_t * strings[NUM_FIXED_STRINGS];
+    PLAN_HEADER * header;
+    CACHE_STAMP * stamps;
+    wchar_t * p;
+    size_t chars = 0;
+    size_t size;
+    int i;
+
+    *data = NULL;
+    if ((num_views < 0) || (num_views > CACHE_MAX_VIEWS) ||
+        (num_files < 0) || (num_files > PLAN_MAX_FILES) ||
+        (plan->executable == NULL))
+        return 0;
+    strings[STRING_SCRIPT] = script;
+    strings[STRING_EXECUTABLE] = plan->executable;
+    strings[STRING_SUFFIX] = plan->suffix;
+    strings[STRING_RULE] = plan->rule;
+    for (i = 0; i < NUM_FIXED_STRINGS; i++)
+        chars += (strings[i] ? wcslen(strings[i]) : 0) + 1;
+    for (i = 0; i < num_files; i++)
+        chars += wcslen(files[i].path) + 1;
+    size = strings_offset(num_files) + chars * sizeof(wchar_t);
+    if (size > PLAN_MAX_SIZE)
+        return 0;
+    header = calloc(1, size);   /* zeroes any padding, too */
+    if (header == NULL)
+        return 0;
+    header->magic = PLAN_MAGIC;
+    header->format = PLAN_FORMAT_VERSION;
+    header->char_size = sizeof(wchar_t);
+    header->num_views = num_views;
+    header->num_files = num_files;
+    header->fingerprint = fingerprint;
+    memcpy(header->views, views, num_views * sizeof(int));
+    memcpy(header->view_stamps, view_stamps, num_views * sizeof(CACHE_STAMP));
+    stamps = (CACHE_STAMP *) &header[1];
+    for (i = 0; i < num_files; i++)
+        stamps[i] = files[i].stamp;
+    p = (wchar_t *) ((char *) header + strings_offset(num_files));
+    for (i = 0; i < NUM_FIXED_STRINGS; i++)
+        p = append_string(p, strings[i]);
+    for (i = 0; i < num_files; i++)
+        p = append_string(p, files[i].path);
+    header->checksum = checksum(header, size);
+    *data = header;
+    return size;
+}
+
+/*
+ * Find the strings in a plan, checking that there are as many as there
+ * should be and that they exactly fill the rest of it.
+ */
+static BOOL
+find_strings(const void * data, size_t size, size_t num_files,
+             const wchar_t ** strings)
+{
+    const wchar_t * p;
+    const wchar_t * end;
+    size_t offset = strings_offset(num_files);
+    size_t i;
+
+    if ((size < offset) || ((size - offset) % sizeof(wchar_t)))
+        return FALSE;
+    p = (const wchar_t *) ((const char *) data + offset);
+    end = (const wchar_t *) ((const char *) data + size);
+    for (i = 0; i < NUM_FIXED_STRINGS + num_files; i++) {
+        strings[i] = p;
+        while ((p < end) && *p)
+            ++p;
+        if (p == end)
+            return FALSE;
+        ++p;
+    }
+    return p == end;
+}
+
+BOOL
+plan_validate(const CACHE_BACKEND * backend, const wchar_t * script,
+              unsigned long long fingerprint, const int * views,
+              int num_views, const void * data, size_t size, PLAN * plan)
+{
+    const wchar_t * strings[NUM_FIXED_STRINGS + PLAN_MAX_FILES];
+    const CACHE_STAMP * stamps;
+    PLAN_HEADER header;
+    CACHE_STAMP stamp;
+    unsigned int i;
+
+    if ((data == NULL) || (size < sizeof(header)) || (size > PLAN_MAX_SIZE))
+        return FALSE;
+    memcpy(&header, data, sizeof(header));
+    if ((header.magic != PLAN_MAGIC) ||
+        (header.format != PLAN_FORMAT_VERSION) ||
+        (header.char_size != sizeof(wchar_t)) ||
+        (header.num_views != (unsigned int) num_views) ||
+        (header.num_files > PLAN_MAX_FILES) ||
+        (header.fingerprint != fingerprint) ||
+        (header.checksum != checksum(data, size)) ||
+        !find_strings(data, size, header.num_files, strings))
+        return FALSE;
+    /* Different scripts can share a file name, if their hashes collide. */
+    if (_wcsicmp(strings[STRING_SCRIPT], script) ||
+        memcmp(header.views, views, num_views * sizeof(int)))
+        return FALSE;
+    /* Registry checks first - they're cheaper than touching the disk. */
+    for (i = 0; i < header.num_views; i++) {
+        memset(&stamp, 0, sizeof(stamp));
+        backend->view_stamp(backend->context, views[i], &stamp);
+        if (memcmp(&stamp, &header.view_stamps[i], sizeof(stamp)))
+            return FALSE;
+    }
+    stamps = (const CACHE_STAMP *) ((const char *) data + sizeof(header));
+    for (i = 0; i < header.num_files; i++) {
+        cache_stamp_file(backend, strings[NUM_FIXED_STRINGS + i], &stamp);
+        if (memcmp(&stamp, &stamps[i], sizeof(stamp)))
+            return FALSE;
+    }
+    plan->executable = strings[STRING_EXECUTABLE];
+    plan->suffix = *strings[STRING_SUFFIX] ? strings[STRING_SUFFIX] : NULL;
+    plan->rule = strings[STRING_RULE];
+    return TRUE;
+}
+
+static int
+compare_entries(const void * a, const void * b)
+{
+    const PLAN_ENTRY * e1 = a;
+    const PLAN_ENTRY * e2 = b;
+
+    if (e1->last_used != e2->last_used)
+        return (e1->last_used < e2->last_used) ? -1 : 1;
+    return wcscmp(e1->name, e2->name);
+}
+
+size_t
+plan_evict(PLAN_ENTRY * entries, size_t num_entries, size_t max_entries)
+{
+    if (num_entries <= max_entries)
+        return 0;
+    qsort(entries, num_entries, sizeof(PLAN_ENTRY), compare_entries);
+    return num_entries - max_entries;
+}
@@ -0,0 +1,99 @@
+/*
+ * On-disk cache of launch plans: what the launcher decided to run a given
+ * script with, so that the next launch of the same script can go straight
+ * to creating the child.
+ *
+ * Each plan is stored in a file of its own, named after a hash of the
+ * script's full path (see plan_file_name()). A plan records:
+ *
+ *   - the script's full path, and a fingerprint of everything else the
+ *     decision depended on which can be compared without touching the disk
+ *     (the relevant environment variables, and the launcher's location);
+ *   - the stamps of the registry views scanned for installed Pythons;
+ *   - the stamps of the files the decision depended on: the script, the
+ *     py.ini files (present or not), and the chosen executable;
+ *   - the decision itself: executable, suffix and rule.
+ *
+ * A plan is only used if all of these still match. The portable parts live
+ * here; reading, writing and evicting plan files is up to the caller.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef PLAN_CACHE_H
+#define PLAN_CACHE_H
+
+#include "install_cache.h"
+
+#define PLAN_MAGIC              0x5059504CU     /* "LPYP" */
+#define PLAN_FORMAT_VERSION     1
+#define PLAN_MAX_FILES          8
+#define PLAN_MAX_SIZE           (64 * 1024)
+
+/* Starting value for plan_hash(). */
+#define PLAN_HASH_INIT          14695981039346656037ULL
+
+/* Length of a name made by plan_file_name(), including the NUL. */
+#define PLAN_NAME_SIZE          22
+
+typedef struct {
+    const wchar_t * path;
+    CACHE_STAMP stamp;
+} PLAN_FILE;
+
+/* What to run. An empty suffix is the same as none. */
+typedef struct {
+    const wchar_t * executable;
+    const wchar_t * suffix;
+    const wchar_t * rule;
+} PLAN;
+
+/* A plan file found in the cache directory, for plan_evict(). */
+typedef struct {
+    wchar_t name[PLAN_NAME_SIZE];
+    unsigned long long last_used;
+} PLAN_ENTRY;
+
+/*
+ * Add a string to a 64-bit FNV-1a hash. Chain calls, starting with
+ * PLAN_HASH_INIT, to fingerprint several strings; a NULL string hashes
+ * differently from an empty one.
+ */
+unsigned long long plan_hash(unsigned long long hash, const wchar_t * s);
+
+/*
+ * The name of the plan file for a script, from its full path, which is
+ * compared without regard to case: "<16 hex digits>.plan".
+ */
+void plan_file_name(const wchar_t * script, wchar_t * name);
+
+/*
+ * Serialize a plan. The stamps of the files and views must have been taken
+ * *before* the decision was made, so that a change made in the meantime
+ * invalidates the plan; the executable's stamp can be taken afterwards.
+ * On success, *data points to a malloc'd block which the caller must free,
+ * and its size is returned. Returns 0 on failure.
+ */
+size_t plan_build(const wchar_t * script, unsigned long long fingerprint,
+                  const int * views, const CACHE_STAMP * view_stamps,
+                  int num_views, const PLAN_FILE * files, int num_files,
+                  const PLAN * plan, void ** data);
+
+/*
+ * Check that a plan is well-formed, is for the same script, fingerprint and
+ * views, and is still up to date. If so, fill in *plan with pointers into
+ * data and return TRUE.
+ */
+BOOL plan_validate(const CACHE_BACKEND * backend, const wchar_t * script,
+                   unsigned long long fingerprint, const int * views,
+                   int num_views, const void * data, size_t size,
+                   PLAN * plan);
+
+/*
+ * Order plan files from least to most recently used, and return how many
+ * of the first ones must go so that no more than max_entries remain.
+ */
+size_t plan_evict(PLAN_ENTRY * entries, size_t num_entries,
+                  size_t max_entries);
+
+#endif
@@ -0,0 +1,557 @@
+/*
+ * Finding the project a script belongs to.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+#include <wctype.h>
+
+#include "project.h"
+
+#define MIN_BUCKETS     64
+
+#define FNV_BASIS       2166136261U
+#define FNV_PRIME       16777619U
+
+/* The names looked for in each directory, and what they mean. */
+static const struct {
+    const wchar_t * name;
+    unsigned int bit;
+} markers[] = {
+    { PROJECT_VENV_NAME, PROJECT_VENV },
+    { PROJECT_PIN_NAME, PROJECT_PIN },
+    { PROJECT_INI_NAME, PROJECT_INI },
+    { L".git", PROJECT_ROOT },
+    { L".hg", PROJECT_ROOT },
+};
+
+#define NUM_MARKERS     (sizeof(markers) / sizeof(markers[0]))
+
+typedef struct {
+    unsigned int magic;
+    unsigned int format;
+    unsigned int char_size;     /* sizeof(wchar_t) of the writer */
+    unsigned int num_dirs;
+    unsigned int checksum;      /* over everything, with this field zero */
+    unsigned int reserved;
+} SAVED_HEADER;
+
+/* Followed by the characters of each directory's path. */
+typedef struct {
+    CACHE_STAMP stamp;
+    unsigned int holds;
+    unsigned int path_length;   /* in characters, including the NUL */
+} SAVED_DIR;
+
+static unsigned int
+hash_path(const wchar_t * s)
+{
+    unsigned int h = FNV_BASIS;
+
+    for (; *s; s++) {
+        h ^= (unsigned int) towlower(*s);
+        h *= FNV_PRIME;
+    }
+    return h;
+}
+
+static BOOL
+same_stamp(const CACHE_STAMP * a, const CACHE_STAMP * b)
+{
+    return (a->time == b->time) && (a->size == b->size);
+}
+
+/*
+ * Copy a path into a MAX_PATH buffer, or join a name onto it, returning
+ * FALSE (and leaving out empty) if the result wouldn't fit. A drive's root
+ * already ends with a backslash.
+ */
+static BOOL
+join(const wchar_t * dir, const wchar_t * name, wchar_t * out)
+{
+    size_t n = wcslen(dir);
+    size_t m = (name == NULL) ? 0 : wcslen(name);
+    BOOL sep = (m > 0) && (n > 0) && (dir[n - 1] != L'\\');
+
+    if (n + sep + m >= MAX_PATH) {
+        out[0] = L'\0';
+        return FALSE;
+    }
+    memmove(out, dir, n * sizeof(wchar_t));
+    if (sep)
+        out[n++] = L'\\';
+    memcpy(&out[n], name ? name : L"", (m + 1) * sizeof(wchar_t));
+    return TRUE;
+}
+
+/*
+ * The length of the root of a full path - "C:\", "\\server\share", or
+ * either with "\\?\" in front - or 0 if it doesn't start with one. Walks
+ * go no higher.
+ */
+static size_t
+root_length(const wchar_t * path)
+{
+    const wchar_t * p = path;
+    int part;
+
+    if (!wcsncmp(p, L"\\\\?\\", 4)) {
+        p += 4;
+        if (_wcsnicmp(p, L"UNC\\", 4))
+            goto drive;
+        p += 4;
+    }
+    else if (!wcsncmp(p, L"\\\\", 2)) {
+        p += 2;
+    }
+    else {
+        goto drive;
+    }
+    /* \\server\share */
+    for (part = 0; part < 2; part++) {
+        if ((*p == L'\0') || (*p == L'\\'))
+            return 0;
+        while (*p && (*p != L'\\'))
+            ++p;
+        if ((part == 0) && (*p++ != L'\\'))
+            return 0;
+    }
+    return p - path;
+drive:
+    if (iswalpha(p[0]) && (p[1] == L':') && (p[2] == L'\\'))
+        return p + 3 - path;
+    return 0;
+}
+
+/* Go up to the parent directory, returning FALSE if path is the root. */
+static BOOL
+parent(wchar_t * path, size_t root)
+{
+    wchar_t * p;
+
+    if (wcslen(path) <= root)
+        return FALSE;
+    p = wcsrchr(path, L'\\');
+    if ((p == NULL) || ((size_t) (p - path) < root))
+        path[root] = L'\0';
+    else
+        *p = L'\0';
+    return TRUE;
+}
+
+static BOOL
+stamp_path(PROJECT_INDEX * index, PROJECT * project, const wchar_t * path,
+           CACHE_STAMP * stamp)
+{
+    memset(stamp, 0, sizeof(CACHE_STAMP));
+    ++index->stats;
+    ++project->stats;
+    return index->backend->stamp(index->backend->context, path, stamp);
+}
+
+static long
+lookup(const PROJECT_INDEX * index, const wchar_t * path, unsigned int hash)
+{
+    long i;
+
+    if (index->buckets == NULL)
+        return -1;
+    for (i = index->buckets[hash & (index->num_buckets - 1)]; i >= 0;
+         i = index->dirs[i].next) {
+        if ((index->dirs[i].hash == hash) &&
+            !_wcsicmp(index->dirs[i].path, path))
+            break;
+    }
+    return i;
+}
+
+static BOOL
+grow_table(PROJECT_INDEX * index)
+{
+    size_t num_buckets = index->num_buckets ? index->num_buckets * 2 :
+                         MIN_BUCKETS;
+    long * buckets = malloc(num_buckets * sizeof(long));
+    size_t i;
+
+    if (buckets == NULL)
+        return FALSE;
+    for (i = 0; i < num_buckets; i++)
+        buckets[i] = -1;
+    for (i = 0; i < index->num_dirs; i++) {
+        index->dirs[i].next = buckets[index->dirs[i].hash & (num_buckets - 1)];
+        buckets[index->dirs[i].hash & (num_buckets - 1)] = (long) i;
+    }
+    free(index->buckets);
+    index->buckets = buckets;
+    index->num_buckets = num_buckets;
+    return TRUE;
+}
+
+/* Remember what a directory holds, returning FALSE if memory runs out. */
+static BOOL
+remember(PROJECT_INDEX * index, const wchar_t * path, unsigned int hash,
+         const CACHE_STAMP * stamp, unsigned int holds, BOOL used)
+{
+    long i = lookup(index, path, hash);
+    PROJECT_DIR * dirs;
+    PROJECT_DIR * dir;
+    size_t n;
+
+    if (i < 0) {
+        if ((index->num_dirs >= index->num_buckets) && !grow_table(index))
+            return FALSE;
+        if (index->num_dirs == index->capacity) {
+            n = index->capacity ? index->capacity * 2 : MIN_BUCKETS;
+            dirs = realloc(index->dirs, n * sizeof(PROJECT_DIR));
+            if (dirs == NULL)
+                return FALSE;
+            index->dirs = dirs;
+            index->capacity = n;
+        }
+        n = wcslen(path) + 1;
+        dir = &index->dirs[index->num_dirs];
+        dir->path = malloc(n * sizeof(wchar_t));
+        if (dir->path == NULL)
+            return FALSE;
+        memcpy(dir->path, path, n * sizeof(wchar_t));
+        dir->hash = hash;
+        dir->next = index->buckets[hash & (index->num_buckets - 1)];
+        index->buckets[hash & (index->num_buckets - 1)] =
+            (long) index->num_dirs++;
+    }
+    else {
+        dir = &index->dirs[i];
+    }
+    dir->stamp = *stamp;
+    dir->holds = holds;
+    dir->used = used;
+    return TRUE;
+}
+
+/*
+ * What a directory holds, as PROJECT_* bits, or -1 if it doesn't exist.
+ * Only if it has changed since it was last looked at is each name looked
+ * for.
+ */
+static int
+dir_holds(PROJECT_INDEX * index, const wchar_t * path, PROJECT * project)
+{
+    wchar_t name[MAX_PATH];
+    CACHE_STAMP stamp, ignored;
+    unsigned int hash = hash_path(path);
+    unsigned int holds = 0;
+    long i;
+    size_t m;
+
+    if (!stamp_path(index, project, path, &stamp))
+        return -1;
+    i = lookup(index, path, hash);
+    if ((i >= 0) && same_stamp(&index->dirs[i].stamp, &stamp)) {
+        index->dirs[i].used = TRUE;
+        ++index->reused;
+        ++project->reused;
+        return (int) index->dirs[i].holds;
+    }
+    for (m = 0; m < NUM_MARKERS; m++) {
+        if (!(holds & markers[m].bit) && join(path, markers[m].name, name) &&
+            stamp_path(index, project, name, &ignored))
+            holds |= markers[m].bit;
+    }
+    if (!remember(index, path, hash, &stamp, holds, TRUE))
+        index->failed = TRUE;
+    index->dirty = TRUE;
+    return (int) holds;
+}
+
+void
+project_index_init(PROJECT_INDEX * index, const PROJECT_BACKEND * backend)
+{
+    memset(index, 0, sizeof(PROJECT_INDEX));
+    index->backend = backend;
+}
+
+void
+project_find(PROJECT_INDEX * index, const wchar_t * dir, PROJECT * project)
+{
+    wchar_t path[MAX_PATH];
+    wchar_t venv[MAX_PATH];
+    wchar_t cfg[MAX_PATH];
+    CACHE_STAMP stamp;
+    size_t root, n;
+    int holds;
+
+    memset(project, 0, sizeof(PROJECT));
+    if (!join(dir, NULL, path))
+        return;
+    root = root_length(path);
+    if (root == 0)
+        return;
+    n = wcslen(path);
+    while ((n > root) && (path[n - 1] == L'\\'))
+        path[--n] = L'\0';
+    for (;;) {
+        if (project->stats >= PROJECT_MAX_STATS) {
+            project->capped = TRUE;
+            break;
+        }
+        holds = dir_holds(index, path, project);
+        if (holds < 0)
+            break;
+        ++project->dirs;
+        /* A .venv is only a virtual environment with its pyvenv.cfg, which
+         * can come and go without this directory changing. */
+        if ((holds & PROJECT_VENV) && !project->venv[0] &&
+            join(path, PROJECT_VENV_NAME, venv) &&
+            join(venv, PROJECT_VENV_CFG, cfg) &&
+            stamp_path(index, project, cfg, &stamp))
+            join(venv, NULL, project->venv);
+        if ((holds & PROJECT_PIN) && !project->pin[0])
+            join(path, PROJECT_PIN_NAME, project->pin);
+        if ((holds & PROJECT_INI) && !project->ini[0])
+            join(path, PROJECT_INI_NAME, project->ini);
+        if ((holds & PROJECT_ROOT) ||
+            (project->venv[0] && project->pin[0] && project->ini[0]))
+            break;
+        if (!parent(path, root))
+            break;
+    }
+}
+
+static const char *
+parse_number(const char * p, const char * end, int * value)
+{
+    int n = 0;
+
+    *value = 0;
+    while ((p < end) && (*p >= '0') && (*p <= '9') && (n < 4)) {
+        *value = *value * 10 + (*p++ - '0');
+        ++n;
+    }
+    return ((n == 0) || ((p < end) && (*p >= '0') && (*p <= '9'))) ? NULL :
+           p;
+}
+
+/* Parse a line such as "3.12.4" or "cpython-3.13t" into a tag. */
+static BOOL
+parse_pin_line(const char * p, const char * end, wchar_t * version,
+               size_t version_size)
+{
+    int major, minor = -1, micro;
+    BOOL freethreaded = FALSE;
+    const wchar_t * suffix = L"";
+    int n;
+
+    if ((end - p >= 8) && !memcmp(p, "cpython-", 8))
+        p += 8;
+    else if ((end - p >= 6) && !memcmp(p, "python", 6))
+        p += 6;
+    p = parse_number(p, end, &major);
+    if ((p != NULL) && (p < end) && (*p == '.')) {
+        p = parse_number(p + 1, end, &minor);
+        if ((p != NULL) && (p < end) && (*p == '.')) {
+            p = parse_number(p + 1, end, &micro);
+            /* A pre-release, such as 3.14.0rc1, is of its minor version. */
+            if ((p != NULL) && (p < end) && ((*p == 'a') || (*p == 'b')))
+                p = parse_number(p + 1, end, &micro);
+            else if ((p != NULL) && (end - p >= 2) && !memcmp(p, "rc", 2))
+                p = parse_number(p + 2, end, &micro);
+        }
+    }
+    if (p == NULL)
+        return FALSE;
+    if ((p < end) && (*p == 't')) {
+        freethreaded = TRUE;
+        ++p;
+    }
+    if ((end - p == 3) && (!memcmp(p, "-32", 3) || !memcmp(p, "-64", 3)))
+        suffix = (p[1] == '3') ? L"-32" : L"-64";
+    else if ((end - p == 6) && !memcmp(p, "-arm64", 6))
+        suffix = L"-arm64";
+    else if (p != end)
+        return FALSE;
+    if (minor < 0)
+        n = swprintf(version, version_size, L"%d%ls%ls", major,
+                     freethreaded ? L"t" : L"", suffix);
+    else
+        n = swprintf(version, version_size, L"%d.%d%ls%ls", major, minor,
+                     freethreaded ? L"t" : L"", suffix);
+    return n > 0;
+}
+
+BOOL
+project_parse_pin(const char * data, size_t size, wchar_t * version,
+                  size_t version_size)
+{
+    const char * p = data;
+    const char * end = data + size;
+    const char * line;
+    const char * line_end;
+
+    if ((size >= 3) && !memcmp(data, "\xEF\xBB\xBF", 3))
+        p += 3;
+    while (p < end) {
+        line = p;
+        while ((p < end) && (*p != '\n'))
+            ++p;
+        line_end = p;
+        if (p < end)
+            ++p;
+        while ((line < line_end) && ((*line == ' ') || (*line == '\t')))
+            ++line;
+        if ((line == line_end) || (*line == '#') || (*line == '\r'))
+            continue;
+        /* pyenv allows several versions, separated by spaces: the first is
+         * the one used. */
+        for (p = line; (p < line_end) && (*p != ' ') && (*p != '\t') &&
+                       (*p != '\r'); p++)
+            ;
+        line_end = p;
+        if (parse_pin_line(line, line_end, version, version_size))
+            return TRUE;
+        break;
+    }
+    if (version_size > 0)
+        version[0] = L'\0';
+    return FALSE;
+}
+
+/* FNV-1a - only needs to catch truncated or otherwise mangled files. */
+static unsigned int
+checksum(const void * data, size_t size)
+{
+    const unsigned char * p = data;
+    SAVED_HEADER header;
+    unsigned int result = FNV_BASIS;
+    size_t i;
+
+    memcpy(&header, data, sizeof(header));
+    header.checksum = 0;
+    for (i = 0; i < size; i++) {
+        result ^= (i < sizeof(header)) ? ((unsigned char *) &header)[i] : p[i];
+        result *= FNV_PRIME;
+    }
+    return result;
+}
+
+BOOL
+project_index_load(PROJECT_INDEX * index, void * data, size_t size)
+{
+    SAVED_HEADER header;
+    SAVED_DIR record;
+    const unsigned char * records;
+    const wchar_t * p;
+    const wchar_t * end;
+    unsigned int i;
+    BOOL ok = FALSE;
+
+    if ((data == NULL) || (size < sizeof(header)))
+        goto done;
+    memcpy(&header, data, sizeof(header));
+    if ((header.magic != PROJECT_MAGIC) ||
+        (header.format != PROJECT_FORMAT_VERSION) ||
+        (header.char_size != sizeof(wchar_t)) ||
+        (header.num_dirs > PROJECT_MAX_SAVED) ||
+        (size < sizeof(header) + header.num_dirs * sizeof(SAVED_DIR)) ||
+        ((size - sizeof(header)) % sizeof(wchar_t)) ||
+        (header.checksum != checksum(data, size)))
+        goto done;
+    records = (const unsigned char *) data + sizeof(header);
+    p = (const wchar_t *) (records + header.num_dirs * sizeof(SAVED_DIR));
+    end = (const wchar_t *) ((const unsigned char *) data + size);
+    /* Check it all before adopting any of it. */
+    for (i = 0; i < header.num_dirs; i++) {
+        memcpy(&record, records + i * sizeof(SAVED_DIR), sizeof(record));
+        if ((record.path_length == 0) ||
+            (record.path_length > (size_t) (end - p)) ||
+            p[record.path_length - 1])
+            goto done;
+        p += record.path_length;
+    }
+    if (p != end)
+        goto done;
+    p = (const wchar_t *) (records + header.num_dirs * sizeof(SAVED_DIR));
+    for (i = 0; i < header.num_dirs; i++) {
+        memcpy(&record, records + i * sizeof(SAVED_DIR), sizeof(record));
+        if (!remember(index, p, hash_path(p), &record.stamp, record.holds,
+                      FALSE)) {
+            index->failed = TRUE;
+            break;
+        }
+        p += record.path_length;
+    }
+    ok = TRUE;
+done:
+    free(data);
+    return ok;
+}
+
+size_t
+project_index_save(PROJECT_INDEX * index, void ** data)
+{
+    SAVED_HEADER * header;
+    SAVED_DIR record;
+    unsigned char * records;
+    wchar_t * p;
+    size_t chars = 0, size, i, n;
+    size_t num_dirs = 0;
+    int pass;
+
+    *data = NULL;
+    if (index->failed)
+        return 0;
+    /* Those used this time come first, so they're kept if there are too
+     * many. */
+    for (pass = 0; pass < 2; pass++) {
+        for (i = 0; i < index->num_dirs; i++) {
+            if ((index->dirs[i].used == !pass) &&
+                (num_dirs < PROJECT_MAX_SAVED)) {
+                ++num_dirs;
+                chars += wcslen(index->dirs[i].path) + 1;
+            }
+        }
+    }
+    size = sizeof(SAVED_HEADER) + num_dirs * sizeof(SAVED_DIR) +
+           chars * sizeof(wchar_t);
+    header = calloc(1, size);   /* zeroes any padding, too */
+    if (header == NULL)
+        return 0;
+    header->magic = PROJECT_MAGIC;
+    header->format = PROJECT_FORMAT_VERSION;
+    header->char_size = sizeof(wchar_t);
+    records = (unsigned char *) &header[1];
+    p = (wchar_t *) (records + num_dirs * sizeof(SAVED_DIR));
+    for (pass = 0; pass < 2; pass++) {
+        for (i = 0; (i < index->num_dirs) && (header->num_dirs < num_dirs);
+             i++) {
+            if (index->dirs[i].used != !pass)
+                continue;
+            n = wcslen(index->dirs[i].path) + 1;
+            memset(&record, 0, sizeof(record));
+            record.stamp = index->dirs[i].stamp;
+            record.holds = index->dirs[i].holds;
+            record.path_length = (unsigned int) n;
+            memcpy(records + header->num_dirs++ * sizeof(SAVED_DIR), &record,
+                   sizeof(record));
+            memcpy(p, index->dirs[i].path, n * sizeof(wchar_t));
+            p += n;
+        }
+    }
+    header->checksum = checksum(header, size);
+    *data = header;
+    return size;
+}
+
+void
+project_index_free(PROJECT_INDEX * index)
+{
+    size_t i;
+
+    for (i = 0; i < index->num_dirs; i++)
+        free(index->dirs[i].path);
+    free(index->dirs);
+    free(index->buckets);
+    memset(index, 0, sizeof(PROJECT_INDEX));
+}
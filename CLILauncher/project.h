@@ -0,0 +1,129 @@
+/*
+ * Finding the project a script belongs to: walking up from the script's
+ * directory to find the nearest virtual environment (a .venv directory with
+ * a pyvenv.cfg in it), .python-version file and py.ini file. Each is looked
+ * for separately, so they needn't be in the same directory. The walk stops
+ * at the root of a repository (a directory with .git or .hg in it) or of the
+ * volume, once all three have been found, or once it has made
+ * PROJECT_MAX_STATS calls to the file system.
+ *
+ * Most directories have none of these in them, so what each directory holds
+ * is remembered - including that it holds none of them - along with its
+ * stamp. A directory's last-write time changes whenever an entry is added to
+ * it, removed or renamed, so while its stamp is the same, one call to stamp
+ * it is all it takes to know it hasn't changed, rather than one for each
+ * name looked for. What's remembered can be saved, and loaded by a later
+ * launch; the files found are read afresh each time.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef PROJECT_H
+#define PROJECT_H
+
+#include "install_cache.h"
+
+#define PROJECT_MAGIC           0x4A50594CU     /* "LPYJ" */
+#define PROJECT_FORMAT_VERSION  1
+
+/* What a directory holds, as bits. */
+#define PROJECT_VENV            0x01    /* .venv */
+#define PROJECT_PIN             0x02    /* .python-version */
+#define PROJECT_INI             0x04    /* py.ini */
+#define PROJECT_ROOT            0x08    /* .git or .hg */
+
+#define PROJECT_VENV_NAME       L".venv"
+#define PROJECT_VENV_CFG        L"pyvenv.cfg"
+#define PROJECT_PIN_NAME        L".python-version"
+#define PROJECT_INI_NAME        L"py.ini"
+
+/*
+ * The most file system calls made for one walk: enough to look in every
+ * directory of a walk 60 deep with nothing remembered.
+ */
+#define PROJECT_MAX_STATS       384
+
+/* The most directories saved, including ones not used this time. */
+#define PROJECT_MAX_SAVED       1024
+
+typedef struct {
+    void * context;
+    /*
+     * As for CACHE_BACKEND: stamp a file or directory, returning FALSE if
+     * it doesn't exist.
+     */
+    BOOL (*stamp)(void * context, const wchar_t * path, CACHE_STAMP * stamp);
+} PROJECT_BACKEND;
+
+typedef struct {
+    wchar_t * path;
+    unsigned int hash;              /* of the folded path */
+    CACHE_STAMP stamp;
+    unsigned int holds;             /* PROJECT_* bits */
+    BOOL used;                      /* looked at by this launch */
+    long next;                      /* next in the same bucket, or -1 */
+} PROJECT_DIR;
+
+typedef struct {
+    const PROJECT_BACKEND * backend;
+    PROJECT_DIR * dirs;
+    size_t num_dirs;
+    size_t capacity;
+    long * buckets;                 /* indexes into dirs, or -1 */
+    size_t num_buckets;             /* a power of two */
+    BOOL dirty;                     /* something changed since loading */
+    BOOL failed;                    /* memory ran out: don't save */
+    /* Statistics, over all walks */
+    unsigned long stats;            /* backend stamp() calls */
+    unsigned long reused;           /* directories known to be unchanged */
+} PROJECT_INDEX;
+
+/* What a walk found. A path is empty if it wasn't found. */
+typedef struct {
+    wchar_t venv[MAX_PATH];         /* the .venv directory */
+    wchar_t pin[MAX_PATH];          /* the .python-version file */
+    wchar_t ini[MAX_PATH];          /* the py.ini file */
+    int dirs;                       /* directories looked at */
+    int stats;                      /* backend stamp() calls made */
+    int reused;                     /* directories known to be unchanged */
+    BOOL capped;                    /* stopped at PROJECT_MAX_STATS */
+} PROJECT;
+
+void project_index_init(PROJECT_INDEX * index,
+                        const PROJECT_BACKEND * backend);
+
+/*
+ * Walk up from dir, a full path, filling in project. Paths found are
+ * left empty if they'd be too long for MAX_PATH.
+ */
+void project_find(PROJECT_INDEX * index, const wchar_t * dir,
+                  PROJECT * project);
+
+/*
+ * The version named in a .python-version file's contents: the first line
+ * which isn't blank or a comment, such as "3.12", "3.12.4" or "3.13t",
+ * reduced to a tag the launcher understands ("3.12", "3.13t"). Returns
+ * FALSE, leaving version empty, if there isn't one it can use - for
+ * instance, "pypy3.10" or "system".
+ */
+BOOL project_parse_pin(const char * data, size_t size, wchar_t * version,
+                       size_t version_size);
+
+/*
+ * Adopt what was saved by project_index_save() in an earlier launch. data
+ * must be a malloc'd block, which is freed. Call this before any walks.
+ * Returns FALSE if data wasn't usable.
+ */
+BOOL project_index_load(PROJECT_INDEX * index, void * data, size_t size);
+
+/*
+ * Serialize what's known: the directories looked at so far, then others
+ * loaded, up to PROJECT_MAX_SAVED. On success, *data points to a malloc'd
+ * block which the caller must free, and its size is returned. Returns 0 on
+ * failure.
+ */
+size_t project_index_save(PROJECT_INDEX * index, void ** data);
+
+void project_index_free(PROJECT_INDEX * index);
+
+#endif
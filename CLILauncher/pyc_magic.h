@@ -0,0 +1,34 @@
+/*
+ * Generated by genmagic.py - don't edit - from the history in
+ * importlib/_bootstrap_external.py (Python 3.11.7).
+ *
+ * The range of .pyc magic numbers used by each version of Python,
+ * sorted for a binary search.
+ */
+
+static const PYC_MAGIC pyc_magic_values[] = {
+    { 3000, 3131, L"3.0" },
+    { 3141, 3151, L"3.1" },
+    { 3160, 3180, L"3.2" },
+    { 3190, 3230, L"3.3" },
+    { 3250, 3310, L"3.4" },
+    { 3320, 3351, L"3.5" },
+    { 3360, 3379, L"3.6" },
+    { 3390, 3394, L"3.7" },
+    { 3400, 3413, L"3.8" },
+    { 3420, 3425, L"3.9" },
+    { 3430, 3439, L"3.10" },
+    { 3450, 3495, L"3.11" },
+    { 3500, 3549, L"3.12" },
+    { 3550, 3599, L"3.13" },
+    { 3600, 3649, L"3.14" },
+    { 3650, 3699, L"3.15" },
+    { 50823, 50823, L"2.0" },
+    { 60202, 60202, L"2.1" },
+    { 60717, 60717, L"2.2" },
+    { 62011, 62021, L"2.3" },
+    { 62041, 62061, L"2.4" },
+    { 62071, 62131, L"2.5" },
+    { 62151, 62161, L"2.6" },
+    { 62171, 62211, L"2.7" },
+};
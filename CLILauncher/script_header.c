@@ -0,0 +1,257 @@
+/*
+ * Classifying a script from the start of its file.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <string.h>
+
+#include "script_header.h"
+#include "pyc_magic.h"
+
+#define NUM_MAGIC_VALUES    (sizeof(pyc_magic_values) / sizeof(PYC_MAGIC))
+
+typedef struct {
+    size_t length;
+    unsigned char sequence[4];
+    unsigned int code_page;
+} BOM;
+
+/*
+ * UTF-32LE must come before UTF-16LE, since the UTF-16LE BOM is a prefix
+ * of the UTF-32LE one.
+ */
+static const BOM BOMs[] = {
+    { 3, { 0xEF, 0xBB, 0xBF }, HEADER_UTF8 },
+    { 4, { 0xFF, 0xFE, 0x00, 0x00 }, HEADER_UTF32LE },
+    { 4, { 0x00, 0x00, 0xFE, 0xFF }, HEADER_UTF32BE },
+    { 2, { 0xFF, 0xFE }, HEADER_UTF16LE },
+    { 2, { 0xFE, 0xFF }, HEADER_UTF16BE },
+    { 0 }
+};
+
+/* A zip file's first local file header */
+static const unsigned char zip_signature[4] = { 'P', 'K', 0x03, 0x04 };
+
+const wchar_t *
+header_pyc_version(unsigned short magic)
+{
+    size_t lo = 0, hi = NUM_MAGIC_VALUES, mid;
+
+    while (lo < hi) {
+        mid = (lo + hi) / 2;
+        if (magic < pyc_magic_values[mid].min)
+            hi = mid;
+        else if (magic > pyc_magic_values[mid].max)
+            lo = mid + 1;
+        else
+            return pyc_magic_values[mid].version;
+    }
+    return NULL;
+}
+
+size_t
+header_unit_size(unsigned int code_page)
+{
+    switch (code_page) {
+    case HEADER_UTF16LE:
+    case HEADER_UTF16BE:
+        return 2;
+    case HEADER_UTF32LE:
+    case HEADER_UTF32BE:
+        return 4;
+    default:
+        return 1;
+    }
+}
+
+/* The code unit at p, which must have a whole one. */
+static unsigned long
+get_unit(const unsigned char * p, unsigned int code_page)
+{
+    switch (code_page) {
+    case HEADER_UTF16LE:
+        return p[0] | (p[1] << 8);
+    case HEADER_UTF16BE:
+        return (p[0] << 8) | p[1];
+    case HEADER_UTF32LE:
+        return p[0] | (p[1] << 8) | ((unsigned long) p[2] << 16) |
+               ((unsigned long) p[3] << 24);
+    case HEADER_UTF32BE:
+        return ((unsigned long) p[0] << 24) | ((unsigned long) p[1] << 16) |
+               (p[2] << 8) | p[3];
+    default:
+        return p[0];
+    }
+}
+
+static BOOL
+is_zip(const unsigned char * data, size_t size)
+{
+    return (size >= sizeof(zip_signature)) &&
+           !memcmp(data, zip_signature, sizeof(zip_signature));
+}
+
+/*
+ * Decode n bytes of UTF-8 as MultiByteToWideChar() does, with characters
+ * outside the BMP as surrogate pairs where wchar_t is 16 bits. Returns the
+ * number of characters, at most n.
+ */
+static size_t
+decode_utf8(const unsigned char * s, size_t n, wchar_t * out)
+{
+    size_t i = 0, count = 0, need, k;
+    unsigned long c, min;
+
+    while (i < n) {
+        c = s[i];
+        if (c < 0x80) {
+            out[count++] = (wchar_t) c;
+            ++i;
+            continue;
+        }
+        if ((c & 0xE0) == 0xC0) {
+            need = 1;
+            c &= 0x1F;
+            min = 0x80;
+        }
+        else if ((c & 0xF0) == 0xE0) {
+            need = 2;
+            c &= 0x0F;
+            min = 0x800;
+        }
+        else if ((c & 0xF8) == 0xF0) {
+            need = 3;
+            c &= 0x07;
+            min = 0x10000;
+        }
+        else {
+            out[count++] = 0xFFFD;
+            ++i;
+            continue;
+        }
+        for (k = 1; k <= need; k++) {
+            if ((i + k >= n) || ((s[i + k] & 0xC0) != 0x80))
+                break;
+            c = (c << 6) | (s[i + k] & 0x3F);
+        }
+        i += k;     /* the lead byte and the continuation bytes used */
+        if ((k <= need) || (c < min) || (c > 0x10FFFF) ||
+            ((c >= 0xD800) && (c <= 0xDFFF)))
+            out[count++] = 0xFFFD;
+        else if ((c > 0xFFFF) && (sizeof(wchar_t) == 2)) {
+            c -= 0x10000;
+            out[count++] = (wchar_t) (0xD800 + (c >> 10));
+            out[count++] = (wchar_t) (0xDC00 + (c & 0x3FF));
+        }
+        else
+            out[count++] = (wchar_t) c;
+    }
+    return count;
+}
+
+int
+header_decode_line(const unsigned char * data, const SCRIPT_HEADER * header,
+                   wchar_t * line)
+{
+    const unsigned char * start = data + header->bom_length;
+    size_t unit = header_unit_size(header->code_page);
+    size_t i, nchars = 0;
+
+    if (header->line_length == 0)
+        return -1;
+    if (unit == 1)
+        nchars = decode_utf8(start, header->line_length, line);
+    else {
+        for (i = 0; i < header->line_length; i += unit)
+            line[nchars++] = (wchar_t) (get_unit(start + i,
+                                                 header->code_page) & 0xFFFF);
+    }
+    line[--nchars] = L'\0';  /* drop the terminator */
+    return (int) nchars;
+}
+
+size_t
+header_classify(const unsigned char * data, size_t size, BOOL at_end,
+                SCRIPT_HEADER * header)
+{
+    const BOM * bom;
+    const unsigned char * line;
+    size_t unit, available, i, wanted;
+    BOOL shebang;
+
+    /* Enough for the magic number and the longest BOM. */
+    if ((size < 4) && !at_end)
+        return HEADER_READ_SIZE;
+    memset(header, 0, sizeof(SCRIPT_HEADER));
+    header->code_page = HEADER_UTF8;
+    if ((size >= 4) && (data[2] == '\r') && (data[3] == '\n')) {
+        header->magic = (unsigned short) (data[0] | (data[1] << 8));
+        header->version = header_pyc_version(header->magic);
+        if (header->version != NULL)
+            header->kind = HEADER_PYC;
+    }
+    if (is_zip(data, size)) {
+        header->kind = HEADER_ZIPAPP;
+        return 0;
+    }
+    for (bom = BOMs; bom->length; bom++) {
+        if ((size >= bom->length) &&
+            !memcmp(data, bom->sequence, bom->length)) {
+            header->code_page = bom->code_page;
+            header->bom_length = bom->length;
+            break;
+        }
+    }
+    unit = header_unit_size(header->code_page);
+    line = data + header->bom_length;
+    available = size - header->bom_length;
+    available -= available % unit;
+    if ((available < 2 * unit) && !at_end)
+        return header->bom_length + 2 * unit;
+    shebang = (available >= 2 * unit) &&
+              (get_unit(line, header->code_page) == '#') &&
+              (get_unit(line + unit, header->code_page) == '!');
+    if (unit == 1) {
+        for (i = 0; i < available; i++) {
+            if ((line[i] == '\r') || (line[i] == '\n')) {
+                header->line_length = i + 1;
+                break;
+            }
+        }
+    }
+    else {
+        for (i = 0; i < available; i += unit) {
+            if ((get_unit(line + i, header->code_page) == '\r') ||
+                (get_unit(line + i, header->code_page) == '\n')) {
+                header->line_length = i + unit;
+                break;
+            }
+        }
+    }
+    if (header->line_length == 0) {
+        /* Only a shebang line is worth reading more of. */
+        if (shebang && !at_end && (available < HEADER_MAX_SIZE)) {
+            wanted = size * 4;
+            if (wanted > header->bom_length + HEADER_MAX_SIZE)
+                wanted = header->bom_length + HEADER_MAX_SIZE;
+            return wanted;
+        }
+        return 0;   /* HEADER_NONE, or HEADER_PYC */
+    }
+    if (shebang) {
+        /* A zip application starts with a shebang line. */
+        wanted = header->bom_length + header->line_length +
+                 sizeof(zip_signature);
+        if ((size < wanted) && !at_end)
+            return wanted;
+        if (is_zip(line + header->line_length,
+                   size - header->bom_length - header->line_length)) {
+            header->kind = HEADER_ZIPAPP;
+            return 0;
+        }
+    }
+    if (header->kind == HEADER_NONE)
+        header->kind = HEADER_TEXT;
+    return 0;
+}
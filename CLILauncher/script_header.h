@@ -0,0 +1,80 @@
+/*
+ * Classifying a script from the start of its file: a compiled (.pyc) file,
+ * a zip application (.pyz) or text, perhaps starting with a byte order
+ * mark, whose first line may be a shebang line.
+ *
+ * The launcher reads HEADER_READ_SIZE bytes, which is almost always enough.
+ * Only when a shebang line carries on past them - as one naming a Python
+ * deep inside a virtual environment can - is more of the file asked for,
+ * up to HEADER_MAX_SIZE.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef SCRIPT_HEADER_H
+#define SCRIPT_HEADER_H
+
+#include "launcher.h"
+
+#define HEADER_READ_SIZE    256
+#define HEADER_MAX_SIZE     (128 * 1024)    /* the longest first line */
+
+/* Kinds of file */
+#define HEADER_NONE     0   /* no first line found */
+#define HEADER_TEXT     1   /* a first line, which may be a shebang line */
+#define HEADER_PYC      2   /* compiled, by a known version of Python */
+#define HEADER_ZIPAPP   3   /* zip data, perhaps after a first line */
+
+/* Encodings, numbered as Windows code pages */
+#define HEADER_UTF8     65001
+#define HEADER_UTF16LE  1200
+#define HEADER_UTF16BE  1201
+#define HEADER_UTF32LE  12000
+#define HEADER_UTF32BE  12001
+
+typedef struct {
+    unsigned short min;
+    unsigned short max;
+    const wchar_t * version;
+} PYC_MAGIC;
+
+typedef struct {
+    int kind;
+    unsigned short magic;       /* for HEADER_PYC */
+    const wchar_t * version;    /* for HEADER_PYC: the version it's for */
+    unsigned int code_page;     /* HEADER_UTF8 unless there's a BOM */
+    size_t bom_length;
+    /*
+     * The bytes in the first line, after any BOM, including its
+     * terminator, or 0 if there isn't one. A .pyc file whose Python isn't
+     * installed is treated as text, so this is set for HEADER_PYC too.
+     */
+    size_t line_length;
+} SCRIPT_HEADER;
+
+/*
+ * Classify a file from its first size bytes; at_end is TRUE if that's all
+ * of it. Returns 0 if *header has been filled in, or else the number of
+ * bytes from the start of the file needed to decide, which is more than
+ * size - read them (or as many as there are) and call this again.
+ */
+size_t header_classify(const unsigned char * data, size_t size, BOOL at_end,
+                       SCRIPT_HEADER * header);
+
+/*
+ * Decode the first line of a file, as classified by header_classify(),
+ * without its terminator, into line, which must have room for
+ * header->line_length + 1 characters. Returns the number of characters,
+ * or -1 if there is no first line. Malformed UTF-8 is decoded as U+FFFD;
+ * only the low 16 bits of each UTF-32 character are kept.
+ */
+int header_decode_line(const unsigned char * data,
+                       const SCRIPT_HEADER * header, wchar_t * line);
+
+/* The version of Python which uses a .pyc magic number, or NULL. */
+const wchar_t * header_pyc_version(unsigned short magic);
+
+/* The size of a code unit in an encoding. */
+size_t header_unit_size(unsigned int code_page);
+
+#endif
@@ -0,0 +1,173 @@
+/*
+ * Parsing shebang lines, and building the command line of the child
+ * process a script is run in.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <wctype.h>
+
+#include "shebang.h"
+
+typedef struct {
+    wchar_t * shebang;
+    BOOL search;
+} SHEBANG;
+
+static SHEBANG builtin_virtual_paths [] = {
+    { L"/usr/bin/env python", TRUE },
+    { L"/usr/bin/python", FALSE },
+    { L"/usr/local/bin/python", FALSE },
+    { L"python", FALSE },
+    { NULL, FALSE },
+};
+
+static wchar_t * builtin_prefixes [] = {
+    /* These must be in an order that the longest matches should be found,
+     * i.e. if the prefix is "/usr/bin/env ", it should match that entry
+     * *before* matching "/usr/bin/".
+     */
+    L"/usr/bin/env ",
+    L"/usr/bin/",
+    L"/usr/local/bin/",
+    NULL
+};
+
+static wchar_t *
+skip_whitespace(wchar_t * p)
+{
+    while (*p && iswspace(*p))
+        ++p;
+    return p;
+}
+
+wchar_t *
+shebang_skip_prefix(wchar_t * name)
+{
+    wchar_t ** pp = builtin_prefixes;
+    wchar_t * result = name;
+    wchar_t * p;
+    size_t n;
+
+    for (; (p = *pp) != NULL; pp++) {
+        n = wcslen(p);
+        if (_wcsnicmp(p, name, n) == 0) {
+            result += n;   /* skip the prefix */
+            if (p[n - 1] == L' ') /* No empty strings in table, so n > 1 */
+                result = skip_whitespace(result);
+            break;
+        }
+    }
+    return result;
+}
+
+BOOL
+shebang_parse(const SHEBANG_BACKEND * backend, wchar_t * line, int nchars,
+              wchar_t ** command, wchar_t ** suffix, BOOL * search)
+{
+    BOOL rc = FALSE;
+    SHEBANG * vpp;
+    size_t plen;
+    wchar_t * p;
+    wchar_t zapped;
+    wchar_t * endp = line + nchars - 1;
+    wchar_t * value;
+    wchar_t * skipped;
+
+    *command = NULL;    /* failure return */
+    *suffix = NULL;
+    *search = FALSE;
+
+    if ((nchars >= 2) && (line[0] == L'#') && (line[1] == L'!')) {
+        line = skip_whitespace(line + 2);
+        if (*line) {
+            *command = line;
+            for (vpp = builtin_virtual_paths; vpp->shebang; ++vpp) {
+                plen = wcslen(vpp->shebang);
+                if (wcsncmp(line, vpp->shebang, plen) == 0) {
+                    rc = TRUE;
+                    *search = vpp->search;
+                    /* We can do this because all builtin commands contain
+                     * "python".
+                     */
+                    *command = wcsstr(line, L"python");
+                    break;
+                }
+            }
+            if (vpp->shebang == NULL) {
+                /*
+                 * Not found in builtins - look in customized commands.
+                 *
+                 * We can't permanently modify the shebang line in case
+                 * it's not a customized command, but we can temporarily
+                 * stick a NUL after the command while searching for it,
+                 * then put back the char we zapped.
+                 */
+                skipped = backend->skip_prefix ? shebang_skip_prefix(line) :
+                          line;
+                p = wcspbrk(skipped, L" \t\r\n");
+                if (p != NULL) {
+                    zapped = *p;
+                    *p = L'\0';
+                }
+                value = backend->find_command(backend->context, skipped);
+                if (p != NULL)
+                    *p = zapped;
+                if (value != NULL) {
+                    *command = value;
+                    if (p != NULL)
+                        *suffix = skip_whitespace(p);
+                }
+            }
+            /* remove trailing whitespace */
+            while ((endp > line) && iswspace(*endp))
+                --endp;
+            if (endp > line)
+                endp[1] = L'\0';
+        }
+    }
+    return rc;
+}
+
+wchar_t *
+shebang_child_command(const wchar_t * executable, const wchar_t * suffix,
+                      const wchar_t * cmdline)
+{
+    BOOL no_suffix = (suffix == NULL) || (*suffix == L'\0');
+    BOOL no_cmdline = (*cmdline == L'\0');
+    size_t n = wcslen(executable);
+    size_t size = n + 1;
+    wchar_t * result;
+    wchar_t * p;
+
+    /*
+     * With a suffix, the arguments follow it after a space even if there
+     * are none, as they always have.
+     */
+    if (!no_suffix)
+        size += wcslen(suffix) + 1 + wcslen(cmdline) + 1;
+    else if (!no_cmdline)
+        size += wcslen(cmdline) + 1;
+    result = malloc(size * sizeof(wchar_t));
+    if (result == NULL)
+        return NULL;
+    p = result;
+    memcpy(p, executable, n * sizeof(wchar_t));
+    p += n;
+    if (!no_suffix) {
+        *p++ = L' ';
+        n = wcslen(suffix);
+        memcpy(p, suffix, n * sizeof(wchar_t));
+        p += n;
+    }
+    if (!no_suffix || !no_cmdline) {
+        *p++ = L' ';
+        n = wcslen(cmdline);
+        memcpy(p, cmdline, n * sizeof(wchar_t));
+        p += n;
+    }
+    *p = L'\0';
+    return result;
+}
@@ -0,0 +1,55 @@
+/*
+ * Parsing shebang lines, and building the command line of the child
+ * process a script is run in.
+ *
+ * A shebang line names either one of the builtin virtual commands (such as
+ * "/usr/bin/env python3"), which the launcher resolves to an installed
+ * Python, or some other command, which is looked up - in the [commands]
+ * section of py.ini, and on PATH - through a backend.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef SHEBANG_H
+#define SHEBANG_H
+
+#include "launcher.h"
+
+typedef struct {
+    void * context;
+    /*
+     * The command line a name (such as "perl") stands for, or NULL if it
+     * isn't a known command. The result must stay valid until the next
+     * call.
+     */
+    wchar_t * (*find_command)(void * context, const wchar_t * name);
+    /* Look up "/usr/bin/perl" and "/usr/bin/env perl" as just "perl"? */
+    BOOL skip_prefix;
+} SHEBANG_BACKEND;
+
+/* Skip a leading "/usr/bin/env ", "/usr/bin/" or "/usr/local/bin/". */
+wchar_t * shebang_skip_prefix(wchar_t * name);
+
+/*
+ * Parse the first line of a script, nchars long, without its terminator.
+ * Returns TRUE if it names a virtual command, with *command pointing to the
+ * "python..." part of the line and *search set if PATH may be searched for
+ * python.exe. Otherwise *command is what the backend found for the command
+ * named, with *suffix pointing to the rest of the line, or the line after
+ * the "#!" if nothing was found; or NULL if the line isn't a shebang line.
+ * Trailing whitespace is removed from the line.
+ */
+BOOL shebang_parse(const SHEBANG_BACKEND * backend, wchar_t * line,
+                   int nchars, wchar_t ** command, wchar_t ** suffix,
+                   BOOL * search);
+
+/*
+ * The command line for running a command: the executable, then the suffix
+ * (if any) and the launcher's own arguments (if any), separated by spaces.
+ * Returns a malloc'd string, or NULL if memory runs out.
+ */
+wchar_t * shebang_child_command(const wchar_t * executable,
+                                const wchar_t * suffix,
+                                const wchar_t * cmdline);
+
+#endif
@@ -0,0 +1,65 @@
+/*
+ * Times parsing a py.ini file with many commands, and looking them all up.
+ *
+ *     build/bench_ini_config [num_commands [repeats]]
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "ini_config.h"
+
+static double
+now()
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+int
+main(int argc, char ** argv)
+{
+    size_t n = (argc > 1) ? strtoul(argv[1], NULL, 10) : 10000;
+    int repeats = (argc > 2) ? atoi(argv[2]) : 20;
+    size_t size = n * 64 + 64;
+    wchar_t * text = malloc(size * sizeof(wchar_t));
+    wchar_t * p = text;
+    wchar_t key[32];
+    CONFIG config;
+    double t, parse_time = 0, find_time = 0;
+    size_t i, found = 0;
+    int r;
+
+    if (text == NULL)
+        return 1;
+    p += swprintf(p, size, L"[defaults]\npython=3\n[commands]\n");
+    for (i = 0; i < n; i++)
+        p += swprintf(p, size - (p - text), L"cmd%lu = C:\\Tools\\cmd%lu.exe\n",
+                      (unsigned long) i, (unsigned long) i);
+    for (r = 0; r < repeats; r++) {
+        memset(&config, 0, sizeof(config));
+        t = now();
+        if (!config_parse(&config, text, p - text, L"py.ini"))
+            return 1;
+        parse_time += now() - t;
+        t = now();
+        for (i = 0; i < n; i++) {
+            swprintf(key, 32, L"CMD%lu", (unsigned long) i);
+            found += config_find(&config, L"commands", key) != NULL;
+        }
+        find_time += now() - t;
+        config_free(&config);
+    }
+    printf("%lu commands, %lu characters\n", (unsigned long) n,
+           (unsigned long) (p - text));
+    printf("parse:  %10.1f us per file\n", parse_time * 1e6 / repeats);
+    printf("lookup: %10.3f us per key (%lu found)\n",
+           find_time * 1e6 / repeats / (n ? n : 1),
+           (unsigned long) (found / repeats));
+    free(text);
+    return 0;
+}
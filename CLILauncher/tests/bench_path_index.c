@@ -0,0 +1,189 @@
+/*
+ * Compares finding commands on PATH by probing each directory for each
+ * extension, as SearchPathW does, with listing directories into an index.
+ *
+ *     build/bench_path_index [files_per_dir [latency_us]]
+ *
+ * The file system is simulated, so times cover only the work done in the
+ * launcher; the estimates add latency_us for each call which would go to
+ * the file system - a probe, a directory listing or a stamp.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "path_index.h"
+
+#define NUM_LOOKUPS 4
+
+static const wchar_t * pathext =
+    L".COM;.EXE;.BAT;.CMD;.VBS;.VBE;.JS;.JSE;.WSF;.WSH;.MSC;.PY";
+
+static const wchar_t * extensions[] = {
+    L".COM", L".EXE", L".BAT", L".CMD", L".VBS", L".VBE", L".JS", L".JSE",
+    L".WSF", L".WSH", L".MSC", L".PY"
+};
+
+#define NUM_EXTENSIONS  (sizeof(extensions) / sizeof(extensions[0]))
+
+/* Commands looked up: near the front, at the back, and not there at all. */
+static const wchar_t * lookups[NUM_LOOKUPS] = {
+    L"file0", L"target", L"missing", L"script"
+};
+
+typedef struct {
+    size_t num_dirs;
+    size_t files_per_dir;
+    unsigned long probes;
+} FAKE;
+
+/* Directory d holds fileN.exe...; the last also holds target.py. */
+static BOOL
+fake_exists(FAKE * fake, size_t d, const wchar_t * name)
+{
+    unsigned long n;
+    wchar_t extra;
+
+    ++fake->probes;
+    if (!_wcsicmp(name, L"target.py"))
+        return d == fake->num_dirs - 1;
+    if (!_wcsicmp(name, L"script.cmd"))
+        return d == fake->num_dirs / 2;
+    return (swscanf(name, L"file%lu.exe%lc", &n, &extra) == 1) &&
+           (n < fake->files_per_dir);
+}
+
+static BOOL
+fake_list_dir(void * context, const wchar_t * dir, PATH_ADD add, void * arg)
+{
+    FAKE * fake = context;
+    size_t d = wcstoul(dir + 3, NULL, 10), i;
+    wchar_t name[32];
+
+    for (i = 0; i < fake->files_per_dir; i++) {
+        swprintf(name, 32, L"file%lu.exe", (unsigned long) i);
+        add(arg, name);
+        swprintf(name, 32, L"file%lu.dll", (unsigned long) i);
+        add(arg, name);
+    }
+    if (d == fake->num_dirs - 1)
+        add(arg, L"target.py");
+    if (d == fake->num_dirs / 2)
+        add(arg, L"script.cmd");
+    return TRUE;
+}
+
+static BOOL
+fake_dir_stamp(void * context, const wchar_t * dir, CACHE_STAMP * stamp)
+{
+    (void) context;
+    memset(stamp, 0, sizeof(CACHE_STAMP));
+    stamp->time = wcstoul(dir + 3, NULL, 10) + 1;
+    return TRUE;
+}
+
+static double
+now()
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+/* What the launcher used to do: SearchPathW for each extension in turn. */
+static long
+probe(FAKE * fake, const wchar_t * command)
+{
+    wchar_t name[MAX_PATH];
+    size_t e, d;
+
+    for (e = 0; e < NUM_EXTENSIONS; e++) {
+        swprintf(name, MAX_PATH, L"%ls%ls", command, extensions[e]);
+        for (d = 0; d < fake->num_dirs; d++) {
+            if (fake_exists(fake, d, name))
+                return (long) d;
+        }
+    }
+    return -1;
+}
+
+int
+main(int argc, char ** argv)
+{
+    static const size_t sizes[] = { 10, 50, 100, 250, 500 };
+    size_t files = (argc > 1) ? strtoul(argv[1], NULL, 10) : 200;
+    double latency = ((argc > 2) ? atof(argv[2]) : 20.0) / 1e6;
+    PATH_BACKEND backend;
+    const wchar_t ** dirs;
+    wchar_t ** names;
+    PATH_INDEX index;
+    const wchar_t * extension;
+    double t, probe_time, index_time, warm_time;
+    unsigned long listings, stamps;
+    void * data;
+    size_t size, s, d, i;
+    FAKE fake;
+
+    printf("%lu files per directory, %lu extensions, %.0f us per call\n",
+           (unsigned long) files, (unsigned long) NUM_EXTENSIONS,
+           latency * 1e6);
+    printf("%5s %10s %10s %10s %8s %10s %10s %10s\n", "dirs", "probes",
+           "probe ms", "est ms", "lists", "index ms", "est ms", "warm ms");
+    for (s = 0; s < sizeof(sizes) / sizeof(sizes[0]); s++) {
+        fake.num_dirs = sizes[s];
+        fake.files_per_dir = files;
+        fake.probes = 0;
+        backend.context = &fake;
+        backend.list_dir = fake_list_dir;
+        backend.dir_stamp = fake_dir_stamp;
+        dirs = malloc(sizes[s] * sizeof(wchar_t *));
+        names = malloc(sizes[s] * sizeof(wchar_t *));
+        for (d = 0; d < sizes[s]; d++) {
+            names[d] = malloc(16 * sizeof(wchar_t));
+            swprintf(names[d], 16, L"C:\\%lu", (unsigned long) d);
+            dirs[d] = names[d];
+        }
+
+        t = now();
+        for (i = 0; i < NUM_LOOKUPS; i++)
+            probe(&fake, lookups[i]);
+        probe_time = now() - t;
+
+        t = now();
+        path_index_init(&index, &backend, dirs, (int) sizes[s], pathext);
+        for (i = 0; i < NUM_LOOKUPS; i++)
+            path_index_find(&index, lookups[i], &extension);
+        index_time = now() - t;
+        listings = index.listings;
+        size = path_index_save(&index, &data);
+        path_index_free(&index);
+
+        /* The next launch, with the saved listings. */
+        t = now();
+        path_index_init(&index, &backend, dirs, (int) sizes[s], pathext);
+        path_index_load(&index, data, size);
+        for (i = 0; i < NUM_LOOKUPS; i++)
+            path_index_find(&index, lookups[i], &extension);
+        warm_time = now() - t;
+        stamps = index.stamps;
+        path_index_free(&index);
+
+        printf("%5lu %10lu %10.3f %10.1f %8lu %10.3f %10.1f %10.3f\n",
+               (unsigned long) sizes[s], fake.probes, probe_time * 1e3,
+               (probe_time + fake.probes * latency) * 1e3, listings,
+               index_time * 1e3,
+               (index_time + (listings * 2) * latency) * 1e3,
+               (warm_time + stamps * latency) * 1e3);
+        for (d = 0; d < sizes[s]; d++)
+            free(names[d]);
+        free(names);
+        free(dirs);
+    }
+    printf("(%d lookups; est = time + calls x latency; a listing counts as "
+           "two calls; warm is\n the next launch with saved listings, which "
+           "stamps each directory)\n", NUM_LOOKUPS);
+    return 0;
+}
@@ -0,0 +1,145 @@
+/*
+ * Times finding a script's project, for scripts nested more and more deeply
+ * below the project's root, with and without what an earlier launch saved.
+ *
+ *     build/bench_project [latency_us]
+ *
+ * The file system is simulated, so times cover only the work done in the
+ * launcher; the estimates add latency_us for each call which would go to
+ * the file system. The project's root, C:\proj, holds .git and a .venv;
+ * the script is in C:\proj\d\d...\d, depth directories below it.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "project.h"
+
+#define REPEATS     1000
+#define ROOT        L"C:\\proj"
+#define ROOT_LENGTH 7
+
+typedef struct {
+    int depth;
+    unsigned long calls;
+} FAKE;
+
+/* C:\, C:\proj, its .git, .venv and pyvenv.cfg, and the \d below it. */
+static BOOL
+fake_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    FAKE * fake = context;
+    const wchar_t * p;
+    int depth = 0;
+
+    ++fake->calls;
+    stamp->time = 1;
+    if (!wcscmp(path, L"C:\\"))
+        return TRUE;
+    if (wcsncmp(path, ROOT, ROOT_LENGTH))
+        return FALSE;
+    p = path + ROOT_LENGTH;
+    if (!wcscmp(p, L"\\.git") || !wcscmp(p, L"\\.venv") ||
+        !wcscmp(p, L"\\.venv\\pyvenv.cfg"))
+        return TRUE;
+    for (; *p; p += 2, depth++) {
+        if (wcsncmp(p, L"\\d", 2))
+            return FALSE;
+    }
+    return depth <= fake->depth;
+}
+
+static double
+now()
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+int
+main(int argc, char ** argv)
+{
+    static const int depths[] = { 1, 5, 10, 20, 30, 40, 50 };
+    double latency = ((argc > 1) ? atof(argv[1]) : 20.0) / 1e6;
+    PROJECT_BACKEND backend;
+    PROJECT_INDEX index;
+    PROJECT project;
+    wchar_t dir[MAX_PATH];
+    double t, cold_time, saved_time, warm_time;
+    unsigned long cold_calls, saved_calls, warm_calls;
+    void * data;
+    void * copy;
+    size_t size, s;
+    int i;
+    FAKE fake;
+
+    backend.context = &fake;
+    backend.stamp = fake_stamp;
+    printf("%.0f us per call, %d walks each\n", latency * 1e6, REPEATS);
+    printf("%5s %6s %8s %10s %6s %8s %10s %6s %8s\n", "depth", "calls",
+           "cold us", "est us", "calls", "saved us", "est us", "calls",
+           "warm us");
+    for (s = 0; s < sizeof(depths) / sizeof(depths[0]); s++) {
+        fake.depth = depths[s];
+        wcscpy(dir, ROOT);
+        for (i = 0; i < depths[s]; i++)
+            wcscat(dir, L"\\d");
+
+        /* A first launch, with nothing saved. */
+        fake.calls = 0;
+        t = now();
+        for (i = 0; i < REPEATS; i++) {
+            project_index_init(&index, &backend);
+            project_find(&index, dir, &project);
+            if (i < REPEATS - 1)
+                project_index_free(&index);
+        }
+        cold_time = (now() - t) / REPEATS;
+        cold_calls = fake.calls / REPEATS;
+        if (!project.venv[0] || (project.dirs != depths[s] + 1)) {
+            fprintf(stderr, "depth %d: walk went wrong\n", depths[s]);
+            return 1;
+        }
+        size = project_index_save(&index, &data);
+        project_index_free(&index);
+
+        /* A later launch, which loads what the first saved. */
+        fake.calls = 0;
+        t = now();
+        for (i = 0; i < REPEATS; i++) {
+            copy = malloc(size);
+            memcpy(copy, data, size);
+            project_index_init(&index, &backend);
+            project_index_load(&index, copy, size);
+            project_find(&index, dir, &project);
+            project_index_free(&index);
+        }
+        saved_time = (now() - t) / REPEATS;
+        saved_calls = fake.calls / REPEATS;
+
+        /* More scripts in the same launch, as with py --resolve. */
+        project_index_init(&index, &backend);
+        project_find(&index, dir, &project);
+        fake.calls = 0;
+        t = now();
+        for (i = 0; i < REPEATS; i++)
+            project_find(&index, dir, &project);
+        warm_time = (now() - t) / REPEATS;
+        warm_calls = fake.calls / REPEATS;
+        project_index_free(&index);
+        free(data);
+
+        printf("%5d %6lu %8.2f %10.1f %6lu %8.2f %10.1f %6lu %8.2f\n",
+               depths[s], cold_calls, cold_time * 1e6,
+               (cold_time + cold_calls * latency) * 1e6, saved_calls,
+               saved_time * 1e6, (saved_time + saved_calls * latency) * 1e6,
+               warm_calls, warm_time * 1e6);
+    }
+    printf("(est = time + calls x latency; saved includes loading what the "
+           "first launch saved;\n warm is another walk in the same launch)\n");
+    return 0;
+}
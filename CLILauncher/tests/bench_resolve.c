@@ -0,0 +1,153 @@
+/*
+ * Times resolving scripts with the portable parts of the launcher, as
+ * resolve_shebang() and invoke_child() do once a script has been read:
+ * classifying its header, decoding and parsing its shebang line, finding
+ * the installed Python a virtual command asks for (or the command a
+ * [commands] entry gives), and building the child's command line.
+ *
+ *     build/bench_resolve [repeats]
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "script_header.h"
+#include "shebang.h"
+#include "version_index.h"
+
+typedef struct {
+    const char * name;
+    const char * header;
+} SAMPLE;
+
+static const SAMPLE corpus[] = {
+    { "env python3", "#!/usr/bin/env python3\nimport sys\n" },
+    { "python3.12 -u", "#! python3.12 -u\r\nimport sys\r\n" },
+    { "python2", "#!/usr/bin/python2\nprint 'hi'\n" },
+    { "arm64", "#!python3.13-arm64\nimport sys\n" },
+    { "free-threaded", "#!/usr/bin/env python3.14t -X gil=0\n" },
+    { "default", "#!python\nimport sys\n" },
+    { "perl command", "#!/usr/bin/perl -w\nprint;\n" },
+    { "unknown command", "#!/bin/sh -x\necho\n" },
+    { "venv path",
+      "#!C:\\Users\\builder\\project\\.venv\\Scripts\\python.exe\n" },
+    { "no shebang", "import sys\nprint(sys.argv)\n" },
+    { "UTF-8 BOM", "\xEF\xBB\xBF#!python3\nprint('h\xC3\xA9')\n" },
+};
+
+#define NUM_SAMPLES (sizeof(corpus) / sizeof(corpus[0]))
+
+static const wchar_t * tags[] = {
+    L"2.7", L"2.7-32", L"3.8", L"3.9", L"3.10", L"3.11", L"3.11-32",
+    L"3.12", L"3.12-32", L"3.12-arm64", L"3.13", L"3.13t", L"3.13-arm64",
+    L"3.14", L"3.14t",
+};
+
+#define NUM_TAGS    (sizeof(tags) / sizeof(tags[0]))
+
+static wchar_t perl[] = L"C:\\Perl\\bin\\perl.exe";
+
+static wchar_t *
+find_command(void * context, const wchar_t * name)
+{
+    (void) context;
+    return wcscmp(name, L"perl") ? NULL : perl;
+}
+
+static SHEBANG_BACKEND backend = { NULL, find_command, TRUE };
+
+static INSTALLED_PYTHON pythons[NUM_TAGS];
+static VERSION_INDEX index_;
+
+static double
+now()
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+/* Resolve a script, returning its child command line, or NULL. */
+static wchar_t *
+resolve(const unsigned char * data, size_t size)
+{
+    SCRIPT_HEADER header;
+    wchar_t line[HEADER_READ_SIZE + 1];
+    wchar_t * command;
+    wchar_t * suffix;
+    wchar_t * p;
+    PY_VERSION wanted;
+    BOOL search;
+    long found;
+    int nchars;
+
+    if (header_classify(data, size, TRUE, &header) != 0)
+        return NULL;
+    nchars = header_decode_line(data, &header, line);
+    if (nchars < 0)
+        return NULL;
+    if (shebang_parse(&backend, line, nchars, &command, &suffix, &search)) {
+        suffix = wcschr(command, L' ');
+        if (suffix != NULL) {
+            *suffix++ = L'\0';
+            while (*suffix == L' ')
+                ++suffix;
+        }
+        p = command + 6;    /* skip past "python" */
+        /* with no version, say the default is 3 */
+        if (!parse_version(*p ? p : L"3", &wanted, TRUE))
+            return NULL;
+        found = version_index_find(&index_, &wanted);
+        if (found < 0)
+            return NULL;
+        command = pythons[found].executable;
+    }
+    if (command == NULL)
+        command = L"C:\\Python314\\python.exe";     /* the default */
+    return shebang_child_command(command, suffix, L"script.py arg1 arg2");
+}
+
+int
+main(int argc, char ** argv)
+{
+    long repeats = (argc > 1) ? atol(argv[1]) : 100000;
+    wchar_t * result = NULL;
+    size_t i, n;
+    double t, total = 0;
+    long r;
+
+    for (i = 0; i < NUM_TAGS; i++) {
+        wcscpy(pythons[i].version, tags[i]);
+        parse_version(tags[i], &pythons[i].parsed, FALSE);
+        if (pythons[i].parsed.arch == ARCH_ANY)
+            pythons[i].parsed.arch = ARCH_64;
+        pythons[i].bits = (pythons[i].parsed.arch == ARCH_32) ? 32 : 64;
+        swprintf(pythons[i].executable, MAX_PATH,
+                 L"C:\\Python\\%ls\\python.exe", tags[i]);
+        pythons[i].order = (unsigned int) i;
+    }
+    qsort(pythons, NUM_TAGS, sizeof(INSTALLED_PYTHON), compare_installed);
+    if (!version_index_build(&index_, pythons, NUM_TAGS))
+        return 1;
+    printf("%-16s %10s  %s\n", "sample", "ns each", "child command");
+    for (i = 0; i < NUM_SAMPLES; i++) {
+        n = strlen(corpus[i].header);
+        t = now();
+        for (r = 0; r < repeats; r++) {
+            free(result);
+            result = resolve((const unsigned char *) corpus[i].header, n);
+        }
+        t = now() - t;
+        total += t;
+        printf("%-16s %10.1f  %ls\n", corpus[i].name, t * 1e9 / repeats,
+               result ? result : L"(default processing)");
+    }
+    free(result);
+    printf("%lu samples: %.2f million resolutions a second\n",
+           (unsigned long) NUM_SAMPLES, NUM_SAMPLES * repeats / total / 1e6);
+    version_index_free(&index_);
+    return 0;
+}
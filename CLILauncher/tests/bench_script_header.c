@@ -0,0 +1,158 @@
+/*
+ * Times classifying a corpus of script headers of the kinds found in the
+ * wild - shebang lines from pip, virtual environments and conda, BOMs,
+ * compiled files from many versions of Python, zip applications - and
+ * compares looking up magic numbers by binary search with the linear scan
+ * the launcher used to do.
+ *
+ *     build/bench_script_header [repeats]
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "script_header.h"
+#include "pyc_magic.h"
+
+#define NUM_MAGIC_VALUES    (sizeof(pyc_magic_values) / sizeof(PYC_MAGIC))
+#define FILE_SIZE           4096
+
+typedef struct {
+    const char * name;
+    const char * header;
+    size_t length;      /* 0 for strlen(header) */
+} SAMPLE;
+
+static const SAMPLE corpus[] = {
+    { "env python3", "#!/usr/bin/env python3\n\"\"\"A tool.\"\"\"\n", 0 },
+    { "python -u", "#!/usr/bin/python3 -u\nimport sys\n", 0 },
+    { "py launcher", "#! python3.12\r\nimport os\r\n", 0 },
+    { "coding cookie", "# -*- coding: utf-8 -*-\nimport sys\n", 0 },
+    { "module docstring",
+      "\"\"\"Build the documentation.\"\"\"\n\nimport os\n", 0 },
+    { "pip console script",
+      "#!c:\\users\\builder\\appdata\\local\\programs\\python\\python312\\"
+      "python.exe\n# -*- coding: utf-8 -*-\nimport re\nimport sys\n", 0 },
+    { "venv script",
+      "#!C:\\Users\\builder\\source\\repos\\product\\services\\ingest\\"
+      ".venv\\Scripts\\python.exe\nimport sys\n", 0 },
+    { "deep venv (> 256)",
+      "#!C:\\Users\\builder\\AppData\\Local\\pypoetry\\Cache\\virtualenvs\\"
+      "ingest-service-pipeline-workers-Xb7tQ2mD-py3.12\\Lib\\site-packages\\"
+      "..\\..\\..\\..\\..\\..\\..\\..\\..\\..\\workspace\\monorepo\\tools\\"
+      "bootstrap\\environments\\ci-windows-x64-release\\python\\3.12.4\\"
+      "amd64\\python.exe -X utf8\nimport sys\n", 0 },
+    { "conda (> 512)",
+      "#!C:\\ProgramData\\Miniconda3\\envs\\placehold_placehold_placehold_"
+      "placehold_placehold_placehold_placehold_placehold_placehold_placehol"
+      "d_placehold_placehold_placehold_placehold_placehold_placehold_placeh"
+      "old_placehold_placehold_placehold_placehold_placehold_placehold_plac"
+      "ehold_placehold_placehold_placehold_placehold_placehold_placehold_pl"
+      "acehold_placehold_placehold_placehold_placehold_placehold_placehold_"
+      "placehold_placehold_placehold_placehold_placehold_placehold_placehol"
+      "d_placehold_placehold_placehold\\python.exe\nimport sys\n", 0 },
+    { "UTF-8 BOM", "\xEF\xBB\xBF#!python3\nprint('h\xC3\xA9')\n", 0 },
+    { "UTF-16LE BOM", "\xFF\xFE#\0!\0p\0y\0t\0h\0o\0n\0\n\0", 20 },
+    { "pyc 2.7", "\x03\xF3\r\n\0\0\0\0", 8 },
+    { "pyc 3.8", "\x55\x0D\r\n\0\0\0\0", 8 },
+    { "pyc 3.11", "\xA7\x0D\r\n\0\0\0\0", 8 },
+    { "pyc 3.12", "\xCB\x0D\r\n\0\0\0\0", 8 },
+    { "pyc 3.13", "\xF3\x0D\r\n\0\0\0\0", 8 },
+    { "zipapp", "#!/usr/bin/env python3\nPK\x03\x04\x14\0\0\0\x08\0", 33 },
+    { "plain zip", "PK\x03\x04\x14\0\0\0\x08\0", 10 },
+    { "binary", "MZ\x90\0\x03\0\0\0\x04\0\0\0\xFF\xFF", 16 },
+    { "empty", "", 0 },
+};
+
+#define NUM_SAMPLES (sizeof(corpus) / sizeof(corpus[0]))
+
+static double
+now()
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+/* The launcher's old lookup. */
+static const wchar_t *
+linear_pyc_version(unsigned short magic)
+{
+    size_t i;
+
+    for (i = 0; i < NUM_MAGIC_VALUES; i++) {
+        if ((magic >= pyc_magic_values[i].min) &&
+            (magic <= pyc_magic_values[i].max))
+            return pyc_magic_values[i].version;
+    }
+    return NULL;
+}
+
+int
+main(int argc, char ** argv)
+{
+    static const char * kinds[] = { "none", "text", "pyc", "zipapp" };
+    long repeats = (argc > 1) ? atol(argv[1]) : 20000;
+    unsigned char * files[NUM_SAMPLES];
+    size_t sizes[NUM_SAMPLES];
+    SCRIPT_HEADER header;
+    size_t i, n, size, wanted, looked_at = 0, found = 0;
+    double t, total = 0;
+    int reads = 0;
+    long r;
+
+    printf("%-20s %-7s %6s %6s %10s\n", "sample", "kind", "reads", "bytes",
+           "ns each");
+    for (i = 0; i < NUM_SAMPLES; i++) {
+        n = corpus[i].length ? corpus[i].length : strlen(corpus[i].header);
+        /* the rest of the file: more code, or more of the archive */
+        sizes[i] = (n == 0) ? 0 : FILE_SIZE;
+        files[i] = malloc(FILE_SIZE);
+        memset(files[i], 'x', FILE_SIZE);
+        memcpy(files[i], corpus[i].header, n);
+        t = now();
+        for (r = 0; r < repeats; r++) {
+            size = (sizes[i] < HEADER_READ_SIZE) ? sizes[i] : HEADER_READ_SIZE;
+            reads = 1;
+            while ((wanted = header_classify(files[i], size,
+                                             size == sizes[i],
+                                             &header)) != 0) {
+                size = (wanted < sizes[i]) ? wanted : sizes[i];
+                ++reads;
+            }
+            looked_at = size;
+        }
+        t = now() - t;
+        total += t;
+        printf("%-20s %-7s %6d %6lu %10.1f\n", corpus[i].name,
+               kinds[header.kind], reads, (unsigned long) looked_at,
+               t * 1e9 / repeats);
+    }
+    printf("%lu samples: %.2f million classifications a second\n",
+           (unsigned long) NUM_SAMPLES, NUM_SAMPLES * repeats / total / 1e6);
+
+    /* Every magic number, over and over. */
+    t = now();
+    for (r = 0; r < repeats / 100; r++) {
+        for (i = 0; i <= 0xFFFF; i++)
+            found += linear_pyc_version((unsigned short) i) != NULL;
+    }
+    t = now() - t;
+    printf("magic lookups: linear %6.1f ns, ", t * 1e9 / (repeats / 100) /
+           65536);
+    t = now();
+    for (r = 0; r < repeats / 100; r++) {
+        for (i = 0; i <= 0xFFFF; i++)
+            found += header_pyc_version((unsigned short) i) != NULL;
+    }
+    t = now() - t;
+    printf("binary %6.1f ns (%lu ranges, %lu found)\n",
+           t * 1e9 / (repeats / 100) / 65536,
+           (unsigned long) NUM_MAGIC_VALUES, (unsigned long) found);
+    for (i = 0; i < NUM_SAMPLES; i++)
+        free(files[i]);
+    return 0;
+}
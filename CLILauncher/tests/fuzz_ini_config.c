@@ -0,0 +1,31 @@
+/*
+ * libFuzzer target for the py.ini parser: "make fuzz" builds it with clang.
+ * The input is taken as wide characters, and parsed twice into the same
+ * configuration so that overriding is exercised too.
+ */
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "ini_config.h"
+
+int
+LLVMFuzzerTestOneInput(const uint8_t * data, size_t size)
+{
+    size_t n = size / sizeof(wchar_t);
+    wchar_t * text = malloc((n + 1) * sizeof(wchar_t));
+    CONFIG config;
+
+    if (text == NULL)
+        return 0;
+    memcpy(text, data, n * sizeof(wchar_t));
+    memset(&config, 0, sizeof(config));
+    config_parse(&config, text, n, L"first");
+    config_parse(&config, text, n / 2, L"second");
+    config_find(&config, L"defaults", L"python");
+    config_find(&config, L"commands", L"x");
+    config_free(&config);
+    free(text);
+    return 0;
+}
@@ -0,0 +1,60 @@
+/*
+ * libFuzzer target for the script header and shebang line decoders: "make
+ * fuzz" builds it with clang. The input is a script; it is classified as
+ * the launcher reads it - a first read, then more when asked - and its
+ * first line decoded, parsed and made into a child command line.
+ */
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "script_header.h"
+#include "shebang.h"
+
+static wchar_t perl[] = L"perl.exe";
+
+static wchar_t *
+find_command(void * context, const wchar_t * name)
+{
+    (void) context;
+    return wcscmp(name, L"perl") ? NULL : perl;
+}
+
+static SHEBANG_BACKEND backend = { NULL, find_command, TRUE };
+
+int
+LLVMFuzzerTestOneInput(const uint8_t * data, size_t size)
+{
+    SCRIPT_HEADER header;
+    size_t have = (size < HEADER_READ_SIZE) ? size : HEADER_READ_SIZE;
+    size_t wanted;
+    wchar_t * line;
+    wchar_t * command;
+    wchar_t * suffix;
+    wchar_t * child;
+    BOOL search;
+    int nchars;
+
+    while ((wanted = header_classify(data, have, have == size,
+                                     &header)) != 0) {
+        if (wanted <= have)
+            abort();    /* it must always ask for more */
+        have = (wanted < size) ? wanted : size;
+    }
+    line = malloc((header.line_length + 1) * sizeof(wchar_t));
+    if (line == NULL)
+        return 0;
+    nchars = header_decode_line(data, &header, line);
+    if (nchars >= 0) {
+        if ((size_t) nchars > header.line_length)
+            abort();
+        shebang_parse(&backend, line, nchars, &command, &suffix, &search);
+        if (command != NULL) {
+            child = shebang_child_command(command, suffix, L"x.py");
+            free(child);
+        }
+    }
+    free(line);
+    return 0;
+}
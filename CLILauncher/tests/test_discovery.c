@@ -0,0 +1,490 @@
+/*
+ * Tests for registry discovery, using a fake registry and file system whose
+ * calls can be made to take a while - as they do when Pythons are installed
+ * on network drives - to show that the work is spread across the workers.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "discovery.h"
+#include "testing.h"
+
+#define MAX_ENTRIES 64
+#define MAX_FILES   64
+
+typedef struct {
+    int view;
+    const wchar_t * company;
+    const wchar_t * tag;
+    const wchar_t * install_path;   /* NULL for no InstallPath */
+    const wchar_t * executable_path;
+    const wchar_t * sys_version;
+} FAKE_ENTRY;
+
+/* bits is 32 or 64, 0 for a directory, or 16 for a DOS program. */
+typedef struct {
+    const wchar_t * path;
+    int bits;
+} FAKE_FILE;
+
+typedef struct {
+    FAKE_ENTRY entries[MAX_ENTRIES];
+    int num_entries;
+    FAKE_FILE files[MAX_FILES];
+    int num_files;
+    long latency_us;                /* how long each probe takes */
+    int probes;
+    int open_keys;                  /* keys not yet closed */
+} FAKE;
+
+typedef struct {
+    const wchar_t * names[MAX_ENTRIES];
+    int count;
+} FAKE_KEY;
+
+static FAKE fake;
+
+static void
+sleep_us(long us)
+{
+    struct timespec ts;
+
+    ts.tv_sec = us / 1000000;
+    ts.tv_nsec = (us % 1000000) * 1000;
+    nanosleep(&ts, NULL);
+}
+
+static void
+add_entry(int view, const wchar_t * company, const wchar_t * tag,
+          const wchar_t * install_path, const wchar_t * executable_path,
+          const wchar_t * sys_version)
+{
+    FAKE_ENTRY * e = &fake.entries[fake.num_entries++];
+
+    e->view = view;
+    e->company = company;
+    e->tag = tag;
+    e->install_path = install_path;
+    e->executable_path = executable_path;
+    e->sys_version = sys_version;
+}
+
+static void
+add_file(const wchar_t * path, int bits)
+{
+    fake.files[fake.num_files].path = path;
+    fake.files[fake.num_files++].bits = bits;
+}
+
+static void *
+fake_open_key(void * context, int view, const wchar_t * company)
+{
+    FAKE * f = context;
+    FAKE_KEY * key = calloc(1, sizeof(FAKE_KEY));
+    const wchar_t * name;
+    int i, j;
+
+    for (i = 0; i < f->num_entries; i++) {
+        if (f->entries[i].view != view)
+            continue;
+        if (company == NULL)
+            name = f->entries[i].company;
+        else if (!wcscmp(f->entries[i].company, company))
+            name = f->entries[i].tag;
+        else
+            continue;
+        for (j = 0; j < key->count; j++) {
+            if (!wcscmp(key->names[j], name))
+                break;
+        }
+        if (j == key->count)
+            key->names[key->count++] = name;
+    }
+    if (key->count == 0) {
+        free(key);
+        return NULL;
+    }
+    __sync_fetch_and_add(&f->open_keys, 1);
+    return key;
+}
+
+static BOOL
+fake_enum_key(void * context, void * key, unsigned long index,
+              wchar_t * name, size_t size)
+{
+    FAKE_KEY * k = key;
+
+    (void) context;
+    if ((index >= (unsigned long) k->count) ||
+        (wcslen(k->names[index]) >= size))
+        return FALSE;
+    wcscpy(name, k->names[index]);
+    return TRUE;
+}
+
+static void
+fake_close_key(void * context, void * key)
+{
+    __sync_fetch_and_sub(&((FAKE *) context)->open_keys, 1);
+    free(key);
+}
+
+static BOOL
+fake_read_install(void * context, int view, const wchar_t * company,
+                  const wchar_t * tag, DISCOVERY_INSTALL * install)
+{
+    FAKE * f = context;
+    FAKE_ENTRY * e;
+    int i;
+
+    for (i = 0; i < f->num_entries; i++) {
+        e = &f->entries[i];
+        if ((e->view == view) && !wcscmp(e->company, company) &&
+            !wcscmp(e->tag, tag) && (e->install_path != NULL)) {
+            wcscpy(install->install_path, e->install_path);
+            if (e->executable_path != NULL) {
+                wcscpy(install->executable_path, e->executable_path);
+                swprintf(install->windowed_path, MAX_PATH, L"%lsw",
+                         e->executable_path);
+            }
+            if (e->sys_version != NULL)
+                wcscpy(install->sys_version, e->sys_version);
+            return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+static int
+fake_probe(void * context, const wchar_t * path, int * bits)
+{
+    FAKE * f = context;
+    int i;
+
+    __sync_fetch_and_add(&f->probes, 1);
+    if (f->latency_us)
+        sleep_us(f->latency_us);
+    for (i = 0; i < f->num_files; i++) {
+        if (!wcscasecmp(f->files[i].path, path)) {
+            if (f->files[i].bits == 0)
+                return PROBE_DIRECTORY;
+            if (f->files[i].bits == 16)
+                return PROBE_INVALID_TYPE;
+            *bits = f->files[i].bits;
+            return PROBE_FOUND;
+        }
+    }
+    return PROBE_MISSING;
+}
+
+static long long
+fake_now(void * context)
+{
+    struct timespec ts;
+
+    (void) context;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000LL + ts.tv_nsec / 1000;
+}
+
+static DISCOVERY_BACKEND backend = {
+    &fake, fake_open_key, fake_enum_key, fake_close_key, fake_read_install,
+    fake_probe, fake_now
+};
+
+static int views[] = { 2, 3, 0, 1 };
+
+#define NUM_VIEWS   (sizeof(views) / sizeof(views[0]))
+
+typedef struct {
+    const wchar_t * executable;
+    int outcome;
+    int view;
+} MERGED;
+
+/* Run discovery to the end, recording what was merged. */
+static int
+discover(int workers, BOOL windowed, MERGED * merged, int max_merged)
+{
+    DISCOVERY d;
+    DISCOVERY_CANDIDATE * c;
+    static wchar_t executables[MAX_ENTRIES * 4][MAX_PATH];
+    int n = 0;
+
+    discovery_start(&d, &backend, windowed, views, NUM_VIEWS, workers);
+    while ((c = discovery_next(&d)) != NULL) {
+        if (n < max_merged) {
+            wcscpy(executables[n], c->python.executable);
+            merged[n].executable = executables[n];
+            merged[n].outcome = c->outcome;
+            merged[n].view = c->python.view;
+        }
+        ++n;
+    }
+    CHECK(!d.failed);
+    discovery_free(&d);
+    CHECK(fake.open_keys == 0);
+    return n;
+}
+
+static void
+setup()
+{
+    memset(&fake, 0, sizeof(fake));
+    add_entry(0, L"PythonCore", L"3.12", L"C:\\Python312\\", NULL, NULL);
+    add_entry(1, L"PythonCore", L"3.11", L"C:\\Python311", NULL, NULL);
+    add_entry(1, L"PythonCore", L"3.13t", L"C:\\Python313", NULL, NULL);
+    add_entry(2, L"PythonCore", L"3.12-32", L"C:\\Python312-32", NULL, NULL);
+    add_file(L"C:\\Python312\\python.exe", 64);
+    add_file(L"C:\\Python312\\pythonw.exe", 64);
+    add_file(L"C:\\Python311\\python.exe", 64);
+    add_file(L"C:\\Python311\\PCBuild\\amd64\\python.exe", 64);
+    add_file(L"C:\\Python313\\python3.13t.exe", 64);
+    add_file(L"C:\\Python312-32\\python.exe", 32);
+}
+
+static void
+test_order()
+{
+    MERGED merged[64];
+    int n, i, found = 0;
+
+    setup();
+    n = discover(0, FALSE, merged, 64);
+    /* Each PythonCore tag has four candidates. */
+    CHECK(n == 16);
+    for (i = 0; i < n; i++) {
+        if (merged[i].outcome == PROBE_FOUND)
+            ++found;
+    }
+    CHECK(found == 5);
+    /* Views in priority order, then tags, then build folders. */
+    CHECK(merged[0].view == 2);
+    CHECK(!wcscmp(merged[0].executable, L"C:\\Python312-32\\python.exe"));
+    CHECK(merged[1].outcome == PROBE_MISSING);
+    CHECK(!wcscmp(merged[1].executable,
+                  L"C:\\Python312-32\\PCBuild\\win32\\python.exe"));
+    CHECK(!wcscmp(merged[4].executable, L"C:\\Python312\\python.exe"));
+    CHECK(merged[8].outcome == PROBE_FOUND);
+    CHECK(!wcscmp(merged[8].executable, L"C:\\Python311\\python.exe"));
+    CHECK(merged[10].outcome == PROBE_FOUND);
+    CHECK(!wcscmp(merged[12].executable, L"C:\\Python313\\python3.13t.exe"));
+    CHECK(fake.probes == 16);
+}
+
+static void
+test_windowed()
+{
+    MERGED merged[64];
+    int n;
+
+    setup();
+    n = discover(2, TRUE, merged, 64);
+    CHECK(n == 16);
+    CHECK(merged[4].outcome == PROBE_FOUND);
+    CHECK(!wcscmp(merged[4].executable, L"C:\\Python312\\pythonw.exe"));
+    CHECK(merged[0].outcome == PROBE_MISSING);
+    CHECK(!wcscmp(merged[12].executable, L"C:\\Python313\\pythonw3.13t.exe"));
+}
+
+static void
+test_same_with_workers()
+{
+    MERGED serial[64], parallel[64];
+    int n, i, workers;
+
+    setup();
+    /* A mix of companies, with probes taking long enough to overlap. */
+    add_entry(0, L"ContinuumAnalytics", L"Anaconda39-64", L"C:\\Anaconda3",
+              NULL, L"3.9");
+    add_entry(3, L"PythonCore", L"3.10", L"C:\\Python310", NULL, NULL);
+    add_file(L"C:\\Anaconda3\\python.exe", 64);
+    add_file(L"C:\\Python310\\python.exe", 64);
+    fake.latency_us = 200;
+    n = discover(0, FALSE, serial, 64);
+    for (workers = 1; workers <= DISCOVERY_MAX_WORKERS + 1; workers *= 3) {
+        fake.probes = 0;
+        CHECK(discover(workers, FALSE, parallel, 64) == n);
+        CHECK(fake.probes == n);
+        for (i = 0; i < n; i++) {
+            CHECK(!wcscmp(serial[i].executable, parallel[i].executable));
+            CHECK(serial[i].outcome == parallel[i].outcome);
+        }
+    }
+}
+
+static void
+test_companies()
+{
+    MERGED merged[64];
+    int n;
+
+    memset(&fake, 0, sizeof(fake));
+    /* Enumerated before PythonCore, but merged after it. */
+    add_entry(0, L"Anaconda", L"Anaconda39-64", L"C:\\Anaconda3", NULL,
+              L"3.9");
+    add_entry(0, L"PythonCore", L"3.12", L"C:\\Python312", NULL, NULL);
+    /* ExecutablePath is used when given. */
+    add_entry(0, L"Zeta", L"3.11", L"C:\\Zeta", L"D:\\zeta\\bin\\zpy.exe",
+              NULL);
+    /* With no SysVersion, an unparseable tag is left out. */
+    add_entry(0, L"Spam", L"Eggs", L"C:\\Spam", NULL, NULL);
+    /* No InstallPath, so nothing to look for. */
+    add_entry(0, L"Spam", L"3.8", NULL, NULL, NULL);
+    add_file(L"C:\\Anaconda3\\python.exe", 64);
+    add_file(L"C:\\Python312\\python.exe", 64);
+    add_file(L"D:\\zeta\\bin\\zpy.exe", 32);
+    n = discover(0, FALSE, merged, 64);
+    CHECK(n == 6);
+    CHECK(!wcscmp(merged[0].executable, L"C:\\Python312\\python.exe"));
+    CHECK(!wcscmp(merged[4].executable, L"C:\\Anaconda3\\python.exe"));
+    CHECK(merged[4].outcome == PROBE_FOUND);
+    CHECK(!wcscmp(merged[5].executable, L"D:\\zeta\\bin\\zpy.exe"));
+    CHECK(merged[5].outcome == PROBE_FOUND);
+    n = discover(0, TRUE, merged, 64);
+    CHECK(!wcscmp(merged[5].executable, L"D:\\zeta\\bin\\zpy.exew"));
+}
+
+static void
+test_versions()
+{
+    DISCOVERY d;
+    DISCOVERY_CANDIDATE * c;
+
+    memset(&fake, 0, sizeof(fake));
+    add_entry(0, L"Anaconda", L"Anaconda39-64", L"C:\\Anaconda3", NULL,
+              L"3.9");
+    add_entry(0, L"Other", L"3.12-arm64", L"C:\\Other", NULL, NULL);
+    add_file(L"C:\\Anaconda3\\python.exe", 32);
+    add_file(L"C:\\Other\\python.exe", 64);
+    discovery_start(&d, &backend, FALSE, views, NUM_VIEWS, 0);
+    c = discovery_next(&d);
+    CHECK((c != NULL) && !wcscmp(c->python.company, L"Anaconda"));
+    CHECK((c != NULL) && !wcscmp(c->python.version, L"Anaconda39-64"));
+    CHECK((c != NULL) && (c->python.parsed.major == 3) &&
+          (c->python.parsed.minor == 9) && (c->python.bits == 32) &&
+          (c->python.parsed.arch == ARCH_32));
+    c = discovery_next(&d);
+    CHECK((c != NULL) && (c->python.parsed.arch == ARCH_ARM64) &&
+          (c->python.bits == 64));
+    CHECK((c != NULL) && (c->start <= c->end));
+    CHECK(discovery_next(&d) == NULL);
+    CHECK(d.merged_views == NUM_VIEWS);
+    CHECK(d.views[2].opened && (d.views[2].keys == 2) &&
+          (d.views[2].found == 2));
+    CHECK(!d.views[0].opened);
+    discovery_free(&d);
+}
+
+static void
+test_duplicates()
+{
+    MERGED merged[64];
+    int n;
+
+    memset(&fake, 0, sizeof(fake));
+    add_entry(2, L"PythonCore", L"3.9", L"C:\\Program Files\\Python39", NULL,
+              NULL);
+    add_entry(0, L"PythonCore", L"3.9", L"c:\\program files\\python39", NULL,
+              NULL);
+    add_entry(0, L"Other", L"3.9", L"C:\\Program Files\\Python39", NULL,
+              NULL);
+    add_file(L"C:\\Program Files\\Python39\\python.exe", 64);
+    n = discover(3, FALSE, merged, 64);
+    CHECK(n == 9);
+    CHECK(merged[0].outcome == PROBE_FOUND);
+    CHECK(merged[0].view == 2);
+    /* Found again - ignoring case - in a later view, and another company. */
+    CHECK(merged[4].outcome == PROBE_DUPLICATE);
+    CHECK(merged[8].outcome == PROBE_DUPLICATE);
+}
+
+static void
+test_quirks()
+{
+    MERGED merged[64];
+    int n;
+
+    memset(&fake, 0, sizeof(fake));
+    add_entry(0, L"PythonCore", L"3.10", L"C:\\Py310", NULL, NULL);
+    /* An overlong key name ends the enumeration. */
+    add_entry(0, L"PythonCore", L"xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx",
+              L"C:\\PyX", NULL, NULL);
+    add_entry(0, L"PythonCore", L"3.9", L"C:\\Py39", NULL, NULL);
+    add_file(L"C:\\Py310\\python.exe", 16);
+    add_file(L"C:\\Py310\\PCBuild\\python.exe", 0);
+    n = discover(0, FALSE, merged, 64);
+    CHECK(n == 4);
+    CHECK(merged[0].outcome == PROBE_INVALID_TYPE);
+    CHECK(merged[3].outcome == PROBE_DIRECTORY);
+}
+
+static void
+test_stop_early()
+{
+    DISCOVERY d;
+    DISCOVERY_CANDIDATE * c;
+
+    setup();
+    fake.latency_us = 1000;
+    discovery_start(&d, &backend, FALSE, views, NUM_VIEWS, 4);
+    CHECK(d.num_workers == 4);
+    c = discovery_next(&d);
+    CHECK((c != NULL) && (c->outcome == PROBE_FOUND));
+    /* The workers are told to stop, and waited for. */
+    discovery_free(&d);
+    CHECK(fake.probes < 16);
+    CHECK(fake.open_keys == 0);
+}
+
+static double
+time_discovery(int workers)
+{
+    MERGED merged[MAX_ENTRIES * 4];
+    long long t = fake_now(NULL);
+
+    discover(workers, FALSE, merged, MAX_ENTRIES * 4);
+    return (double) (fake_now(NULL) - t);
+}
+
+static void
+test_speedup()
+{
+    static wchar_t paths[16][MAX_PATH];
+    static wchar_t tags[16][8];
+    double serial, parallel;
+    int i;
+
+    memset(&fake, 0, sizeof(fake));
+    for (i = 0; i < 16; i++) {
+        swprintf(tags[i], 8, L"3.%d", i);
+        swprintf(paths[i], MAX_PATH, L"\\\\server\\share\\Python3%d", i);
+        add_entry(views[i % NUM_VIEWS], L"PythonCore", tags[i], paths[i],
+                  NULL, NULL);
+    }
+    /* 64 probes, each taking a millisecond: most of the time taken. */
+    fake.latency_us = 1000;
+    serial = time_discovery(0);
+    parallel = time_discovery(4);
+    printf("64 probes of 1ms: %.1fms with no workers, %.1fms with 4\n",
+           serial / 1000, parallel / 1000);
+    CHECK(serial >= 64000);
+    CHECK(parallel < serial / 2);
+}
+
+int
+main()
+{
+    RUN(test_order);
+    RUN(test_windowed);
+    RUN(test_same_with_workers);
+    RUN(test_companies);
+    RUN(test_versions);
+    RUN(test_duplicates);
+    RUN(test_quirks);
+    RUN(test_stop_early);
+    RUN(test_speedup);
+    return TEST_RESULT();
+}
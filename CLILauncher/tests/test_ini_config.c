@@ -0,0 +1,172 @@
+/*
+ * Tests for the py.ini parser.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "ini_config.h"
+#include "testing.h"
+
+static const wchar_t GLOBAL[] = L"C:\\Windows\\py.ini";
+static const wchar_t LOCAL[] = L"C:\\Users\\me\\AppData\\Local\\py.ini";
+
+static BOOL
+parse(CONFIG * config, const wchar_t * text, const wchar_t * source)
+{
+    return config_parse(config, text, wcslen(text), source);
+}
+
+static BOOL
+has(const CONFIG * config, const wchar_t * section, const wchar_t * key,
+    const wchar_t * value)
+{
+    const CONFIG_ENTRY * entry = config_find(config, section, key);
+
+    if (value == NULL)
+        return entry == NULL;
+    return (entry != NULL) && (wcscmp(entry->value, value) == 0);
+}
+
+static void
+test_empty()
+{
+    CONFIG config;
+
+    memset(&config, 0, sizeof(config));
+    CHECK(has(&config, L"defaults", L"python", NULL));
+    CHECK(parse(&config, L"", GLOBAL));
+    CHECK(has(&config, L"defaults", L"python", NULL));
+    config_free(&config);
+}
+
+static void
+test_syntax()
+{
+    CONFIG config;
+
+    memset(&config, 0, sizeof(config));
+    CHECK(parse(&config, L"python=ignored, outside any section\r\n"
+                         L"[Defaults]\r\n"
+                         L"  python = \"3.6\"  \r\n"
+                         L"; python2=comment\r\n"
+                         L"python3='3.5-32'\r\n"
+                         L"python4=\"unbalanced'\n"
+                         L"no equals sign\n"
+                         L" = no key\n"
+                         L"empty=\n"
+                         L"quoted=\"\"\n"
+                         L"  [ commands ]  \n"
+                         L"x=y=z\n"
+                         L"[unterminated\n"
+                         L"a=b", GLOBAL));
+    CHECK(has(&config, L"defaults", L"python", L"3.6"));
+    CHECK(has(&config, L"DEFAULTS", L"PYTHON", L"3.6"));
+    CHECK(has(&config, L"defaults", L"python2", NULL));
+    CHECK(has(&config, L"defaults", L"python3", L"3.5-32"));
+    CHECK(has(&config, L"defaults", L"python4", L"\"unbalanced'"));
+    CHECK(has(&config, L"defaults", L"empty", NULL));
+    CHECK(has(&config, L"defaults", L"quoted", NULL));
+    CHECK(has(&config, L"defaults", L"x", NULL));
+    CHECK(has(&config, L"commands", L"x", L"y=z"));
+    CHECK(has(&config, L"unterminated", L"a", L"b"));
+    CHECK(config_find(&config, L"commands", L"x")->source == GLOBAL);
+    config_free(&config);
+}
+
+static void
+test_first_wins_in_a_file()
+{
+    CONFIG config;
+
+    memset(&config, 0, sizeof(config));
+    CHECK(parse(&config, L"[defaults]\npython=3\nPython=2\n"
+                         L"[commands]\nperl=perl\n"
+                         L"[DEFAULTS]\npython3=3.6\n", GLOBAL));
+    CHECK(has(&config, L"defaults", L"python", L"3"));
+    CHECK(has(&config, L"defaults", L"python3", NULL));
+    CHECK(has(&config, L"commands", L"perl", L"perl"));
+    config_free(&config);
+}
+
+static void
+test_later_files_override()
+{
+    CONFIG config;
+
+    memset(&config, 0, sizeof(config));
+    CHECK(parse(&config, L"[defaults]\npython=2\npython3=3.5\n"
+                         L"[commands]\nperl=global-perl\nruby=ruby\n",
+                GLOBAL));
+    CHECK(parse(&config, L"[defaults]\npython3=3.6-32\npython=\n"
+                         L"[Commands]\nPERL=my-perl\nperl=ignored\n"
+                         L"[commands]\nruby=ignored\n", LOCAL));
+    CHECK(has(&config, L"defaults", L"python", L"2"));
+    CHECK(config_find(&config, L"defaults", L"python")->source == GLOBAL);
+    CHECK(has(&config, L"defaults", L"python3", L"3.6-32"));
+    CHECK(config_find(&config, L"defaults", L"python3")->source == LOCAL);
+    CHECK(has(&config, L"commands", L"perl", L"my-perl"));
+    CHECK(!wcscmp(config_find(&config, L"commands", L"perl")->key, L"PERL"));
+    CHECK(has(&config, L"commands", L"ruby", L"ruby"));
+    config_free(&config);
+}
+
+static void
+test_no_limits()
+{
+    CONFIG config;
+    size_t n = 5000, i, len;
+    size_t size = n * 64 + 4 * 4096;
+    wchar_t * text = malloc(size * sizeof(wchar_t));
+    wchar_t * p = text;
+    wchar_t key[32];
+    wchar_t value[32];
+    BOOL ok = TRUE;
+
+    memset(&config, 0, sizeof(config));
+    p += swprintf(p, size, L"[commands]\n");
+    for (i = 0; i < n; i++)
+        p += swprintf(p, size - (p - text), L"cmd%lu=command %lu\n",
+                      (unsigned long) i, (unsigned long) i);
+    p += swprintf(p, size - (p - text), L"long=");
+    for (len = 0; len < 4096; len++)
+        *p++ = L'a' + len % 26;
+    *p++ = L'\n';
+    CHECK(config_parse(&config, text, p - text, GLOBAL));
+    for (i = 0; i < n; i++) {
+        swprintf(key, 32, L"CMD%lu", (unsigned long) i);
+        swprintf(value, 32, L"command %lu", (unsigned long) i);
+        ok = ok && has(&config, L"commands", key, value);
+    }
+    CHECK(ok);
+    CHECK(wcslen(config_find(&config, L"commands", L"long")->value) == 4096);
+    config_free(&config);
+    free(text);
+}
+
+static void
+test_embedded_nuls()
+{
+    static const wchar_t text[] = L"[commands]\nx=a\0b\ny\0z=c\n";
+    CONFIG config;
+
+    memset(&config, 0, sizeof(config));
+    CHECK(config_parse(&config, text, sizeof(text) / sizeof(wchar_t) - 1,
+                       GLOBAL));
+    CHECK(has(&config, L"commands", L"x", L"a"));
+    CHECK(has(&config, L"commands", L"y", NULL));
+    config_free(&config);
+}
+
+int
+main()
+{
+    RUN(test_empty);
+    RUN(test_syntax);
+    RUN(test_first_wins_in_a_file);
+    RUN(test_later_files_override);
+    RUN(test_no_limits);
+    RUN(test_embedded_nuls);
+    return TEST_RESULT();
+}
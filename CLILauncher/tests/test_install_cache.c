@@ -0,0 +1,507 @@
+/*
+ * Tests for the installed-Python cache, using a fake registry and file
+ * system.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <wchar.h>
+
+#include "install_cache.h"
+#include "testing.h"
+
+#define NUM_VIEWS   2
+#define NUM_FILES   3
+
+typedef struct {
+    CACHE_STAMP views[NUM_VIEWS];
+    BOOL view_present[NUM_VIEWS];
+    const wchar_t * paths[NUM_FILES];
+    CACHE_STAMP files[NUM_FILES];
+    int view_calls;
+    int file_calls;
+} FAKE;
+
+static BOOL
+fake_view_stamp(void * context, int view, CACHE_STAMP * stamp)
+{
+    FAKE * fake = context;
+
+    ++fake->view_calls;
+    if (!fake->view_present[view])
+        return FALSE;
+    *stamp = fake->views[view];
+    return TRUE;
+}
+
+static BOOL
+fake_file_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    FAKE * fake = context;
+    int i;
+
+    ++fake->file_calls;
+    for (i = 0; i < NUM_FILES; i++) {
+        if (fake->paths[i] && !wcscmp(fake->paths[i], path)) {
+            *stamp = fake->files[i];
+            return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+static FAKE fake;
+static CACHE_BACKEND backend = { &fake, fake_view_stamp, fake_file_stamp };
+static INSTALLED_PYTHON pythons[2] = {
+    { .version = L"3.6", .bits = 64,
+      .executable = L"\"C:\\Program Files\\Python36\\python.exe\"",
+      .parsed = { 3, 6, FALSE, ARCH_64 }, .view = 0, .probe_us = 0,
+      .order = 0, .company = L"PythonCore" },
+    { .version = L"2.7", .bits = 32,
+      .executable = L"C:\\Python27\\python.exe",
+      .parsed = { 2, 7, FALSE, ARCH_32 }, .view = 1, .probe_us = 0,
+      .order = 1, .company = L"PythonCore" },
+};
+
+static void
+setup()
+{
+    memset(&fake, 0, sizeof(fake));
+    /* view 0 present, view 1 absent */
+    fake.view_present[0] = TRUE;
+    fake.views[0].time = 131000000000000000ULL;
+    fake.views[0].size = 2;
+    fake.paths[0] = L"C:\\Program Files\\Python36\\python.exe";
+    fake.files[0].time = 131000000000000001ULL;
+    fake.files[0].size = 98328;
+    fake.paths[1] = L"C:\\Python27\\python.exe";
+    fake.files[1].time = 129000000000000000ULL;
+    fake.files[1].size = 26624;
+}
+
+/* View ids are indexes into the fake's tables. */
+static int fake_views[NUM_VIEWS] = { 0, 1 };
+
+static size_t
+build(void ** data)
+{
+    CACHE_STAMP stamps[NUM_VIEWS];
+
+    cache_stamp_views(&backend, fake_views, NUM_VIEWS, stamps);
+    return cache_build(&backend, fake_views, stamps, NUM_VIEWS, pythons, 2,
+                       data);
+}
+
+static void
+test_round_trip()
+{
+    void * data;
+    size_t size;
+    INSTALLED_PYTHON ip;
+
+    setup();
+    size = build(&data);
+    CHECK(size == cache_size(2));
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == 2);
+    cache_get(data, 0, &ip);
+    CHECK(!wcscmp(ip.version, L"3.6"));
+    CHECK(ip.bits == 64);
+    CHECK(!wcscmp(ip.executable, pythons[0].executable));
+    CHECK(!wcscmp(ip.company, L"PythonCore"));
+    cache_get(data, 1, &ip);
+    CHECK(!wcscmp(ip.version, L"2.7"));
+    CHECK(ip.bits == 32);
+    free(data);
+}
+
+static void
+test_get_terminates_strings()
+{
+    void * data;
+    CACHE_STAMP stamps[NUM_VIEWS];
+    INSTALLED_PYTHON unterminated = pythons[0];
+    INSTALLED_PYTHON ip;
+
+    setup();
+    wmemset(unterminated.version, L'9', MAX_VERSION_SIZE);
+    wmemset(unterminated.company, L'C', MAX_COMPANY_SIZE);
+    cache_stamp_views(&backend, fake_views, NUM_VIEWS, stamps);
+    cache_build(&backend, fake_views, stamps, NUM_VIEWS, &unterminated, 1,
+                &data);
+    cache_get(data, 0, &ip);
+    CHECK(wcslen(ip.version) == MAX_VERSION_SIZE - 1);
+    CHECK(wcslen(ip.company) == MAX_COMPANY_SIZE - 1);
+    CHECK(!wcscmp(ip.executable, pythons[0].executable));
+    free(data);
+}
+
+static void
+test_empty_table()
+{
+    void * data;
+    CACHE_STAMP stamps[NUM_VIEWS];
+    size_t size;
+
+    setup();
+    cache_stamp_views(&backend, fake_views, NUM_VIEWS, stamps);
+    size = cache_build(&backend, fake_views, stamps, NUM_VIEWS, NULL, 0,
+                       &data);
+    CHECK(size == cache_size(0));
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == 0);
+    free(data);
+}
+
+static void
+test_quoted_executable_is_unquoted_for_backend()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.paths[0] = L"\"C:\\Program Files\\Python36\\python.exe\"";
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    free(data);
+}
+
+static void
+test_registry_change_invalidates()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.views[0].time += 1;
+    fake.file_calls = 0;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    /* registry is checked before any files are touched */
+    CHECK(fake.file_calls == 0);
+    free(data);
+}
+
+static void
+test_new_subkey_invalidates()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.views[0].size = 3;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    free(data);
+}
+
+static void
+test_view_appearing_invalidates()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.view_present[1] = TRUE;
+    fake.views[1].time = 1;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    free(data);
+}
+
+static void
+test_executable_change_invalidates()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.files[1].time += 10000000;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    fake.files[1].time -= 10000000;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == 2);
+    fake.files[1].size += 1;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    free(data);
+}
+
+static void
+test_executable_removed_invalidates()
+{
+    void * data;
+    size_t size;
+
+    setup();
+    size = build(&data);
+    fake.paths[1] = NULL;
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == -1);
+    free(data);
+}
+
+static void
+test_different_views_rejected()
+{
+    void * data;
+    size_t size;
+    int other_views[NUM_VIEWS] = { 1, 0 };
+
+    setup();
+    size = build(&data);
+    CHECK(cache_validate(&backend, other_views, NUM_VIEWS, data, size) == -1);
+    CHECK(cache_validate(&backend, fake_views, 1, data, size) == -1);
+    free(data);
+}
+
+static void
+test_corruption_rejected()
+{
+    unsigned char * data;
+    size_t size, i;
+
+    setup();
+    size = build((void **) &data);
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size - 1) == -1);
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, 0) == -1);
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, NULL, size) == -1);
+    /* flipping any single byte must be detected */
+    for (i = 0; i < size; i += 7) {
+        data[i] ^= 0x40;
+        CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data,
+                             size) == -1);
+        data[i] ^= 0x40;
+    }
+    CHECK(cache_validate(&backend, fake_views, NUM_VIEWS, data, size) == 2);
+    free(data);
+}
+
+/*
+ * A fake registry for cache_stamp_registry(): the keys under SOFTWARE\Python
+ * in view 0, by path ("" for SOFTWARE\Python itself), each with its
+ * last-write time. Other views have none.
+ */
+
+#define MAX_KEYS    16
+
+typedef struct {
+    const wchar_t * path;
+    unsigned long long time;
+} FAKE_REG_KEY;
+
+static FAKE_REG_KEY reg_keys[MAX_KEYS];
+static int num_reg_keys;
+static int open_reg_keys;
+
+static void
+add_reg_key(const wchar_t * path, unsigned long long time)
+{
+    reg_keys[num_reg_keys].path = path;
+    reg_keys[num_reg_keys++].time = time;
+}
+
+static FAKE_REG_KEY *
+find_reg_key(const wchar_t * path)
+{
+    int i;
+
+    for (i = 0; i < num_reg_keys; i++)
+        if (!wcscmp(reg_keys[i].path, path))
+            return &reg_keys[i];
+    return NULL;
+}
+
+/* If child is a subkey of parent, its name; else NULL. */
+static const wchar_t *
+child_name(const FAKE_REG_KEY * parent, const FAKE_REG_KEY * child)
+{
+    size_t n = wcslen(parent->path);
+    const wchar_t * name = child->path;
+
+    if (n) {
+        if (wcsncmp(child->path, parent->path, n) || child->path[n] != L'\\')
+            return NULL;
+        name += n + 1;
+    }
+    return (*name && !wcschr(name, L'\\')) ? name : NULL;
+}
+
+static void *
+fake_open_key(void * context, int view, void * parent, const wchar_t * name)
+{
+    wchar_t path[MAX_PATH];
+    FAKE_REG_KEY * key;
+
+    (void) context;
+    if (view != 0)
+        return NULL;
+    if (parent == NULL)
+        path[0] = L'\0';
+    else if (((FAKE_REG_KEY *) parent)->path[0])
+        swprintf(path, MAX_PATH, L"%ls\\%ls",
+                 ((FAKE_REG_KEY *) parent)->path, name);
+    else
+        swprintf(path, MAX_PATH, L"%ls", name);
+    key = find_reg_key(path);
+    if (key != NULL)
+        ++open_reg_keys;
+    return key;
+}
+
+static BOOL
+fake_enum_key(void * context, void * key, unsigned long index,
+              wchar_t * name, size_t size)
+{
+    const wchar_t * child;
+    int i;
+
+    (void) context;
+    for (i = 0; i < num_reg_keys; i++) {
+        child = child_name(key, &reg_keys[i]);
+        if ((child != NULL) && !index--) {
+            if (wcslen(child) >= size)
+                return FALSE;
+            wcscpy(name, child);
+            return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+static BOOL
+fake_key_stamp(void * context, void * key, CACHE_STAMP * stamp)
+{
+    int i;
+
+    (void) context;
+    stamp->time = ((FAKE_REG_KEY *) key)->time;
+    stamp->size = 0;
+    for (i = 0; i < num_reg_keys; i++)
+        if (child_name(key, &reg_keys[i]) != NULL)
+            ++stamp->size;
+    return TRUE;
+}
+
+static void
+fake_close_key(void * context, void * key)
+{
+    (void) context;
+    (void) key;
+    --open_reg_keys;
+}
+
+static CACHE_REGISTRY registry = {
+    NULL, fake_open_key, fake_enum_key, fake_key_stamp, fake_close_key
+};
+
+static void
+setup_registry()
+{
+    num_reg_keys = open_reg_keys = 0;
+    add_reg_key(L"", 100);
+    add_reg_key(L"PythonCore", 300);
+    add_reg_key(L"PythonCore\\3.12", 200);
+    add_reg_key(L"PythonCore\\3.12\\InstallPath", 200);
+    add_reg_key(L"PythonCore\\3.13", 300);
+    add_reg_key(L"PythonCore\\3.13\\InstallPath", 300);
+    add_reg_key(L"ContinuumAnalytics", 150);
+    add_reg_key(L"ContinuumAnalytics\\Anaconda39-64", 150);
+    add_reg_key(L"ContinuumAnalytics\\Anaconda39-64\\InstallPath", 150);
+}
+
+static BOOL
+stamp_changed(const CACHE_STAMP * before)
+{
+    CACHE_STAMP after;
+
+    CHECK(cache_stamp_registry(&registry, 0, &after));
+    CHECK(open_reg_keys == 0);
+    return memcmp(before, &after, sizeof(after)) != 0;
+}
+
+static void
+test_registry_stamp()
+{
+    CACHE_STAMP stamp;
+
+    setup_registry();
+    CHECK(cache_stamp_registry(&registry, 0, &stamp));
+    CHECK(open_reg_keys == 0);
+    CHECK(stamp.time == 300);
+    /* 2 companies, 3 tags and 3 InstallPaths */
+    CHECK(stamp.size == 8);
+    CHECK(!stamp_changed(&stamp));
+    /* A view without SOFTWARE\Python */
+    stamp.time = 1;
+    CHECK(!cache_stamp_registry(&registry, 1, &stamp));
+    CHECK((stamp.time == 0) && (stamp.size == 0));
+}
+
+static void
+test_registry_stamp_covers_install_path()
+{
+    CACHE_STAMP stamp;
+
+    /*
+     * Registering 3.12 again, somewhere else, rewrites only the values in
+     * its InstallPath key.
+     */
+    setup_registry();
+    cache_stamp_registry(&registry, 0, &stamp);
+    find_reg_key(L"PythonCore\\3.12\\InstallPath")->time = 400;
+    CHECK(stamp_changed(&stamp));
+    /* Likewise for another company's installation, and its tag's key. */
+    setup_registry();
+    find_reg_key(L"ContinuumAnalytics\\Anaconda39-64\\InstallPath")->time =
+        400;
+    CHECK(stamp_changed(&stamp));
+    setup_registry();
+    find_reg_key(L"PythonCore\\3.13")->time = 400;
+    CHECK(stamp_changed(&stamp));
+}
+
+static void
+test_registry_stamp_covers_new_keys()
+{
+    CACHE_STAMP stamp;
+
+    setup_registry();
+    cache_stamp_registry(&registry, 0, &stamp);
+    /* A new InstallPath, for a tag which had none, at an old time */
+    reg_keys[4].path = L"PythonCore\\3.11";
+    reg_keys[5].path = L"PythonCore\\3.11\\Help";
+    add_reg_key(L"PythonCore\\3.11\\InstallPath", 50);
+    CHECK(stamp_changed(&stamp));
+}
+
+static void
+test_too_many_views_rejected()
+{
+    void * data;
+    CACHE_STAMP stamps[CACHE_MAX_VIEWS + 1];
+    int many[CACHE_MAX_VIEWS + 1] = { 0 };
+
+    setup();
+    memset(stamps, 0, sizeof(stamps));
+    CHECK(cache_build(&backend, many, stamps, CACHE_MAX_VIEWS + 1, pythons, 2,
+                      &data) == 0);
+    CHECK(data == NULL);
+}
+
+int
+main()
+{
+    RUN(test_round_trip);
+    RUN(test_get_terminates_strings);
+    RUN(test_empty_table);
+    RUN(test_quoted_executable_is_unquoted_for_backend);
+    RUN(test_registry_change_invalidates);
+    RUN(test_new_subkey_invalidates);
+    RUN(test_view_appearing_invalidates);
+    RUN(test_executable_change_invalidates);
+    RUN(test_executable_removed_invalidates);
+    RUN(test_different_views_rejected);
+    RUN(test_corruption_rejected);
+    RUN(test_too_many_views_rejected);
+    RUN(test_registry_stamp);
+    RUN(test_registry_stamp_covers_install_path);
+    RUN(test_registry_stamp_covers_new_keys);
+    return TEST_RESULT();
+}
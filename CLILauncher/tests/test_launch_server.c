@@ -0,0 +1,98 @@
+/*
+ * Tests for the launcher's side of the launch server protocol.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "launch_server.h"
+#include "testing.h"
+
+/*
+ * A request, and what it should be encoded as - test_launchserver.py
+ * checks that launchserver.py reads and writes the same bytes.
+ */
+static wchar_t script[] = L"s.py";
+static wchar_t argument[] = L"\u00e9\U0001F600";
+static wchar_t * argv[] = { script, argument };
+static const wchar_t environment[] = L"A=1\0=C:=C:\\\0B=\0";
+
+static const unsigned char expected[] =
+    "Q\x52\0\0\0"
+    "\x03\0\0\0t0k"
+    "\x04\0\0\0" "3.12"
+    "\x10\0\0\0" "C:\\Py\\python.exe"
+    "\x04\0\0\0" "C:\\w"
+    "\x02\0\0\0"
+    "\x04\0\0\0s.py"
+    "\x06\0\0\0\xc3\xa9\xf0\x9f\x98\x80"
+    "\x02\0\0\0"
+    "\x03\0\0\0" "A=1"
+    "\x02\0\0\0" "B=";
+
+static void
+test_request()
+{
+    SERVER_REQUEST_INFO request = {
+        "t0k", L"3.12", L"C:\\Py\\python.exe", L"C:\\w", 2, argv,
+        environment
+    };
+    unsigned char buffer[200];
+    size_t size = server_encode_request(&request, NULL, 0);
+    int type;
+    size_t length;
+
+    CHECK(size == sizeof(expected) - 1);
+    /* too small a buffer isn't written past */
+    memset(buffer, 0xAA, sizeof(buffer));
+    CHECK(server_encode_request(&request, buffer, 10) == size);
+    CHECK(buffer[10] == 0xAA);
+    CHECK(server_encode_request(&request, buffer, sizeof(buffer)) == size);
+    CHECK(!memcmp(buffer, expected, size));
+    CHECK(server_parse_header(buffer, &type, &length));
+    CHECK(type == SERVER_REQUEST);
+    CHECK(length == size - SERVER_HEADER_SIZE);
+    /* no environment at all */
+    request.environment = NULL;
+    CHECK(server_encode_request(&request, NULL, 0) == size - 13);
+}
+
+static void
+test_headers()
+{
+    unsigned char header[SERVER_HEADER_SIZE];
+    int type;
+    size_t length;
+
+    server_make_header(SERVER_STDOUT, 0x123456, header);
+    CHECK(!memcmp(header, "O\x56\x34\x12\0", SERVER_HEADER_SIZE));
+    CHECK(server_parse_header(header, &type, &length));
+    CHECK((type == SERVER_STDOUT) && (length == 0x123456));
+    server_make_header(SERVER_STDIN, 0, header);
+    CHECK(server_parse_header(header, &type, &length));
+    CHECK((type == SERVER_STDIN) && (length == 0));
+    /* a length no server would send */
+    memcpy(header, "O\xff\xff\xff\xff", SERVER_HEADER_SIZE);
+    CHECK(!server_parse_header(header, &type, &length));
+}
+
+static void
+test_exit_codes()
+{
+    CHECK(server_exit_code((const unsigned char *) "\0\0\0\0") == 0);
+    CHECK(server_exit_code((const unsigned char *) "\x03\0\0\0") == 3);
+    CHECK(server_exit_code((const unsigned char *) "\xff\xff\xff\xff") == -1);
+    CHECK(server_exit_code((const unsigned char *) "\0\0\0\x80") ==
+          (-2147483647 - 1));
+    CHECK(server_exit_code((const unsigned char *) "\x09\x01\0\xc0") ==
+          (int) (0xC0000109UL - 0x100000000LL));
+}
+
+int
+main()
+{
+    RUN(test_request);
+    RUN(test_headers);
+    RUN(test_exit_codes);
+    return TEST_RESULT();
+}
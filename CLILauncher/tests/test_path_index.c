@@ -0,0 +1,423 @@
+/*
+ * Tests for the PATH index, using a fake file system.
+ */
+
+#include <stdarg.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "path_index.h"
+#include "testing.h"
+
+#define MAX_DIRS    8
+#define MAX_FILES   16
+
+typedef struct {
+    const wchar_t * path;
+    BOOL missing;
+    CACHE_STAMP stamp;
+    const wchar_t * files[MAX_FILES];
+} FAKE_DIR;
+
+typedef struct {
+    FAKE_DIR dirs[MAX_DIRS];
+    int num_dirs;
+    int list_calls;
+    int stamp_calls;
+} FAKE;
+
+static FAKE fake;
+
+static FAKE_DIR *
+fake_find(FAKE * fake, const wchar_t * path)
+{
+    int i;
+
+    for (i = 0; i < fake->num_dirs; i++) {
+        if (!fake->dirs[i].missing && !wcscmp(fake->dirs[i].path, path))
+            return &fake->dirs[i];
+    }
+    return NULL;
+}
+
+static BOOL
+fake_list_dir(void * context, const wchar_t * path, PATH_ADD add, void * arg)
+{
+    FAKE_DIR * dir = fake_find(context, path);
+    int i;
+
+    ++((FAKE *) context)->list_calls;
+    if (dir == NULL)
+        return FALSE;
+    add(arg, L".");
+    add(arg, L"..");
+    for (i = 0; (i < MAX_FILES) && dir->files[i]; i++)
+        add(arg, dir->files[i]);
+    return TRUE;
+}
+
+static BOOL
+fake_dir_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    FAKE_DIR * dir = fake_find(context, path);
+
+    ++((FAKE *) context)->stamp_calls;
+    if (dir == NULL)
+        return FALSE;
+    *stamp = dir->stamp;
+    return TRUE;
+}
+
+static PATH_BACKEND backend = { &fake, fake_list_dir, fake_dir_stamp };
+
+#define PATHEXT L".COM;.EXE;.BAT;;.CMD"
+
+static const wchar_t * dir_paths[MAX_DIRS];
+
+static void
+add_dir(const wchar_t * path, ...)
+{
+    FAKE_DIR * dir = &fake.dirs[fake.num_dirs];
+    const wchar_t * file;
+    va_list args;
+    int i = 0;
+
+    dir->path = path;
+    dir->stamp.time = 130000000000000000ULL + fake.num_dirs;
+    va_start(args, path);
+    while ((file = va_arg(args, const wchar_t *)) != NULL)
+        dir->files[i++] = file;
+    va_end(args);
+    dir_paths[fake.num_dirs++] = path;
+}
+
+static void
+setup()
+{
+    memset(&fake, 0, sizeof(fake));
+    add_dir(L"C:\\Windows\\system32", L"cmd.exe", L"where.EXE",
+            L"tool.bat", L"notes.txt", L"python.exe", NULL);
+    add_dir(L"C:\\Tools", L"Tool.COM", L"tool.exe", L"build.cmd",
+            L"deploy.bat", L"EXE", L".exe", NULL);
+    add_dir(L"C:\\Missing", NULL);
+    fake.dirs[2].missing = TRUE;
+    add_dir(L"C:\\Scripts", L"deploy.cmd", L"only.CMD", L"build.bat",
+            L"readme.md", NULL);
+    add_dir(L"C:\\Late", L"late.exe", L"build.com", NULL);
+}
+
+static BOOL
+init(PATH_INDEX * index)
+{
+    return path_index_init(index, &backend, dir_paths, fake.num_dirs,
+                           PATHEXT);
+}
+
+/*
+ * What calling SearchPathW for each extension in turn would find, probing
+ * every directory for every extension.
+ */
+static int
+naive_find(const wchar_t * name, const wchar_t ** extension)
+{
+    static const wchar_t * extensions[] = {
+        L".COM", L".EXE", L".BAT", L".CMD"
+    };
+    wchar_t candidate[MAX_PATH];
+    FAKE_DIR * dir;
+    int e, d, f;
+
+    for (e = 0; e < 4; e++) {
+        swprintf(candidate, MAX_PATH, L"%ls%ls", name, extensions[e]);
+        for (d = 0; d < fake.num_dirs; d++) {
+            dir = &fake.dirs[d];
+            if (dir->missing)
+                continue;
+            for (f = 0; (f < MAX_FILES) && dir->files[f]; f++) {
+                if (!_wcsicmp(dir->files[f], candidate)) {
+                    *extension = extensions[e];
+                    return d;
+                }
+            }
+        }
+    }
+    return -1;
+}
+
+static void
+test_same_as_probing()
+{
+    static const wchar_t * names[] = {
+        L"cmd", L"CMD", L"where", L"tool", L"Tool", L"build", L"deploy",
+        L"only", L"late", L"notes", L"readme", L"python", L"nothing", L"",
+        L"tool.", L"EXE", NULL
+    };
+    const wchar_t * extension;
+    const wchar_t * expected;
+    PATH_INDEX index;
+    int i, d;
+
+    setup();
+    CHECK(init(&index));
+    for (i = 0; names[i]; i++) {
+        extension = expected = NULL;
+        d = path_index_find(&index, names[i], &extension);
+        CHECK(d == naive_find(names[i], &expected));
+        if (d >= 0)
+            CHECK(!wcscmp(extension, expected));
+    }
+    /* an earlier extension further along the path wins */
+    CHECK(path_index_find(&index, L"build", &extension) == 4);
+    CHECK(!wcscmp(extension, L".COM"));
+    CHECK(path_index_find(&index, L"Tool", &extension) == 1);
+    CHECK(!wcscmp(extension, L".COM"));
+    CHECK(!index.failed);
+    /* each directory listed at most once, for all those lookups */
+    CHECK(fake.list_calls == fake.num_dirs - 1);    /* one is missing */
+    path_index_free(&index);
+}
+
+static void
+test_lists_lazily()
+{
+    const wchar_t * extension;
+    PATH_INDEX index;
+
+    setup();
+    CHECK(init(&index));
+    CHECK(fake.list_calls == 0);
+    /* .COM could be anywhere - but .COM is the first extension */
+    CHECK(path_index_find(&index, L"tool", &extension) == 1);
+    CHECK(fake.list_calls == 2);
+    /* A .EXE in the first directory still needs every one checked for .COM */
+    CHECK(path_index_find(&index, L"cmd", &extension) == 0);
+    CHECK(!wcscmp(extension, L".EXE"));
+    CHECK(fake.list_calls == fake.num_dirs - 1);
+    CHECK(fake.stamp_calls == fake.num_dirs);
+    CHECK(index.listings == (unsigned long) fake.num_dirs - 1);
+    path_index_free(&index);
+}
+
+static void
+test_no_dirs()
+{
+    const wchar_t * extension;
+    PATH_INDEX index;
+
+    setup();
+    CHECK(path_index_init(&index, &backend, dir_paths, 0, PATHEXT));
+    CHECK(path_index_find(&index, L"cmd", &extension) == -1);
+    path_index_free(&index);
+    CHECK(path_index_init(&index, &backend, dir_paths, fake.num_dirs, L""));
+    CHECK(path_index_find(&index, L"cmd", &extension) == -1);
+    CHECK(fake.list_calls == 0);
+    path_index_free(&index);
+}
+
+static void
+test_long_names()
+{
+    wchar_t name[MAX_PATH + 10];
+    const wchar_t * extension;
+    PATH_INDEX index;
+    int i;
+
+    setup();
+    for (i = 0; i < MAX_PATH + 9; i++)
+        name[i] = L'x';
+    name[i] = L'\0';
+    CHECK(init(&index));
+    CHECK(path_index_find(&index, name, &extension) == -1);
+    name[MAX_PATH - 5] = L'\0';
+    CHECK(path_index_find(&index, name, &extension) == -1);
+    path_index_free(&index);
+}
+
+/* Save an index which has listed everything, and load it into a new one. */
+static void
+reload(PATH_INDEX * index)
+{
+    const wchar_t * extension;
+    PATH_INDEX old;
+    void * data;
+    size_t size;
+
+    CHECK(init(&old));
+    path_index_find(&old, L"nothing", &extension);
+    CHECK(old.dirty);
+    size = path_index_save(&old, &data);
+    CHECK(size > 0);
+    path_index_free(&old);
+    CHECK(init(index));
+    CHECK(path_index_load(index, data, size));
+    fake.list_calls = fake.stamp_calls = 0;
+}
+
+static void
+test_saved_listings_reused()
+{
+    const wchar_t * extension;
+    PATH_INDEX index;
+
+    setup();
+    reload(&index);
+    CHECK(path_index_find(&index, L"build", &extension) == 4);
+    CHECK(!wcscmp(extension, L".COM"));
+    CHECK(path_index_find(&index, L"deploy", &extension) == 1);
+    CHECK(!wcscmp(extension, L".BAT"));
+    CHECK(fake.list_calls == 0);
+    CHECK(fake.stamp_calls == fake.num_dirs);
+    CHECK(index.reused == (unsigned long) fake.num_dirs - 1);
+    CHECK(!index.dirty);
+    path_index_free(&index);
+}
+
+static void
+test_changed_dir_relisted()
+{
+    const wchar_t * extension;
+    PATH_INDEX index;
+
+    setup();
+    reload(&index);
+    fake.dirs[3].files[4] = L"late.bat";
+    fake.dirs[3].stamp.time += 1;
+    CHECK(path_index_find(&index, L"late", &extension) == 4);
+    CHECK(!wcscmp(extension, L".EXE"));
+    CHECK(path_index_find(&index, L"late", &extension) == 4);
+    CHECK(fake.list_calls == 1);
+    CHECK(index.dirty);
+    path_index_free(&index);
+
+    /* a directory which has appeared since */
+    setup();
+    reload(&index);
+    fake.dirs[2].missing = FALSE;
+    fake.dirs[2].files[0] = L"cmd.com";
+    CHECK(path_index_find(&index, L"cmd", &extension) == 2);
+    CHECK(!wcscmp(extension, L".COM"));
+    CHECK(fake.list_calls == 1);
+    path_index_free(&index);
+
+    /* and one which has gone */
+    setup();
+    reload(&index);
+    fake.dirs[1].missing = TRUE;
+    CHECK(path_index_find(&index, L"tool", &extension) == 0);
+    CHECK(!wcscmp(extension, L".BAT"));
+    CHECK(fake.list_calls == 0);
+    path_index_free(&index);
+}
+
+static void
+test_path_changes()
+{
+    static const wchar_t * reordered[] = {
+        L"C:\\Late", L"C:\\New", L"C:\\Tools"
+    };
+    const wchar_t * extension;
+    PATH_INDEX index;
+    void * data;
+    size_t size;
+
+    setup();
+    reload(&index);
+    path_index_free(&index);
+    add_dir(L"C:\\New", L"tool.com", NULL);
+    CHECK(path_index_init(&index, &backend, dir_paths, fake.num_dirs,
+                          PATHEXT));
+    path_index_find(&index, L"nothing", &extension);
+    size = path_index_save(&index, &data);
+    path_index_free(&index);
+    /* listings are found by path, not position */
+    CHECK(path_index_init(&index, &backend, reordered, 3, PATHEXT));
+    CHECK(path_index_load(&index, data, size));
+    fake.list_calls = 0;
+    CHECK(path_index_find(&index, L"tool", &extension) == 1);
+    CHECK(path_index_find(&index, L"late", &extension) == 0);
+    CHECK(fake.list_calls == 0);
+    /* listings not used this time are kept */
+    size = path_index_save(&index, &data);
+    path_index_free(&index);
+    CHECK(init(&index));
+    CHECK(path_index_load(&index, data, size));
+    fake.list_calls = 0;
+    CHECK(path_index_find(&index, L"only", &extension) == 3);
+    CHECK(fake.list_calls == 0);
+    path_index_free(&index);
+}
+
+static void
+test_saved_for_other_extensions()
+{
+    const wchar_t * extension;
+    PATH_INDEX index;
+    void * data;
+    size_t size;
+
+    setup();
+    CHECK(init(&index));
+    path_index_find(&index, L"nothing", &extension);
+    size = path_index_save(&index, &data);
+    path_index_free(&index);
+    CHECK(path_index_init(&index, &backend, dir_paths, fake.num_dirs,
+                          L".EXE;.PY"));
+    CHECK(!path_index_load(&index, data, size));
+    /* differing only in case is the same, though */
+    size = path_index_save(&index, &data);
+    path_index_free(&index);
+    CHECK(path_index_init(&index, &backend, dir_paths, fake.num_dirs,
+                          L".exe;.py"));
+    CHECK(path_index_load(&index, data, size));
+    path_index_free(&index);
+}
+
+static void
+test_mangled_data_rejected()
+{
+    const wchar_t * extension;
+    unsigned char * data;
+    unsigned char * copy;
+    PATH_INDEX index;
+    size_t size, i;
+
+    setup();
+    CHECK(init(&index));
+    path_index_find(&index, L"nothing", &extension);
+    size = path_index_save(&index, (void **) &data);
+    path_index_free(&index);
+    for (i = 0; i < size; i += 5) {
+        copy = malloc(size);
+        memcpy(copy, data, size);
+        copy[i] ^= 0x20;
+        CHECK(init(&index));
+        CHECK(!path_index_load(&index, copy, size));
+        path_index_free(&index);
+    }
+    copy = malloc(size);
+    memcpy(copy, data, size);
+    CHECK(init(&index));
+    CHECK(!path_index_load(&index, copy, size - sizeof(wchar_t)));
+    CHECK(!path_index_load(&index, NULL, 0));
+    /* still usable, listing everything afresh */
+    fake.list_calls = 0;
+    CHECK(path_index_find(&index, L"tool", &extension) == 1);
+    CHECK(fake.list_calls == 2);
+    path_index_free(&index);
+    free(data);
+}
+
+int
+main()
+{
+    RUN(test_same_as_probing);
+    RUN(test_lists_lazily);
+    RUN(test_no_dirs);
+    RUN(test_long_names);
+    RUN(test_saved_listings_reused);
+    RUN(test_changed_dir_relisted);
+    RUN(test_path_changes);
+    RUN(test_saved_for_other_extensions);
+    RUN(test_mangled_data_rejected);
+    return TEST_RESULT();
+}
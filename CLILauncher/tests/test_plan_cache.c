@@ -0,0 +1,333 @@
+/*
+ * Tests for the launch-plan cache, using a fake registry and file system.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "plan_cache.h"
+#include "testing.h"
+
+#define NUM_VIEWS   2
+#define NUM_FILES   4
+
+typedef struct {
+    CACHE_STAMP views[NUM_VIEWS];
+    const wchar_t * paths[NUM_FILES];
+    CACHE_STAMP files[NUM_FILES];
+    int view_calls;
+    int file_calls;
+} FAKE;
+
+static BOOL
+fake_view_stamp(void * context, int view, CACHE_STAMP * stamp)
+{
+    FAKE * fake = context;
+
+    ++fake->view_calls;
+    *stamp = fake->views[view];
+    return TRUE;
+}
+
+static BOOL
+fake_file_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    FAKE * fake = context;
+    int i;
+
+    ++fake->file_calls;
+    for (i = 0; i < NUM_FILES; i++) {
+        if (fake->paths[i] && !wcscmp(fake->paths[i], path)) {
+            *stamp = fake->files[i];
+            return TRUE;
+        }
+    }
+    return FALSE;
+}
+
+#define SCRIPT      L"C:\\Jobs\\nightly.py"
+#define LOCAL_INI   L"C:\\Users\\me\\AppData\\Local\\py.ini"
+#define GLOBAL_INI  L"C:\\Windows\\py.ini"
+#define EXECUTABLE  L"\"C:\\Program Files\\Python312\\python.exe\""
+
+static FAKE fake;
+static CACHE_BACKEND backend = { &fake, fake_view_stamp, fake_file_stamp };
+static int fake_views[NUM_VIEWS] = { 0, 1 };
+static unsigned long long fingerprint;
+
+static void
+setup()
+{
+    memset(&fake, 0, sizeof(fake));
+    fake.views[0].time = 131000000000000000ULL;
+    fake.views[0].size = 2;
+    fake.paths[0] = SCRIPT;
+    fake.files[0].time = 132000000000000000ULL;
+    fake.files[0].size = 1234;
+    fake.paths[1] = GLOBAL_INI;     /* the local py.ini doesn't exist */
+    fake.files[1].time = 130000000000000000ULL;
+    fake.files[1].size = 88;
+    fake.paths[2] = L"C:\\Program Files\\Python312\\python.exe";
+    fake.files[2].time = 133000000000000000ULL;
+    fake.files[2].size = 98328;
+    fingerprint = plan_hash(plan_hash(PLAN_HASH_INIT, L"PY_PYTHON=3"), NULL);
+}
+
+/* Stamp everything, as the launcher would, then build a plan. */
+static size_t
+build(const wchar_t * suffix, void ** data)
+{
+    static const wchar_t * paths[] = {
+        SCRIPT, LOCAL_INI, GLOBAL_INI, EXECUTABLE
+    };
+    CACHE_STAMP view_stamps[NUM_VIEWS];
+    PLAN_FILE files[4];
+    PLAN plan;
+    int i;
+
+    cache_stamp_views(&backend, fake_views, NUM_VIEWS, view_stamps);
+    for (i = 0; i < 4; i++) {
+        files[i].path = paths[i];
+        cache_stamp_file(&backend, paths[i], &files[i].stamp);
+    }
+    plan.executable = EXECUTABLE;
+    plan.suffix = suffix;
+    plan.rule = L"virtual";
+    return plan_build(SCRIPT, fingerprint, fake_views, view_stamps,
+                      NUM_VIEWS, files, 4, &plan, data);
+}
+
+static BOOL
+validate(void * data, size_t size, PLAN * plan)
+{
+    return plan_validate(&backend, SCRIPT, fingerprint, fake_views,
+                         NUM_VIEWS, data, size, plan);
+}
+
+static void
+test_round_trip()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+
+    setup();
+    size = build(L"-u -X dev", &data);
+    CHECK(size > 0);
+    CHECK(validate(data, size, &plan));
+    CHECK(!wcscmp(plan.executable, EXECUTABLE));
+    CHECK(!wcscmp(plan.suffix, L"-u -X dev"));
+    CHECK(!wcscmp(plan.rule, L"virtual"));
+    free(data);
+    size = build(NULL, &data);
+    CHECK(validate(data, size, &plan));
+    CHECK(plan.suffix == NULL);
+    free(data);
+}
+
+static void
+test_script_compared_without_case()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+
+    setup();
+    size = build(NULL, &data);
+    CHECK(plan_validate(&backend, L"c:\\jobs\\NIGHTLY.py", fingerprint,
+                        fake_views, NUM_VIEWS, data, size, &plan));
+    /* a different script which happens to share the plan's file name */
+    CHECK(!plan_validate(&backend, L"C:\\Jobs\\weekly.py", fingerprint,
+                         fake_views, NUM_VIEWS, data, size, &plan));
+    free(data);
+}
+
+static void
+test_fingerprint_mismatch()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+
+    setup();
+    size = build(NULL, &data);
+    fingerprint = plan_hash(plan_hash(PLAN_HASH_INIT, L"PY_PYTHON=2"), NULL);
+    fake.file_calls = fake.view_calls = 0;
+    CHECK(!validate(data, size, &plan));
+    /* rejected before anything is stamped */
+    CHECK(fake.file_calls == 0);
+    CHECK(fake.view_calls == 0);
+    free(data);
+}
+
+static void
+test_registry_change_invalidates()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+
+    setup();
+    size = build(NULL, &data);
+    fake.views[1].size = 1;     /* a Python installed in another view */
+    fake.file_calls = 0;
+    CHECK(!validate(data, size, &plan));
+    CHECK(fake.file_calls == 0);
+    free(data);
+}
+
+static void
+test_file_changes_invalidate()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+    int i;
+
+    for (i = 0; i < 3; i++) {
+        setup();
+        size = build(NULL, &data);
+        fake.files[i].time += 1;
+        CHECK(!validate(data, size, &plan));
+        fake.files[i].time -= 1;
+        CHECK(validate(data, size, &plan));
+        fake.paths[i] = NULL;   /* removed */
+        CHECK(!validate(data, size, &plan));
+        free(data);
+    }
+}
+
+static void
+test_file_appearing_invalidates()
+{
+    void * data;
+    size_t size;
+    PLAN plan;
+
+    setup();
+    size = build(NULL, &data);
+    fake.paths[3] = LOCAL_INI;
+    fake.files[3].time = 1;
+    CHECK(!validate(data, size, &plan));
+    free(data);
+}
+
+static void
+test_mangled_plans_rejected()
+{
+    unsigned char * data;
+    size_t size;
+    size_t i;
+    PLAN plan;
+
+    setup();
+    size = build(L"-u", (void **) &data);
+    for (i = 0; i < size; i += 7) {
+        data[i] ^= 0x40;
+        CHECK(!validate(data, size, &plan));
+        data[i] ^= 0x40;
+    }
+    CHECK(!validate(data, size - 2, &plan));
+    CHECK(!validate(data, 8, &plan));
+    CHECK(!validate(NULL, 0, &plan));
+    CHECK(validate(data, size, &plan));
+    free(data);
+}
+
+static void
+test_limits()
+{
+    CACHE_STAMP view_stamps[NUM_VIEWS];
+    PLAN_FILE files[PLAN_MAX_FILES + 1];
+    wchar_t * big;
+    void * data;
+    PLAN plan;
+    size_t i;
+
+    setup();
+    memset(view_stamps, 0, sizeof(view_stamps));
+    memset(files, 0, sizeof(files));
+    for (i = 0; i <= PLAN_MAX_FILES; i++)
+        files[i].path = SCRIPT;
+    plan.executable = EXECUTABLE;
+    plan.suffix = NULL;
+    plan.rule = L"command";
+    CHECK(plan_build(SCRIPT, 0, fake_views, view_stamps, NUM_VIEWS, files,
+                     PLAN_MAX_FILES + 1, &plan, &data) == 0);
+    CHECK(data == NULL);
+    CHECK(plan_build(SCRIPT, 0, fake_views, view_stamps, CACHE_MAX_VIEWS + 1,
+                     files, 1, &plan, &data) == 0);
+    big = malloc(PLAN_MAX_SIZE * sizeof(wchar_t));
+    for (i = 0; i < PLAN_MAX_SIZE - 1; i++)
+        big[i] = L'x';
+    big[i] = L'\0';
+    plan.executable = big;
+    CHECK(plan_build(SCRIPT, 0, fake_views, view_stamps, NUM_VIEWS, files,
+                     1, &plan, &data) == 0);
+    free(big);
+}
+
+static void
+test_hash()
+{
+    unsigned long long h1, h2;
+
+    h1 = plan_hash(plan_hash(PLAN_HASH_INIT, L"ab"), L"c");
+    h2 = plan_hash(plan_hash(PLAN_HASH_INIT, L"a"), L"bc");
+    CHECK(h1 != h2);
+    CHECK(plan_hash(PLAN_HASH_INIT, NULL) != plan_hash(PLAN_HASH_INIT, L""));
+    CHECK(plan_hash(PLAN_HASH_INIT, L"x") == plan_hash(PLAN_HASH_INIT, L"x"));
+}
+
+static void
+test_file_names()
+{
+    wchar_t name1[PLAN_NAME_SIZE], name2[PLAN_NAME_SIZE];
+
+    plan_file_name(L"C:\\Jobs\\nightly.py", name1);
+    plan_file_name(L"c:\\JOBS\\Nightly.PY", name2);
+    CHECK(wcslen(name1) == PLAN_NAME_SIZE - 1);
+    CHECK(!wcscmp(&name1[16], L".plan"));
+    CHECK(!wcscmp(name1, name2));
+    plan_file_name(L"C:\\Jobs\\weekly.py", name2);
+    CHECK(wcscmp(name1, name2));
+}
+
+static void
+test_evict()
+{
+    PLAN_ENTRY entries[5];
+    size_t i;
+
+    for (i = 0; i < 5; i++) {
+        swprintf(entries[i].name, PLAN_NAME_SIZE, L"%016x.plan", (int) i);
+        entries[i].last_used = 100 - i * 10;
+    }
+    entries[4].last_used = 100;     /* ties are broken by name */
+    CHECK(plan_evict(entries, 5, 5) == 0);
+    CHECK(plan_evict(entries, 5, 3) == 2);
+    /* the least recently used first */
+    CHECK(entries[0].last_used == 70);
+    CHECK(entries[1].last_used == 80);
+    CHECK(entries[2].last_used == 90);
+    CHECK(!wcscmp(entries[3].name, L"0000000000000000.plan"));
+    CHECK(!wcscmp(entries[4].name, L"0000000000000004.plan"));
+    CHECK(plan_evict(entries, 5, 0) == 5);
+}
+
+int
+main()
+{
+    RUN(test_round_trip);
+    RUN(test_script_compared_without_case);
+    RUN(test_fingerprint_mismatch);
+    RUN(test_registry_change_invalidates);
+    RUN(test_file_changes_invalidate);
+    RUN(test_file_appearing_invalidates);
+    RUN(test_mangled_plans_rejected);
+    RUN(test_limits);
+    RUN(test_hash);
+    RUN(test_file_names);
+    RUN(test_evict);
+    return TEST_RESULT();
+}
@@ -0,0 +1,447 @@
+/*
+ * Tests for finding a script's project, using a fake file system.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "project.h"
+#include "testing.h"
+
+#define MAX_ENTRIES 128
+
+typedef struct {
+    wchar_t path[MAX_PATH];
+    CACHE_STAMP stamp;
+} FAKE_ENTRY;
+
+typedef struct {
+    FAKE_ENTRY entries[MAX_ENTRIES];
+    int num_entries;
+    unsigned long long clock;
+    int stamp_calls;
+} FAKE;
+
+static FAKE fake;
+
+static FAKE_ENTRY *
+fake_find(const wchar_t * path)
+{
+    int i;
+
+    for (i = 0; i < fake.num_entries; i++) {
+        if (!_wcsicmp(fake.entries[i].path, path))
+            return &fake.entries[i];
+    }
+    return NULL;
+}
+
+/*
+ * Touch the directory holding path, as the file system does when an entry
+ * is added to it or removed.
+ */
+static void
+touch_parent(const wchar_t * path)
+{
+    wchar_t dir[MAX_PATH];
+    wchar_t * p;
+    FAKE_ENTRY * entry;
+
+    wcscpy(dir, path);
+    p = wcsrchr(dir, L'\\');
+    if (p == NULL)
+        return;
+    p[(p == dir + 2) ? 1 : 0] = L'\0';     /* C:\ keeps its backslash */
+    entry = fake_find(dir);
+    if (entry != NULL)
+        entry->stamp.time = ++fake.clock;
+}
+
+/* Add a file or directory, and the directories it's in. */
+static void
+add(const wchar_t * path)
+{
+    wchar_t dir[MAX_PATH];
+    wchar_t * p;
+    FAKE_ENTRY * entry;
+
+    wcscpy(dir, path);
+    p = wcsrchr(dir, L'\\');
+    if ((p != NULL) && (p > dir + 2)) {
+        *p = L'\0';
+        add(dir);
+    }
+    else if ((p != NULL) && (path[3] != L'\0')) {
+        add(L"C:\\");
+    }
+    if (fake_find(path) != NULL)
+        return;
+    entry = &fake.entries[fake.num_entries++];
+    wcscpy(entry->path, path);
+    entry->stamp.time = ++fake.clock;
+    touch_parent(path);
+}
+
+static void
+delete(const wchar_t * path)
+{
+    FAKE_ENTRY * entry = fake_find(path);
+
+    *entry = fake.entries[--fake.num_entries];
+    touch_parent(path);
+}
+
+static BOOL
+fake_stamp(void * context, const wchar_t * path, CACHE_STAMP * stamp)
+{
+    FAKE_ENTRY * entry = fake_find(path);
+
+    (void) context;
+    ++fake.stamp_calls;
+    if (entry == NULL)
+        return FALSE;
+    *stamp = entry->stamp;
+    return TRUE;
+}
+
+static PROJECT_BACKEND backend = { NULL, fake_stamp };
+
+static void
+setup()
+{
+    memset(&fake, 0, sizeof(fake));
+    add(L"C:\\work\\app\\.git");
+    add(L"C:\\work\\app\\.venv\\pyvenv.cfg");
+    add(L"C:\\work\\app\\.venv\\Scripts\\python.exe");
+    add(L"C:\\work\\app\\.python-version");
+    add(L"C:\\work\\app\\src\\tools\\py.ini");
+    add(L"C:\\work\\app\\src\\tools\\deep\\er\\script.py");
+    add(L"C:\\work\\py.ini");
+    add(L"C:\\loose\\a\\b\\script.py");
+    fake.stamp_calls = 0;
+}
+
+static void
+test_nearest_of_each()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+
+    setup();
+    project_index_init(&index, &backend);
+    project_find(&index, L"C:\\work\\app\\src\\tools\\deep\\er", &project);
+    CHECK(!wcscmp(project.venv, L"C:\\work\\app\\.venv"));
+    CHECK(!wcscmp(project.pin, L"C:\\work\\app\\.python-version"));
+    CHECK(!wcscmp(project.ini, L"C:\\work\\app\\src\\tools\\py.ini"));
+    CHECK(project.dirs == 5);
+    CHECK(!project.capped);
+    /* py.ini above the repository isn't part of it */
+    project_find(&index, L"C:\\work\\app\\src\\", &project);
+    CHECK(project.ini[0] == L'\0');
+    CHECK(project.venv[0] && project.pin[0]);
+    CHECK(project.dirs == 2);
+    project_index_free(&index);
+}
+
+static void
+test_stops_at_volume_root()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+
+    setup();
+    project_index_init(&index, &backend);
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(!project.venv[0] && !project.pin[0] && !project.ini[0]);
+    CHECK(project.dirs == 4);  /* b, a, loose and C:\ */
+    /* not a full path, or one which doesn't exist */
+    project_find(&index, L"loose\\a", &project);
+    CHECK(project.dirs == 0);
+    project_find(&index, L"C:\\nowhere\\at\\all", &project);
+    CHECK(project.dirs == 0);
+    CHECK(project.stats == 1);
+    project_index_free(&index);
+}
+
+static void
+test_unc_roots()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    static const wchar_t * roots[] = {
+        L"\\\\server\\share", L"\\\\?\\UNC\\server\\share", L"\\\\?\\C:\\"
+    };
+    static const wchar_t * dirs[] = {
+        L"\\\\server\\share\\proj\\src", L"\\\\?\\UNC\\server\\share\\proj",
+        L"\\\\?\\C:\\proj"
+    };
+    /* "C:\" has its own backslash */
+    static const wchar_t * inis[] = {
+        L"\\\\server\\share\\py.ini", L"\\\\?\\UNC\\server\\share\\py.ini",
+        L"\\\\?\\C:\\py.ini"
+    };
+    static const int depths[] = { 3, 2, 2 };
+    int i;
+
+    for (i = 0; i < 3; i++) {
+        memset(&fake, 0, sizeof(fake));
+        wcscpy(fake.entries[0].path, roots[i]);
+        wcscpy(fake.entries[1].path, inis[i]);
+        wcscpy(fake.entries[2].path, dirs[i]);
+        fake.num_entries = 3;
+        if (i == 0) {
+            wcscpy(fake.entries[3].path, L"\\\\server\\share\\proj");
+            fake.num_entries = 4;
+        }
+        project_index_init(&index, &backend);
+        project_find(&index, dirs[i], &project);
+        CHECK(project.dirs == depths[i]);
+        CHECK(!wcscmp(project.ini, inis[i]));
+        project_index_free(&index);
+    }
+}
+
+static void
+test_negative_caching()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    int first;
+
+    setup();
+    project_index_init(&index, &backend);
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    first = project.stats;
+    CHECK(project.reused == 0);
+    CHECK(index.dirty);
+    /* Again: one stamp for each directory, nothing else. */
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(project.stats == 4);
+    CHECK(project.reused == 4);
+    CHECK(first > 4 * 4);
+    /* A new file is noticed, as its directory has changed. */
+    add(L"C:\\loose\\a\\.python-version");
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(!wcscmp(project.pin, L"C:\\loose\\a\\.python-version"));
+    CHECK(project.reused == 3);
+    CHECK(project.dirs == 4);
+    delete(L"C:\\loose\\a\\.python-version");
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(!project.pin[0]);
+    CHECK(index.reused == 4 + 3 + 3);
+    project_index_free(&index);
+}
+
+static void
+test_venv_needs_cfg()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+
+    setup();
+    add(L"C:\\loose\\a\\.venv\\Scripts\\python.exe");
+    project_index_init(&index, &backend);
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(!project.venv[0]);
+    /* Adding pyvenv.cfg doesn't change C:\loose\a, but is noticed. */
+    add(L"C:\\loose\\a\\.venv\\pyvenv.cfg");
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    CHECK(!wcscmp(project.venv, L"C:\\loose\\a\\.venv"));
+    CHECK(project.reused == project.dirs);
+    project_index_free(&index);
+}
+
+static void
+test_capped()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    wchar_t path[MAX_PATH] = L"C:";
+    int i;
+
+    memset(&fake, 0, sizeof(fake));
+    for (i = 0; i < 100; i++)
+        wcscat(path, L"\\d");
+    add(path);
+    fake.stamp_calls = 0;
+    project_index_init(&index, &backend);
+    project_find(&index, path, &project);
+    CHECK(project.capped);
+    CHECK(project.stats >= PROJECT_MAX_STATS);
+    CHECK(project.stats < PROJECT_MAX_STATS + 8);
+    CHECK(project.stats == fake.stamp_calls);
+    CHECK(project.dirs < 101);
+    /* Remembered, the whole walk fits. */
+    project_find(&index, path, &project);
+    project_find(&index, path, &project);
+    CHECK(!project.capped);
+    CHECK(project.dirs == 101);
+    project_index_free(&index);
+}
+
+static void
+test_long_paths()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    wchar_t path[MAX_PATH + 8];
+    int i;
+
+    memset(&fake, 0, sizeof(fake));
+    wcscpy(path, L"C:\\");
+    for (i = 3; i < MAX_PATH - 10; i++)
+        path[i] = L'x';
+    path[i] = L'\0';
+    add(path);
+    project_index_init(&index, &backend);
+    /* Too long for .python-version to fit on the end, so that isn't
+     * looked for, but the walk goes on. */
+    project_find(&index, path, &project);
+    CHECK(project.dirs == 2);
+    for (; i < MAX_PATH + 4; i++)
+        path[i] = L'x';
+    path[i] = L'\0';
+    project_find(&index, path, &project);
+    CHECK(project.dirs == 0);
+    project_index_free(&index);
+}
+
+static void
+test_save_and_load()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    void * data;
+    unsigned char * copy;
+    size_t size, i;
+
+    setup();
+    project_index_init(&index, &backend);
+    project_find(&index, L"C:\\work\\app\\src\\tools\\deep\\er", &project);
+    project_find(&index, L"C:\\loose\\a\\b", &project);
+    size = project_index_save(&index, &data);
+    CHECK(size > 0);
+    project_index_free(&index);
+
+    project_index_init(&index, &backend);
+    copy = malloc(size);
+    memcpy(copy, data, size);
+    CHECK(project_index_load(&index, copy, size));
+    CHECK(!index.dirty);
+    fake.stamp_calls = 0;
+    project_find(&index, L"C:\\work\\app\\src\\tools\\deep\\er", &project);
+    CHECK(project.reused == 5);
+    CHECK(!wcscmp(project.ini, L"C:\\work\\app\\src\\tools\\py.ini"));
+    CHECK(fake.stamp_calls == 5 + 1);  /* and pyvenv.cfg */
+    CHECK(!index.dirty);
+    project_index_free(&index);
+
+    for (i = 0; i < size; i += 3) {
+        copy = malloc(size);
+        memcpy(copy, data, size);
+        copy[i] ^= 0x10;
+        project_index_init(&index, &backend);
+        CHECK(!project_index_load(&index, copy, size));
+        CHECK(index.num_dirs == 0);
+        project_index_free(&index);
+    }
+    copy = malloc(size);
+    memcpy(copy, data, size);
+    project_index_init(&index, &backend);
+    CHECK(!project_index_load(&index, copy, size - sizeof(wchar_t)));
+    CHECK(!project_index_load(&index, NULL, 0));
+    project_index_free(&index);
+    free(data);
+}
+
+static void
+test_saved_limit()
+{
+    PROJECT_INDEX index;
+    PROJECT project;
+    wchar_t path[MAX_PATH];
+    void * data;
+    size_t size;
+    int i;
+
+    memset(&fake, 0, sizeof(fake));
+    add(L"C:\\many");
+    project_index_init(&index, &backend);
+    /* Remembered directories which don't exist any more are still saved,
+     * up to the limit, after those looked at this time. */
+    for (i = 0; i < PROJECT_MAX_SAVED + 10; i++) {
+        swprintf(path, MAX_PATH, L"C:\\gone\\%d", i);
+        add(path);
+        project_find(&index, path, &project);
+        delete(path);
+    }
+    size = project_index_save(&index, &data);
+    project_index_free(&index);
+    project_index_init(&index, &backend);
+    CHECK(project_index_load(&index, data, size));
+    CHECK(index.num_dirs == PROJECT_MAX_SAVED);
+    project_index_free(&index);
+}
+
+static void
+test_parse_pin()
+{
+    wchar_t version[MAX_VERSION_SIZE];
+    static const struct {
+        const char * text;
+        const wchar_t * expected;
+    } cases[] = {
+        { "3.12\n", L"3.12" },
+        { "3.12.4", L"3.12" },
+        { "  3.11.0rc2  \r\n", L"3.11" },
+        { "3.14.0a1", L"3.14" },
+        { "3.14.0b3", L"3.14" },
+        { "\xEF\xBB\xBF# pinned\n\n3.13t\n", L"3.13t" },
+        { "cpython-3.10", L"3.10" },
+        { "python3.9", L"3.9" },
+        { "3", L"3" },
+        { "3.12-32", L"3.12-32" },
+        { "3.12-arm64", L"3.12-arm64" },
+        { "3.12 3.11\n", L"3.12" },
+        { "3.12\n3.11\n", L"3.12" },
+        { "pypy3.10", NULL },
+        { "system", NULL },
+        { "3.12-foo", NULL },
+        { "3.x", NULL },
+        { "312345", NULL },
+        { "", NULL },
+        { "# nothing\n\n", NULL },
+        { "system\n3.12\n", NULL },
+    };
+    size_t i;
+
+    for (i = 0; i < sizeof(cases) / sizeof(cases[0]); i++) {
+        BOOL ok = project_parse_pin(cases[i].text, strlen(cases[i].text),
+                                    version, MAX_VERSION_SIZE);
+
+        if (cases[i].expected == NULL) {
+            CHECK(!ok);
+            CHECK(version[0] == L'\0');
+        }
+        else {
+            CHECK(ok);
+            CHECK(!wcscmp(version, cases[i].expected));
+        }
+    }
+}
+
+int
+main()
+{
+    RUN(test_nearest_of_each);
+    RUN(test_stops_at_volume_root);
+    RUN(test_unc_roots);
+    RUN(test_negative_caching);
+    RUN(test_venv_needs_cfg);
+    RUN(test_capped);
+    RUN(test_long_paths);
+    RUN(test_save_and_load);
+    RUN(test_saved_limit);
+    RUN(test_parse_pin);
+    return TEST_RESULT();
+}
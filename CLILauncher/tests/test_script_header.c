@@ -0,0 +1,363 @@
+/*
+ * Tests for classifying scripts from their headers.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "script_header.h"
+#include "testing.h"
+
+#include "pyc_magic.h"
+
+#define NUM_MAGIC_VALUES    (sizeof(pyc_magic_values) / sizeof(PYC_MAGIC))
+
+/*
+ * Classify a file the way the launcher does: a first read, then more only
+ * when asked. Returns the number of reads.
+ */
+static int
+classify(const void * file, size_t file_size, SCRIPT_HEADER * header)
+{
+    size_t size = (file_size < HEADER_READ_SIZE) ? file_size :
+                  HEADER_READ_SIZE;
+    size_t wanted;
+    int reads = 1;
+
+    while ((wanted = header_classify(file, size, size == file_size,
+                                     header)) != 0) {
+        CHECK(wanted > size);
+        size = (wanted < file_size) ? wanted : file_size;
+        ++reads;
+    }
+    return reads;
+}
+
+static void
+test_magic_table()
+{
+    size_t i;
+
+    for (i = 0; i < NUM_MAGIC_VALUES; i++) {
+        CHECK(pyc_magic_values[i].min <= pyc_magic_values[i].max);
+        if (i > 0)
+            CHECK(pyc_magic_values[i - 1].max < pyc_magic_values[i].min);
+    }
+    CHECK(!wcscmp(header_pyc_version(3379), L"3.6"));   /* 3.6.0 final */
+    CHECK(!wcscmp(header_pyc_version(3394), L"3.7"));
+    CHECK(!wcscmp(header_pyc_version(3413), L"3.8"));
+    CHECK(!wcscmp(header_pyc_version(3425), L"3.9"));
+    CHECK(!wcscmp(header_pyc_version(3439), L"3.10"));
+    CHECK(!wcscmp(header_pyc_version(3495), L"3.11"));
+    CHECK(!wcscmp(header_pyc_version(3531), L"3.12"));
+    CHECK(!wcscmp(header_pyc_version(3571), L"3.13"));
+    CHECK(!wcscmp(header_pyc_version(3627), L"3.14"));
+    CHECK(!wcscmp(header_pyc_version(62211), L"2.7"));
+    CHECK(!wcscmp(header_pyc_version(50823), L"2.0"));
+    CHECK(header_pyc_version(3385) == NULL);    /* between 3.6 and 3.7 */
+    CHECK(header_pyc_version(20121) == NULL);   /* Python 1.5 */
+    CHECK(header_pyc_version(0) == NULL);
+    CHECK(header_pyc_version(65535) == NULL);
+}
+
+/* The binary search finds the same as looking through the whole table. */
+static void
+test_magic_search()
+{
+    const wchar_t * expected;
+    const wchar_t * found;
+    unsigned long magic;
+    size_t i;
+    int mismatches = 0;
+
+    for (magic = 0; magic <= 0xFFFF; magic++) {
+        expected = NULL;
+        for (i = 0; i < NUM_MAGIC_VALUES; i++) {
+            if ((magic >= pyc_magic_values[i].min) &&
+                (magic <= pyc_magic_values[i].max))
+                expected = pyc_magic_values[i].version;
+        }
+        /* this file has its own copy of the table */
+        found = header_pyc_version((unsigned short) magic);
+        if ((found == NULL) ? (expected != NULL) :
+            ((expected == NULL) || wcscmp(found, expected)))
+            ++mismatches;
+    }
+    CHECK(mismatches == 0);
+}
+
+static void
+test_pyc()
+{
+    static const unsigned char py312[] = {
+        0xCB, 0x0D, 0x0D, 0x0A, 0, 0, 0, 0, 0x12, 0x34, 0x56, 0x78
+    };
+    static const unsigned char unknown[] = { 0x01, 0x00, 0x0D, 0x0A, 0 };
+    SCRIPT_HEADER header;
+
+    CHECK(classify(py312, sizeof(py312), &header) == 1);
+    CHECK(header.kind == HEADER_PYC);
+    CHECK(header.magic == 3531);
+    CHECK(!wcscmp(header.version, L"3.12"));
+    /* in case that Python isn't installed: 3531 is 0x0DCB, so a CR */
+    CHECK(header.line_length == 2);
+    classify(unknown, sizeof(unknown), &header);
+    CHECK(header.kind == HEADER_TEXT);
+    CHECK(header.magic == 1);
+    CHECK(header.version == NULL);
+}
+
+static void
+test_text()
+{
+    static const char * script = "#!/usr/bin/env python3\nprint('hi')\n";
+    static const char * crlf = "#! python3.12 -u\r\nimport sys\r\n";
+    static const char * plain = "import sys\nprint(sys.argv)\n";
+    SCRIPT_HEADER header;
+
+    CHECK(classify(script, strlen(script), &header) == 1);
+    CHECK(header.kind == HEADER_TEXT);
+    CHECK(header.code_page == HEADER_UTF8);
+    CHECK(header.bom_length == 0);
+    CHECK(header.line_length == 23);
+    classify(crlf, strlen(crlf), &header);
+    CHECK(header.line_length == 17);    /* up to and including the CR */
+    classify(plain, strlen(plain), &header);
+    CHECK(header.kind == HEADER_TEXT);
+    CHECK(header.line_length == 11);
+    /* no terminator */
+    classify("#!python", 8, &header);
+    CHECK(header.kind == HEADER_NONE);
+    classify("", 0, &header);
+    CHECK(header.kind == HEADER_NONE);
+    classify("#", 1, &header);
+    CHECK(header.kind == HEADER_NONE);
+    classify("\n", 1, &header);
+    CHECK(header.kind == HEADER_TEXT);
+    CHECK(header.line_length == 1);
+}
+
+static void
+test_long_shebang()
+{
+    size_t sizes[] = { 255, 256, 257, 300, 1000, 5000, 100000 };
+    SCRIPT_HEADER header;
+    char * file;
+    size_t i, n;
+    int reads;
+
+    for (i = 0; i < sizeof(sizes) / sizeof(sizes[0]); i++) {
+        n = sizes[i];
+        file = malloc(n + 100);
+        memset(file, 'x', n + 100);
+        memcpy(file, "#!C:\\venvs\\", 11);
+        file[n] = '\n';
+        reads = classify(file, n + 100, &header);
+        CHECK(header.kind == HEADER_TEXT);
+        CHECK(header.line_length == n + 1);
+        /* a line ending at byte 256 or later needs more of the file */
+        CHECK((reads == 1) == (n + 1 + 4 <= HEADER_READ_SIZE));
+        CHECK(reads <= 8);
+        free(file);
+    }
+}
+
+static void
+test_long_lines_limited()
+{
+    size_t n = HEADER_MAX_SIZE + 10;
+    SCRIPT_HEADER header;
+    char * file = malloc(n);
+
+    memset(file, 'x', n);
+    memcpy(file, "#!", 2);
+    file[n - 1] = '\n';
+    classify(file, n, &header);
+    CHECK(header.kind == HEADER_NONE);
+    /* Without a shebang, only the first read is looked at. */
+    file[0] = 'y';
+    CHECK(classify(file, n, &header) == 1);
+    CHECK(header.kind == HEADER_NONE);
+    free(file);
+}
+
+/* Encode an ASCII string in an encoding, after its BOM. */
+static size_t
+encode(const char * s, unsigned int code_page, unsigned char * out)
+{
+    static const unsigned char utf8[] = { 0xEF, 0xBB, 0xBF };
+    size_t n = 0;
+
+    switch (code_page) {
+    case HEADER_UTF8:
+        memcpy(out, utf8, 3);
+        n = 3;
+        for (; *s; s++)
+            out[n++] = *s;
+        break;
+    case HEADER_UTF16LE:
+        out[n++] = 0xFF; out[n++] = 0xFE;
+        for (; *s; s++) {
+            out[n++] = *s; out[n++] = 0;
+        }
+        break;
+    case HEADER_UTF16BE:
+        out[n++] = 0xFE; out[n++] = 0xFF;
+        for (; *s; s++) {
+            out[n++] = 0; out[n++] = *s;
+        }
+        break;
+    case HEADER_UTF32LE:
+        out[n++] = 0xFF; out[n++] = 0xFE; out[n++] = 0; out[n++] = 0;
+        for (; *s; s++) {
+            out[n++] = *s; out[n++] = 0; out[n++] = 0; out[n++] = 0;
+        }
+        break;
+    case HEADER_UTF32BE:
+        out[n++] = 0; out[n++] = 0; out[n++] = 0xFE; out[n++] = 0xFF;
+        for (; *s; s++) {
+            out[n++] = 0; out[n++] = 0; out[n++] = 0; out[n++] = *s;
+        }
+        break;
+    }
+    return n;
+}
+
+static void
+test_boms()
+{
+    static const unsigned int code_pages[] = {
+        HEADER_UTF8, HEADER_UTF16LE, HEADER_UTF16BE, HEADER_UTF32LE,
+        HEADER_UTF32BE
+    };
+    static const size_t units[] = { 1, 2, 2, 4, 4 };
+    static const size_t boms[] = { 3, 2, 2, 4, 4 };
+    unsigned char file[4 * 300];
+    SCRIPT_HEADER header;
+    char text[200];
+    size_t i, n;
+
+    for (i = 0; i < 5; i++) {
+        n = encode("#!python3\nprint()\n", code_pages[i], file);
+        classify(file, n, &header);
+        CHECK(header.kind == HEADER_TEXT);
+        CHECK(header.code_page == code_pages[i]);
+        CHECK(header.bom_length == boms[i]);
+        CHECK(header.line_length == 10 * units[i]);
+        /* a long line in a wide encoding */
+        memset(text, 'x', sizeof(text));
+        memcpy(text, "#!", 2);
+        text[sizeof(text) - 2] = '\n';
+        text[sizeof(text) - 1] = '\0';
+        n = encode(text, code_pages[i], file);
+        classify(file, n, &header);
+        CHECK(header.kind == HEADER_TEXT);
+        CHECK(header.line_length == (sizeof(text) - 1) * units[i]);
+    }
+}
+
+static void
+test_wide_terminators()
+{
+    /* U+0A23 and U+0D21 contain LF and CR bytes, but aren't terminators. */
+    static const unsigned char utf16le[] = {
+        0xFF, 0xFE, '#', 0, '!', 0, 0x23, 0x0A, 0x21, 0x0D, 'x', 0, '\n', 0
+    };
+    static const unsigned char utf16be[] = {
+        0xFE, 0xFF, 0, '#', 0, '!', 0x0A, 0x23, 0x0D, 0x21, 0, 'x', 0, '\n'
+    };
+    /* Files starting with a NUL aren't UTF-32BE. */
+    static const unsigned char nul[] = { 0, 'a', '\n', 'b' };
+    SCRIPT_HEADER header;
+
+    classify(utf16le, sizeof(utf16le), &header);
+    CHECK(header.line_length == 12);
+    classify(utf16be, sizeof(utf16be), &header);
+    CHECK(header.line_length == 12);
+    classify(nul, sizeof(nul), &header);
+    CHECK(header.code_page == HEADER_UTF8);
+    CHECK(header.line_length == 3);
+}
+
+static void
+test_zipapps()
+{
+    static const char pyz[] =
+        "#!/usr/bin/env python3\nPK\003\004\024\0\0\0\010\0\n\n\n";
+    static const char zip[] = "PK\003\004\024\0\0\0\010\0\n#!python\n";
+    char file[HEADER_READ_SIZE + 10];
+    SCRIPT_HEADER header;
+
+    classify(pyz, sizeof(pyz) - 1, &header);
+    CHECK(header.kind == HEADER_ZIPAPP);
+    CHECK(header.line_length == 23);
+    classify(zip, sizeof(zip) - 1, &header);
+    CHECK(header.kind == HEADER_ZIPAPP);
+    CHECK(header.line_length == 0);
+    /* a shebang line ending at the end of the first read */
+    memset(file, 'x', sizeof(file));
+    memcpy(file, "#!", 2);
+    file[HEADER_READ_SIZE - 1] = '\n';
+    memcpy(&file[HEADER_READ_SIZE], "PK\003\004", 4);
+    CHECK(classify(file, sizeof(file), &header) == 2);
+    CHECK(header.kind == HEADER_ZIPAPP);
+    CHECK(header.line_length == HEADER_READ_SIZE);
+    /* and at the end of the file */
+    CHECK(classify(file, HEADER_READ_SIZE, &header) == 1);
+    CHECK(header.kind == HEADER_TEXT);
+}
+
+static void
+test_decode()
+{
+    /* e acute, a bad continuation, a lone continuation, G clef */
+    static const char utf8[] = "#!py\xC3\xA9\xC3x\x80\xF0\x9D\x84\x9E\r\n";
+    static const unsigned char utf16be[] = {
+        0xFE, 0xFF, 0, '#', 0, '!', 0x20, 0xAC, 0, '\n'
+    };
+    static const unsigned char utf32le[] = {
+        0xFF, 0xFE, 0, 0, '#', 0, 0, 0, 0x1E, 0xD1, 0x01, 0, '\n', 0, 0, 0
+    };
+    SCRIPT_HEADER header;
+    wchar_t line[40];
+    int n;
+
+    classify(utf8, sizeof(utf8) - 1, &header);
+    n = header_decode_line((const unsigned char *) utf8, &header, line);
+    CHECK(n == ((sizeof(wchar_t) == 2) ? 10 : 9));
+    CHECK(!wcsncmp(line, L"#!py\x00E9\xFFFDx\xFFFD", 8));
+    if (sizeof(wchar_t) == 2)
+        CHECK((line[8] == 0xD834) && (line[9] == 0xDD1E));
+    else
+        CHECK(line[8] == 0x1D11E);
+    CHECK(line[n] == L'\0');   /* in place of the CR */
+    classify(utf16be, sizeof(utf16be), &header);
+    n = header_decode_line(utf16be, &header, line);
+    CHECK((n == 3) && !wcscmp(line, L"#!\x20AC"));
+    /* only the low 16 bits of UTF-32 */
+    classify(utf32le, sizeof(utf32le), &header);
+    n = header_decode_line(utf32le, &header, line);
+    CHECK((n == 2) && (line[0] == L'#') && (line[1] == 0xD11E));
+    classify("#!python", 8, &header);
+    CHECK(header_decode_line((const unsigned char *) "#!python", &header,
+                             line) == -1);
+    classify("\n", 1, &header);
+    CHECK(header_decode_line((const unsigned char *) "\n", &header,
+                             line) == 0);
+}
+
+int
+main()
+{
+    RUN(test_magic_table);
+    RUN(test_magic_search);
+    RUN(test_pyc);
+    RUN(test_text);
+    RUN(test_long_shebang);
+    RUN(test_long_lines_limited);
+    RUN(test_boms);
+    RUN(test_wide_terminators);
+    RUN(test_zipapps);
+    RUN(test_decode);
+    return TEST_RESULT();
+}
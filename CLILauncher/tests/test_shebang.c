@@ -0,0 +1,160 @@
+/*
+ * Tests for parsing shebang lines and building child command lines.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "shebang.h"
+#include "testing.h"
+
+typedef struct {
+    int lookups;
+    wchar_t last[100];
+} FAKE_COMMANDS;
+
+static wchar_t perl[] = L"C:\\Perl\\bin\\perl.exe";
+
+static wchar_t *
+fake_find_command(void * context, const wchar_t * name)
+{
+    FAKE_COMMANDS * fake = context;
+
+    ++fake->lookups;
+    wcsncpy(fake->last, name, 99);
+    if (!wcscmp(name, L"perl"))
+        return perl;
+    return NULL;
+}
+
+static FAKE_COMMANDS fake;
+static SHEBANG_BACKEND backend = { &fake, fake_find_command, TRUE };
+
+static wchar_t line[200];
+
+/* Parse a copy of s, which shebang_parse() may change. */
+static BOOL
+parse(const wchar_t * s, wchar_t ** command, wchar_t ** suffix,
+      BOOL * search)
+{
+    wcscpy(line, s);
+    return shebang_parse(&backend, line, (int) wcslen(line), command,
+                         suffix, search);
+}
+
+static void
+test_virtual()
+{
+    wchar_t * command;
+    wchar_t * suffix;
+    BOOL search;
+
+    fake.lookups = 0;
+    CHECK(parse(L"#!/usr/bin/env python3 -v  ", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"python3 -v"));
+    CHECK(suffix == NULL);
+    CHECK(search);
+    CHECK(parse(L"#! /usr/bin/python2.7", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"python2.7"));
+    CHECK(!search);
+    CHECK(parse(L"#!/usr/local/bin/python", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"python"));
+    CHECK(parse(L"#!python3.12-arm64", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"python3.12-arm64"));
+    CHECK(fake.lookups == 0);
+}
+
+static void
+test_not_shebang()
+{
+    wchar_t * command;
+    wchar_t * suffix;
+    BOOL search;
+
+    CHECK(!parse(L"import sys", &command, &suffix, &search));
+    CHECK(command == NULL);
+    CHECK(!parse(L"#!   ", &command, &suffix, &search));
+    CHECK(command == NULL);
+    CHECK(!parse(L"#", &command, &suffix, &search));
+    CHECK(command == NULL);
+    CHECK(!parse(L"", &command, &suffix, &search));
+    CHECK(command == NULL);
+}
+
+static void
+test_commands()
+{
+    wchar_t * command;
+    wchar_t * suffix;
+    BOOL search;
+
+    CHECK(!parse(L"#!/usr/bin/perl -w  ", &command, &suffix, &search));
+    CHECK(command == perl);
+    CHECK(!wcscmp(suffix, L"-w"));
+    CHECK(!wcscmp(fake.last, L"perl"));
+    CHECK(!parse(L"#!/usr/bin/env   perl", &command, &suffix, &search));
+    CHECK(command == perl);
+    CHECK(suffix == NULL);
+    /* An unknown command is used as it is. */
+    CHECK(!parse(L"#!/bin/sh -x", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"/bin/sh -x"));
+    CHECK(suffix == NULL);
+    CHECK(!wcscmp(fake.last, L"/bin/sh"));
+    /* Prefixes are only skipped when asked for. */
+    backend.skip_prefix = FALSE;
+    CHECK(!parse(L"#!/usr/bin/perl", &command, &suffix, &search));
+    CHECK(!wcscmp(command, L"/usr/bin/perl"));
+    CHECK(!wcscmp(fake.last, L"/usr/bin/perl"));
+    backend.skip_prefix = TRUE;
+    /* Python names that aren't virtual commands are looked up too. */
+    CHECK(!parse(L"#!/opt/python3", &command, &suffix, &search));
+    CHECK(!wcscmp(fake.last, L"/opt/python3"));
+}
+
+static void
+test_skip_prefix()
+{
+    wchar_t s1[] = L"/usr/bin/env   perl";
+    wchar_t s2[] = L"/USR/LOCAL/BIN/perl";
+    wchar_t s3[] = L"/opt/perl";
+
+    CHECK(!wcscmp(shebang_skip_prefix(s1), L"perl"));
+    CHECK(!wcscmp(shebang_skip_prefix(s2), L"perl"));
+    CHECK(shebang_skip_prefix(s3) == s3);
+}
+
+static void
+test_child_command()
+{
+    static const struct {
+        const wchar_t * suffix;
+        const wchar_t * cmdline;
+        const wchar_t * expected;
+    } cases[] = {
+        { NULL, L"", L"python.exe" },
+        { L"", L"", L"python.exe" },
+        { NULL, L"x.py 1", L"python.exe x.py 1" },
+        { L"-u", L"x.py", L"python.exe -u x.py" },
+        { L"-u", L"", L"python.exe -u " },
+    };
+    wchar_t * result;
+    size_t i;
+
+    for (i = 0; i < sizeof(cases) / sizeof(cases[0]); i++) {
+        result = shebang_child_command(L"python.exe", cases[i].suffix,
+                                       cases[i].cmdline);
+        CHECK((result != NULL) && !wcscmp(result, cases[i].expected));
+        free(result);
+    }
+}
+
+int
+main()
+{
+    RUN(test_virtual);
+    RUN(test_not_shebang);
+    RUN(test_commands);
+    RUN(test_skip_prefix);
+    RUN(test_child_command);
+    return TEST_RESULT();
+}
@@ -0,0 +1,147 @@
+/*
+ * Tests for the trace buffer and duration histograms.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "trace.h"
+#include "testing.h"
+
+/* Compare what has been buffered with the expected text. */
+static BOOL
+buffered(const TRACE * trace, const char * expected)
+{
+    return (trace->length == strlen(expected)) &&
+           (memcmp(trace->data, expected, trace->length) == 0);
+}
+
+static void
+test_events()
+{
+    TRACE trace;
+
+    memset(&trace, 0, sizeof(trace));
+    trace_begin(&trace, "probe", 12.345);
+    trace_string(&trace, "path", L"C:\\Python312\\python.exe");
+    trace_integer(&trace, "bits", 64);
+    trace_number(&trace, "dur_us", 3.0);
+    trace_string(&trace, "error", NULL);
+    trace_end(&trace);
+    trace_begin(&trace, "exit", 20.0);
+    trace_end(&trace);
+    CHECK(buffered(&trace, "{\"t_us\": 12.3, \"event\": \"probe\", "
+                           "\"path\": \"C:\\\\Python312\\\\python.exe\", "
+                           "\"bits\": 64, \"dur_us\": 3.0, \"error\": null}\n"
+                           "{\"t_us\": 20.0, \"event\": \"exit\"}\n"));
+    trace_clear(&trace);
+    CHECK(trace.length == 0);
+    trace_free(&trace);
+}
+
+static void
+test_escaping()
+{
+    TRACE trace;
+
+    memset(&trace, 0, sizeof(trace));
+    trace_begin(&trace, "e", 0);
+    trace_string(&trace, "s", L"\"q\"\t\n\x7f\xe9\x20ac");
+    trace_end(&trace);
+    CHECK(buffered(&trace, "{\"t_us\": 0.0, \"event\": \"e\", "
+                           "\"s\": \"\\\"q\\\"\\u0009\\u000a\\u007f"
+                           "\\u00e9\\u20ac\"}\n"));
+    trace_free(&trace);
+    if (sizeof(wchar_t) > 2) {
+        wchar_t s[2];
+
+        s[0] = (wchar_t) 0x1F40D;
+        s[1] = L'\0';
+        trace_begin(&trace, "e", 0);
+        trace_string(&trace, "s", s);
+        trace_end(&trace);
+        CHECK(buffered(&trace, "{\"t_us\": 0.0, \"event\": \"e\", "
+                               "\"s\": \"\\ud83d\\udc0d\"}\n"));
+        trace_free(&trace);
+    }
+}
+
+static void
+test_limit()
+{
+    TRACE trace;
+    wchar_t * big = malloc((TRACE_MAX_SIZE / 2 + 1) * sizeof(wchar_t));
+    size_t i, length;
+
+    for (i = 0; i < TRACE_MAX_SIZE / 2; i++)
+        big[i] = L'x';
+    big[i] = L'\0';
+    memset(&trace, 0, sizeof(trace));
+    trace_begin(&trace, "first", 1);
+    trace_end(&trace);
+    length = trace.length;
+    trace_begin(&trace, "big", 2);
+    trace_string(&trace, "a", big);
+    trace_string(&trace, "b", big);
+    trace_end(&trace);
+    /* the oversized event is dropped, leaving the buffer usable */
+    CHECK(trace.length == length);
+    CHECK(trace.dropped == 1);
+    trace_begin(&trace, "small", 3);
+    trace_end(&trace);
+    CHECK(buffered(&trace, "{\"t_us\": 1.0, \"event\": \"first\"}\n"
+                           "{\"t_us\": 3.0, \"event\": \"small\"}\n"));
+    CHECK(trace.capacity <= TRACE_MAX_SIZE);
+    trace_free(&trace);
+    free(big);
+}
+
+static void
+test_buckets()
+{
+    CHECK(histogram_bucket(0) == 0);
+    CHECK(histogram_bucket(0.9) == 0);
+    CHECK(histogram_bucket(1) == 1);
+    CHECK(histogram_bucket(1.9) == 1);
+    CHECK(histogram_bucket(2) == 2);
+    CHECK(histogram_bucket(1000) == 10);
+    CHECK(histogram_bucket(1024) == 11);
+    CHECK(histogram_bucket(1e30) == HISTOGRAM_BUCKETS - 1);
+}
+
+static void
+test_histogram()
+{
+    TRACE trace;
+    HISTOGRAM h;
+
+    memset(&trace, 0, sizeof(trace));
+    memset(&h, 0, sizeof(h));
+    histogram_add(&h, 0.5);
+    histogram_add(&h, 3);
+    histogram_add(&h, 3.5);
+    histogram_add(&h, 1e30);
+    CHECK(h.count == 4);
+    CHECK(h.max_us == 1e30);
+    h.total_us = 7.0;   /* keep the formatted text short */
+    h.max_us = 5.0;
+    trace_begin(&trace, "summary", 0);
+    trace_histogram(&trace, "probe", &h);
+    trace_end(&trace);
+    CHECK(buffered(&trace, "{\"t_us\": 0.0, \"event\": \"summary\", "
+                           "\"probe\": {\"count\": 4, \"total_us\": 7.0, "
+                           "\"max_us\": 5.0, \"buckets\": {\"1\": 1, "
+                           "\"4\": 2, \"inf\": 1}}}\n"));
+    trace_free(&trace);
+}
+
+int
+main()
+{
+    RUN(test_events);
+    RUN(test_escaping);
+    RUN(test_limit);
+    RUN(test_buckets);
+    RUN(test_histogram);
+    return TEST_RESULT();
+}
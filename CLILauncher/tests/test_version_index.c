@@ -0,0 +1,280 @@
+/*
+ * Tests for version parsing and the index of installed Pythons.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "version_index.h"
+#include "testing.h"
+
+static BOOL
+parses(const wchar_t * text, int major, int minor, int freethreaded,
+       int arch)
+{
+    PY_VERSION v;
+
+    return parse_version(text, &v, TRUE) && (v.major == major) &&
+           (v.minor == minor) && (v.freethreaded == freethreaded) &&
+           (v.arch == arch);
+}
+
+static BOOL
+rejected(const wchar_t * text)
+{
+    PY_VERSION v;
+
+    return !parse_version(text, &v, TRUE) && (v.major == -1);
+}
+
+static void
+test_parse_requests()
+{
+    CHECK(parses(L"3", 3, -1, FALSE, ARCH_ANY));
+    CHECK(parses(L"3.6", 3, 6, FALSE, ARCH_ANY));
+    CHECK(parses(L"3.10", 3, 10, FALSE, ARCH_ANY));
+    CHECK(parses(L"3.12-32", 3, 12, FALSE, ARCH_32));
+    CHECK(parses(L"3.12-64", 3, 12, FALSE, ARCH_64));
+    CHECK(parses(L"3.12-arm64", 3, 12, FALSE, ARCH_ARM64));
+    CHECK(parses(L"3.12-ARM64", 3, 12, FALSE, ARCH_ARM64));
+    CHECK(parses(L"3.13t", 3, 13, TRUE, ARCH_ANY));
+    CHECK(parses(L"3.13t-arm64", 3, 13, TRUE, ARCH_ARM64));
+    CHECK(parses(L"3-32", 3, -1, FALSE, ARCH_32));
+    CHECK(parses(L"10.0", 10, 0, FALSE, ARCH_ANY));
+    CHECK(rejected(L""));
+    CHECK(rejected(L"x"));
+    CHECK(rejected(L"3."));
+    CHECK(rejected(L"3.6-"));
+    CHECK(rejected(L"3.6-3x"));
+    CHECK(rejected(L"3.6.1"));
+    CHECK(rejected(L"3t"));
+    CHECK(rejected(L"3.13tt"));
+    CHECK(rejected(L"256"));
+    CHECK(rejected(L"3.10000"));
+}
+
+static void
+test_parse_tags()
+{
+    PY_VERSION v;
+
+    CHECK(parse_version(L"3.6-32", &v, FALSE) && (v.minor == 6) &&
+          (v.arch == ARCH_32));
+    CHECK(parse_version(L"2.7-foo", &v, FALSE) && (v.major == 2) &&
+          (v.minor == 7) && (v.arch == ARCH_ANY));
+    CHECK(parse_version(L"3.x", &v, FALSE) && (v.major == 3) &&
+          (v.minor == -1));
+    CHECK(!parse_version(L"foo", &v, FALSE) && (v.major == -1));
+}
+
+static PY_VERSION
+request(const wchar_t * text)
+{
+    PY_VERSION v;
+
+    parse_version(text, &v, TRUE);
+    return v;
+}
+
+static void
+test_matching()
+{
+    PY_VERSION have = request(L"3.12-arm64");
+    PY_VERSION wanted;
+
+    wanted = request(L"3");
+    CHECK(version_matches(&wanted, &have));
+    wanted = request(L"3.12-64");
+    CHECK(version_matches(&wanted, &have));
+    wanted = request(L"3.12-32");
+    CHECK(!version_matches(&wanted, &have));
+    wanted = request(L"3.12t");
+    CHECK(!version_matches(&wanted, &have));
+    wanted = request(L"3.1");
+    CHECK(!version_matches(&wanted, &have));
+    /* arm64 could be beaten by x64 unless arm64 is asked for */
+    wanted = request(L"3.12");
+    CHECK(!version_is_best(&wanted, &have));
+    wanted = request(L"3.12-arm64");
+    CHECK(version_is_best(&wanted, &have));
+    wanted = request(L"3");
+    have = request(L"3.12-64");
+    CHECK(!version_is_best(&wanted, &have));
+}
+
+static INSTALLED_PYTHON *
+make_table(const wchar_t ** tags, size_t n)
+{
+    INSTALLED_PYTHON * result = calloc(n, sizeof(INSTALLED_PYTHON));
+    size_t i;
+
+    for (i = 0; i < n; i++) {
+        wcscpy(result[i].version, tags[i]);
+        parse_version(tags[i], &result[i].parsed, FALSE);
+        if (result[i].parsed.arch == ARCH_ANY)
+            result[i].parsed.arch = ARCH_64;
+        result[i].bits = (result[i].parsed.arch == ARCH_32) ? 32 : 64;
+        result[i].order = (unsigned int) i;
+    }
+    qsort(result, n, sizeof(INSTALLED_PYTHON), compare_installed);
+    return result;
+}
+
+static const wchar_t *
+find(VERSION_INDEX * index, INSTALLED_PYTHON * table, const wchar_t * text)
+{
+    PY_VERSION wanted = request(text);
+    long i = version_index_find(index, &wanted);
+
+    return (i < 0) ? L"" : table[i].version;
+}
+
+static void
+test_ordering()
+{
+    static const wchar_t * tags[] = {
+        L"3.9", L"3.10-32", L"3.10", L"2.7", L"3.13t", L"3.12-arm64",
+        L"3.13", L"3.12", L"foo",
+    };
+    static const wchar_t * expected[] = {
+        L"3.13", L"3.13t", L"3.12", L"3.12-arm64", L"3.10", L"3.10-32",
+        L"3.9", L"2.7", L"foo",
+    };
+    INSTALLED_PYTHON * table = make_table(tags, 9);
+    size_t i;
+
+    for (i = 0; i < 9; i++)
+        CHECK(wcscmp(table[i].version, expected[i]) == 0);
+    free(table);
+}
+
+static void
+test_index()
+{
+    static const wchar_t * tags[] = {
+        L"3.9", L"3.10-32", L"3.10", L"2.7-32", L"3.13t", L"3.12-arm64",
+        L"3.13", L"2.6", L"foo",
+    };
+    INSTALLED_PYTHON * table = make_table(tags, 9);
+    VERSION_INDEX index;
+
+    CHECK(version_index_build(&index, table, 9));
+    CHECK(!wcscmp(find(&index, table, L"3"), L"3.13"));
+    CHECK(!wcscmp(find(&index, table, L"2"), L"2.7-32"));
+    CHECK(!wcscmp(find(&index, table, L"3.10"), L"3.10"));
+    CHECK(!wcscmp(find(&index, table, L"3.10-32"), L"3.10-32"));
+    CHECK(!wcscmp(find(&index, table, L"3.10-64"), L"3.10"));
+    CHECK(!wcscmp(find(&index, table, L"3-32"), L"3.10-32"));
+    CHECK(!wcscmp(find(&index, table, L"3.1"), L""));
+    CHECK(!wcscmp(find(&index, table, L"3.13t"), L"3.13t"));
+    CHECK(!wcscmp(find(&index, table, L"3.12"), L"3.12-arm64"));
+    CHECK(!wcscmp(find(&index, table, L"3.12-64"), L"3.12-arm64"));
+    CHECK(!wcscmp(find(&index, table, L"3.12-arm64"), L"3.12-arm64"));
+    CHECK(!wcscmp(find(&index, table, L"3-arm64"), L"3.12-arm64"));
+    CHECK(!wcscmp(find(&index, table, L"3.12-32"), L""));
+    CHECK(!wcscmp(find(&index, table, L"4"), L""));
+    version_index_free(&index);
+    free(table);
+}
+
+static void
+test_other_companies()
+{
+    static const wchar_t * tags[] = { L"3.12", L"3.11", L"3.13" };
+    INSTALLED_PYTHON * table = make_table(tags, 3);
+    VERSION_INDEX index;
+    size_t i;
+
+    /* 3.13 is someone else's, so it's only used when asked for by name. */
+    for (i = 0; i < 3; i++) {
+        if (!wcscmp(table[i].version, L"3.13"))
+            wcscpy(table[i].company, L"ContosoPython");
+        else if (!wcscmp(table[i].version, L"3.11"))
+            wcscpy(table[i].company, L"pythoncore");
+    }
+    CHECK(!is_core_python(&table[0]));
+    CHECK(is_core_python(&table[1]));
+    CHECK(is_core_python(&table[2]));
+    CHECK(version_index_build(&index, table, 3));
+    CHECK(!wcscmp(find(&index, table, L"3"), L"3.12"));
+    CHECK(!wcscmp(find(&index, table, L"3.11"), L"3.11"));
+    CHECK(!wcscmp(find(&index, table, L"3.13"), L""));
+    version_index_free(&index);
+    free(table);
+}
+
+static void
+test_index_agrees_with_linear_search()
+{
+    static const wchar_t * tags[] = {
+        L"3.9", L"3.10-32", L"3.10", L"2.7-32", L"2.7", L"3.13t",
+        L"3.13t-arm64", L"3.12-arm64", L"3.13", L"3.13-32", L"2.6",
+    };
+    static const wchar_t * requests[] = {
+        L"2", L"3", L"2.6", L"2.7", L"2.7-32", L"2.7-64", L"3.9", L"3.9-32",
+        L"3.10", L"3.10-32", L"3.12", L"3.12-64", L"3.12-arm64", L"3.13",
+        L"3.13t", L"3.13t-arm64", L"3.13t-32", L"3-32", L"3-arm64",
+        L"2-arm64", L"3.11",
+    };
+    size_t num_tags = sizeof(tags) / sizeof(tags[0]);
+    size_t num_requests = sizeof(requests) / sizeof(requests[0]);
+    INSTALLED_PYTHON * table = make_table(tags, num_tags);
+    VERSION_INDEX index;
+    PY_VERSION wanted;
+    size_t i, j;
+    long expected;
+
+    CHECK(version_index_build(&index, table, num_tags));
+    for (i = 0; i < num_requests; i++) {
+        wanted = request(requests[i]);
+        expected = -1;
+        for (j = 0; j < num_tags; j++) {
+            if (version_matches(&wanted, &table[j].parsed)) {
+                expected = (long) j;
+                break;
+            }
+        }
+        CHECK(version_index_find(&index, &wanted) == expected);
+    }
+    version_index_free(&index);
+    free(table);
+}
+
+static void
+test_large_table()
+{
+    size_t n = 5000, i;
+    INSTALLED_PYTHON * table = calloc(n, sizeof(INSTALLED_PYTHON));
+    VERSION_INDEX index;
+    PY_VERSION wanted;
+
+    for (i = 0; i < n; i++) {
+        table[i].parsed.major = 3;
+        table[i].parsed.minor = (int) (n - i);
+        table[i].parsed.arch = (i % 2) ? ARCH_32 : ARCH_64;
+        table[i].order = (unsigned int) i;
+    }
+    CHECK(version_index_build(&index, table, n));
+    wanted = request(L"3");
+    CHECK(version_index_find(&index, &wanted) == 0);
+    wanted = request(L"3-32");
+    CHECK(version_index_find(&index, &wanted) == 1);
+    wanted = request(L"3.1");
+    CHECK(version_index_find(&index, &wanted) == (long) (n - 1));
+    version_index_free(&index);
+    free(table);
+}
+
+int
+main()
+{
+    RUN(test_parse_requests);
+    RUN(test_parse_tags);
+    RUN(test_matching);
+    RUN(test_ordering);
+    RUN(test_index);
+    RUN(test_other_companies);
+    RUN(test_index_agrees_with_linear_search);
+    RUN(test_large_table);
+    return TEST_RESULT();
+}
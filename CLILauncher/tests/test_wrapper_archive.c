@@ -0,0 +1,124 @@
+/*
+ * Tests for finding a script appended to a wrapper executable.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "script_header.h"
+#include "wrapper_archive.h"
+#include "testing.h"
+
+static const char stub[] = "MZ\220\0\003\0\0\0pretend wrapper executable";
+static const char payload[] =
+    "#!/usr/bin/env python3 -u\nPK\003\004\024\0\0\0\010\0rest of zip";
+
+/* Make a wrapper: stub, payload and trailer. Returns its size. */
+static size_t
+make_wrapper(unsigned char * file)
+{
+    size_t size = 0;
+
+    memcpy(file, stub, sizeof(stub) - 1);
+    size += sizeof(stub) - 1;
+    memcpy(file + size, payload, sizeof(payload) - 1);
+    size += sizeof(payload) - 1;
+    archive_make_trailer(sizeof(stub) - 1, file + size);
+    return size + ARCHIVE_TRAILER_SIZE;
+}
+
+static void
+test_round_trip()
+{
+    unsigned char file[200];
+    size_t size = make_wrapper(file);
+    ARCHIVE_INFO info;
+    SCRIPT_HEADER header;
+    wchar_t line[100];
+    const unsigned char * p;
+
+    /* Everything is found from the last ARCHIVE_TRAILER_SIZE bytes. */
+    CHECK(archive_parse_trailer(file + size - ARCHIVE_TRAILER_SIZE, size,
+                                &info));
+    CHECK(info.offset == sizeof(stub) - 1);
+    CHECK(info.size == sizeof(payload) - 1);
+    p = file + info.offset;
+    CHECK(!memcmp(p, payload, (size_t) info.size));
+    /* The payload's shebang line is read from where it starts. */
+    CHECK(header_classify(p, (size_t) info.size, TRUE, &header) == 0);
+    CHECK(header.kind == HEADER_ZIPAPP);
+    CHECK(header_decode_line(p, &header, line) == 25);
+    CHECK(!wcscmp(line, L"#!/usr/bin/env python3 -u"));
+}
+
+static void
+test_offsets()
+{
+    unsigned char trailer[ARCHIVE_TRAILER_SIZE];
+    ARCHIVE_INFO info;
+
+    archive_make_trailer(0x0102030405060708ULL, trailer);
+    CHECK(trailer[0] == 0x08);
+    CHECK(trailer[7] == 0x01);
+    CHECK(!memcmp(trailer + 8, "PYWRAP01", 8));
+    CHECK(archive_parse_trailer(trailer, 0x0102030405060800ULL, &info));
+    CHECK(info.offset == 0x0102030405060708ULL);
+    CHECK(info.size == 0x0102030405060800ULL - 0x0102030405060708ULL - 16);
+    /* a payload of one byte */
+    archive_make_trailer(10, trailer);
+    CHECK(archive_parse_trailer(trailer, 27, &info));
+    CHECK(info.size == 1);
+}
+
+static void
+test_invalid()
+{
+    unsigned char trailer[ARCHIVE_TRAILER_SIZE];
+    ARCHIVE_INFO info;
+
+    archive_make_trailer(10, trailer);
+    /* too short to hold the trailer */
+    CHECK(!archive_parse_trailer(trailer, ARCHIVE_TRAILER_SIZE - 1, &info));
+    /* no room for the payload */
+    CHECK(!archive_parse_trailer(trailer, 26, &info));
+    CHECK(!archive_parse_trailer(trailer, 20, &info));
+    /* no executable in front */
+    archive_make_trailer(0, trailer);
+    CHECK(!archive_parse_trailer(trailer, 100, &info));
+    /* not a trailer at all: an ordinary executable, or a newer format */
+    memset(trailer, 0, sizeof(trailer));
+    CHECK(!archive_parse_trailer(trailer, 100, &info));
+    archive_make_trailer(10, trailer);
+    trailer[15] = '2';
+    CHECK(!archive_parse_trailer(trailer, 100, &info));
+}
+
+static void
+test_python_supported()
+{
+    static const PY_VERSION supported[] = {
+        { 3, 8, FALSE, ARCH_64 }, { 3, 13, TRUE, ARCH_ARM64 },
+        { 4, 0, FALSE, ARCH_32 }, { 3, -1, FALSE, ARCH_ANY },
+        { -1, -1, FALSE, ARCH_ANY },
+    };
+    static const PY_VERSION unsupported[] = {
+        { 3, 7, FALSE, ARCH_64 }, { 3, 6, FALSE, ARCH_32 },
+        { 2, 7, FALSE, ARCH_64 }, { 2, -1, FALSE, ARCH_ANY },
+    };
+    size_t i;
+
+    for (i = 0; i < sizeof(supported) / sizeof(supported[0]); i++)
+        CHECK(archive_python_supported(&supported[i]));
+    for (i = 0; i < sizeof(unsupported) / sizeof(unsupported[0]); i++)
+        CHECK(!archive_python_supported(&unsupported[i]));
+}
+
+int
+main()
+{
+    RUN(test_round_trip);
+    RUN(test_offsets);
+    RUN(test_invalid);
+    RUN(test_python_supported);
+    return TEST_RESULT();
+}
@@ -0,0 +1,38 @@
+/*
+ * A minimal unit-test harness for the portable launcher modules.
+ *
+ * Each test program defines some test functions, runs them with RUN() from
+ * main() and returns TEST_RESULT().
+ */
+
+#ifndef TESTING_H
+#define TESTING_H
+
+#include <stdio.h>
+
+static int test_failures = 0;
+static int test_checks = 0;
+
+#define CHECK(cond) \
+    do { \
+        ++test_checks; \
+        if (!(cond)) { \
+            ++test_failures; \
+            fprintf(stderr, "%s:%d: check failed: %s\n", __FILE__, \
+                    __LINE__, #cond); \
+        } \
+    } while (0)
+
+#define RUN(test) \
+    do { \
+        int before = test_failures; \
+        test(); \
+        printf("%-50s %s\n", #test, \
+               (test_failures == before) ? "ok" : "FAILED"); \
+    } while (0)
+
+#define TEST_RESULT() \
+    (printf("%d checks, %d failures\n", test_checks, test_failures), \
+     test_failures ? 1 : 0)
+
+#endif
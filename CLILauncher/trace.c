@@ -0,0 +1,206 @@
+/*
+ * Buffered JSON-lines trace output.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdarg.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "trace.h"
+
+#define MIN_CAPACITY    4096
+
+static void
+append(TRACE * trace, const char * s, size_t n)
+{
+    size_t capacity;
+    char * data;
+
+    if (trace->failed)
+        return;
+    if (trace->length + n > trace->capacity) {
+        if (trace->length + n > TRACE_MAX_SIZE) {
+            trace->failed = TRUE;
+            return;
+        }
+        capacity = trace->capacity ? trace->capacity : MIN_CAPACITY;
+        while (capacity < trace->length + n)
+            capacity *= 2;
+        if (capacity > TRACE_MAX_SIZE)
+            capacity = TRACE_MAX_SIZE;
+        data = realloc(trace->data, capacity);
+        if (data == NULL) {
+            trace->failed = TRUE;
+            return;
+        }
+        trace->data = data;
+        trace->capacity = capacity;
+    }
+    memcpy(&trace->data[trace->length], s, n);
+    trace->length += n;
+}
+
+static void
+append_format(TRACE * trace, const char * format, ...)
+{
+    char buffer[64];
+    va_list va;
+    int n;
+
+    va_start(va, format);
+    n = vsnprintf(buffer, sizeof(buffer), format, va);
+    va_end(va);
+    if ((n < 0) || (n >= (int) sizeof(buffer)))
+        trace->failed = TRUE;
+    else
+        append(trace, buffer, n);
+}
+
+static void
+append_name(TRACE * trace, const char * name)
+{
+    append_format(trace, ", \"%s\": ", name);
+}
+
+/* Write a string as JSON, escaping anything outside printable ASCII. */
+static void
+append_string(TRACE * trace, const wchar_t * s)
+{
+    unsigned long c;
+    char ch;
+
+    append(trace, "\"", 1);
+    for (; *s; s++) {
+        c = (unsigned long) *s;
+        if ((c == '"') || (c == '\\')) {
+            ch = (char) c;
+            append(trace, "\\", 1);
+            append(trace, &ch, 1);
+        }
+        else if ((c >= 0x20) && (c <= 0x7E)) {
+            ch = (char) c;
+            append(trace, &ch, 1);
+        }
+        else if (c <= 0xFFFF) {
+            append_format(trace, "\\u%04lx", c);
+        }
+        else if (c <= 0x10FFFF) {   /* only where wchar_t is 32 bits */
+            c -= 0x10000;
+            append_format(trace, "\\u%04lx\\u%04lx", 0xD800 + (c >> 10),
+                          0xDC00 + (c & 0x3FF));
+        }
+        else {
+            append_format(trace, "\\ufffd");
+        }
+    }
+    append(trace, "\"", 1);
+}
+
+void
+trace_begin(TRACE * trace, const char * name, double t_us)
+{
+    trace->event_start = trace->length;
+    trace->failed = FALSE;
+    append_format(trace, "{\"t_us\": %.1f, \"event\": \"%s\"", t_us, name);
+}
+
+void
+trace_string(TRACE * trace, const char * name, const wchar_t * value)
+{
+    append_name(trace, name);
+    if (value == NULL)
+        append(trace, "null", 4);
+    else
+        append_string(trace, value);
+}
+
+void
+trace_number(TRACE * trace, const char * name, double value)
+{
+    append_name(trace, name);
+    append_format(trace, "%.1f", value);
+}
+
+void
+trace_integer(TRACE * trace, const char * name, long long value)
+{
+    append_name(trace, name);
+    append_format(trace, "%lld", value);
+}
+
+void
+trace_histogram(TRACE * trace, const char * name,
+                const HISTOGRAM * histogram)
+{
+    const char * separator = "";
+    int i;
+
+    append_name(trace, name);
+    append_format(trace, "{\"count\": %lu, \"total_us\": %.1f, ",
+                  histogram->count, histogram->total_us);
+    append_format(trace, "\"max_us\": %.1f, \"buckets\": {",
+                  histogram->max_us);
+    for (i = 0; i < HISTOGRAM_BUCKETS; i++) {
+        if (histogram->buckets[i] == 0)
+            continue;
+        if (i == HISTOGRAM_BUCKETS - 1)
+            append_format(trace, "%s\"inf\": %lu", separator,
+                          histogram->buckets[i]);
+        else
+            append_format(trace, "%s\"%lu\": %lu", separator, 1UL << i,
+                          histogram->buckets[i]);
+        separator = ", ";
+    }
+    append(trace, "}}", 2);
+}
+
+void
+trace_end(TRACE * trace)
+{
+    append(trace, "}\n", 2);
+    if (trace->failed) {
+        trace->length = trace->event_start;
+        trace->failed = FALSE;
+        ++trace->dropped;
+    }
+}
+
+void
+trace_clear(TRACE * trace)
+{
+    trace->length = trace->event_start = 0;
+    trace->failed = FALSE;
+}
+
+void
+trace_free(TRACE * trace)
+{
+    free(trace->data);
+    memset(trace, 0, sizeof(TRACE));
+}
+
+int
+histogram_bucket(double us)
+{
+    double bound = 1.0;
+    int i = 0;
+
+    while ((us >= bound) && (i < HISTOGRAM_BUCKETS - 1)) {
+        bound *= 2;
+        ++i;
+    }
+    return i;
+}
+
+void
+histogram_add(HISTOGRAM * histogram, double us)
+{
+    ++histogram->count;
+    histogram->total_us += us;
+    if (us > histogram->max_us)
+        histogram->max_us = us;
+    ++histogram->buckets[histogram_bucket(us)];
+}
@@ -0,0 +1,77 @@
+/*
+ * Structured trace output, enabled with PYLAUNCH_TRACE.
+ *
+ * Events are formatted as lines of JSON into an in-memory buffer, which the
+ * launcher writes out in one go - before it hands over to the child, and at
+ * exit - so that tracing costs a couple of writes however many events there
+ * are. Strings are escaped to plain ASCII, as for "py --resolve".
+ *
+ * An event is built with trace_begin(), then any number of trace_string(),
+ * trace_number(), trace_integer() and trace_histogram() calls, then
+ * trace_end(). If memory runs out, or the buffer reaches TRACE_MAX_SIZE,
+ * the event being built is dropped and counted, rather than failing the
+ * launch.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef TRACE_H
+#define TRACE_H
+
+#include "launcher.h"
+
+/* The most that will be buffered between flushes. */
+#define TRACE_MAX_SIZE      (1024 * 1024)
+
+typedef struct {
+    char * data;
+    size_t length;
+    size_t capacity;
+    size_t event_start;     /* offset of the event being built */
+    BOOL failed;            /* the event being built will be dropped */
+    unsigned long dropped;  /* events dropped so far */
+} TRACE;
+
+/*
+ * Durations, counted in power-of-two buckets: bucket 0 counts durations
+ * under 1 microsecond, and bucket i those from 2^(i-1) up to 2^i. The last
+ * bucket also counts anything longer.
+ */
+#define HISTOGRAM_BUCKETS   32
+
+typedef struct {
+    unsigned long count;
+    double total_us;
+    double max_us;
+    unsigned long buckets[HISTOGRAM_BUCKETS];
+} HISTOGRAM;
+
+/* Start an event called name, at a time in microseconds. */
+void trace_begin(TRACE * trace, const char * name, double t_us);
+
+/* Add a field to the event being built. A NULL value is written as null. */
+void trace_string(TRACE * trace, const char * name, const wchar_t * value);
+void trace_number(TRACE * trace, const char * name, double value);
+void trace_integer(TRACE * trace, const char * name, long long value);
+
+/*
+ * Add a histogram as an object with "count", "total_us" and "max_us", and
+ * "buckets" mapping each non-empty bucket's upper bound (in microseconds)
+ * to its count.
+ */
+void trace_histogram(TRACE * trace, const char * name,
+                     const HISTOGRAM * histogram);
+
+void trace_end(TRACE * trace);
+
+/* Forget what has been buffered, once it has been written out. */
+void trace_clear(TRACE * trace);
+
+void trace_free(TRACE * trace);
+
+void histogram_add(HISTOGRAM * histogram, double us);
+
+/* The bucket a duration is counted in. */
+int histogram_bucket(double us);
+
+#endif
@@ -0,0 +1,251 @@
+/*
+ * Parsing of Python versions, and the index of installed Pythons.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "version_index.h"
+
+#define MAX_MAJOR   255
+#define MAX_MINOR   9999
+
+/*
+ * Parse a decimal number no bigger than limit, returning a pointer to what
+ * follows it, or NULL if there isn't one.
+ */
+static const wchar_t *
+parse_number(const wchar_t * p, int limit, int * result)
+{
+    int n = 0;
+
+    if ((*p < L'0') || (*p > L'9'))
+        return NULL;
+    while ((*p >= L'0') && (*p <= L'9')) {
+        n = n * 10 + (*p++ - L'0');
+        if (n > limit)
+            return NULL;
+    }
+    *result = n;
+    return p;
+}
+
+BOOL
+parse_version(const wchar_t * text, PY_VERSION * v, BOOL strict)
+{
+    const wchar_t * p;
+    const wchar_t * q;
+
+    v->major = v->minor = -1;
+    v->freethreaded = FALSE;
+    v->arch = ARCH_ANY;
+    p = parse_number(text, MAX_MAJOR, &v->major);
+    if (p == NULL) {
+        v->major = -1;
+        return FALSE;
+    }
+    if (*p == L'.') {
+        q = parse_number(p + 1, MAX_MINOR, &v->minor);
+        if (q == NULL) {
+            v->minor = -1;
+            if (strict) {
+                v->major = -1;
+                return FALSE;
+            }
+            return TRUE;
+        }
+        p = q;
+        if ((*p == L't') || (*p == L'T')) {
+            v->freethreaded = TRUE;
+            ++p;
+        }
+    }
+    if (*p == L'-') {
+        if (wcscmp(p + 1, L"32") == 0)
+            v->arch = ARCH_32;
+        else if (wcscmp(p + 1, L"64") == 0)
+            v->arch = ARCH_64;
+        else if (_wcsicmp(p + 1, L"arm64") == 0)
+            v->arch = ARCH_ARM64;
+        else if (strict) {
+            v->major = -1;
+            return FALSE;
+        }
+        return TRUE;
+    }
+    if (*p && strict) {
+        v->major = -1;
+        return FALSE;
+    }
+    return TRUE;
+}
+
+BOOL
+version_matches(const PY_VERSION * wanted, const PY_VERSION * have)
+{
+    if ((have->major < 0) || (have->major != wanted->major))
+        return FALSE;
+    if ((wanted->minor >= 0) && (have->minor != wanted->minor))
+        return FALSE;
+    if (have->freethreaded != wanted->freethreaded)
+        return FALSE;
+    switch (wanted->arch) {
+    case ARCH_ANY:
+        return TRUE;
+    case ARCH_64:
+        return (have->arch == ARCH_64) || (have->arch == ARCH_ARM64);
+    default:
+        return have->arch == wanted->arch;
+    }
+}
+
+BOOL
+version_is_best(const PY_VERSION * wanted, const PY_VERSION * have)
+{
+    int best = wanted->arch;
+
+    if ((best == ARCH_ANY) || (best == ARCH_64))
+        best = ARCH_64;
+    return (wanted->minor >= 0) && version_matches(wanted, have) &&
+           (have->arch == best);
+}
+
+BOOL
+is_core_python(const INSTALLED_PYTHON * ip)
+{
+    return !ip->company[0] || (_wcsicmp(ip->company, CORE_COMPANY) == 0);
+}
+
+/* x64 is preferred to arm64, since it runs (emulated) on arm64 as well. */
+static int
+arch_rank(int arch)
+{
+    switch (arch) {
+    case ARCH_64:
+        return 3;
+    case ARCH_ARM64:
+        return 2;
+    case ARCH_32:
+        return 1;
+    default:
+        return 0;
+    }
+}
+
+int
+compare_installed(const void * p1, const void * p2)
+{
+    const INSTALLED_PYTHON * ip1 = (const INSTALLED_PYTHON *) p1;
+    const INSTALLED_PYTHON * ip2 = (const INSTALLED_PYTHON *) p2;
+    const PY_VERSION * v1 = &ip1->parsed;
+    const PY_VERSION * v2 = &ip2->parsed;
+
+    /* note reverse sorting on version */
+    if (v1->major != v2->major)
+        return v2->major - v1->major;
+    if (v1->minor != v2->minor)
+        return v2->minor - v1->minor;
+    if (v1->freethreaded != v2->freethreaded)
+        return v1->freethreaded - v2->freethreaded;
+    if (v1->arch != v2->arch)
+        return arch_rank(v2->arch) - arch_rank(v1->arch);
+    return (ip1->order > ip2->order) - (ip1->order < ip2->order);
+}
+
+#define KEY_USED    0x80000000U
+
+static unsigned int
+make_key(int major, int minor, int freethreaded, int arch)
+{
+    return KEY_USED | ((unsigned int) major << 20) |
+           ((unsigned int) (minor + 1) << 4) |
+           ((freethreaded ? 1U : 0U) << 2) | (unsigned int) arch;
+}
+
+static size_t
+slot_for(const VERSION_INDEX * index, unsigned int key)
+{
+    /* Fibonacci hashing, then linear probing. */
+    size_t i = (size_t) ((key * 2654435761U) >> 7) & (index->size - 1);
+
+    while (index->keys[i] && (index->keys[i] != key))
+        i = (i + 1) & (index->size - 1);
+    return i;
+}
+
+static void
+add_key(VERSION_INDEX * index, unsigned int key, size_t value)
+{
+    size_t i = slot_for(index, key);
+
+    if (!index->keys[i]) {  /* the first Python added for a key wins */
+        index->keys[i] = key;
+        index->values[i] = value;
+    }
+}
+
+BOOL
+version_index_build(VERSION_INDEX * index, const INSTALLED_PYTHON * pythons,
+                    size_t n)
+{
+    size_t i;
+    int j, k;
+    int minors[2], arches[3];
+    int num_minors, num_arches;
+    const PY_VERSION * v;
+
+    /* Each Python adds at most six keys; keep the table at most half full. */
+    index->size = 16;
+    while (index->size < n * 12)
+        index->size <<= 1;
+    index->keys = calloc(index->size, sizeof(unsigned int));
+    index->values = malloc(index->size * sizeof(size_t));
+    if ((index->keys == NULL) || (index->values == NULL)) {
+        version_index_free(index);
+        return FALSE;
+    }
+    for (i = 0; i < n; i++) {
+        v = &pythons[i].parsed;
+        if ((v->major < 0) || !is_core_python(&pythons[i]))
+            continue;
+        num_minors = 0;
+        minors[num_minors++] = -1;
+        if (v->minor >= 0)
+            minors[num_minors++] = v->minor;
+        num_arches = 0;
+        arches[num_arches++] = ARCH_ANY;
+        if (v->arch == ARCH_ARM64)
+            arches[num_arches++] = ARCH_64;
+        if (v->arch != ARCH_ANY)
+            arches[num_arches++] = v->arch;
+        for (j = 0; j < num_minors; j++)
+            for (k = 0; k < num_arches; k++)
+                add_key(index, make_key(v->major, minors[j],
+                                        v->freethreaded, arches[k]), i);
+    }
+    return TRUE;
+}
+
+long
+version_index_find(const VERSION_INDEX * index, const PY_VERSION * wanted)
+{
+    size_t i;
+
+    if ((index->keys == NULL) || (wanted->major < 0))
+        return -1;
+    i = slot_for(index, make_key(wanted->major, wanted->minor,
+                                 wanted->freethreaded, wanted->arch));
+    return index->keys[i] ? (long) index->values[i] : -1;
+}
+
+void
+version_index_free(VERSION_INDEX * index)
+{
+    free(index->keys);
+    free(index->values);
+    index->keys = NULL;
+    index->values = NULL;
+    index->size = 0;
+}
@@ -0,0 +1,76 @@
+/*
+ * Parsing of Python version tags and requests, and an index for finding the
+ * best installed Python for a request in constant time.
+ *
+ * Tags in the registry (the key names under PythonCore) and version
+ * requests (such as "-3.12" on the command line, "python3.12" in a shebang
+ * line or a [defaults] value) have the form
+ *
+ *     X[.Y][t][-32|-64|-arm64]
+ *
+ * where X and Y are decimal numbers and 't' marks a free-threaded build.
+ * Versions compare numerically, so 3.10 is later than 3.9.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef VERSION_INDEX_H
+#define VERSION_INDEX_H
+
+#include "launcher.h"
+
+/*
+ * Parse a version tag or request. A request must be well-formed; a tag
+ * found in the registry needs only a leading major version, and anything
+ * after the parts recognised is ignored. Returns FALSE if the text can't be
+ * parsed, in which case v->major is set to -1.
+ */
+BOOL parse_version(const wchar_t * text, PY_VERSION * v, BOOL strict);
+
+/* Does an installed Python with version 'have' satisfy 'wanted'? */
+BOOL version_matches(const PY_VERSION * wanted, const PY_VERSION * have);
+
+/*
+ * Could no other installed Python satisfying 'wanted' be preferred to one
+ * with version 'have' (apart from one found earlier)? Only ever true when a
+ * minor version is wanted.
+ */
+BOOL version_is_best(const PY_VERSION * wanted, const PY_VERSION * have);
+
+/*
+ * Is this one of the python.org builds? Only they satisfy version requests;
+ * other companies' Pythons have to be asked for by company and tag. An
+ * empty company counts as PythonCore.
+ */
+BOOL is_core_python(const INSTALLED_PYTHON * ip);
+
+/*
+ * qsort() comparison for INSTALLED_PYTHON, putting the preferred Pythons
+ * first: later versions, then ordinary builds before free-threaded ones,
+ * then x64, arm64 and x86, then discovery order.
+ */
+int compare_installed(const void * p1, const void * p2);
+
+typedef struct {
+    size_t size;            /* number of slots, a power of two */
+    unsigned int * keys;    /* 0 marks an empty slot */
+    size_t * values;        /* index into the table of installed Pythons */
+} VERSION_INDEX;
+
+/*
+ * Build an index over a table of installed Pythons sorted with
+ * compare_installed(). For each request which some Python satisfies - by
+ * major version, X.Y, and either of those with an architecture - the index
+ * records the first such Python; only python.org builds are indexed.
+ * Returns FALSE if memory runs out.
+ */
+BOOL version_index_build(VERSION_INDEX * index,
+                         const INSTALLED_PYTHON * pythons, size_t n);
+
+/* Return the table index of the best match for a request, or -1. */
+long version_index_find(const VERSION_INDEX * index,
+                        const PY_VERSION * wanted);
+
+void version_index_free(VERSION_INDEX * index);
+
+#endif
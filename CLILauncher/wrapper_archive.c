@@ -0,0 +1,53 @@
+/*
+ * Script wrappers with the script appended.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#include <string.h>
+
+#include "wrapper_archive.h"
+
+BOOL
+archive_parse_trailer(const unsigned char * trailer,
+                      unsigned long long file_size, ARCHIVE_INFO * info)
+{
+    unsigned long long offset = 0;
+    int i;
+
+    if (file_size < ARCHIVE_TRAILER_SIZE)
+        return FALSE;
+    if (memcmp(trailer + ARCHIVE_TRAILER_SIZE - ARCHIVE_MAGIC_SIZE,
+               ARCHIVE_MAGIC, ARCHIVE_MAGIC_SIZE))
+        return FALSE;
+    for (i = 7; i >= 0; i--)
+        offset = (offset << 8) | trailer[i];
+    if ((offset == 0) || (offset >= file_size - ARCHIVE_TRAILER_SIZE))
+        return FALSE;
+    info->offset = offset;
+    info->size = file_size - ARCHIVE_TRAILER_SIZE - offset;
+    return TRUE;
+}
+
+BOOL
+archive_python_supported(const PY_VERSION * version)
+{
+    if (version->major < 0)
+        return TRUE;
+    if (version->major != ARCHIVE_MIN_MAJOR)
+        return version->major > ARCHIVE_MIN_MAJOR;
+    return (version->minor < 0) || (version->minor >= ARCHIVE_MIN_MINOR);
+}
+
+void
+archive_make_trailer(unsigned long long offset, unsigned char * trailer)
+{
+    int i;
+
+    for (i = 0; i < 8; i++) {
+        trailer[i] = (unsigned char) (offset & 0xFF);
+        offset >>= 8;
+    }
+    memcpy(trailer + ARCHIVE_TRAILER_SIZE - ARCHIVE_MAGIC_SIZE, ARCHIVE_MAGIC,
+           ARCHIVE_MAGIC_SIZE);
+}
@@ -0,0 +1,62 @@
+/*
+ * Script wrappers with the script appended. Instead of looking for
+ * <name>-script.py next to itself, a wrapper built with SCRIPT_WRAPPER can
+ * carry its script, as a zip application, on the end of its own executable:
+ *
+ *   +-------------+-------------------------------------+---------+
+ *   | wrapper exe | payload: [#! line] zip archive      | trailer |
+ *   +-------------+-------------------------------------+---------+
+ *
+ * The trailer is the last ARCHIVE_TRAILER_SIZE bytes of the file: the
+ * offset of the payload (little-endian, 8 bytes), then ARCHIVE_MAGIC. So a
+ * wrapper finds its payload with one seek, and reads its shebang line with
+ * the same handle. Python runs the executable itself as a zip application,
+ * as zip archives may have other data before them, and a little after -
+ * though only from Python 3.8 (ARCHIVE_MIN_MAJOR.ARCHIVE_MIN_MINOR): before
+ * then, zipimport only looks for an archive's end record at the very end of
+ * the file, so it can't see one with the trailer after it. A wrapper refuses
+ * to run its appended script with an older Python, and stampwrap.py writes
+ * a script which asks for one to a side file instead.
+ *
+ * stampwrap.py in the source distribution makes these.
+ *
+ * Distributed under the same terms as launcher.c.
+ */
+
+#ifndef WRAPPER_ARCHIVE_H
+#define WRAPPER_ARCHIVE_H
+
+#include "launcher.h"
+
+#define ARCHIVE_TRAILER_SIZE    16
+#define ARCHIVE_MAGIC           "PYWRAP01"  /* the digits are the format */
+#define ARCHIVE_MAGIC_SIZE      8
+
+/* The oldest Python which can run an appended script */
+#define ARCHIVE_MIN_MAJOR       3
+#define ARCHIVE_MIN_MINOR       8
+
+typedef struct {
+    unsigned long long offset;  /* where the payload starts */
+    unsigned long long size;    /* how long it is, up to the trailer */
+} ARCHIVE_INFO;
+
+/*
+ * Check the last ARCHIVE_TRAILER_SIZE bytes of a file file_size bytes
+ * long, filling in *info if they're a trailer for a payload which fits in
+ * the file after at least one byte of executable. Returns FALSE if not.
+ */
+BOOL archive_parse_trailer(const unsigned char * trailer,
+                           unsigned long long file_size, ARCHIVE_INFO * info);
+
+/*
+ * Check whether a Python of the given version can run an appended script.
+ * A version which isn't known - an unparsed tag, or a major version alone
+ * - gets the benefit of the doubt.
+ */
+BOOL archive_python_supported(const PY_VERSION * version);
+
+/* Make the trailer for a payload appended at offset. */
+void archive_make_trailer(unsigned long long offset, unsigned char * trailer);
+
+#endif
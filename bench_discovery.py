@@ -0,0 +1,120 @@
+#!python3
+#
+# Counts the registry and file system calls made to find an interpreter for
+# some typical launcher invocations, with discovery finished up front (as the
+# launcher used to do) and done lazily, stopping as soon as the request can
+# be satisfied. With --latency, it also times full discovery with each
+# registry and file system call taking that long, on a range of worker
+# thread counts. This uses the reference implementation (the pylauncher
+# package) with in-memory backends, so it runs on any platform.
+#
+
+import argparse
+import time
+
+from pylauncher import Resolver, VIEW_HKLM, VIEW_WOW64_32
+from pylauncher.fakes import FakeRegistry, FakeFileSystem, FakeEnvironment
+
+# (description, launcher arguments, script contents, environment)
+INVOCATIONS = [
+    ('py -3.6', ['-3.6'], None, {}),
+    ('py -3.6-32', ['-3.6-32'], None, {}),
+    ('py -2.7', ['-2.7'], None, {}),
+    ('py -3', ['-3'], None, {}),
+    ('py (default)', [], None, {}),
+    ('py (PY_PYTHON=3.8)', [], None, {'PY_PYTHON': '3.8'}),
+    ('py (PY_PYTHON3=3.7)', ['-3'], None, {'PY_PYTHON3': '3.7'}),
+    ('#!python3.5', ['script.py'], b'#!python3.5\n', {}),
+    ('#!/usr/bin/env python3', ['script.py'], b'#!/usr/bin/env python3\n',
+     {}),
+    ('.pyc for 3.4', ['script.pyc'], b'\xee\x0c\r\n' + bytes(12), {}),
+]
+
+
+def make_machine(versions, per_user):
+    """
+    A machine with 32- and 64-bit installs of each version. 32-bit ones are
+    installed for all users; 64-bit ones are installed for all users or (as
+    the python.org installers do by default) for the current user. HKCU isn't
+    redirected for 32-bit programs, so per-user installs appear in every
+    HKCU view.
+    """
+    registry = FakeRegistry()
+    fs = FakeFileSystem()
+    for version in versions:
+        name = 'Python%s' % version.replace('.', '')
+        if per_user:
+            install_path = 'C:\\Users\\me\\AppData\\Local\\Programs\\' + name
+            for view in (0, VIEW_WOW64_32):
+                registry.add_python(view, version, install_path)
+        else:
+            install_path = 'C:\\' + name
+            registry.add_python(VIEW_HKLM, version, install_path)
+        fs.add_python(install_path + r'\python.exe', 64)
+        install_path = r'C:\%s-32' % name
+        registry.add_python(VIEW_HKLM | VIEW_WOW64_32, version, install_path)
+        fs.add_python(install_path + r'\python.exe', 32)
+    return registry, fs
+
+
+def count_calls(versions, per_user, args, script, env, lazy):
+    registry, fs = make_machine(versions, per_user)
+    if script is not None:
+        fs.add_file(args[0], script)
+    r = Resolver(registry, fs, FakeEnvironment(env, PATHEXT='.COM;.EXE'))
+    if not lazy:
+        r.installed_pythons
+    r.resolve_args(args)
+    # Don't count reading the script itself
+    return sum(registry.calls.values()), (sum(fs.calls.values()) -
+                                          fs.calls['read'])
+
+
+def time_discovery(versions, per_user, latency, workers):
+    registry, fs = make_machine(versions, per_user)
+    registry.latency = fs.latency = latency
+    r = Resolver(registry, fs, FakeEnvironment(), discovery_workers=workers)
+    start = time.perf_counter()
+    r.installed_pythons
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the calls saved by '
+                                     'lazy interpreter discovery.')
+    parser.add_argument('versions', nargs='*', default=[
+        '2.6', '2.7', '3.3', '3.4', '3.5', '3.6', '3.7', '3.8', '3.9'],
+        help='Python versions installed, in registry order')
+    parser.add_argument('--all-users', action='store_true',
+                        help='install 64-bit Pythons for all users rather '
+                        'than the current user')
+    parser.add_argument('--latency', type=float, metavar='MS',
+                        help='also time full discovery with each registry '
+                        'and file system call taking this long')
+    options = parser.parse_args()
+    per_user = not options.all_users
+    print('%d Pythons installed, 64-bit ones for %s' % (
+          2 * len(options.versions), 'the current user' if per_user
+          else 'all users'))
+    print('%-24s %15s %15s %8s' % ('invocation', 'registry', 'file system',
+                                   'saved'))
+    print('%-24s %7s %7s %7s %7s' % ('', 'full', 'lazy', 'full', 'lazy'))
+    for description, args, script, env in INVOCATIONS:
+        full = count_calls(options.versions, per_user, args, script, env,
+                           False)
+        lazy = count_calls(options.versions, per_user, args, script, env,
+                           True)
+        saved = 100.0 * (1 - float(sum(lazy)) / sum(full))
+        print('%-24s %7d %7d %7d %7d %7.0f%%' % (description, full[0],
+                                                 lazy[0], full[1], lazy[1],
+                                                 saved))
+    if options.latency:
+        print('\nFull discovery, with %gms per call:' % options.latency)
+        for workers in (0, 2, 4, 8):
+            elapsed = time_discovery(options.versions, per_user,
+                                     options.latency / 1000.0, workers)
+            print('%d worker threads: %7.1fms' % (workers, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
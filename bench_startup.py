@@ -0,0 +1,445 @@
+#!python3
+#
+# Measures what the launcher adds to the startup time of a script, and how
+# that is split between its phases, over synthetic fixtures scaled along one
+# dimension at a time:
+#
+#   pythons     installed Pythons in the registry (1-500)
+#   commands    [commands] entries in py.ini (0-5000)
+#   path        directories on PATH (10-300)
+#   shebang     the script's first line: "version" (#! python3), "env"
+#               (#!/usr/bin/env python, which searches PATH) or "utf16"
+#               (a UTF-16 file whose first line fills the launcher's buffer)
+#   invocation  how the launcher is run: "script" (py script.py), "version"
+#               (py -3.12 script.py, which needn't read py.ini) or "venv"
+#               (VIRTUAL_ENV set, and a script without a shebang)
+#
+# On Windows, this runs a built launcher (Debug\py.exe by default, as
+# tests.py does) and python.exe directly, and reports the difference. The
+# phase breakdown comes from the "timings:" line the launcher writes with
+# PYLAUNCH_DEBUG set, so the launcher must be one built from
+# CLILauncher/launcher.c: anything else is reported as an error, rather
+# than measured without its phases. Synthetic Pythons are registered under HKCU with
+# version tags 100.x, so they are scanned but never chosen, and removed
+# afterwards.
+#
+# With --fake (the default on other platforms), the reference implementation
+# (the pylauncher package) is driven against in-memory backends instead, so
+# that the algorithmic parts can be benchmarked anywhere. Reading the
+# version resource and creating the child don't apply there.
+#
+# Results are written as JSON. Given --baseline (the JSON from an earlier
+# run), each measurement is compared with it, and the exit status is 1 if
+# any got slower by more than the threshold.
+#
+
+import argparse
+import collections
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pylauncher import Resolver, VIEW_HKLM
+from pylauncher.fakes import FakeRegistry, FakeFileSystem, FakeEnvironment
+from pylauncher.shebang import BUFSIZE, parse_shebang, read_shebang_line
+
+IS_WINDOWS = sys.platform == 'win32'
+
+LAUNCHER = os.path.join('Debug', 'py.exe')
+
+Fixture = collections.namedtuple('Fixture',
+                                 'pythons commands path shebang invocation')
+
+BASE = Fixture(pythons=10, commands=0, path=10, shebang='version',
+               invocation='script')
+
+SCALES = {
+    'pythons': [1, 10, 100, 500],
+    'commands': [0, 100, 1000, 5000],
+    'path': [10, 100, 300],
+    'shebang': ['version', 'env', 'utf16'],
+    'invocation': ['script', 'version', 'venv'],
+}
+
+# Phases reported by the launcher, in order
+PHASES = ['config', 'version', 'discovery', 'shebang', 'path', 'child']
+
+# Changes smaller than this are noise, whatever the percentage.
+MIN_DELTA_US = 20.0
+
+SYNTHETIC_MAJOR = 100
+
+
+def fixture_name(fixture):
+    return ' '.join('%s=%s' % item for item in fixture._asdict().items())
+
+
+def fixtures(scales):
+    "The base fixture, then each dimension varied on its own."
+    result = [BASE]
+    for field, values in scales.items():
+        for value in values:
+            fixture = BASE._replace(**{field: value})
+            if fixture.invocation == 'venv':
+                # a shebang would take precedence over the environment
+                fixture = fixture._replace(shebang='none')
+            if fixture not in result:
+                result.append(fixture)
+    return result
+
+
+def script_bytes(shebang):
+    if shebang == 'version':
+        return b'#! python3\npass\n'
+    if shebang == 'env':
+        return b'#!/usr/bin/env python\npass\n'
+    if shebang == 'none':
+        return b'pass\n'
+    # As long a first line as fits in the launcher's buffer, after the BOM.
+    line = '#!python3' + ' -E' * ((BUFSIZE - 2) // 2 // 3 - 4) + '\n'
+    return b'\xff\xfe' + (line + 'pass\n').encode('utf-16-le')
+
+
+def ini_bytes(commands):
+    lines = ['[commands]']
+    lines.extend('cmd%d=C:\\Tools\\cmd%d.exe --option' % (i, i)
+                 for i in range(commands))
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def launcher_args(fixture, script, version):
+    "The launcher's arguments, for a fixture's kind of invocation."
+    if fixture.invocation == 'version':
+        return ['-' + version, script]
+    return [script]
+
+
+def synthetic_tags(pythons):
+    "Tags for all but one of the installed Pythons."
+    return ['%d.%d' % (SYNTHETIC_MAJOR, i) for i in range(pythons - 1)]
+
+
+def summarize(samples):
+    return {'median': statistics.median(samples), 'min': min(samples)}
+
+
+#
+# Fake mode: the reference implementation against in-memory backends
+#
+
+FAKE_LAUNCHER_DIR = r'C:\Windows'
+FAKE_PYTHON_DIR = r'C:\Python312'
+FAKE_VENV_DIR = r'C:\Project\.venv'
+
+
+def make_fake_resolver(fixture, script):
+    registry = FakeRegistry()
+    path = [r'C:\Path\dir%d' % i for i in range(fixture.path)]
+    fs = FakeFileSystem(path + [FAKE_PYTHON_DIR])
+    registry.add_python(VIEW_HKLM, '3.12', FAKE_PYTHON_DIR)
+    fs.add_python(FAKE_PYTHON_DIR + r'\python.exe')
+    for tag in synthetic_tags(fixture.pythons):
+        install_path = r'C:\Synthetic\%s' % tag
+        registry.add_python(0, tag, install_path)
+        fs.add_python(install_path + r'\python.exe')
+    for d in path:
+        fs.add_dir(d)
+    fs.add_file(FAKE_LAUNCHER_DIR + r'\py.ini', ini_bytes(fixture.commands))
+    fs.add_file(script, script_bytes(fixture.shebang))
+    env = FakeEnvironment(PATHEXT='.COM;.EXE;.BAT')
+    if fixture.invocation == 'venv':
+        fs.add_python(FAKE_VENV_DIR + r'\Scripts\python.exe')
+        env['VIRTUAL_ENV'] = FAKE_VENV_DIR
+    return Resolver(registry, fs, env, FAKE_LAUNCHER_DIR, None)
+
+
+def time_call(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1e6
+
+
+def run_fake(fixture, repeat):
+    script = r'C:\Scripts\script.py'
+    samples = collections.defaultdict(list)
+    for _ in range(repeat):
+        r = make_fake_resolver(fixture, script)
+        samples['config'].append(time_call(lambda: r.config))
+        samples['discovery'].append(time_call(lambda: r.installed_pythons))
+
+        def sniff():
+            line = read_shebang_line(r.fs.read(script, BUFSIZE))
+            parse_shebang(line, lambda name: r.find_command(name)[0])
+
+        samples['shebang'].append(time_call(sniff))
+        samples['path'].append(time_call(
+            lambda: r.find_on_path(r.executable_name)))
+        r = make_fake_resolver(fixture, script)
+        args = launcher_args(fixture, script, '3.12')
+        samples['total'].append(time_call(lambda: r.resolve_args(args)))
+    return {
+        'name': fixture_name(fixture),
+        'fixture': fixture._asdict(),
+        'phases_us': dict((phase, summarize(values)['median'])
+                          for phase, values in samples.items()
+                          if phase != 'total'),
+        'total_us': summarize(samples['total']),
+    }
+
+
+#
+# Windows mode: the built launcher against a real registry and file system
+#
+
+TIMINGS_RE = re.compile(r'^timings:(.*)\(microseconds\)', re.MULTILINE)
+
+
+class WindowsFixture:
+    "Sets up a fixture on disk and in HKCU, and tears it down again."
+
+    def __init__(self, fixture, launcher, use_cache):
+        import winreg
+        self.winreg = winreg
+        self.fixture = fixture
+        self.root = tempfile.mkdtemp(prefix='pylauncher-bench-')
+        self.keys = []
+        self.launcher = os.path.join(self.root, 'py.exe')
+        shutil.copy(launcher, self.launcher)
+        with open(os.path.join(self.root, 'py.ini'), 'wb') as f:
+            f.write(ini_bytes(fixture.commands))
+        self.script = os.path.join(self.root, 'script.py')
+        with open(self.script, 'wb') as f:
+            f.write(script_bytes(fixture.shebang))
+        for tag in synthetic_tags(fixture.pythons):
+            self.add_python(tag)
+        path = []
+        for i in range(fixture.path):
+            path.append(os.path.join(self.root, 'path', 'dir%d' % i))
+            os.makedirs(path[-1])
+        path.append(os.path.dirname(sys.executable))
+        self.env = dict(os.environ, PATH=os.pathsep.join(path))
+        self.env.pop('PYLAUNCH_DEBUG', None)
+        self.env.pop('VIRTUAL_ENV', None)
+        if fixture.invocation == 'venv':
+            venv = os.path.join(self.root, 'venv')
+            subprocess.run([sys.executable, '-m', 'venv', '--without-pip',
+                            venv], check=True)
+            self.env['VIRTUAL_ENV'] = venv
+        self.args = launcher_args(fixture, self.script,
+                                  '%d.%d' % sys.version_info[:2])
+        if not use_cache:
+            self.env['PYLAUNCH_NO_CACHE'] = '1'
+
+    def add_python(self, tag):
+        winreg = self.winreg
+        install_path = os.path.join(self.root, 'pythons', tag)
+        os.makedirs(install_path)
+        executable = os.path.join(install_path, 'python.exe')
+        try:
+            os.link(sys.executable, executable)
+        except OSError:
+            shutil.copy(sys.executable, executable)
+        key = r'Software\Python\PythonCore\%s' % tag
+        with winreg.CreateKey(winreg.HKEY_CURRENT_USER,
+                              key + r'\InstallPath') as k:
+            winreg.SetValue(k, '', winreg.REG_SZ, install_path)
+        self.keys.append(key)
+
+    def close(self):
+        winreg = self.winreg
+        for key in self.keys:
+            for subkey in (key + r'\InstallPath', key):
+                try:
+                    winreg.DeleteKey(winreg.HKEY_CURRENT_USER, subkey)
+                except OSError:
+                    pass
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def time_run(self, cmdline, env=None):
+        start = time.perf_counter()
+        p = subprocess.run(cmdline, env=env or self.env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = (time.perf_counter() - start) * 1e6
+        if p.returncode:
+            raise RuntimeError('%s failed: %s' % (
+                cmdline, p.stderr.decode('mbcs', 'replace').strip()))
+        return elapsed, p.stderr
+
+    def phases(self):
+        env = dict(self.env, PYLAUNCH_DEBUG='1')
+        _, stderr = self.time_run([self.launcher] + self.args, env)
+        m = TIMINGS_RE.search(stderr.decode('mbcs', 'replace'))
+        if m is None:
+            raise RuntimeError('%s wrote no "timings:" line with '
+                               'PYLAUNCH_DEBUG set: is it built from '
+                               'CLILauncher/launcher.c?' % self.launcher)
+        return dict((name, float(value)) for name, value in
+                    (item.split('=') for item in m.group(1).split()))
+
+
+def run_windows(fixture, repeat, launcher, use_cache):
+    wf = WindowsFixture(fixture, launcher, use_cache)
+    try:
+        # Warm up the file cache (and the discovery cache, if used).
+        wf.time_run([wf.launcher] + wf.args)
+        direct, launched = [], []
+        for _ in range(repeat):
+            direct.append(wf.time_run([sys.executable, wf.script])[0])
+            launched.append(wf.time_run([wf.launcher] + wf.args)[0])
+        phases = wf.phases()
+    finally:
+        wf.close()
+    direct, launched = summarize(direct), summarize(launched)
+    return {
+        'name': fixture_name(fixture),
+        'fixture': fixture._asdict(),
+        'phases_us': phases,
+        'direct_us': direct,
+        'total_us': launched,
+        'overhead_us': launched['median'] - direct['median'],
+    }
+
+
+#
+# Reporting
+#
+
+def metrics(result):
+    "The numbers compared against a baseline, by name."
+    result_metrics = {'total': result['total_us']['median']}
+    if 'overhead_us' in result:
+        result_metrics['overhead'] = result['overhead_us']
+    for phase, value in result['phases_us'].items():
+        result_metrics[phase] = value
+    return result_metrics
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline, returning a list of (name, metric,
+    old, new) for the regressions.
+    """
+    old_results = dict((r['name'], r) for r in baseline['results'])
+    regressions = []
+    print('\n%-68s %-10s %10s %10s %8s' % ('fixture', 'metric', 'baseline',
+                                           'current', 'change'))
+    for result in results:
+        old = old_results.get(result['name'])
+        if old is None:
+            continue
+        old_metrics = metrics(old)
+        for metric, new_value in sorted(metrics(result).items()):
+            old_value = old_metrics.get(metric)
+            if old_value is None:
+                continue
+            change = ((new_value - old_value) / old_value * 100
+                      if old_value else 0.0)
+            flag = ''
+            if (new_value - old_value > MIN_DELTA_US and
+                    new_value > old_value * (1 + threshold / 100.0)):
+                regressions.append((result['name'], metric, old_value,
+                                    new_value))
+                flag = ' !'
+            print('%-68s %-10s %10.1f %10.1f %+7.1f%%%s' % (
+                result['name'], metric, old_value, new_value, change, flag))
+    return regressions
+
+
+def print_result(result):
+    phases = result['phases_us']
+    line = '%-68s %10.1f' % (result['name'], result['total_us']['median'])
+    if 'overhead_us' in result:
+        line += ' %10.1f' % result['overhead_us']
+    line += '  ' + ' '.join('%s=%.1f' % (phase, phases[phase])
+                            for phase in PHASES if phase in phases)
+    print(line)
+
+
+def parse_scale(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark launcher '
+                                     'startup, phase by phase.')
+    parser.add_argument('--fake', action='store_true', default=not IS_WINDOWS,
+                        help='benchmark the reference implementation with '
+                        'in-memory backends (the default off Windows)')
+    parser.add_argument('--launcher', default=LAUNCHER,
+                        help='the launcher to run (default %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='disable the discovery cache (PYLAUNCH_NO_CACHE)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='runs per fixture (default %(default)s)')
+    parser.add_argument('--pythons', type=parse_scale,
+                        help='comma-separated numbers of installed Pythons')
+    parser.add_argument('--commands', type=parse_scale,
+                        help='comma-separated numbers of [commands] entries')
+    parser.add_argument('--path', type=parse_scale,
+                        help='comma-separated numbers of PATH directories')
+    parser.add_argument('--shebang', type=lambda s: s.split(','),
+                        help='comma-separated shebang kinds (%s)' %
+                        ', '.join(SCALES['shebang']))
+    parser.add_argument('--invocation', type=lambda s: s.split(','),
+                        help='comma-separated kinds of invocation (%s)' %
+                        ', '.join(SCALES['invocation']))
+    parser.add_argument('-o', '--output', help='write results as JSON here')
+    parser.add_argument('--baseline', help='compare with results in this '
+                        'JSON file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percentage slowdown counted as a regression '
+                        '(default %(default)s)')
+    options = parser.parse_args(argv)
+    if not options.fake and not IS_WINDOWS:
+        parser.error('only --fake is available on this platform')
+    scales = dict(SCALES)
+    for field in SCALES:
+        if getattr(options, field) is not None:
+            scales[field] = getattr(options, field)
+
+    mode = 'fake' if options.fake else 'windows'
+    results = []
+    header = '%-68s %10s' % ('fixture', 'total us')
+    if not options.fake:
+        header += ' %10s' % 'overhead'
+    print(header + '  phases (us)')
+    for fixture in fixtures(scales):
+        if options.fake:
+            result = run_fake(fixture, options.repeat)
+        else:
+            result = run_windows(fixture, options.repeat, options.launcher,
+                                 not options.no_cache)
+        print_result(result)
+        results.append(result)
+    report = {
+        'mode': mode,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'repeat': options.repeat,
+        'cache': not options.no_cache,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    regressions = []
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('mode') != mode:
+            print('warning: baseline was run in %s mode' % baseline.get('mode'))
+        regressions = compare(results, baseline, options.threshold)
+        print('\n%d regression(s) beyond %.0f%%' % (len(regressions),
+                                                     options.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,27 +6,36 @@ except ImportError:
 import os.path
 import sys
 
+from buildmanifest import Manifest, inputs_digest
 
-def main():
+
+def main(force=False):
+    docs = 'docs'
+    infile = os.path.join(docs, 'launcher.rst')
+    outfile = os.path.join(docs, 'index.html')
+    # docutils.conf, if there is one, is read from the current directory.
+    digest = inputs_digest([infile, 'docutils.conf'])
+    manifest = Manifest()
+    if not force and manifest.is_current(outfile, digest):
+        print('%s is up to date' % outfile)
+        return 0
     if publish_cmdline is None:
         sys.stderr.write(
             'Unable to produce documentation: docutils not found.\n')
         rc = 1
     else:
-        docs = 'docs'
-        infile = os.path.join(docs, 'launcher.rst')
-        outfile = os.path.join(docs, 'index.html')
         try:
             publish_cmdline(writer_name='html',
                             argv=[infile, outfile])
+            manifest.record(outfile, digest)
             rc = 0
         except Exception:
             e = sys.exc_info()[1]
-            sys.stderr.write('Failed when producing documentation: %s\n',
+            sys.stderr.write('Failed when producing documentation: %s\n' %
                              e)
             rc = 2
     return rc
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    sys.exit(main('--force' in sys.argv[1:]))
@@ -0,0 +1,69 @@
+#!python3
+#
+# The build manifest records, for each file the build produces, a digest of
+# the inputs it was made from, so that builddoc.py and buildmsi.py can skip
+# work whose inputs haven't changed. Inputs are compared by content rather
+# than by timestamp, so a fresh checkout, or rebuilding the executables to
+# the same bytes, doesn't force the installers to be rebuilt.
+#
+
+import hashlib
+import json
+import os
+
+MANIFEST = os.path.join('build', 'manifest.json')
+
+
+def file_digest(path):
+    "Return the SHA-256 of a file's contents, or None if it doesn't exist."
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def inputs_digest(paths, extra=()):
+    "Return a digest of the named files' contents and some other strings."
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(('%s\0%s\0' % (path, file_digest(path))).encode('utf-8'))
+    for s in extra:
+        h.update(('%s\0' % s).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Manifest:
+    "Maps output files to the digests of the inputs they were built from."
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, output, digest):
+        "Was output built from inputs with this digest (and is it still there)?"
+        return self.entries.get(output) == digest and os.path.exists(output)
+
+    def record(self, output, digest):
+        self.entries[output] = digest
+        self.save()
+
+    def forget(self, output):
+        if self.entries.pop(output, None) is not None:
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp, self.path)
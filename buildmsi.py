@@ -1,39 +1,100 @@
+import argparse
+import concurrent.futures
 import getpass
 import os
 import sys
 
 import builddoc
 import makemsi
+from buildmanifest import Manifest
 
 VER = '2.1.0.0'
 VERSION = 'Version=%s' % VER
-MANUFACTURER = '"Manufacturer=Oleksis Fraga"'
+MANUFACTURER = 'Manufacturer=Oleksis Fraga'
 X86 = 'Platform=x86'
 X64 = 'Platform=x64'
 TOWIN = 'ToWindows'
 
+# The makemsi.py arguments for each installer.
+VARIANTS = [
+    ['-o', 'launchwin-%s' % VER, X86, VERSION, MANUFACTURER, TOWIN,
+     'launcher'],
+    ['-o', 'launcher-%s' % VER, X86, VERSION, MANUFACTURER, 'launcher'],
+    ['-o', 'launchwin-%s' % VER, X64, VERSION, MANUFACTURER, TOWIN,
+     'launcher'],
+    ['-o', 'launcher-%s' % VER, X64, VERSION, MANUFACTURER, 'launcher'],
+    ['-x', '-o', 'uilauncherwin-%s' % VER, X86, VERSION, MANUFACTURER, TOWIN,
+     'uilauncher'],
+    ['-x', '-o', 'uilauncher-%s' % VER, X86, VERSION, MANUFACTURER,
+     'uilauncher'],
+    ['-x', '-o', 'uilauncherwin-%s' % VER, X64, VERSION, MANUFACTURER, TOWIN,
+     'uilauncher'],
+    ['-x', '-o', 'uilauncher-%s' % VER, X64, VERSION, MANUFACTURER,
+     'uilauncher'],
+]
+
+LOG_DIR = os.path.join('build', 'logs')
+
+
+def build_variant(args, log_path):
+    "Build one installer, on a worker process, logging to log_path."
+    with open(log_path, 'w', encoding='utf-8') as log:
+        try:
+            return makemsi.build(args, log)
+        except Exception as e:
+            log.write('%s\n' % e)
+            return 1
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build the installers.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='How many installers to build at once (default: '
+                             'one for each CPU)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Build everything, even if it is up to date')
+    parser.add_argument('--logs', default=LOG_DIR,
+                        help='Where to write a log for each installer '
+                             '(default: %(default)s)')
+    options = parser.parse_args(args)
 
-def main():
     # signpwd = getpass.getpass('Password for signing:')
     # os.environ['SIGNPWD'] = signpwd
 
-    builddoc.main()
-    makemsi.main(['-o', 'launchwin-%s' %
-                 VER, X86, VERSION, MANUFACTURER, TOWIN, 'launcher'])
-    makemsi.main(['-o', 'launcher-%s' %
-                 VER, X86, VERSION, MANUFACTURER, 'launcher'])
-    makemsi.main(['-o', 'launchwin-%s' %
-                 VER, X64, VERSION, MANUFACTURER, TOWIN, 'launcher'])
-    makemsi.main(['-o', 'launcher-%s' %
-                 VER, X64, VERSION, MANUFACTURER, 'launcher'])
-    makemsi.main(['-x', '-o', 'uilauncherwin-%s' %
-                 VER, X86, VERSION, MANUFACTURER, TOWIN, 'uilauncher'])
-    makemsi.main(['-x','-o', 'uilauncher-%s' %
-                 VER, X86, VERSION, MANUFACTURER, 'uilauncher'])
-    makemsi.main(['-x','-o', 'uilauncherwin-%s' %
-                 VER, X64, VERSION, MANUFACTURER, TOWIN, 'uilauncher'])
-    makemsi.main(['-x','-o', 'uilauncher-%s' %
-                 VER, X64, VERSION, MANUFACTURER, 'uilauncher'])
+    # The UI installers include the HTML documentation, so it comes first.
+    rc = builddoc.main(options.force)
+    if rc:
+        return rc
+    manifest = Manifest()
+    os.makedirs(options.logs, exist_ok=True)
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(options.jobs) as pool:
+        builds = {}
+        for variant in VARIANTS:
+            cmdline = makemsi.parse_args(variant)
+            msifn = makemsi.plan(cmdline)[1]
+            # Taken before building, so that any change to the inputs while
+            # building is seen next time.
+            digest = makemsi.digest(cmdline)
+            if not options.force and manifest.is_current(msifn, digest):
+                print('%s is up to date' % msifn)
+                continue
+            manifest.forget(msifn)
+            log_path = os.path.join(options.logs, msifn[:-len('.msi')] +
+                                    '.log')
+            future = pool.submit(build_variant, variant, log_path)
+            builds[future] = (msifn, digest, log_path)
+        for future in concurrent.futures.as_completed(builds):
+            msifn, digest, log_path = builds[future]
+            if future.result() == 0:
+                manifest.record(msifn, digest)
+                print('Built %s' % msifn)
+            else:
+                failed += 1
+                print('Failed to build %s (log in %s):' % (msifn, log_path))
+                with open(log_path, encoding='utf-8') as f:
+                    print(f.read())
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+#!python3
+#
+# Generates the tables of .pyc magic numbers used by the launcher
+# (CLILauncher/pyc_magic.h) and its Python mirror (pylauncher/magic.py)
+# from the history of MAGIC_NUMBER kept in CPython's sources: the comments
+# in Include/internal/pycore_magic_number.h (Python 3.13 on) or in
+# Lib/importlib/_bootstrap_external.py (before that). By default, the
+# history in the running Python's importlib is used.
+#
+# Each version gets the range from its lowest to its highest magic number.
+# Versions after the last one in the history get the whole block CPython
+# reserves for them - since Python 3.11, 3.n uses 2900 + 50n onwards - so
+# that pre-releases of them are recognised too.
+#
+# Run it again, with a newer history, whenever a Python is released.
+#
+
+import argparse
+import importlib._bootstrap_external
+import os
+import platform
+import re
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+C_OUTPUT = os.path.join(HERE, 'CLILauncher', 'pyc_magic.h')
+PY_OUTPUT = os.path.join(HERE, 'pylauncher', 'magic.py')
+
+# Python 1.x magic numbers clash with nothing, but no launcher can run them.
+OLDEST = (2, 0)
+
+# "Python 3.12a1 3500 (...)", "Python 2.5b3: 62101 (...)", "Python 2.2: 60717"
+ENTRY = re.compile(r'Python (\d+)\.(\d+)[a-z0-9.]*:?\s+(\d{4,5})\b')
+# Python 3000's numbers are listed on their own, one per line.
+PY3000 = re.compile(r'Python 3000:\s+(\d{4})\b')
+CONTINUATION = re.compile(r'^[#\s]*(\d{4})\s+\(')
+
+BLOCK_SIZE = 50
+
+
+def block_start(minor):
+    return 2900 + BLOCK_SIZE * minor
+
+
+def parse_history(text):
+    "Return {(major, minor): [magic, ...]} from a MAGIC_NUMBER history."
+    result = {}
+    current = None
+    for line in text.splitlines():
+        m = PY3000.search(line)
+        if m:
+            current = (3, 0)
+            result.setdefault(current, []).append(int(m.group(1)))
+            continue
+        m = ENTRY.search(line)
+        if m:
+            current = (int(m.group(1)), int(m.group(2)))
+            result.setdefault(current, []).append(int(m.group(3)))
+            continue
+        m = CONTINUATION.match(line)
+        if m and current == (3, 0):
+            result[current].append(int(m.group(1)))
+        elif 'Python' in line:
+            current = None
+    return result
+
+
+def make_ranges(history, through):
+    ranges = []
+    for version, values in history.items():
+        if version >= OLDEST:
+            ranges.append((min(values), max(values), '%d.%d' % version))
+    last = max(history)
+    for minor in range(last[1] + 1, through[1] + 1):
+        start = block_start(minor)
+        ranges.append((start, start + BLOCK_SIZE - 1, '3.%d' % minor))
+    ranges.sort()
+    for (lo1, hi1, v1), (lo2, hi2, v2) in zip(ranges, ranges[1:]):
+        if hi1 >= lo2:
+            raise ValueError('ranges for %s and %s overlap' % (v1, v2))
+    return ranges
+
+
+def write_c(path, ranges, source):
+    lines = [
+        '/*',
+        ' * Generated by genmagic.py - don\'t edit - from the history in',
+        ' * %s.' % source,
+        ' *',
+        ' * The range of .pyc magic numbers used by each version of Python,',
+        ' * sorted for a binary search.',
+        ' */',
+        '',
+        'static const PYC_MAGIC pyc_magic_values[] = {',
+    ]
+    for lo, hi, version in ranges:
+        lines.append('    { %d, %d, L"%s" },' % (lo, hi, version))
+    lines += ['};', '']
+    with open(path, 'w', newline='\r\n') as f:
+        f.write('\n'.join(lines))
+
+
+def write_py(path, ranges, source):
+    lines = [
+        '#',
+        '# Generated by genmagic.py - don\'t edit - from the history in',
+        '# %s.' % source,
+        '#',
+        '',
+        '# (min, max, version) - .pyc magic number ranges for each Python '
+        'version,',
+        '# sorted by magic number',
+        'MAGIC_VALUES = [',
+    ]
+    for lo, hi, version in ranges:
+        lines.append("    (%d, %d, '%s')," % (lo, hi, version))
+    lines += [']', '']
+    with open(path, 'w', newline='\n') as f:
+        f.write('\n'.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the tables of '
+                                     '.pyc magic numbers.')
+    parser.add_argument('history', nargs='?',
+                        help='pycore_magic_number.h or _bootstrap_external.py '
+                        'from a CPython source tree (default: the running '
+                        "Python's importlib)")
+    parser.add_argument('--through', default='3.15',
+                        help='the latest version to cover (default: '
+                        '%(default)s)')
+    args = parser.parse_args()
+    if args.history:
+        path = args.history
+        source = 'CPython\'s %s' % os.path.basename(path)
+    else:
+        path = importlib._bootstrap_external.__file__
+        source = 'importlib/_bootstrap_external.py (Python %s)' % (
+            platform.python_version())
+    with open(path, encoding='utf-8') as f:
+        history = parse_history(f.read())
+    through = tuple(int(n) for n in args.through.split('.'))
+    ranges = make_ranges(history, through)
+    write_c(C_OUTPUT, ranges, source)
+    write_py(PY_OUTPUT, ranges, source)
+    print('wrote %d versions, through %s' % (len(ranges), args.through))
+
+
+if __name__ == '__main__':
+    main()
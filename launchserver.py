@@ -0,0 +1,577 @@
+#!python3
+#
+# A launch server: keeps interpreters started and waiting, so that the
+# launcher can hand a script to one rather than starting a new process for
+# it. For short scripts run many times over, starting the interpreter and
+# importing the modules they use can take longer than running them.
+#
+#   launchserver.py serve [--size [VERSION=]N ...] [--idle SECONDS]
+#                         [--preload MODULE,...] [--address FILE]
+#   launchserver.py stats [--address FILE]
+#
+# The server listens on the loopback interface, and writes its port and a
+# random token, which clients must present, to an address file that only
+# its user can read. Setting PYLAUNCH_SERVER to that file's path has the
+# launcher use the server (see CLILauncher/launch_server.h for the
+# protocol); if it can't be reached, the launcher runs scripts itself.
+#
+# There is a pool of interpreters for each executable (and each set of
+# PYTHON* environment variables, which act as an interpreter starts up).
+# Each interpreter runs a single script: it starts, imports any modules to
+# preload, then waits to be told the script, its arguments, the current
+# directory and the environment. Its standard streams are relayed to and
+# from the launcher. A pool is topped up in the background as its
+# interpreters are used, to --size of them (which can be given for each
+# version), and emptied once it hasn't been used for --idle seconds.
+#
+
+import argparse
+import collections
+import json
+import os
+import secrets
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+HEADER = struct.Struct('<BI')
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+# Frame types, as in launch_server.h
+REQUEST = ord('Q')
+ACCEPT = ord('A')
+REFUSE = ord('R')
+STDIN = ord('I')
+STDOUT = ord('O')
+STDERR = ord('E')
+EXIT = ord('X')
+STATS = ord('S')
+
+DEFAULT_SIZE = 2
+DEFAULT_IDLE = 600.0
+
+# Run by each interpreter in the pool: preload modules, then wait for a
+# script to run, given as a line of JSON on stdin. Kept to what Python 2.7
+# understands, too.
+BOOTSTRAP = r'''
+import sys
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except Exception:
+        pass
+import json, os, runpy
+job = json.loads(getattr(sys.stdin, 'buffer', sys.stdin).readline()
+                 .decode('utf-8'))
+os.chdir(job['cwd'])
+os.environ.clear()
+os.environ.update(job['env'])
+sys.argv = job['argv']
+sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+del job
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def default_address_file():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = (os.environ.get('XDG_RUNTIME_DIR') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pylauncher', 'server.txt')
+
+
+def write_address(path, port, token):
+    "Write the address file, readable only by this user, atomically."
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp = path + '.tmp'
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write('%d %s\n' % (port, token))
+    os.replace(temp, path)
+
+
+def read_address(path):
+    "Return (port, token) from an address file."
+    with open(path) as f:
+        port, token = f.read().split()
+    return int(port), token
+
+
+# Frames
+
+def recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    "Return (type, payload) of the next frame."
+    kind, length = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ValueError('frame too long: %d bytes' % length)
+    return kind, recv_exactly(sock, length)
+
+
+def frame(kind, payload=b''):
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def _string(s):
+    data = s.encode('utf-8', 'surrogatepass')
+    return struct.pack('<I', len(data)) + data
+
+
+def _strings(items):
+    return struct.pack('<I', len(items)) + b''.join(map(_string, items))
+
+
+def encode_request(token, version, executable, cwd, argv, env):
+    "Return a request frame, as server_encode_request() makes it."
+    entries = ['%s=%s' % item for item in env.items()
+               if not item[0].startswith('=')]
+    return frame(REQUEST, _string(token) + _string(version) +
+                 _string(executable) + _string(cwd) + _strings(argv) +
+                 _strings(entries))
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u32(self):
+        n, = struct.unpack_from('<I', self.data, self.pos)
+        self.pos += 4
+        return n
+
+    def string(self):
+        n = self.u32()
+        s = self.data[self.pos:self.pos + n]
+        if len(s) != n:
+            raise ValueError('request truncated')
+        self.pos += n
+        return s.decode('utf-8', 'surrogatepass')
+
+    def strings(self):
+        return [self.string() for _ in range(self.u32())]
+
+
+Request = collections.namedtuple('Request',
+                                 'token version executable cwd argv env')
+
+
+def decode_request(payload):
+    r = Reader(payload)
+    token, version, executable, cwd = [r.string() for _ in range(4)]
+    argv = r.strings()
+    env = dict(entry.partition('=')[::2] for entry in r.strings())
+    if r.pos != len(payload):
+        raise ValueError('junk after request')
+    return Request(token, version, executable, cwd, argv, env)
+
+
+# The pool
+
+def startup_env(env):
+    "The environment variables which matter as an interpreter starts."
+    return tuple(sorted((name.upper(), value) for name, value in env.items()
+                        if name.upper().startswith('PYTHON')))
+
+
+def percentiles(values):
+    "Return the median, 95th percentile and maximum, in milliseconds."
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'p50_ms': round(pick(0.5) * 1000, 3),
+            'p95_ms': round(pick(0.95) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3)}
+
+
+class Pool:
+    "The waiting interpreters for one executable and startup environment."
+
+    def __init__(self, executable, version, startup, size, preload):
+        self.executable = executable
+        self.version = version
+        self.startup = startup
+        self.size = size
+        self.preload = preload
+        self.idle = collections.deque()     # (process, when started)
+        self.starting = 0
+        self.last_used = time.monotonic()
+        self.warm = self.cold = self.evicted = self.failed = 0
+        self.dispatch = collections.deque(maxlen=1000)  # seconds
+        self.run = collections.deque(maxlen=1000)
+
+    def start(self):
+        env = {name: value for name, value in os.environ.items()
+               if not name.upper().startswith('PYTHON')}
+        env.update(self.startup)
+        return subprocess.Popen(
+            [self.executable, '-c', BOOTSTRAP] + self.preload,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, env=env,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+
+    def stats(self):
+        return {'executable': self.executable, 'version': self.version,
+                'startup_env': dict(self.startup), 'size': self.size,
+                'waiting': len(self.idle), 'warm': self.warm,
+                'cold': self.cold, 'evicted': self.evicted,
+                'failed': self.failed,
+                'dispatch': percentiles(self.dispatch),
+                'run': percentiles(self.run)}
+
+
+class Pools:
+    """
+    All the pools, topped up and evicted by a maintenance thread. sizes maps
+    version tags to pool sizes, '' being the default for other versions.
+    """
+
+    def __init__(self, sizes=None, idle_timeout=DEFAULT_IDLE, preload=()):
+        self.sizes = dict(sizes or {'': DEFAULT_SIZE})
+        self.idle_timeout = idle_timeout
+        self.preload = list(preload)
+        self.pools = {}
+        self.lock = threading.Condition()
+        self.started = time.monotonic()
+        self.served = self.refused = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.maintain, daemon=True)
+        self.thread.start()
+
+    def size_for(self, version):
+        for tag in (version, version.split('-')[0]):
+            if tag in self.sizes:
+                return self.sizes[tag]
+        return self.sizes.get('', DEFAULT_SIZE)
+
+    def acquire(self, request):
+        """
+        Return (pool, process) for a request: a waiting interpreter if
+        there is one, else a new one. Raises OSError if one can't be
+        started.
+        """
+        key = (os.path.normcase(request.executable),
+               startup_env(request.env))
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = self.pools[key] = Pool(
+                    request.executable, request.version, key[1],
+                    self.size_for(request.version), self.preload)
+            pool.last_used = time.monotonic()
+            process = None
+            while pool.idle and process is None:
+                process = pool.idle.popleft()[0]
+                if process.poll() is not None:
+                    process = None  # it died waiting
+            self.lock.notify()      # to top the pool up
+        if process is not None:
+            pool.warm += 1
+        else:
+            pool.cold += 1
+            try:
+                process = pool.start()
+            except OSError:
+                pool.failed += 1
+                raise
+        return pool, process
+
+    def maintain(self):
+        "Top pools up, and empty those which have been idle too long."
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                now = time.monotonic()
+                wanted = None
+                for key, pool in list(self.pools.items()):
+                    if now - pool.last_used > self.idle_timeout:
+                        pool.evicted += len(pool.idle)
+                        for process, _ in pool.idle:
+                            process.kill()
+                        pool.idle.clear()
+                    elif (wanted is None and
+                          len(pool.idle) + pool.starting < pool.size):
+                        wanted = pool
+                if wanted is None:
+                    self.lock.wait(min(self.idle_timeout / 4, 5.0))
+                    continue
+                wanted.starting += 1
+            try:
+                process = wanted.start()
+            except OSError:
+                process = None
+            with self.lock:
+                wanted.starting -= 1
+                if process is None:
+                    wanted.failed += 1
+                    # Don't spin on an executable which won't start.
+                    wanted.size = 0
+                elif self.closed:
+                    process.kill()
+                else:
+                    wanted.idle.append((process, time.monotonic()))
+
+    def wait_until_full(self, timeout=10.0):
+        "Wait until every pool in use is full (for tests)."
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if all(len(p.idle) >= p.size or
+                       time.monotonic() - p.last_used > self.idle_timeout
+                       for p in self.pools.values()):
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            return {'uptime_s': round(uptime, 3), 'served': self.served,
+                    'refused': self.refused,
+                    'per_second': round(self.served / uptime, 3)
+                                  if uptime else 0.0,
+                    'pools': [pool.stats() for pool in self.pools.values()]}
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for pool in self.pools.values():
+                for process, _ in pool.idle:
+                    process.kill()
+                pool.idle.clear()
+            self.lock.notify()
+        self.thread.join()
+
+
+# The server
+
+class Handler(socketserver.BaseRequestHandler):
+    def send(self, kind, payload=b''):
+        with self.send_lock:
+            self.request.sendall(frame(kind, payload))
+
+    def refuse(self, reason):
+        self.server.pools.refused += 1
+        self.send(REFUSE, reason.encode('utf-8'))
+
+    def handle(self):
+        self.send_lock = threading.Lock()
+        try:
+            kind, payload = read_frame(self.request)
+        except (EOFError, ValueError, OSError):
+            return
+        if kind == STATS:
+            if payload.decode('utf-8', 'replace') == self.server.token:
+                self.send(STATS, json.dumps(self.server.pools.stats())
+                                     .encode('utf-8'))
+            return
+        try:
+            request = decode_request(payload) if kind == REQUEST else None
+        except (ValueError, struct.error):
+            request = None
+        if request is None or request.token != self.server.token:
+            self.refuse('bad request')
+            return
+        # The launcher quotes executables whose paths have spaces in them.
+        request = request._replace(executable=request.executable.strip('"'))
+        if not request.argv:
+            self.refuse('no script')
+            return
+        received = time.monotonic()
+        try:
+            pool, process = self.server.pools.acquire(request)
+        except OSError as e:
+            self.refuse('unable to start %s: %s' % (request.executable, e))
+            return
+        self.send(ACCEPT)
+        self.run(request, pool, process, received)
+
+    def run(self, request, pool, process, received):
+        job = {'argv': request.argv, 'cwd': request.cwd, 'env': request.env}
+        try:
+            process.stdin.write(json.dumps(job).encode('utf-8') + b'\n')
+            process.stdin.flush()
+        except OSError:
+            pass    # it will have exited, and that's reported
+        started = time.monotonic()
+        pool.dispatch.append(started - received)
+        pumps = [threading.Thread(target=self.pump, args=(stream, kind))
+                 for stream, kind in ((process.stdout, STDOUT),
+                                      (process.stderr, STDERR))]
+        for pump in pumps:
+            pump.start()
+        threading.Thread(target=self.relay_stdin, args=(process,),
+                         daemon=True).start()
+        for pump in pumps:
+            pump.join()
+        rc = process.wait()
+        pool.run.append(time.monotonic() - started)
+        with self.server.pools.lock:
+            self.server.pools.served += 1
+        try:
+            self.send(EXIT, struct.pack('<i', rc))
+        except OSError:
+            pass
+
+    def pump(self, stream, kind):
+        try:
+            while True:
+                data = stream.read1(65536)
+                if not data:
+                    break
+                self.send(kind, data)
+        except OSError:
+            pass    # the launcher has gone; the process is killed
+
+    def relay_stdin(self, process):
+        "Relay stdin, and kill the process if the launcher goes away."
+        stdin = process.stdin
+        try:
+            while True:
+                kind, data = read_frame(self.request)
+                if kind != STDIN or stdin is None:
+                    continue
+                if data:
+                    stdin.write(data)
+                    stdin.flush()
+                else:
+                    stdin.close()
+                    stdin = None
+        except (EOFError, ValueError, OSError):
+            if process.poll() is None:
+                process.kill()
+        finally:
+            if stdin is not None:
+                try:
+                    stdin.close()
+                except OSError:
+                    pass
+
+
+class LaunchServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = False
+
+    def __init__(self, pools, address_file, token=None):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.pools = pools
+        self.token = token or secrets.token_hex(16)
+        self.address_file = address_file
+        write_address(address_file, self.server_address[1], self.token)
+
+    def server_close(self):
+        super().server_close()
+        self.pools.close()
+        try:
+            os.remove(self.address_file)
+        except OSError:
+            pass
+
+
+# A client, as the launcher does it
+
+def launch(address_file, executable, argv, version='', cwd=None, env=None,
+           stdin=b'', stdout=None, stderr=None):
+    """
+    Run a script with the server, as the launcher would, relaying stdin
+    (bytes) and writing its output to stdout and stderr (binary files).
+    Returns the exit code, or None if the server couldn't be reached or
+    refused, when the launcher would run the script itself.
+    """
+    try:
+        port, token = read_address(address_file)
+        sock = socket.create_connection(('127.0.0.1', port))
+    except (OSError, ValueError):
+        return None
+    with sock:
+        sock.sendall(encode_request(token, version, executable,
+                                    cwd or os.getcwd(), argv,
+                                    os.environ if env is None else env))
+        kind, payload = read_frame(sock)
+        if kind != ACCEPT:
+            return None
+        sock.sendall(frame(STDIN, stdin) + frame(STDIN) if stdin else
+                     frame(STDIN))
+        while True:
+            kind, payload = read_frame(sock)
+            if kind == STDOUT and stdout is not None:
+                stdout.write(payload)
+            elif kind == STDERR and stderr is not None:
+                stderr.write(payload)
+            elif kind == EXIT:
+                return struct.unpack('<i', payload)[0]
+
+
+def get_stats(address_file):
+    port, token = read_address(address_file)
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(frame(STATS, token.encode('utf-8')))
+        kind, payload = read_frame(sock)
+    return json.loads(payload.decode('utf-8'))
+
+
+def parse_sizes(specs):
+    "Turn [VERSION=]N specifications into a dict of pool sizes."
+    sizes = {'': DEFAULT_SIZE}
+    for spec in specs or []:
+        version, sep, n = spec.rpartition('=')
+        sizes[version] = int(n)
+    return sizes
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run a launch server.')
+    parser.add_argument('--address', default=default_address_file(),
+                        help='The address file (default: %(default)s)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='Run the server')
+    serve.add_argument('--size', action='append', metavar='[VERSION=]N',
+                       help='How many interpreters to keep waiting, for a '
+                            'version or (without one) for any (default: %d)'
+                            % DEFAULT_SIZE)
+    serve.add_argument('--idle', type=float, default=DEFAULT_IDLE,
+                       help='Seconds after which an unused pool is emptied '
+                            '(default: %(default)s)')
+    serve.add_argument('--preload', default='',
+                       help='Modules for interpreters to import while they '
+                            'wait, separated by commas')
+    sub.add_parser('stats', help="Print a running server's statistics")
+    options = parser.parse_args(args)
+    if options.command == 'stats':
+        json.dump(get_stats(options.address), sys.stdout, indent=2)
+        print()
+        return 0
+    pools = Pools(parse_sizes(options.size), options.idle,
+                  [m for m in options.preload.split(',') if m])
+    server = LaunchServer(pools, options.address)
+    print('Serving on port %d; set PYLAUNCH_SERVER=%s to use it' % (
+          server.server_address[1], options.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,45 @@
 #!python
 import argparse
 import os
+import re
 import subprocess
 import sys
 
+from buildmanifest import inputs_digest
 
-def invoke(command):
-    _command = ' '.join(command)
-    print(_command)
-    p = subprocess.Popen(_command,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         shell=True)
-    stdout, stderr = p.communicate()
+# Where the .wxs files find the executables for each platform ($(BinDir)).
+BIN_DIRS = {
+    'x86': 'Release',
+    'x64': os.path.join('x64', 'Release'),
+}
+
+SOURCE_ATTRIBUTE = re.compile(r'\bSource(?:File)?="([^"]+)"')
+
+
+def invoke(command, log=None):
+    """
+    Run a command, given as a list of arguments (no shell is involved), and
+    return its exit code. The command line is written to log (by default,
+    stdout), and so is its output - to stdout only if it fails.
+    """
+    out = log or sys.stdout
+    out.write(subprocess.list2cmdline(command) + '\n')
+    out.flush()
+    try:
+        p = subprocess.run(command, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT)
+    except OSError as e:
+        out.write('%s failed: %s\n' % (command[0], e))
+        return 1
     if p.returncode:
-        print('%s failed:' % command[0])
-        if stderr:
-            print(stderr.decode('utf-8'))
-        if stdout:
-            print(stdout.decode('utf-8'))
-        sys.exit(p.returncode)
+        out.write('%s failed:\n' % command[0])
+    if p.stdout and (p.returncode or log is not None):
+        out.write(p.stdout.decode('utf-8', 'replace'))
+    out.flush()
+    return p.returncode
 
 
-def main(args=None):
+def parse_args(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-o', dest='output')
     parser.add_argument('-x', dest='extensions', action='store_true',
@@ -31,15 +48,23 @@ def main(args=None):
                         help='An option in the form NAME or NAME=VALUE')
     parser.add_argument('wxsname', metavar='WXSNAME',
                         help='The base name of the WiX source file')
-    cmdline = parser.parse_args(args)
+    return parser.parse_args(args)
+
+
+def platform(cmdline):
+    plats = [opt for opt in cmdline.options if opt.startswith('Platform=')]
+    return 'x64' if 'Platform=x64' in plats else 'x86'
+
+
+def plan(cmdline):
+    "Return the wix command for a build, and the files it will write."
     wxsname = cmdline.wxsname
     if cmdline.output:
         msiname = cmdline.output
     else:
         msiname = wxsname
     wxsfn = '%s.wxs' % wxsname
-    objfn = '%s.wixobj' % wxsname
-    opts = cmdline.options
+    opts = list(cmdline.options)
     plats = [opt for opt in opts if opt.startswith('Platform=')]
 
     if not plats:
@@ -52,21 +77,63 @@ def main(args=None):
         msifn = '%s.msi' % msiname
         pdbfn = '%s.wixpdb' % msiname
 
-    if opts:
-        opts = ['-d %s' % opt for opt in opts]
-        # We use WiX v4
-        if cmdline.extensions:
-            opts.extend([
-                            '-ext', 'WixToolset.UI.wixext',
-                            '-ext', 'WixToolset.Util.wixext'
-                        ])  # '-cultures:en-us'
-   
-    invoke(['wix', 'build', '-o', msifn] + opts + [wxsfn])
+    defines = []
+    for opt in opts:
+        defines.extend(['-d', opt])
+    # We use WiX v4
+    if cmdline.extensions:
+        defines.extend([
+                        '-ext', 'WixToolset.UI.wixext',
+                        '-ext', 'WixToolset.Util.wixext'
+                    ])  # '-cultures:en-us'
+    return ['wix', 'build', '-o', msifn] + defines + [wxsfn], msifn, pdbfn
+
+
+def inputs(cmdline):
+    "Return the files a build reads: the .wxs file and the files it names."
+    wxsfn = '%s.wxs' % cmdline.wxsname
+    result = {wxsfn}
+    try:
+        with open(wxsfn, encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return sorted(result)
+    base = os.path.dirname(wxsfn)
+    for source in SOURCE_ATTRIBUTE.findall(text):
+        source = source.replace('$(sys.SOURCEFILEDIR)', '')
+        source = source.replace('$(BinDir)', BIN_DIRS[platform(cmdline)])
+        result.add(os.path.join(base, *re.split(r'[\\/]', source)))
+    return sorted(result)
+
+
+def signing():
+    return bool(os.environ.get('SIGNPWD', '').strip())
+
+
+def digest(cmdline):
+    """
+    Return a digest of everything a build depends on: its inputs' contents,
+    the wix command (which includes the version) and whether it's signed.
+    """
+    command = plan(cmdline)[0]
+    return inputs_digest(inputs(cmdline),
+                         command + ['signed=%s' % signing()])
+
+
+def build(args=None, log=None):
+    "Build an installer, writing progress to log. Return an exit code."
+    command, msifn, pdbfn = plan(parse_args(args))
+    rc = invoke(command, log)
+    if rc:
+        return rc
     os.remove(pdbfn)
-    pwd = os.environ.get('SIGNPWD', '').strip()
-    if pwd:
-        invoke(['sign', '/d', 'Python Launcher Installer', msifn])
-    return 0
+    if signing():
+        rc = invoke(['sign', '/d', 'Python Launcher Installer', msifn], log)
+    return rc
+
+
+def main(args=None):
+    return build(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+#
+# A pure-Python reference implementation of the launcher's resolution logic.
+#
+# The code here mirrors CLILauncher/launcher.c, quirks included, so that the
+# launcher's behaviour can be tested, explored and benchmarked on any
+# platform. The registry, file system and environment are pluggable (see
+# pylauncher.backends and pylauncher.fakes).
+#
+
+from .backends import (Registry, FileSystem, Environment, NullRegistry,
+                       WindowsRegistry, OSFileSystem, OSEnvironment,
+                       VIEW_HKLM, VIEW_WOW64_32, VIEW_WOW64_64)
+from .config import Config
+from .discovery import InstalledPython, locate_all_pythons, registry_views
+from .resolver import Resolver, Resolution, LauncherError
+from .shebang import (BUILTIN_VIRTUAL_PATHS, find_BOM, find_terminator,
+                      parse_shebang, skip_prefix)
+from .versions import (MAGIC_VALUES, PyVersion, VersionIndex, parse_version,
+                       validate_version)
+
+__all__ = [
+    'Registry', 'FileSystem', 'Environment', 'NullRegistry',
+    'WindowsRegistry', 'OSFileSystem', 'OSEnvironment', 'VIEW_HKLM',
+    'VIEW_WOW64_32', 'VIEW_WOW64_64', 'Config', 'InstalledPython',
+    'locate_all_pythons', 'registry_views', 'Resolver', 'Resolution',
+    'LauncherError', 'BUILTIN_VIRTUAL_PATHS', 'find_BOM', 'find_terminator',
+    'parse_shebang', 'skip_prefix', 'MAGIC_VALUES', 'PyVersion',
+    'VersionIndex', 'parse_version', 'validate_version',
+]
@@ -0,0 +1,213 @@
+#
+# The registry, file system and environment, as seen by the resolution code.
+#
+# The resolver never talks to the operating system directly - it goes through
+# one of each of these backends. The classes here talk to the real system;
+# pylauncher.fakes has in-memory versions for use in tests and benchmarks.
+#
+
+import os
+import stat
+import struct
+import sys
+
+# Registry views, encoded as in launcher.c.
+VIEW_HKLM = 1
+VIEW_WOW64_32 = 2
+VIEW_WOW64_64 = 4
+
+REG_SZ = 1
+
+FILE_ATTRIBUTE_DIRECTORY = 0x10
+FILE_ATTRIBUTE_NORMAL = 0x80
+
+# GetBinaryTypeW results which the launcher cares about
+SCS_32BIT_BINARY = 0
+SCS_64BIT_BINARY = 6
+
+IS_WINDOWS = sys.platform == 'win32'
+
+
+def view_name(view):
+    return '%s%s' % ('HKLM' if view & VIEW_HKLM else 'HKCU',
+                     '\\32' if view & VIEW_WOW64_32 else
+                     '\\64' if view & VIEW_WOW64_64 else '')
+
+
+class Registry:
+    "The parts of the registry API used by the launcher."
+
+    def enum_keys(self, view, path):
+        "Return the subkey names of path in order, or None if not openable."
+        raise NotImplementedError
+
+    def query_value(self, view, path, name=None):
+        "Return (value, type) for a value of path, or None."
+        raise NotImplementedError
+
+
+class FileSystem:
+    "The parts of the file system API used by the launcher."
+
+    def attributes(self, path):
+        "Return the file attributes of path, or None if it doesn't exist."
+        raise NotImplementedError
+
+    def binary_type(self, path):
+        "Return SCS_32BIT_BINARY etc. for an executable, or None."
+        raise NotImplementedError
+
+    def read(self, path, size=-1):
+        "Return up to size bytes from the start of path; raise OSError."
+        raise NotImplementedError
+
+    def stamp(self, path):
+        "Return a (mtime, size) tuple for path, or None."
+        raise NotImplementedError
+
+    def search_path(self, name, extension=None, path=None):
+        """
+        Find a file the way SearchPathW(NULL, name, extension, ...) does,
+        returning its full path or None. The extension is only added if name
+        doesn't already have one. The search order is given by path, a list
+        of directories, if specified.
+        """
+        raise NotImplementedError
+
+
+class Environment:
+    "Environment variables, looked up case-insensitively."
+
+    def get(self, key):
+        "Return the value of key, or None if it's unset or blank."
+        raise NotImplementedError
+
+
+class NullRegistry(Registry):
+    "A registry with nothing in it - the default away from Windows."
+
+    def enum_keys(self, view, path):
+        return None
+
+    def query_value(self, view, path, name=None):
+        return None
+
+
+class WindowsRegistry(Registry):
+    def __init__(self):
+        import winreg
+        self.winreg = winreg
+
+    def _open(self, view, path):
+        winreg = self.winreg
+        root = (winreg.HKEY_LOCAL_MACHINE if view & VIEW_HKLM
+                else winreg.HKEY_CURRENT_USER)
+        flags = winreg.KEY_READ
+        if view & VIEW_WOW64_32:
+            flags |= winreg.KEY_WOW64_32KEY
+        if view & VIEW_WOW64_64:
+            flags |= winreg.KEY_WOW64_64KEY
+        return winreg.OpenKeyEx(root, path, 0, flags)
+
+    def enum_keys(self, view, path):
+        try:
+            key = self._open(view, path)
+        except OSError:
+            return None
+        result = []
+        with key:
+            i = 0
+            while True:
+                try:
+                    result.append(self.winreg.EnumKey(key, i))
+                except OSError:
+                    break
+                i += 1
+        return result
+
+    def query_value(self, view, path, name=None):
+        try:
+            with self._open(view, path) as key:
+                return self.winreg.QueryValueEx(key, name)
+        except OSError:
+            return None
+
+
+def pe_binary_type(header):
+    """
+    Work out what GetBinaryTypeW would say about an executable from the
+    start of its contents: SCS_32BIT_BINARY, SCS_64BIT_BINARY or None.
+    """
+    if len(header) < 64 or header[:2] != b'MZ':
+        return None
+    offset = struct.unpack_from('<I', header, 0x3C)[0]
+    if len(header) < offset + 26 or header[offset:offset + 4] != b'PE\0\0':
+        return None
+    magic = struct.unpack_from('<H', header, offset + 24)[0]
+    if magic == 0x10B:
+        return SCS_32BIT_BINARY
+    if magic == 0x20B:
+        return SCS_64BIT_BINARY
+    return None
+
+
+class OSFileSystem(FileSystem):
+    def attributes(self, path):
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            return FILE_ATTRIBUTE_DIRECTORY
+        return FILE_ATTRIBUTE_NORMAL
+
+    def binary_type(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pe_binary_type(f.read(4096))
+        except OSError:
+            return None
+
+    def read(self, path, size=-1):
+        with open(path, 'rb') as f:
+            return f.read(size)
+
+    def stamp(self, path):
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def search_path(self, name, extension=None, path=None):
+        if path is None and IS_WINDOWS:
+            return self._search_path_w(name, extension)
+        if path is None:
+            path = os.environ.get('PATH', '').split(os.pathsep)
+        base = os.path.basename(name)
+        if extension and '.' not in base:
+            name += extension
+        for d in path:
+            if not d:
+                continue
+            candidate = os.path.join(d, name)
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+        return None
+
+    def _search_path_w(self, name, extension):
+        import ctypes
+        buf = ctypes.create_unicode_buffer(1024)
+        n = ctypes.windll.kernel32.SearchPathW(None, name, extension, 1024,
+                                               buf, None)
+        return buf.value if n else None
+
+
+class OSEnvironment(Environment):
+    def __init__(self, environ=None):
+        if environ is None:
+            environ = os.environ
+        self.values = dict((k.upper(), v) for k, v in environ.items())
+
+    def get(self, key):
+        return self.values.get(key.upper()) or None
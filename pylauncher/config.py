@@ -0,0 +1,97 @@
+#
+# py.ini handling, as done by read_config() and get_configured_value() in
+# CLILauncher/launcher.c using the parser in CLILauncher/ini_config.c.
+#
+
+import codecs
+import sys
+
+INI_NAME = 'py.ini'
+
+
+def decode_ini(data):
+    "Decode ini file contents as read_config_file() does."
+    if data.startswith(codecs.BOM_UTF16_LE):
+        return data[2:].decode('utf-16-le', 'replace')
+    if data.startswith(codecs.BOM_UTF8):
+        return data[3:].decode('utf-8', 'replace')
+    if sys.platform == 'win32':
+        return data.decode('mbcs', 'replace')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def _strip(text):
+    return text.strip(' \t\r\f\v')
+
+
+def parse_ini(text):
+    """
+    Parse ini file text into a dict mapping lower-cased section names to
+    dicts mapping lower-cased keys to (key, value) pairs. As with the Windows
+    profile API, only the first section with a given name and the first
+    occurrence of a key in it are used, and values lose surrounding
+    whitespace and one level of matching quotes. Keys with empty values are
+    left out.
+    """
+    result = {}
+    current = None
+    for line in text.split('\n'):
+        line = _strip(line)
+        if not line or line.startswith(';'):
+            continue
+        if line.startswith('['):
+            end = line.find(']')
+            name = _strip(line[1:end] if end >= 0 else line[1:]).lower()
+            if name in result:
+                current = None  # later duplicates are ignored
+            else:
+                current = result[name] = {}
+        elif current is not None and '=' in line:
+            key, value = line.split('=', 1)
+            key = _strip(key)
+            value = _strip(value)
+            if (len(value) >= 2 and value[0] == value[-1] and
+                    value[0] in '\'"'):
+                value = value[1:-1]
+            if key and value:
+                current.setdefault(key.lower(), (key, value))
+    return result
+
+
+class Config:
+    """
+    The launcher's configuration: both ini files parsed into one table, with
+    the per-user file taking precedence over the global one.
+    """
+
+    def __init__(self, fs, launcher_ini_path=None, appdata_ini_path=None):
+        self.entries = {}   # (section, key), lower-cased -> (key, value, path)
+        for path in (launcher_ini_path, appdata_ini_path):
+            if path:
+                self.read(fs, path)
+
+    def read(self, fs, path):
+        "Parse an ini file, overriding anything configured before."
+        try:
+            data = fs.read(path)
+        except OSError:
+            return
+        for section, items in parse_ini(decode_ini(data)).items():
+            for lower_key, (key, value) in items.items():
+                self.entries[section, lower_key] = (key, value, path)
+
+    def find_command(self, name):
+        "Return the configured command line for name, or None."
+        entry = self.entries.get(('commands', name.lower()))
+        return entry[1] if entry else None
+
+    def get_default(self, key):
+        """
+        Return (value, path) for a [defaults] key, or (None, None) if it's
+        not configured in either file.
+        """
+        entry = self.entries.get(('defaults', key.lower()))
+        return (entry[1], entry[2]) if entry else (None, None)
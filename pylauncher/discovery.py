@@ -0,0 +1,277 @@
+#
+# Locating installed Pythons in the registry, as done by discovery.c and
+# locate_all_pythons() in CLILauncher/launcher.c.
+#
+# Each registry view's SOFTWARE\Python key holds a key for each company
+# distributing Python (PEP 514), which holds a key for each installation.
+# Views are scanned, and the candidate executables they name probed, on an
+# optional pool of worker threads; the results are merged in a fixed order
+# which doesn't depend on how the work was scheduled.
+#
+
+import concurrent.futures
+import logging
+
+from .backends import (VIEW_HKLM, VIEW_WOW64_32, VIEW_WOW64_64, REG_SZ,
+                       FILE_ATTRIBUTE_DIRECTORY, SCS_32BIT_BINARY,
+                       SCS_64BIT_BINARY)
+from .versions import (MAX_VERSION_SIZE, ARCH_32, ARCH_64, ARCH_ARM64,
+                       parse_version, sort_key)
+
+logger = logging.getLogger(__name__)
+
+PYTHON_PATH = r'SOFTWARE\Python'
+CORE_COMPANY = 'PythonCore'
+
+MAX_PATH = 260
+MAX_COMPANY_SIZE = 64
+IP_VERSION_SIZE = MAX_VERSION_SIZE    # buffer for subkey names, with NUL
+
+LOCATION_CHECKS = [
+    '\\',
+    '\\PCBuild\\win32\\',
+    '\\PCBuild\\amd64\\',
+    # To support early 32bit versions of Python that stuck the build binaries
+    # directly in PCBuild...
+    '\\PCBuild\\',
+]
+
+# What probing a candidate executable found, as in discovery.h
+PROBE_FOUND = 'found'
+PROBE_MISSING = 'missing'
+PROBE_DIRECTORY = 'directory'
+PROBE_INVALID_TYPE = 'invalid_type'
+PROBE_DUPLICATE = 'duplicate'
+
+
+def is_core_company(company):
+    return not company or company.lower() == CORE_COMPANY.lower()
+
+
+class InstalledPython:
+    "An entry in the launcher's table of installed Pythons."
+
+    def __init__(self, version, bits, executable, view=None, order=0,
+                 company=CORE_COMPANY, sys_version=None):
+        self.version = version          # the registry tag
+        self.bits = bits
+        self.executable = executable    # quoted if it contains spaces
+        self.view = view                # where it was found
+        self.order = order              # position in discovery order
+        self.company = company
+        # Other companies' tags mean nothing in particular, so their
+        # SysVersion is used if they give one.
+        if sys_version and not self.is_core:
+            parsed = parse_version(sys_version, strict=False)
+        else:
+            parsed = parse_version(version, strict=False)
+        # Only the tag can tell arm64 from x64.
+        if parsed.major >= 0 and parsed.arch != ARCH_ARM64:
+            parsed = parsed._replace(arch=ARCH_64 if bits == 64 else ARCH_32)
+        self.parsed = parsed
+
+    @property
+    def is_core(self):
+        "Is this a python.org build? Only they satisfy version requests."
+        return is_core_company(self.company)
+
+    def __repr__(self):
+        return 'InstalledPython(%r, %d, %r)' % (self.version, self.bits,
+                                               self.executable)
+
+    def __eq__(self, other):
+        return (isinstance(other, InstalledPython) and
+                (self.company, self.version, self.bits, self.executable) ==
+                (other.company, other.version, other.bits, other.executable))
+
+    def __hash__(self):
+        return hash((self.company, self.version, self.bits, self.executable))
+
+
+class Candidate:
+    "A candidate executable named by a registry view, before it's probed."
+
+    def __init__(self, view, company, tag, executable, sys_version=None):
+        self.view = view
+        self.company = company
+        self.tag = tag
+        self.executable = executable    # never quoted
+        self.sys_version = sys_version
+
+    def __repr__(self):
+        return 'Candidate(%r, %r, %r)' % (self.company, self.tag,
+                                          self.executable)
+
+
+def registry_views(launcher_bits=64, wow64=True):
+    """
+    Return the registry views to scan, in priority order. A 64-bit launcher
+    looks at the 32-bit views first; a 32-bit launcher on 64-bit Windows
+    looks at the 64-bit views first. Then come the native views.
+    """
+    if launcher_bits == 64:
+        result = [VIEW_WOW64_32, VIEW_HKLM | VIEW_WOW64_32]
+    elif wow64:
+        result = [VIEW_WOW64_64, VIEW_HKLM | VIEW_WOW64_64]
+    else:
+        result = []
+    return result + [0, VIEW_HKLM]
+
+
+def fitting(names, size):
+    "Subkey names, up to the first which wouldn't fit in size characters."
+    result = []
+    for name in names or []:
+        if len(name) >= size:
+            # RegEnumKeyW fails with ERROR_MORE_DATA, ending the enumeration.
+            logger.debug("Can't enumerate registry key %s", name)
+            break
+        result.append(name)
+    return result
+
+
+def query_string(registry, view, path, name=None):
+    value = registry.query_value(view, path, name)
+    if value is None or value[1] != REG_SZ:
+        return None
+    return value[0][:MAX_PATH - 1]
+
+
+def installation_candidates(registry, view, company, tag, executable_name):
+    "The candidate executables for one installation."
+    key_path = '%s\\%s\\%s' % (PYTHON_PATH, company, tag)
+    sys_version = query_string(registry, view, key_path, 'SysVersion')
+    install_path = query_string(registry, view, key_path + '\\InstallPath')
+    if install_path is None:
+        logger.debug('%s: no InstallPath', key_path)
+        return []
+    core = is_core_company(company)
+    parsed = parse_version(sys_version if sys_version and not core else tag,
+                           strict=False)
+    if parsed.major < 0 and not core:
+        return []
+    if install_path.endswith('\\'):
+        install_path = install_path[:-1]
+    stem = executable_name[:-len('.exe')]
+    if not core:
+        name = ('WindowedExecutablePath' if stem == 'pythonw' else
+                'ExecutablePath')
+        executable = query_string(registry, view, key_path + '\\InstallPath',
+                                  name)
+        if not executable:
+            executable = ('%s\\%s' % (install_path, executable_name))
+        return [Candidate(view, company, tag, executable[:MAX_PATH - 1],
+                          sys_version)]
+    if parsed.freethreaded:
+        # Free-threaded builds are installed alongside an ordinary build.
+        executable_name = '%s%d.%dt.exe' % (stem, parsed.major, parsed.minor)
+    return [Candidate(view, company, tag,
+                      (install_path + check + executable_name)[:MAX_PATH - 1])
+            for check in LOCATION_CHECKS]
+
+
+def scan_view(registry, view, executable_name):
+    """
+    Return the candidates in a view, in merge order: PythonCore first, then
+    the other companies by name, then tags in registry order.
+    """
+    names = registry.enum_keys(view, PYTHON_PATH)
+    if names is None:
+        logger.debug('discover: unable to open Python key')
+        return []
+    companies = fitting(names, MAX_COMPANY_SIZE)
+    companies.sort(key=lambda c: (not is_core_company(c), c.lower()))
+    result = []
+    for company in companies:
+        tags = registry.enum_keys(view, '%s\\%s' % (PYTHON_PATH, company))
+        for tag in fitting(tags, IP_VERSION_SIZE):
+            result.extend(installation_candidates(registry, view, company,
+                                                  tag, executable_name))
+    return result
+
+
+def probe(fs, candidate):
+    "Return (outcome, bits) for a candidate executable."
+    attrs = fs.attributes(candidate.executable)
+    if attrs is None:
+        return PROBE_MISSING, 0
+    if attrs & FILE_ATTRIBUTE_DIRECTORY:
+        return PROBE_DIRECTORY, 0
+    binary_type = fs.binary_type(candidate.executable)
+    if binary_type == SCS_64BIT_BINARY:
+        return PROBE_FOUND, 64
+    if binary_type == SCS_32BIT_BINARY:
+        return PROBE_FOUND, 32
+    return PROBE_INVALID_TYPE, 0
+
+
+def _scan_and_probe(executor, registry, fs, view, executable_name):
+    "Scan a view on a worker, then queue the probes of its candidates."
+    candidates = scan_view(registry, view, executable_name)
+    try:
+        return [(c, executor.submit(probe, fs, c)) for c in candidates]
+    except RuntimeError:
+        # Shut down: the caller has stopped merging.
+        return []
+
+
+def _merge_order(registry, fs, views, executable_name, workers):
+    "Yield (candidate, (outcome, bits)) in merge order."
+    if not workers:
+        for view in views:
+            for c in scan_view(registry, view, executable_name):
+                yield c, probe(fs, c)
+        return
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+    try:
+        scans = [executor.submit(_scan_and_probe, executor, registry, fs,
+                                 view, executable_name) for view in views]
+        for scan in scans:
+            for c, result in scan.result():
+                yield c, result.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def discover(registry, fs, views, executable_name, installed, workers=0):
+    """
+    Add installed Pythons to installed, one candidate executable at a time:
+    this generator yields after each, so that the caller can stop as soon as
+    it has what it needs. This mirrors discover_step() in launcher.c. With
+    workers, the registry is scanned and candidates probed ahead of the
+    merge on that many threads.
+    """
+    debug = logger.debug
+    found = set()
+    for c, (outcome, bits) in _merge_order(registry, fs, views,
+                                           executable_name, workers):
+        if outcome == PROBE_FOUND and c.executable.lower() in found:
+            outcome = PROBE_DUPLICATE
+        if outcome == PROBE_FOUND:
+            found.add(c.executable.lower())
+            executable = c.executable
+            if ' ' in executable:
+                executable = '"%s"' % executable
+            debug('discover: %s is a %dbit executable', executable, bits)
+            installed.append(InstalledPython(c.tag, bits, executable, c.view,
+                                             len(installed), c.company,
+                                             c.sys_version))
+        else:
+            debug('discover: %s: %s', c.executable, outcome)
+        yield
+
+
+def sort_pythons(installed):
+    "Sort as compare_installed() in version_index.c does."
+    installed.sort(key=lambda ip: sort_key(ip.parsed) + (ip.order,))
+    return installed
+
+
+def locate_all_pythons(registry, fs, views, executable_name='python.exe',
+                       workers=0):
+    "Return the table of installed Pythons, sorted as the launcher sorts it."
+    installed = []
+    for _ in discover(registry, fs, views, executable_name, installed,
+                      workers):
+        pass
+    return sort_pythons(installed)
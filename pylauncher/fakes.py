@@ -0,0 +1,175 @@
+#
+# In-memory backends, for testing and benchmarking the resolution code on
+# any platform.
+#
+# Paths are Windows paths and are compared case-insensitively; either kind
+# of slash may be used. Each fake counts the calls made to it in its 'calls'
+# attribute, so that tests and benchmarks can see how much work was done.
+# The registry and file system can be given a latency, in seconds, which
+# each call sleeps for, to stand in for a slow registry or disk.
+#
+
+import collections
+import time
+
+from .backends import (Registry, FileSystem, Environment, REG_SZ,
+                       FILE_ATTRIBUTE_DIRECTORY, FILE_ATTRIBUTE_NORMAL,
+                       SCS_32BIT_BINARY, SCS_64BIT_BINARY)
+
+PYTHON_PATH = r'SOFTWARE\Python'
+
+
+def normpath(path):
+    return path.replace('/', '\\').rstrip('\\').lower()
+
+
+def join(*parts):
+    "Join parts of a Windows path."
+    return '\\'.join(p.rstrip('\\/') for p in parts[:-1]) + '\\' + parts[-1]
+
+
+def dirname(path):
+    path = path.replace('/', '\\')
+    i = path.rfind('\\')
+    return path[:i] if i >= 0 else ''
+
+
+class FakeRegistry(Registry):
+    def __init__(self, latency=0):
+        self.keys = {}      # (view, normpath) -> list of subkey names
+        self.values = {}    # (view, normpath, name) -> (value, type)
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    def add_key(self, view, path):
+        parts = path.split('\\')
+        for i in range(len(parts)):
+            key = (view, normpath('\\'.join(parts[:i + 1])))
+            if key not in self.keys:
+                self.keys[key] = []
+                if i:
+                    self.keys[(view, normpath('\\'.join(parts[:i])))].append(
+                        parts[i])
+
+    def set_value(self, view, path, name, value, type=REG_SZ):
+        self.add_key(view, path)
+        self.values[(view, normpath(path), name)] = (value, type)
+
+    def add_python(self, view, version, install_path, company='PythonCore',
+                   sys_version=None, executable_path=None):
+        """
+        Register an installation in a view: by default, under PythonCore,
+        with version as its tag.
+        """
+        key_path = '%s\\%s\\%s' % (PYTHON_PATH, company, version)
+        self.set_value(view, key_path + '\\InstallPath', None, install_path)
+        if sys_version is not None:
+            self.set_value(view, key_path, 'SysVersion', sys_version)
+        if executable_path is not None:
+            self.set_value(view, key_path + '\\InstallPath', 'ExecutablePath',
+                           executable_path)
+
+    def enum_keys(self, view, path):
+        self.calls['enum_keys'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        result = self.keys.get((view, normpath(path)))
+        return None if result is None else list(result)
+
+    def query_value(self, view, path, name=None):
+        self.calls['query_value'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.values.get((view, normpath(path), name))
+
+
+class FakeFileSystem(FileSystem):
+    def __init__(self, search_dirs=None, latency=0):
+        self.files = {}     # normpath -> (path, data, binary type, mtime)
+        self.dirs = set()
+        # Used when search_path() isn't given an explicit path
+        self.search_dirs = list(search_dirs or [])
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    def add_dir(self, path):
+        while path:
+            self.dirs.add(normpath(path))
+            path = dirname(path)
+
+    def add_file(self, path, data=b'', binary_type=None, mtime=0):
+        self.add_dir(dirname(path))
+        self.files[normpath(path)] = (path, data, binary_type, mtime)
+
+    def add_python(self, path, bits=64, mtime=0):
+        "Add an interpreter executable of the given bitness."
+        self.add_file(path, b'MZ', SCS_64BIT_BINARY if bits == 64 else
+                      SCS_32BIT_BINARY, mtime)
+
+    def remove(self, path):
+        del self.files[normpath(path)]
+
+    def attributes(self, path):
+        self.calls['attributes'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        key = normpath(path)
+        if key in self.files:
+            return FILE_ATTRIBUTE_NORMAL
+        if key in self.dirs:
+            return FILE_ATTRIBUTE_DIRECTORY
+        return None
+
+    def binary_type(self, path):
+        self.calls['binary_type'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        entry = self.files.get(normpath(path))
+        return entry[2] if entry else None
+
+    def read(self, path, size=-1):
+        self.calls['read'] += 1
+        entry = self.files.get(normpath(path))
+        if entry is None:
+            raise FileNotFoundError(path)
+        data = entry[1]
+        return data if size < 0 else data[:size]
+
+    def stamp(self, path):
+        self.calls['stamp'] += 1
+        entry = self.files.get(normpath(path))
+        if entry is None:
+            return None
+        return entry[3], len(entry[1])
+
+    def search_path(self, name, extension=None, path=None):
+        self.calls['search_path'] += 1
+        if path is None:
+            path = self.search_dirs
+        base = name.replace('/', '\\').rsplit('\\', 1)[-1]
+        if extension and '.' not in base:
+            name += extension
+        for d in path:
+            self.calls['search_path_probe'] += 1
+            entry = self.files.get(normpath(join(d, name)))
+            if entry:
+                return entry[0]
+        return None
+
+
+class FakeEnvironment(Environment):
+    def __init__(self, values=None, **kwargs):
+        self.values = {}
+        for k, v in dict(values or {}, **kwargs).items():
+            self.values[k.upper()] = v
+        self.calls = collections.Counter()
+
+    def __setitem__(self, key, value):
+        self.values[key.upper()] = value
+
+    def __delitem__(self, key):
+        del self.values[key.upper()]
+
+    def get(self, key):
+        self.calls['get'] += 1
+        return self.values.get(key.upper()) or None
@@ -0,0 +1,33 @@
+#
+# Generated by genmagic.py - don't edit - from the history in
+# importlib/_bootstrap_external.py (Python 3.11.7).
+#
+
+# (min, max, version) - .pyc magic number ranges for each Python version,
+# sorted by magic number
+MAGIC_VALUES = [
+    (3000, 3131, '3.0'),
+    (3141, 3151, '3.1'),
+    (3160, 3180, '3.2'),
+    (3190, 3230, '3.3'),
+    (3250, 3310, '3.4'),
+    (3320, 3351, '3.5'),
+    (3360, 3379, '3.6'),
+    (3390, 3394, '3.7'),
+    (3400, 3413, '3.8'),
+    (3420, 3425, '3.9'),
+    (3430, 3439, '3.10'),
+    (3450, 3495, '3.11'),
+    (3500, 3549, '3.12'),
+    (3550, 3599, '3.13'),
+    (3600, 3649, '3.14'),
+    (3650, 3699, '3.15'),
+    (50823, 50823, '2.0'),
+    (60202, 60202, '2.1'),
+    (60717, 60717, '2.2'),
+    (62011, 62021, '2.3'),
+    (62041, 62061, '2.4'),
+    (62071, 62131, '2.5'),
+    (62151, 62161, '2.6'),
+    (62171, 62211, '2.7'),
+]
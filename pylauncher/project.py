@@ -0,0 +1,155 @@
+#
+# Finding the project a script is in, as done by project_find() in
+# CLILauncher/project.c and find_project() in CLILauncher/launcher.c: the
+# nearest virtual environment (a .venv directory with a pyvenv.cfg in it),
+# .python-version file and py.ini file, walking up from the script's
+# directory.
+#
+# The launcher remembers what each directory held, keyed on the directory's
+# stamp, so that a later walk can skip looking for each name; here every
+# walk looks afresh, which gives the same answers.
+#
+
+import codecs
+import re
+
+from .config import INI_NAME
+from .discovery import MAX_PATH
+
+VENV_NAME = '.venv'
+VENV_CFG = 'pyvenv.cfg'
+PIN_NAME = '.python-version'
+ROOT_NAMES = ('.git', '.hg')    # a repository's root, where walks stop
+MARKERS = (VENV_NAME, PIN_NAME, INI_NAME) + ROOT_NAMES
+
+# The most file system calls made for one walk (PROJECT_MAX_STATS).
+MAX_STATS = 384
+
+# How much of a .python-version file the launcher reads.
+PIN_READ_SIZE = 1024
+
+PIN_RE = re.compile(r'(?:cpython-|python)?([0-9]{1,4})'
+                    r'(?:\.([0-9]{1,4})'
+                    r'(?:\.[0-9]{1,4}(?:(?:a|b|rc)[0-9]{1,4})?)?)?'
+                    r'(t)?(-32|-64|-arm64)?\Z')
+
+
+class Project:
+    "What a walk found. A path is None if it wasn't found."
+
+    def __init__(self):
+        self.venv = None        # the .venv directory
+        self.pin = None         # the .python-version file
+        self.ini = None         # the py.ini file
+        self.version = None     # the version pinned, if the launcher can use it
+        self.dirs = 0           # directories looked at
+        self.stats = 0          # file system calls made
+        self.capped = False     # stopped at MAX_STATS
+
+    def __repr__(self):
+        return 'Project(venv=%r, pin=%r, ini=%r)' % (self.venv, self.pin,
+                                                     self.ini)
+
+    def key(self):
+        "What resolving a script in the project depends on."
+        return self.venv, self.pin, self.ini, self.version
+
+
+def root_length(path):
+    """
+    The length of the root of a full path - "C:\\", "\\\\server\\share", or
+    either with "\\\\?\\" in front - or 0 if it doesn't start with one.
+    """
+    m = re.match(r'(?:\\\\\?\\(?![Uu][Nn][Cc]\\))?[A-Za-z]:\\', path)
+    if m:
+        return m.end()
+    m = re.match(r'(?:\\\\\?\\[Uu][Nn][Cc]\\|\\\\(?!\?\\))[^\\]+\\[^\\]+',
+                 path)
+    return m.end() if m else 0
+
+
+def _join(path, name):
+    "Join a name onto a path, or return None if it wouldn't fit MAX_PATH."
+    result = path + name if path.endswith('\\') else path + '\\' + name
+    return result if len(result) < MAX_PATH else None
+
+
+def find_project(fs, directory, max_stats=MAX_STATS):
+    """
+    Walk up from directory, a full path, to find the project it's in. The
+    walk stops at a repository's root (a directory holding .git or .hg), at
+    the volume's root, once all three files have been found, or once it has
+    made max_stats calls to the file system.
+    """
+    project = Project()
+    path = directory.replace('/', '\\')
+    root = root_length(path)
+    if len(path) >= MAX_PATH or not root:
+        return project
+
+    def exists(path):
+        project.stats += 1
+        return fs.attributes(path) is not None
+
+    while len(path) > root and path.endswith('\\'):
+        path = path[:-1]
+    while True:
+        if project.stats >= max_stats:
+            project.capped = True
+            break
+        if not exists(path):
+            break
+        project.dirs += 1
+        holds = set()
+        for name in MARKERS:
+            if name in ROOT_NAMES and holds & set(ROOT_NAMES):
+                continue
+            marker = _join(path, name)
+            if marker is not None and exists(marker):
+                holds.add(name)
+        # A .venv is only a virtual environment with its pyvenv.cfg.
+        if VENV_NAME in holds and project.venv is None:
+            venv = _join(path, VENV_NAME)
+            cfg = _join(venv, VENV_CFG)
+            if cfg is not None and exists(cfg):
+                project.venv = venv
+        if PIN_NAME in holds and project.pin is None:
+            project.pin = _join(path, PIN_NAME)
+        if INI_NAME in holds and project.ini is None:
+            project.ini = _join(path, INI_NAME)
+        if (holds & set(ROOT_NAMES) or
+                (project.venv and project.pin and project.ini)):
+            break
+        if len(path) <= root:
+            break
+        i = path.rfind('\\')
+        path = path[:i] if i >= root else path[:root]
+    return project
+
+
+def parse_pin(data):
+    """
+    The version named in a .python-version file's contents (bytes): the
+    first line which isn't blank or a comment, such as "3.12", "3.12.4" or
+    "3.13t", reduced to a tag the launcher understands ("3.12", "3.13t").
+    Returns None if there isn't one it can use - for instance, "pypy3.10"
+    or "system".
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[3:]
+    for line in data.split(b'\n'):
+        line = line.lstrip(b' \t')
+        if not line or line[:1] in (b'#', b'\r'):
+            continue
+        # pyenv allows several versions, separated by spaces: the first is
+        # the one used.
+        token = re.split(b'[ \t\r]', line, 1)[0].decode('latin-1')
+        m = PIN_RE.match(token)
+        if m is None:
+            return None
+        major, minor, freethreaded, suffix = m.groups()
+        version = str(int(major))
+        if minor is not None:
+            version += '.%d' % int(minor)
+        return version + (freethreaded or '') + (suffix or '')
+    return None
@@ -0,0 +1,508 @@
+#
+# Deciding which command line to run, as done by process() and
+# maybe_handle_shebang() in CLILauncher/launcher.c, for the console launcher
+# (py.exe) or the windowed one (pyw.exe).
+#
+# Where the C code would run a child process, the resolver returns a
+# Resolution saying what would have been run and why; where the C code would
+# exit with an error, the resolver raises LauncherError with the same return
+# code.
+#
+
+import collections
+import logging
+import threading
+
+from .backends import (IS_WINDOWS, NullRegistry, WindowsRegistry,
+                       OSFileSystem, OSEnvironment)
+from .config import Config, INI_NAME
+from .discovery import discover, sort_pythons, registry_views, MAX_PATH
+from .project import PIN_READ_SIZE, Project, find_project, parse_pin
+from .shebang import (HEADER_PYC, HEADER_READ_SIZE, MSGSIZE, WHITESPACE,
+                      skip_whitespace, classify_header, parse_shebang,
+                      read_shebang_line)
+from .versions import (UNPARSED, VersionIndex, parse_version,
+                       validate_version, version_is_best)
+
+logger = logging.getLogger(__name__)
+
+RC_NO_STD_HANDLES = 100
+RC_CREATE_PROCESS = 101
+RC_BAD_VIRTUAL_PATH = 102
+RC_NO_PYTHON = 103
+RC_NO_MEMORY = 104
+RC_NO_SCRIPT = 105
+
+# Why an executable was chosen
+RULE_MAGIC = 'magic'        # a compiled file's magic number
+RULE_VIRTUAL = 'virtual'    # a virtual shebang such as /usr/bin/python3
+RULE_COMMAND = 'command'    # a [commands] entry in py.ini
+RULE_PATH = 'path'          # a search of PATH
+RULE_SHEBANG = 'shebang'    # a shebang line used verbatim
+RULE_VERSION = 'version'    # a -X.Y launcher argument
+RULE_VENV = 'venv'          # the active virtual environment
+RULE_PROJECT = 'project'    # the script's project's .venv
+RULE_DEFAULT = 'default'    # the default Python
+
+
+class LauncherError(Exception):
+    "Raised where the launcher would exit with an error."
+
+    def __init__(self, rc, message):
+        super().__init__(rc, message)
+        self.rc = rc
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class Resolution:
+    "What the launcher would run, and why."
+
+    def __init__(self, executable, suffix=None, rule=None, python=None,
+                 consumed=0):
+        self.executable = executable
+        self.suffix = suffix    # arguments from the shebang line, if any
+        self.rule = rule
+        self.python = python    # the InstalledPython used, if any
+        # The number of leading arguments which the launcher consumes, and
+        # which are therefore not passed on to the child.
+        self.consumed = consumed
+
+    def __repr__(self):
+        return 'Resolution(%r, %r, %r)' % (self.executable, self.suffix,
+                                           self.rule)
+
+    def __eq__(self, other):
+        return (isinstance(other, Resolution) and
+                (self.executable, self.suffix, self.rule) ==
+                (other.executable, other.suffix, other.rule))
+
+    def command_line(self, cmdline=''):
+        "Return the child's command line, built as invoke_child() builds it."
+        if not self.suffix and not cmdline:
+            return self.executable
+        if not self.suffix:
+            return '%s %s' % (self.executable, cmdline)
+        return '%s %s %s' % (self.executable, self.suffix, cmdline)
+
+
+class Resolver:
+    """
+    The launcher's decision-making, with the registry, file system and
+    environment supplied as backends (see pylauncher.backends).
+
+    launcher_dir is the directory holding the launcher executable, and hence
+    the global py.ini; appdata_dir is the local application data directory
+    holding the per-user py.ini, and defaults to %LOCALAPPDATA%. As in the
+    launcher, PYLAUNCH_LOCAL_INI and PYLAUNCH_GLOBAL_INI in the environment
+    name files to use instead.
+
+    A script's project (see pylauncher.project) is found by walking up from
+    its directory, unless PYLAUNCH_NO_PROJECT is set; its py.ini overrides
+    the other two.
+
+    Installed Pythons and configuration are read on first use and then kept;
+    results of resolve() are cached in an LRU cache of cache_size entries.
+    With discovery_workers, the registry is scanned on that many threads.
+    resolve() may be called from several threads at once: discovery is
+    shared between them, one step at a time. Call invalidate() after
+    changing anything the backends would report.
+    """
+
+    def __init__(self, registry=None, fs=None, env=None, launcher_dir=None,
+                 appdata_dir=None, launcher_bits=64, wow64=True,
+                 windowed=False, cache_size=1024, discovery_workers=0):
+        if registry is None:
+            registry = WindowsRegistry() if IS_WINDOWS else NullRegistry()
+        self.registry = registry
+        self.fs = fs if fs is not None else OSFileSystem()
+        self.env = env if env is not None else OSEnvironment()
+        self.launcher_dir = launcher_dir
+        if appdata_dir is None:
+            appdata_dir = self.env.get('LOCALAPPDATA')
+        self.appdata_dir = appdata_dir
+        self.views = registry_views(launcher_bits, wow64)
+        self.executable_name = 'pythonw.exe' if windowed else 'python.exe'
+        self.cache_size = cache_size
+        self.discovery_workers = discovery_workers
+        self._lock = threading.Lock()
+        # Held while discovery is advanced, and taken before _lock.
+        self._discovery_lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        "Forget everything learned from the backends."
+        with self._discovery_lock, self._lock:
+            self._installed = None
+            self._index = None
+            self._found = []
+            self._scan = None
+            self._config = None
+            self._project_configs = {}
+            self._cache = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def _ini_path(self, directory, override):
+        path = self.env.get(override)
+        if path is None:
+            if not directory:
+                return None
+            path = '%s\\%s' % (directory, INI_NAME)
+        path = path[:MAX_PATH - 1]
+        if self.fs.attributes(path) is None:
+            logger.debug("File '%s' non-existent", path)
+            return None
+        return path
+
+    def _ini_paths(self):
+        return (self._ini_path(self.launcher_dir, 'PYLAUNCH_GLOBAL_INI'),
+                self._ini_path(self.appdata_dir, 'PYLAUNCH_LOCAL_INI'))
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = Config(self.fs, *self._ini_paths())
+        return self._config
+
+    def project_config(self, project):
+        """
+        The configuration for a script in a project: the project's py.ini,
+        read after the other two unless it's one of them.
+        """
+        if project is None or not project.ini:
+            return self.config
+        result = self._project_configs.get(project.ini.lower())
+        if result is None:
+            paths = self._ini_paths()
+            result = Config(self.fs, *paths)
+            if project.ini.lower() not in [p.lower() for p in paths if p]:
+                result.read(self.fs, project.ini)
+            self._project_configs[project.ini.lower()] = result
+        return result
+
+    def find_project(self, path):
+        """
+        Return the Project of the script at path, a full path, with the
+        version its .python-version file pins if the launcher can use it.
+        """
+        if self.env.get('PYLAUNCH_NO_PROJECT') is not None:
+            return Project()
+        path = path.replace('/', '\\')
+        project = find_project(self.fs, path[:path.rfind('\\') + 1])
+        if project.pin:
+            try:
+                version = parse_pin(self.fs.read(project.pin, PIN_READ_SIZE))
+            except OSError:
+                version = None
+            if version is not None and validate_version(version):
+                project.version = version
+            else:
+                logger.debug("'%s' pins no version the launcher can use",
+                             project.pin)
+        return project
+
+    def _discover_step(self):
+        """
+        Merge the next candidate; return False once there are none. Call
+        this with _discovery_lock held.
+        """
+        if self._scan is None:
+            self._scan = discover(self.registry, self.fs, self.views,
+                                  self.executable_name, self._found,
+                                  self.discovery_workers)
+        return next(self._scan, False) is None
+
+    @property
+    def installed_pythons(self):
+        "All the installed Pythons, sorted - discovery is finished if needed."
+        if self._installed is None:
+            with self._discovery_lock:
+                if self._installed is None:
+                    while self._discover_step():
+                        pass
+                    installed = sort_pythons(self._found)
+                    self._index = VersionIndex(installed)
+                    self._installed = installed
+        return self._installed
+
+    def _find_exact_python(self, wanted):
+        """
+        Look for a specific X.Y version while discovery is in progress,
+        returning it as soon as nothing found later could be better, or None
+        if discovery had to be finished. See find_exact_python() in
+        launcher.c.
+        """
+        checked = 0
+        with self._discovery_lock:
+            while self._installed is None:
+                for ip in self._found[checked:]:
+                    if ip.is_core and version_is_best(wanted, ip.parsed):
+                        logger.debug("found '%s' without a full scan",
+                                     ip.executable)
+                        return ip
+                checked = len(self._found)
+                if not self._discover_step():
+                    break
+        return None
+
+    def get_configured_value(self, key, project=None):
+        """
+        Return a value from the environment (as py_<key>), the version the
+        script's project pins or [defaults] in the project's, per-user or
+        global py.ini, in that order; or None. The pinned version is used
+        for "python", or for "pythonX" if it's a version of Python X more
+        precise than that.
+        """
+        result = self.env.get(('py_%s' % key)[:MSGSIZE - 1])
+        found_in = 'environment'
+        pin = project.version if project is not None else None
+        if result is None and pin and (
+                key == 'python' or pin.startswith(key[6:] + '.')):
+            result, found_in = pin, project.pin
+        if result is None:
+            result, found_in = self.project_config(project).get_default(key)
+        if result:
+            logger.debug("found configured value '%s=%s' in %s", key, result,
+                         found_in)
+        else:
+            logger.debug("found no configured value for '%s'", key)
+        return result
+
+    def find_python_by_version(self, wanted_ver):
+        wanted = parse_version(wanted_ver)
+        if wanted is UNPARSED:
+            logger.debug("invalid version request '%s'", wanted_ver)
+            return None
+        if self._installed is None and wanted.minor >= 0:
+            result = self._find_exact_python(wanted)
+            if result is not None:
+                return result
+        self.installed_pythons
+        return self._index.find(wanted)
+
+    def find_python_by_tag(self, wanted):
+        """
+        Find the Python registered by another company (PEP 514) as
+        COMPANY/TAG. Those Pythons are only used when asked for by name.
+        """
+        company, tag = wanted.split('/', 1)
+        for ip in self.installed_pythons:
+            if (ip.company.lower() == company.lower() and
+                    ip.version.lower() == tag.lower()):
+                return ip
+        logger.debug("no Python registered as '%s'", wanted)
+        return None
+
+    def find_python_by_venv(self, project=None):
+        """
+        Return (executable, rule) for the Python of the active virtual
+        environment or, if there isn't one, of the script's project; or
+        (None, None).
+        """
+        virtual_env = self.env.get('VIRTUAL_ENV')
+        rule = RULE_VENV
+        if not virtual_env:
+            if project is None or not project.venv:
+                return None, None
+            virtual_env, rule = project.venv, RULE_PROJECT
+        venv_python = ('%s\\Scripts\\%s' % (virtual_env,
+                                            self.executable_name))
+        venv_python = venv_python[:MAX_PATH - 1]
+        if self.fs.attributes(venv_python) is None:
+            logger.debug('Python executable %s missing from virtual env',
+                         venv_python)
+            return None, None
+        return venv_python, rule
+
+    def locate_python(self, wanted_ver, from_shebang, project=None):
+        if len(wanted_ver) == 1:    # just major version specified
+            configured = self.get_configured_value('python' + wanted_ver,
+                                                   project)
+            if configured is not None:
+                wanted_ver = configured
+        if wanted_ver:
+            return self.find_python_by_version(wanted_ver)
+        result = None
+        configured = self.get_configured_value('python', project)
+        if configured:
+            result = self.find_python_by_version(configured)
+        # From a shebang line, try Python 2 before Python 3, as Unix does;
+        # interactively, assume the latest version is wanted.
+        if result is None:
+            result = self.find_python_by_version('2' if from_shebang else '3')
+        if result is None:
+            result = self.find_python_by_version('3' if from_shebang else '2')
+        return result
+
+    def find_on_path(self, name):
+        if '.' in name:
+            # assume it has an extension.
+            return self.fs.search_path(name)
+        pathext = self.env.get('PATHEXT')
+        if pathext is None:
+            return None
+        for extension in pathext.split(';'):
+            if extension:
+                result = self.fs.search_path(name, extension)
+                if result:
+                    return result[:MSGSIZE - 1]
+        return None
+
+    def find_command(self, name, project=None):
+        "Return (command, rule) for a command name, or (None, None)."
+        result = self.project_config(project).find_command(name)
+        if result is not None:
+            return result, RULE_COMMAND
+        result = self.find_on_path(name)
+        if result is not None:
+            return result, RULE_PATH
+        return None, None
+
+    def read_header(self, path):
+        """
+        Read the start of a script, and more only if classify_header() asks
+        for it, returning (data, header) - as read_header() in launcher.c.
+        """
+        size = HEADER_READ_SIZE
+        while True:
+            data = self.fs.read(path, size)
+            size, header = classify_header(data, len(data) < size)
+            if header is not None:
+                return data, header
+
+    def maybe_handle_shebang(self, path, project=None):
+        """
+        Return the Resolution for a script's first line or magic number, or
+        None if the launcher would go on to its default processing.
+        """
+        try:
+            buffer, header = self.read_header(path)
+        except OSError:
+            return None
+        if header.kind == HEADER_PYC:
+            ip = self.locate_python(header.version, False, project)
+            if ip is not None:
+                return Resolution(ip.executable, None, RULE_MAGIC, ip)
+        line = read_shebang_line(buffer, header)
+        if line is None:
+            return None
+        rules = []
+
+        def find_command(name):
+            value, rule = self.find_command(name, project)
+            rules.append(rule)
+            return value
+
+        is_virt, command, suffix, search = parse_shebang(line, find_command)
+        if command is None:
+            return None
+        if not is_virt:
+            rule = rules[-1] if rules and rules[-1] else RULE_SHEBANG
+            return Resolution(command, suffix, rule)
+        i = command.find(' ')
+        if i >= 0:
+            suffix = skip_whitespace(command[i + 1:])
+            command = command[:i]
+        else:
+            suffix = None
+        if not command.startswith('python'):
+            raise LauncherError(RC_BAD_VIRTUAL_PATH,
+                                "Unknown virtual path '%s'" % command)
+        command = command[6:]   # skip past "python"
+        if search and (not command or command[0] in WHITESPACE):
+            found = self.find_on_path(self.executable_name)
+            if found:
+                return Resolution(found, suffix, RULE_PATH)
+            # No python found on PATH, so fall back to locating the correct
+            # installed python.
+        if command and not validate_version(command):
+            raise LauncherError(RC_BAD_VIRTUAL_PATH, "Invalid version "
+                                "specification: '%s'.\nIn the first line of "
+                                "the script, 'python' needs to be followed "
+                                "by a valid version specifier.\nPlease check "
+                                "the documentation." % command)
+        ip = self.locate_python(command, True, project)
+        if ip is None:
+            raise LauncherError(RC_NO_PYTHON, 'Requested Python version (%s) '
+                                'is not installed' % command)
+        return Resolution(ip.executable, suffix, RULE_VIRTUAL, ip)
+
+    def resolve_args(self, args, project=None):
+        """
+        Return the Resolution for a launcher invoked with the given
+        arguments (not including the launcher itself). project is the
+        script's Project, if it has already been found.
+        """
+        if args:
+            p = args[0]
+            if p.startswith('-'):
+                # Version options come before [commands] entries, so they
+                # don't need the configuration.
+                if p.startswith('-V:'):
+                    # an exact tag, with or without the company
+                    tag = p[3:]
+                    if tag.lower().startswith('pythoncore/'):
+                        tag = tag[len('pythoncore/'):]
+                    if '/' in tag:
+                        # another company's, whose tags needn't be versions
+                        ip = self.find_python_by_tag(tag)
+                    elif not validate_version(tag):
+                        raise LauncherError(RC_NO_PYTHON, "Invalid version "
+                                            "tag '%s'" % p[3:])
+                    else:
+                        ip = self.find_python_by_version(tag)
+                elif validate_version(p[1:]):
+                    tag = p[1:]
+                    ip = self.locate_python(tag, False)
+                else:
+                    tag = None
+                if tag is not None:
+                    if ip is None:
+                        raise LauncherError(RC_NO_PYTHON, 'Requested Python '
+                                            'version (%s) not installed' %
+                                            tag)
+                    return Resolution(ip.executable, None, RULE_VERSION, ip,
+                                      consumed=1)
+                command, rule = self.find_command(p[1:])
+                if command is not None:
+                    return Resolution(command, None, rule, consumed=1)
+            for arg in args:
+                if not arg.startswith('-'):
+                    if project is None:
+                        project = self.find_project(arg)
+                    result = self.maybe_handle_shebang(arg, project)
+                    if result is not None:
+                        return result
+                    break
+        executable, rule = self.find_python_by_venv(project)
+        if executable is not None:
+            return Resolution(executable, None, rule)
+        ip = self.locate_python('', False, project)
+        if ip is None:
+            raise LauncherError(RC_NO_PYTHON, "Can't find a default Python.")
+        return Resolution(ip.executable, None, RULE_DEFAULT, ip)
+
+    def resolve(self, path):
+        """
+        Return the Resolution for running the script at path, as in
+        'py <path>'. Results are cached, keyed on the path, the script's
+        modification time and size, and its project.
+        """
+        project = self.find_project(path)
+        key = (path, self.fs.stamp(path), project.key(),
+               project.ini and self.fs.stamp(project.ini))
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = self.resolve_args([path], project)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
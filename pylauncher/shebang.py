@@ -0,0 +1,274 @@
+#
+# Shebang parsing and header decoding, as done by header_classify() in
+# CLILauncher/script_header.c and by resolve_shebang() and parse_shebang() in
+# CLILauncher/launcher.c.
+#
+
+import collections
+
+from .versions import pyc_magic, pyc_version
+
+BUFSIZE = 256
+MSGSIZE = 1024
+
+CP_UTF8 = 65001
+CP_UTF16LE = 1200
+CP_UTF16BE = 1201
+CP_UTF32LE = 12000
+CP_UTF32BE = 12001
+
+HEADER_READ_SIZE = 256
+HEADER_MAX_SIZE = 128 * 1024    # the longest first line
+
+# Kinds of file
+HEADER_NONE = 0     # no first line found
+HEADER_TEXT = 1     # a first line, which may be a shebang line
+HEADER_PYC = 2      # compiled, by a known version of Python
+HEADER_ZIPAPP = 3   # zip data, perhaps after a first line
+
+# A zip file's first local file header
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+# line_length is the bytes in the first line after any BOM, including its
+# terminator, or 0 if there isn't one.
+ScriptHeader = collections.namedtuple(
+    'ScriptHeader', 'kind magic version code_page bom_length line_length')
+
+
+class BOM:
+    def __init__(self, sequence, code_page):
+        self.sequence = sequence
+        self.code_page = code_page
+
+    @property
+    def length(self):
+        return len(self.sequence)
+
+    def __repr__(self):
+        return 'BOM(%r, %d)' % (self.sequence, self.code_page)
+
+
+# Same order as the C table: UTF-8 first (it's the default), and UTF-32LE
+# before UTF-16LE since the UTF-16LE BOM is a prefix of the UTF-32LE one.
+BOMS = [
+    BOM(b'\xEF\xBB\xBF', CP_UTF8),
+    BOM(b'\xFF\xFE\x00\x00', CP_UTF32LE),
+    BOM(b'\x00\x00\xFE\xFF', CP_UTF32BE),
+    BOM(b'\xFF\xFE', CP_UTF16LE),
+    BOM(b'\xFE\xFF', CP_UTF16BE),
+]
+
+# (shebang, search) - search means that PATH may be searched for python.exe
+BUILTIN_VIRTUAL_PATHS = [
+    ('/usr/bin/env python', True),
+    ('/usr/bin/python', False),
+    ('/usr/local/bin/python', False),
+    ('python', False),
+]
+
+# Longest matches must come first.
+BUILTIN_PREFIXES = [
+    '/usr/bin/env ',
+    '/usr/bin/',
+    '/usr/local/bin/',
+]
+
+# What iswspace() accepts for the characters which matter here.
+WHITESPACE = ' \t\n\v\f\r'
+
+
+def skip_whitespace(s):
+    return s.lstrip(WHITESPACE)
+
+
+def skip_prefix(name):
+    "Skip a leading builtin prefix such as '/usr/bin/env '."
+    lname = name.lower()
+    for prefix in BUILTIN_PREFIXES:
+        if lname.startswith(prefix):
+            result = name[len(prefix):]
+            if prefix.endswith(' '):
+                result = skip_whitespace(result)
+            return result
+    return name
+
+
+def find_BOM(buffer):
+    "Return the BOM which starts buffer, or None."
+    for bom in BOMS:
+        if buffer.startswith(bom.sequence):
+            return bom
+    return None
+
+
+def unit_size(code_page):
+    "The size of a code unit in an encoding."
+    if code_page in (CP_UTF16LE, CP_UTF16BE):
+        return 2
+    if code_page in (CP_UTF32LE, CP_UTF32BE):
+        return 4
+    return 1
+
+
+def _get_unit(buffer, i, code_page):
+    unit = unit_size(code_page)
+    if unit == 1:
+        return buffer[i]
+    byteorder = 'little' if code_page in (CP_UTF16LE, CP_UTF32LE) else 'big'
+    return int.from_bytes(buffer[i:i + unit], byteorder)
+
+
+def find_terminator(buffer, start, bom, limit=HEADER_MAX_SIZE):
+    """
+    Return the offset just past the first CR or LF character found at or
+    after start, or None. Characters are whole code units of the BOM's
+    encoding, so that (say) U+0A23 in UTF-16 isn't taken for an LF.
+    """
+    unit = unit_size(bom.code_page)
+    end = min(len(buffer), start + limit)
+    end -= (end - start) % unit
+    for i in range(start, end, unit):
+        if _get_unit(buffer, i, bom.code_page) in (0x0D, 0x0A):
+            return i + unit
+    return None
+
+
+def classify_header(data, at_end):
+    """
+    Classify a file from its first bytes, as header_classify() does; at_end
+    is true if data is all of it. Returns (wanted, header): if more of the
+    file is needed to decide, header is None and wanted is the number of
+    bytes from the start of the file to read.
+    """
+    size = len(data)
+    if size < 4 and not at_end:
+        return HEADER_READ_SIZE, None
+    kind, version = HEADER_NONE, None
+    magic = pyc_magic(data)
+    if magic is not None:
+        version = pyc_version(magic)
+        if version is not None:
+            kind = HEADER_PYC
+    else:
+        magic = 0
+    if data.startswith(ZIP_SIGNATURE):
+        return 0, ScriptHeader(HEADER_ZIPAPP, magic, version, CP_UTF8, 0, 0)
+    bom = find_BOM(data) or BOMS[0]
+    bom_length = len(bom.sequence) if data.startswith(bom.sequence) else 0
+    unit = unit_size(bom.code_page)
+    available = size - bom_length
+    available -= available % unit
+    if available < 2 * unit and not at_end:
+        return bom_length + 2 * unit, None
+    shebang = (available >= 2 * unit and
+               _get_unit(data, bom_length, bom.code_page) == ord('#') and
+               _get_unit(data, bom_length + unit, bom.code_page) == ord('!'))
+    p = find_terminator(data, bom_length, bom)
+    line_length = 0 if p is None else p - bom_length
+    if line_length == 0:
+        # Only a shebang line is worth reading more of.
+        if shebang and not at_end and available < HEADER_MAX_SIZE:
+            return min(size * 4, bom_length + HEADER_MAX_SIZE), None
+    elif shebang:
+        # A zip application starts with a shebang line.
+        end = bom_length + line_length
+        if size < end + len(ZIP_SIGNATURE) and not at_end:
+            return end + len(ZIP_SIGNATURE), None
+        if data.startswith(ZIP_SIGNATURE, end):
+            kind = HEADER_ZIPAPP
+    if kind == HEADER_NONE and line_length:
+        kind = HEADER_TEXT
+    return 0, ScriptHeader(kind, magic, version, bom.code_page, bom_length,
+                           line_length)
+
+
+def _utf32_units(data, byteorder):
+    # The launcher only keeps the low 16 bits of each UTF-32 code unit.
+    return ''.join(chr(int.from_bytes(data[i:i + 4], byteorder) & 0xFFFF)
+                   for i in range(0, len(data), 4))
+
+
+def decode_header(data, code_page):
+    """
+    Decode the bytes of a header line, including its terminator, into text.
+    Returns None when the C code would give up (an odd number of bytes for a
+    UTF-16 encoding, or a count not divisible by four for UTF-32).
+    """
+    if code_page == CP_UTF8:
+        result = data.decode('utf-8', 'replace')
+    elif code_page in (CP_UTF16LE, CP_UTF16BE):
+        if len(data) % 2:
+            return None
+        encoding = 'utf-16-le' if code_page == CP_UTF16LE else 'utf-16-be'
+        result = data.decode(encoding, 'surrogatepass')
+    else:
+        if len(data) % 4:
+            return None
+        result = _utf32_units(data, 'little' if code_page == CP_UTF32LE
+                              else 'big')
+    return result
+
+
+def read_shebang_line(buffer, header=None):
+    """
+    Find and decode the first line of a file header, the way
+    resolve_shebang() does, given its classification if known. Returns the
+    line without its terminator, or None if no line could be found.
+    """
+    if header is None:
+        header = classify_header(buffer, True)[1]
+    if header.line_length == 0:
+        return None
+    start = header.bom_length
+    line = decode_header(buffer[start:start + header.line_length],
+                         header.code_page)
+    if not line:
+        return None
+    return line[:-1]    # drop the terminator
+
+
+def parse_shebang(line, find_command=None):
+    """
+    Parse a shebang line. Returns a tuple (is_virtual, command, suffix,
+    search), where command is None if the line isn't a shebang at all.
+
+    find_command is called with a command name and should return the
+    configured (or PATH) command for it, or None.
+    """
+    command = suffix = None
+    is_virtual = search = False
+    if not line.startswith('#!'):
+        return is_virtual, command, suffix, search
+    line = skip_whitespace(line[2:])
+    if not line:
+        return is_virtual, command, suffix, search
+    # Once parsed, the C code trims trailing whitespace from the line (but
+    # never below one character). Command and suffix point into the line,
+    # so they're cut at the same place.
+    end = len(line.rstrip(WHITESPACE))
+    if end <= 1:
+        end = len(line)
+    command_start = 0
+    for shebang, can_search in BUILTIN_VIRTUAL_PATHS:
+        if line.startswith(shebang):
+            is_virtual = True
+            search = can_search
+            command_start = line.index('python')
+            break
+    else:
+        skipped = skip_prefix(line)
+        offset = len(line) - len(skipped)
+        name, rest = skipped, None
+        for i, c in enumerate(skipped):
+            if c in ' \t\r\n':
+                name, rest = skipped[:i], offset + i
+                break
+        value = find_command(name) if find_command else None
+        if value is not None:
+            command = value
+            if rest is not None:
+                rest = len(line) - len(skip_whitespace(line[rest:]))
+                suffix = line[rest:end]
+            return is_virtual, command, suffix, search
+    command = line[command_start:end]
+    return is_virtual, command, suffix, search
@@ -0,0 +1,171 @@
+#
+# Version specifiers and compiled-file magic numbers, as handled by
+# validate_version() in CLILauncher/launcher.c and header_pyc_version() in
+# CLILauncher/script_header.c.
+#
+
+import bisect
+import collections
+
+from .magic import MAGIC_VALUES
+
+MAX_VERSION_SIZE = 32   # wchar_t slots, including the terminating NUL
+
+MAX_MAJOR = 255
+MAX_MINOR = 9999
+
+# Architectures, as in launcher.h. ARCH_ANY only appears in requests, where
+# ARCH_64 means any 64-bit architecture.
+ARCH_ANY = 0
+ARCH_32 = 1
+ARCH_64 = 2
+ARCH_ARM64 = 3
+
+ARCH_SUFFIXES = {'32': ARCH_32, '64': ARCH_64, 'arm64': ARCH_ARM64}
+
+# x64 is preferred to arm64, since it runs (emulated) on arm64 as well.
+ARCH_RANK = {ARCH_64: 3, ARCH_ARM64: 2, ARCH_32: 1, ARCH_ANY: 0}
+
+# The lowest magic number of each range, for a binary search
+_MAGIC_STARTS = [lo for lo, hi, version in MAGIC_VALUES]
+
+
+PyVersion = collections.namedtuple('PyVersion',
+                                   'major minor freethreaded arch')
+
+UNPARSED = PyVersion(-1, -1, False, ARCH_ANY)
+
+
+def _parse_number(text, pos, limit):
+    end = pos
+    while end < len(text) and '0' <= text[end] <= '9':
+        end += 1
+    if end == pos or int(text[pos:end]) > limit:
+        return None, pos
+    return int(text[pos:end]), end
+
+
+def parse_version(text, strict=True):
+    """
+    Parse a version of the form X[.Y][t][-32|-64|-arm64], returning a
+    PyVersion, or UNPARSED if it can't be parsed. A request must be
+    well-formed (strict); a registry tag needs only a leading major version.
+    See parse_version() in CLILauncher/version_index.c.
+    """
+    major, pos = _parse_number(text, 0, MAX_MAJOR)
+    if major is None:
+        return UNPARSED
+    minor, freethreaded, arch = -1, False, ARCH_ANY
+    if text[pos:pos + 1] == '.':
+        minor, end = _parse_number(text, pos + 1, MAX_MINOR)
+        if minor is None:
+            return UNPARSED if strict else PyVersion(major, -1, False,
+                                                     ARCH_ANY)
+        pos = end
+        if text[pos:pos + 1] in ('t', 'T'):
+            freethreaded = True
+            pos += 1
+    if text[pos:pos + 1] == '-':
+        suffix = text[pos + 1:]
+        arch = ARCH_SUFFIXES.get(suffix if suffix in ('32', '64')
+                                 else suffix.lower())
+        if arch is None:
+            if strict:
+                return UNPARSED
+            arch = ARCH_ANY
+    elif pos < len(text) and strict:
+        return UNPARSED
+    return PyVersion(major, minor, freethreaded, arch)
+
+
+def validate_version(spec):
+    "Check a version request of the form X[.Y][t][-32|-64|-arm64]."
+    return parse_version(spec) is not UNPARSED
+
+
+def version_matches(wanted, have):
+    "Does an installed Python with version have satisfy wanted?"
+    if have.major < 0 or have.major != wanted.major:
+        return False
+    if wanted.minor >= 0 and have.minor != wanted.minor:
+        return False
+    if have.freethreaded != wanted.freethreaded:
+        return False
+    if wanted.arch == ARCH_ANY:
+        return True
+    if wanted.arch == ARCH_64:
+        return have.arch in (ARCH_64, ARCH_ARM64)
+    return have.arch == wanted.arch
+
+
+def version_is_best(wanted, have):
+    """
+    Could no other installed Python satisfying wanted be preferred to one
+    with version have (apart from one found earlier)?
+    """
+    best = ARCH_64 if wanted.arch in (ARCH_ANY, ARCH_64) else wanted.arch
+    return (wanted.minor >= 0 and version_matches(wanted, have) and
+            have.arch == best)
+
+
+def sort_key(version):
+    """
+    Sort key putting preferred Pythons first: later versions, then ordinary
+    builds before free-threaded ones, then x64, arm64 and x86.
+    """
+    return (-version.major, -version.minor, version.freethreaded,
+            -ARCH_RANK[version.arch])
+
+
+class VersionIndex:
+    """
+    Maps each request which some Python in a sorted table satisfies - by
+    major version, X.Y, and either of those with an architecture - to the
+    first such Python, as version_index_build() in version_index.c does.
+    Only python.org builds are indexed.
+    """
+
+    def __init__(self, pythons):
+        self._index = {}
+        for ip in pythons:
+            v = ip.parsed
+            if v.major < 0 or not ip.is_core:
+                continue
+            minors = [-1] if v.minor < 0 else [-1, v.minor]
+            arches = [ARCH_ANY]
+            if v.arch == ARCH_ARM64:
+                arches.append(ARCH_64)
+            if v.arch != ARCH_ANY:
+                arches.append(v.arch)
+            for minor in minors:
+                for arch in arches:
+                    self._index.setdefault(
+                        (v.major, minor, v.freethreaded, arch), ip)
+
+    def find(self, wanted):
+        "Return the best Python for a parsed request, or None."
+        return self._index.get(tuple(wanted))
+
+
+def pyc_version(magic):
+    "Return the version of Python which uses a .pyc magic number, or None."
+    i = bisect.bisect_right(_MAGIC_STARTS, magic) - 1
+    if i >= 0 and magic <= MAGIC_VALUES[i][1]:
+        return MAGIC_VALUES[i][2]
+    return None
+
+
+def magic_to_versions(magic):
+    "Return the versions whose magic number range includes magic."
+    version = pyc_version(magic)
+    return [] if version is None else [version]
+
+
+def pyc_magic(header):
+    """
+    Return the magic number from a file header if it looks like a compiled
+    Python file, else None.
+    """
+    if len(header) >= 4 and header[3] == 0x0A and header[2] == 0x0D:
+        return (header[1] << 8 | header[0]) & 0xFFFF
+    return None
@@ -0,0 +1,327 @@
+#!python3
+#
+# Probing interpreters: running each one once to find out what it really
+# is - its version, implementation, pointer size, whether it's a
+# free-threaded build, the magic number of the .pyc files it writes and its
+# sys.prefix - rather than guessing from where it's installed or what it's
+# called. Used by tests.py to know what each installed Python will print.
+#
+#   pyprobe.py [--json] [-j WORKERS] [--timeout SECONDS] [--cache FILE |
+#              --no-cache] EXECUTABLE ...
+#
+# Interpreters are run concurrently on a pool of threads, each with a
+# timeout. What they report is cached in a file (by default, in the local
+# application data folder), keyed by the executable's path, size and
+# modification time, so asking again about an interpreter which hasn't
+# changed runs nothing at all. The interpreters needn't be on Windows, or
+# even be Pythons: anything which prints the same JSON will do.
+#
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = 1
+CACHE_NAME = 'probe-cache.json'
+MAX_CACHED = 1024
+
+DEFAULT_TIMEOUT = 10.0
+
+# Run by each interpreter, with -E -s so that neither the environment nor
+# the user's site-packages can change what it says. (site itself is left
+# alone, as before Python 3.11 it's what makes a virtual environment's
+# sys.prefix.) Kept to what Python 2.7 understands, too.
+PROBE = r'''
+import json, struct, sys
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+try:
+    import sysconfig
+    freethreaded = bool(sysconfig.get_config_var('Py_GIL_DISABLED'))
+except ImportError:
+    freethreaded = False
+try:
+    implementation = sys.implementation.name
+except AttributeError:
+    import platform
+    implementation = platform.python_implementation().lower()
+sys.stdout.write(json.dumps({
+    'version': '%d.%d.%d' % tuple(sys.version_info[:3]),
+    'releaselevel': sys.version_info[3],
+    'implementation': implementation,
+    'bits': struct.calcsize('P') * 8,
+    'freethreaded': freethreaded,
+    'magic': struct.unpack('<H', MAGIC_NUMBER[:2])[0],
+    'prefix': sys.prefix,
+    'sys_version': sys.version.split('\n')[0],
+}))
+'''
+
+PROBE_ARGS = ['-E', '-s', '-c', PROBE]
+
+FIELDS = ('version', 'releaselevel', 'implementation', 'bits',
+          'freethreaded', 'magic', 'prefix', 'sys_version')
+
+
+class Interpreter(collections.namedtuple('Interpreter',
+                                         ('executable',) + FIELDS)):
+    "What an interpreter said about itself."
+    __slots__ = ()
+
+    @property
+    def major(self):
+        return int(self.version.split('.')[0])
+
+    @property
+    def minor(self):
+        return int(self.version.split('.')[1])
+
+    @property
+    def tag(self):
+        "The tag the launcher would know it by, such as 3.12, 3.13t or 2.7-32."
+        return '%d.%d%s%s' % (self.major, self.minor,
+                              't' if self.freethreaded else '',
+                              '-32' if self.bits == 32 else '')
+
+
+class ProbeError(Exception):
+    "Raised when an interpreter couldn't be run, or said nothing useful."
+
+
+def default_cache_path():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pylauncher', CACHE_NAME) if base else None
+
+
+def stamp(path):
+    "The (size, mtime) of a file, or None if it doesn't exist."
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def parse_output(executable, output):
+    "Turn what PROBE printed into an Interpreter, or raise ProbeError."
+    try:
+        values = json.loads(output.decode('utf-8'))
+        return Interpreter(executable, *[values[name] for name in FIELDS])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ProbeError('%s: unexpected output %r (%s)' %
+                         (executable, output[:200], e))
+
+
+def run_probe(executable, timeout=DEFAULT_TIMEOUT):
+    "Run an interpreter, returning the Interpreter it says it is."
+    try:
+        p = subprocess.run([executable] + PROBE_ARGS, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise ProbeError('%s: no answer in %g seconds' % (executable,
+                                                          timeout))
+    except OSError as e:
+        raise ProbeError('%s: %s' % (executable, e))
+    if p.returncode:
+        raise ProbeError('%s: exit code %d: %s' %
+                         (executable, p.returncode,
+                          p.stderr.decode('utf-8', 'replace').strip()[-200:]))
+    return parse_output(executable, p.stdout)
+
+
+class ProbeCache:
+    """
+    What interpreters said, keyed by their executables' paths, sizes and
+    modification times. Only successful probes are remembered. The file is
+    replaced as a whole, so concurrent readers only ever see a complete one;
+    writers merge what's there first, so they lose little to each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = self._read()
+        self.dirty = False
+
+    def _read(self):
+        if not self.path:
+            return collections.OrderedDict()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f, object_pairs_hook=collections.OrderedDict)
+            if (data.get('format') == CACHE_FORMAT and
+                    isinstance(data['entries'], dict)):
+                return data['entries']
+        except (OSError, ValueError, AttributeError, KeyError):
+            pass
+        return collections.OrderedDict()
+
+    @staticmethod
+    def key(executable):
+        return os.path.normcase(os.path.abspath(executable))
+
+    def get(self, executable, file_stamp):
+        entry = self.entries.get(self.key(executable))
+        try:
+            if file_stamp is None or entry['stamp'] != list(file_stamp):
+                return None
+            return Interpreter(executable, *[entry['result'][name]
+                                             for name in FIELDS])
+        except (KeyError, TypeError):
+            return None
+
+    def put(self, interpreter, file_stamp):
+        if file_stamp is None:
+            return
+        key = self.key(interpreter.executable)
+        self.entries.pop(key, None)
+        self.entries[key] = {'stamp': list(file_stamp),
+                             'result': interpreter._asdict()}
+        self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        entries = self._read()
+        for key, entry in self.entries.items():
+            entries.pop(key, None)
+            entries[key] = entry
+        while len(entries) > MAX_CACHED:
+            entries.popitem(last=False)
+        directory = os.path.dirname(self.path)
+        temp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': CACHE_FORMAT, 'entries': entries}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.debug('unable to write probe cache %s: %s', self.path, e)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.entries = entries
+        self.dirty = False
+
+
+class Prober:
+    """
+    Probes interpreters, workers at a time (by default, one per CPU), each
+    given timeout seconds to answer. cache_path is the cache file to use:
+    by default, default_cache_path(), and if empty, none is. After probe(),
+    errors maps each executable which couldn't be probed to the reason why,
+    and hits and probed count the answers taken from the cache and the
+    interpreters run.
+    """
+
+    def __init__(self, cache_path=None, workers=None,
+                 timeout=DEFAULT_TIMEOUT):
+        if cache_path is None:
+            cache_path = default_cache_path()
+        self.cache = ProbeCache(cache_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.errors = {}
+        self.hits = self.probed = 0
+        self._lock = threading.Lock()
+
+    def _probe(self, executable):
+        file_stamp = stamp(executable)
+        if file_stamp is None:
+            raise ProbeError('%s: not found' % executable)
+        with self._lock:
+            result = self.cache.get(executable, file_stamp)
+            if result is not None:
+                self.hits += 1
+                return result
+        result = run_probe(executable, self.timeout)
+        with self._lock:
+            self.probed += 1
+            self.cache.put(result, file_stamp)
+        return result
+
+    def probe(self, executables):
+        """
+        Return an Interpreter for each executable, in the same order, or
+        None for each one which couldn't be probed.
+        """
+        self.errors = {}
+        results = [None] * len(executables)
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            futures = dict((pool.submit(self._probe, executable), i)
+                           for i, executable in enumerate(executables))
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except ProbeError as e:
+                    logger.debug('%s', e)
+                    self.errors[executables[i]] = str(e)
+        self.cache.save()
+        return results
+
+
+def probe(executables, **kwargs):
+    "Probe interpreters with a Prober made with the keyword arguments."
+    return Prober(**kwargs).probe(executables)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Find out what '
+                                     'interpreters really are.')
+    parser.add_argument('executables', nargs='+', metavar='EXECUTABLE')
+    parser.add_argument('--json', action='store_true',
+                        help='print each result as a line of JSON')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='interpreters to run at once (default: one per '
+                        'CPU)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds to wait for each interpreter (default: '
+                        '%(default)s)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--cache', default=default_cache_path(),
+                       help='the cache file (default: %(default)s)')
+    group.add_argument('--no-cache', dest='cache', action='store_const',
+                       const='', help="don't use a cache")
+    options = parser.parse_args(args)
+    prober = Prober(options.cache, options.workers, options.timeout)
+    results = prober.probe(options.executables)
+    for executable, result in zip(options.executables, results):
+        if result is None:
+            error = prober.errors[executable]
+            if options.json:
+                print(json.dumps({'executable': executable, 'error': error}))
+            else:
+                print(error, file=sys.stderr)
+        elif options.json:
+            print(json.dumps(result._asdict()))
+        else:
+            print('%-8s %-10s %-8s %2d-bit magic %5d %s' %
+                  (result.tag, result.version, result.implementation,
+                   result.bits, result.magic, executable))
+    if not options.json:
+        print('%d probed, %d from the cache, %d failed' %
+              (prober.probed, prober.hits, len(prober.errors)),
+              file=sys.stderr)
+    return 1 if prober.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!python3
+#
+# Makes script wrappers in bulk: copies of the wrapper executable (built by
+# the CLIWrapper or GUIWrapper projects) which each run a command.
+#
+# By default, each command's script is appended to its wrapper, as a zip
+# application, with a trailer saying where it starts (see
+# CLILauncher/wrapper_archive.h), so that a wrapper is a single file which
+# needn't look for anything else when it starts. Python is then given the
+# wrapper itself to run. Wrappers for the same script are identical, and are
+# hard-linked to one another where the file system allows.
+#
+# Python can only run an appended script from 3.8 on: before then, zipimport
+# doesn't find an archive with the trailer after it. So a script whose
+# shebang line asks for an older Python - #!python2 or #!python3.7, say, or
+# just #!python, which the launcher takes to mean Python 2 if it's installed
+# - is written to a side file instead, as below.
+#
+# With --side-file, the script is written next to the wrapper as
+# <name>-script.py (or -script.pyw, for the GUI wrapper), as setuptools
+# does, and every wrapper is a hard link to the stub executable itself, so
+# they share disk space and page cache.
+#
+# Commands are given as NAME=SOURCE, where SOURCE is a script, a zip
+# application, or MODULE:FUNCTION for an entry point; or just as a script,
+# which names the command after itself. --from reads them from a file, one
+# to a line.
+#
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import shutil
+import struct
+import sys
+import zipfile
+
+TRAILER_SIZE = 16
+MAGIC = b'PYWRAP01'
+BOM_UTF8 = b'\xef\xbb\xbf'
+
+ENTRY_POINT = re.compile(r'^\s*[\w.]+\s*:\s*[\w.]+\s*$')
+
+# The oldest Python which can run an appended script (ARCHIVE_MIN_MAJOR and
+# ARCHIVE_MIN_MINOR in CLILauncher/wrapper_archive.h).
+MIN_APPENDED_VERSION = (3, 8)
+
+# A shebang line naming one of the launcher's virtual paths, and the version
+# it asks for, if any.
+VIRTUAL_SHEBANG = re.compile(br'#!\s*(?:/usr/bin/env\s+|/usr/bin/|'
+                             br'/usr/local/bin/)?python'
+                             br'(?:([0-9]+)(?:\.([0-9]+))?)?(?=[t\s-]|$)')
+
+# A fixed timestamp, so that the same script always makes the same archive.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+ENTRY_POINT_TEMPLATE = '''# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(function)s())
+'''
+
+
+def make_trailer(offset):
+    "Return the trailer for a payload appended at offset."
+    return struct.pack('<Q', offset) + MAGIC
+
+
+def find_payload(path):
+    """
+    Return (offset, size) of the payload appended to a wrapper, or None if
+    there isn't one, reading just the trailer, as the wrapper does.
+    """
+    with open(path, 'rb') as f:
+        file_size = f.seek(0, os.SEEK_END)
+        if file_size < TRAILER_SIZE:
+            return None
+        f.seek(-TRAILER_SIZE, os.SEEK_END)
+        trailer = f.read(TRAILER_SIZE)
+    if trailer[8:] != MAGIC:
+        return None
+    offset = struct.unpack('<Q', trailer[:8])[0]
+    if offset == 0 or offset >= file_size - TRAILER_SIZE:
+        return None
+    return offset, file_size - TRAILER_SIZE - offset
+
+
+def entry_point_script(spec, shebang=None):
+    "Return the script (bytes) for an entry point, MODULE:FUNCTION."
+    module, function = spec.split(':', 1)
+    text = ENTRY_POINT_TEMPLATE % {'module': module.strip(),
+                                   'import_name': function.split('.')[0],
+                                   'function': function.strip()}
+    if shebang:
+        text = shebang + '\n' + text
+    return text.encode('utf-8')
+
+
+def first_line(script):
+    "Return a script's shebang line, with its terminator (and any BOM)."
+    start = len(BOM_UTF8) if script.startswith(BOM_UTF8) else 0
+    if not script.startswith(b'#!', start):
+        return b''
+    end = script.find(b'\n')
+    return script if end < 0 else script[:end + 1]
+
+
+def can_append(script):
+    """
+    Return False if a script's shebang line asks for a Python too old to
+    run it appended to a wrapper, or for just "python" - which, from a
+    shebang line, the launcher takes to mean Python 2 unless py.ini says
+    otherwise. Anything else, such as #!python3, is given the benefit of the
+    doubt: the wrapper says so if what it finds is too old.
+    """
+    line = first_line(script)
+    if line.startswith(BOM_UTF8):
+        line = line[len(BOM_UTF8):]
+    m = VIRTUAL_SHEBANG.match(line)
+    if m is None:
+        return True
+    major, minor = m.groups()
+    if major is None:
+        return False
+    if minor is None:
+        return int(major) >= MIN_APPENDED_VERSION[0]
+    return (int(major), int(minor)) >= MIN_APPENDED_VERSION
+
+
+def make_payload(script):
+    """
+    Return what to append to a wrapper for a script (bytes): a zip
+    application, which is used as it is, or else one made with the script
+    as its __main__.py, after the script's shebang line.
+    """
+    if zipfile.is_zipfile(io.BytesIO(script)):
+        return script
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as zf:
+        info = zipfile.ZipInfo('__main__.py', ZIP_DATE_TIME)
+        info.external_attr = 0o644 << 16
+        zf.writestr(info, script)
+    return first_line(script) + out.getvalue()
+
+
+def read_source(source, shebang=None):
+    "Return the script for a command's SOURCE, as bytes."
+    if ENTRY_POINT.match(source) and not os.path.exists(source):
+        return entry_point_script(source, shebang)
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def parse_command(command):
+    "Split NAME=SOURCE, or name a bare SOURCE after its file."
+    name, sep, source = command.partition('=')
+    if sep:
+        return name.strip(), source.strip()
+    source = command.strip()
+    return os.path.splitext(os.path.basename(source))[0], source
+
+
+def replace_file(dest, data=None, link_to=None):
+    """
+    Write dest, atomically: with data, or as a hard link to link_to, or a
+    copy of it if a link can't be made. Returns True if dest is a link.
+    """
+    temp = dest + '.tmp'
+    if os.path.lexists(temp):
+        os.remove(temp)
+    linked = False
+    if data is not None:
+        with open(temp, 'wb') as f:
+            f.write(data)
+    else:
+        try:
+            os.link(link_to, temp)
+            linked = True
+        except OSError:
+            shutil.copyfile(link_to, temp)
+    os.replace(temp, dest)
+    # Renaming a link over another link to the same file does nothing, and
+    # leaves the link it was given in place.
+    if os.path.lexists(temp):
+        os.remove(temp)
+    return linked
+
+
+def stamp(stub, commands, out_dir, gui=False, side_file=False, link=True,
+          shebang=None):
+    """
+    Make a wrapper in out_dir for each (name, source) in commands, from the
+    stub executable. A script which can't be appended (see can_append()) is
+    written to a side file, as with side_file. Returns how many were
+    written, and how many of those are hard links.
+    """
+    with open(stub, 'rb') as f:
+        stub_data = f.read()
+    os.makedirs(out_dir, exist_ok=True)
+    made = {}       # wrapper content digest -> the first wrapper with it
+    written = linked = 0
+    for name, source in commands:
+        script = read_source(source, shebang)
+        exe = os.path.join(out_dir, name + '.exe')
+        beside = side_file or not can_append(script)
+        if beside and not side_file:
+            line = first_line(script).strip().decode('utf-8', 'replace')
+            print('%s: %s may run a Python older than %d.%d, so its script '
+                  'is written beside it' % (name, line,
+                                            MIN_APPENDED_VERSION[0],
+                                            MIN_APPENDED_VERSION[1]),
+                  file=sys.stderr)
+        if beside:
+            suffix = '-script.pyw' if gui else '-script.py'
+            replace_file(os.path.join(out_dir, name + suffix), script)
+            if link:
+                linked += replace_file(exe, link_to=stub)
+            else:
+                replace_file(exe, stub_data)
+        else:
+            data = (stub_data + make_payload(script) +
+                    make_trailer(len(stub_data)))
+            digest = hashlib.sha256(data).digest()
+            if link and digest in made:
+                linked += replace_file(exe, link_to=made[digest])
+            else:
+                replace_file(exe, data)
+                made[digest] = exe
+        written += 1
+    return written, linked
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Make script wrappers.')
+    parser.add_argument('-s', '--stub', required=True,
+                        help='The wrapper executable to copy')
+    parser.add_argument('-o', '--out-dir', default='.',
+                        help='Where to put the wrappers (default: the '
+                             'current directory)')
+    parser.add_argument('--gui', action='store_true',
+                        help='The stub is the GUI wrapper (for side files)')
+    parser.add_argument('--side-file', action='store_true',
+                        help='Write scripts next to the wrappers, rather than '
+                             'appending them')
+    parser.add_argument('--no-link', dest='link', action='store_false',
+                        help="Don't make hard links")
+    parser.add_argument('--shebang',
+                        help='The shebang line for entry point scripts, '
+                             'e.g. "#!python3" (default: none)')
+    parser.add_argument('--from', dest='from_file', metavar='FILE',
+                        help='Read commands from FILE, one to a line')
+    parser.add_argument('commands', nargs='*', metavar='COMMAND',
+                        help='NAME=SOURCE or SOURCE')
+    options = parser.parse_args(args)
+    commands = list(options.commands)
+    if options.from_file:
+        with open(options.from_file, encoding='utf-8') as f:
+            commands.extend(line for line in f
+                            if line.strip() and not line.startswith('#'))
+    if not commands:
+        parser.error('no commands given')
+    written, linked = stamp(options.stub, map(parse_command, commands),
+                            options.out_dir, options.gui, options.side_file,
+                            options.link, options.shebang)
+    print('%d wrappers written to %s, %d of them hard links' % (
+          written, options.out_dir, linked))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!python3
+#
+# Tests for the installer build (buildmsi.py, makemsi.py and builddoc.py).
+# These run in a scratch copy of the sources, with pretend executables and a
+# stub wix which records how it was run, so they need neither Windows nor
+# the WiX Toolset.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import builddoc
+import buildmsi
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SOURCES = ['launcher.wxs', 'uilauncher.wxs', 'py.ini.template',
+           'docutils.conf', os.path.join('docs', 'launcher.rst'),
+           os.path.join('docs', 'py-launcher.png')]
+
+EXECUTABLES = ['py.exe', 'pyw.exe', 'Associator.exe', 'Messager.exe']
+
+STUB_WIX = '''#!%s
+import json, os, sys
+args = sys.argv[1:]
+with open(os.environ['WIX_RUNS'], 'a') as f:
+    f.write(json.dumps(args) + '\\n')
+output = args[args.index('-o') + 1]
+if os.environ.get('WIX_FAIL', '\\0') in output:
+    print('error WIX0001: failed as asked')
+    sys.exit(1)
+with open(output, 'w') as f:
+    f.write(' '.join(args))
+with open(output[:-len('.msi')] + '.wixpdb', 'w'):
+    pass
+'''
+
+
+def fake_publish_cmdline(writer_name, argv):
+    infile, outfile = argv
+    with open(infile, 'rb') as fin, open(outfile, 'wb') as fout:
+        fout.write(b'<html>' + fin.read())
+
+
+@unittest.skipIf(sys.platform == 'win32', 'the stub wix needs a #! line')
+class BuildTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        for path in SOURCES:
+            self.copy(path)
+        for bin_dir in ('Release', os.path.join('x64', 'Release')):
+            for name in EXECUTABLES:
+                self.write(os.path.join(bin_dir, name), bin_dir + name)
+        stub = self.write(os.path.join('bin', 'wix'),
+                          STUB_WIX % sys.executable)
+        os.chmod(stub, 0o755)
+        self.runs = os.path.join(self.work_dir, 'runs.txt')
+        env = {'PATH': os.path.dirname(stub) + os.pathsep +
+                       os.environ.get('PATH', ''),
+               'WIX_RUNS': self.runs}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop('SIGNPWD', None)
+        os.environ.pop('WIX_FAIL', None)
+        patcher = mock.patch.object(builddoc, 'publish_cmdline',
+                                    side_effect=fake_publish_cmdline)
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.work_dir)
+
+    def copy(self, path):
+        dest = os.path.join(self.work_dir, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy(os.path.join(HERE, path), dest)
+
+    def write(self, path, text):
+        dest = os.path.join(self.work_dir, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'w') as f:
+            f.write(text)
+        return dest
+
+    def build(self, *args):
+        "Run buildmsi, returning its exit code and the outputs wix wrote."
+        start = os.path.getsize(self.runs) if os.path.exists(self.runs) else 0
+        rc = buildmsi.main(['-j', '2'] + list(args))
+        runs = []
+        if os.path.exists(self.runs):
+            with open(self.runs) as f:
+                f.seek(start)
+                runs = [json.loads(line) for line in f]
+        return rc, sorted(run[run.index('-o') + 1] for run in runs)
+
+    def test_incremental(self):
+        rc, built = self.build()
+        self.assertEqual((rc, len(built)), (0, 8))
+        self.assertEqual(self.publish.call_count, 1)
+        self.assertTrue(all(os.path.exists(msi) for msi in built))
+        self.assertFalse([n for n in os.listdir('.') if n.endswith('.wixpdb')])
+        # Nothing has changed, so nothing is done.
+        self.assertEqual(self.build(), (0, []))
+        self.assertEqual(self.publish.call_count, 1)
+        # Only the 64-bit installers include the 64-bit launcher...
+        self.write(os.path.join('x64', 'Release', 'py.exe'), 'rebuilt')
+        rc, built = self.build()
+        self.assertEqual((rc, len(built)), (0, 4))
+        self.assertTrue(all(msi.endswith('.amd64.msi') for msi in built))
+        # ...and only the UI installers include the documentation.
+        with open(os.path.join('docs', 'launcher.rst'), 'a') as f:
+            f.write('\nMore.\n')
+        rc, built = self.build()
+        self.assertEqual((rc, len(built)), (0, 4))
+        self.assertTrue(all(msi.startswith('uilauncher') for msi in built))
+        self.assertEqual(self.publish.call_count, 2)
+        # Rewriting an executable to the same bytes changes nothing.
+        self.write(os.path.join('x64', 'Release', 'py.exe'), 'rebuilt')
+        self.assertEqual(self.build(), (0, []))
+        rc, built = self.build('--force')
+        self.assertEqual((rc, len(built)), (0, 8))
+
+    def test_failure(self):
+        os.environ['WIX_FAIL'] = 'uilauncher-'
+        rc, built = self.build()
+        self.assertEqual((rc, len(built)), (1, 8))
+        log = os.path.join('build', 'logs', 'uilauncher-%s.amd64.log' %
+                           buildmsi.VER)
+        with open(log) as f:
+            self.assertIn('error WIX0001', f.read())
+        # Only the installers which failed are built again.
+        del os.environ['WIX_FAIL']
+        rc, built = self.build()
+        self.assertEqual(rc, 0)
+        self.assertEqual(built, ['uilauncher-%s.amd64.msi' % buildmsi.VER,
+                                 'uilauncher-%s.msi' % buildmsi.VER])
+
+    def test_command(self):
+        self.build()
+        with open(self.runs) as f:
+            runs = [json.loads(line) for line in f]
+        run = [r for r in runs
+               if r[2] == 'uilauncherwin-%s.amd64.msi' % buildmsi.VER][0]
+        # The arguments aren't split or quoted by a shell.
+        self.assertEqual(run, [
+            'build', '-o', 'uilauncherwin-%s.amd64.msi' % buildmsi.VER,
+            '-d', 'Platform=x64', '-d', 'Version=%s' % buildmsi.VER,
+            '-d', 'Manufacturer=Oleksis Fraga', '-d', 'ToWindows',
+            '-ext', 'WixToolset.UI.wixext', '-ext', 'WixToolset.Util.wixext',
+            'uilauncher.wxs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
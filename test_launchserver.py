@@ -0,0 +1,162 @@
+#!python3
+#
+# Tests for launchserver.py, which keeps interpreters waiting for the
+# launcher to hand them scripts. The server is run on a thread, and the
+# launcher played by launchserver.launch(), with this Python as the pool's
+# executable.
+#
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import launchserver
+
+SCRIPT = r'''
+import os, sys
+data = sys.stdin.read()
+cwd = os.path.basename(os.getcwd())
+sys.stdout.write('argv=%r cwd=%s\n' % (sys.argv[1:], cwd))
+sys.stdout.write('env=%s stdin=%r\n' % (os.environ.get('LS_TEST'), data))
+sys.stderr.write('to stderr\n')
+sys.exit(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+'''
+
+# What launch_server.c encodes for the same request; see
+# CLILauncher/tests/test_launch_server.c.
+ENCODED = bytes.fromhex(
+    '51520000000300000074306b04000000332e313210000000433a5c50795c707974686f'
+    '6e2e65786504000000433a5c770200000004000000732e707906000000c3a9f09f9880'
+    '0200000003000000413d3102000000423d')
+
+
+class ProtocolTest(unittest.TestCase):
+    def test_encode_matches_launcher(self):
+        encoded = launchserver.encode_request(
+            't0k', '3.12', 'C:\\Py\\python.exe', 'C:\\w',
+            ['s.py', '\xe9\U0001f600'], {'A': '1', '=C:': 'C:\\', 'B': ''})
+        self.assertEqual(encoded, ENCODED)
+
+    def test_decode(self):
+        request = launchserver.decode_request(
+            ENCODED[launchserver.HEADER.size:])
+        self.assertEqual(request.token, 't0k')
+        self.assertEqual(request.executable, 'C:\\Py\\python.exe')
+        self.assertEqual(request.argv, ['s.py', '\xe9\U0001f600'])
+        self.assertEqual(request.env, {'A': '1', 'B': ''})
+
+    def test_parse_sizes(self):
+        self.assertEqual(launchserver.parse_sizes(None),
+                         {'': launchserver.DEFAULT_SIZE})
+        self.assertEqual(launchserver.parse_sizes(['3', '3.12=1']),
+                         {'': 3, '3.12': 1})
+        pools = launchserver.Pools({'': 3, '3.12': 1})
+        try:
+            self.assertEqual(pools.size_for('3.12'), 1)
+            self.assertEqual(pools.size_for('3.12-32'), 1)
+            self.assertEqual(pools.size_for('3.11'), 3)
+        finally:
+            pools.close()
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.script = os.path.join(self.work_dir, 'script.py')
+        with open(self.script, 'w') as f:
+            f.write(SCRIPT)
+        self.address = os.path.join(self.work_dir, 'address')
+        self.start_server()
+
+    def start_server(self, idle=60.0):
+        self.pools = launchserver.Pools({'': 1}, idle)
+        self.server = launchserver.LaunchServer(self.pools, self.address)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.start()
+
+        def stop():
+            self.server.shutdown()
+            thread.join()
+            self.server.server_close()
+
+        self.addCleanup(stop)
+
+    def launch(self, *args, **kwargs):
+        env = dict(os.environ, LS_TEST='yes')
+        env.update(kwargs.pop('env', {}))
+        out, err = io.BytesIO(), io.BytesIO()
+        rc = launchserver.launch(self.address, sys.executable,
+                                 [self.script] + list(args), env=env,
+                                 cwd=self.work_dir, stdout=out, stderr=err,
+                                 **kwargs)
+        return rc, out.getvalue().decode(), err.getvalue().decode()
+
+    def test_address_file(self):
+        if os.name != 'nt':
+            self.assertEqual(os.stat(self.address).st_mode & 0o777, 0o600)
+        port, token = launchserver.read_address(self.address)
+        self.assertEqual(port, self.server.server_address[1])
+        self.assertEqual(token, self.server.token)
+
+    def test_run(self):
+        rc, out, err = self.launch('3', '\xe9', stdin=b'some input')
+        self.assertEqual(rc, 3)
+        self.assertEqual(out.splitlines(), [
+            "argv=['3', '\xe9'] cwd=%s" % os.path.basename(self.work_dir),
+            "env=yes stdin='some input'"])
+        self.assertEqual(err.strip(), 'to stderr')
+
+    def test_warm(self):
+        self.assertEqual(self.launch()[0], 0)
+        self.assertTrue(self.pools.wait_until_full())
+        self.assertEqual(self.launch()[0], 0)
+        stats = launchserver.get_stats(self.address)
+        self.assertEqual(stats['served'], 2)
+        [pool] = stats['pools']
+        self.assertEqual((pool['cold'], pool['warm']), (1, 1))
+        self.assertEqual(pool['waiting'], 1)
+
+    def test_startup_environment(self):
+        self.launch()
+        self.launch(env={'PYTHONPATH': self.work_dir})
+        self.assertEqual(len(launchserver.get_stats(self.address)['pools']),
+                         2)
+
+    def test_refused(self):
+        with open(self.address) as f:
+            port = f.read().split()[0]
+        with open(self.address, 'w') as f:
+            f.write('%s wrong-token\n' % port)
+        self.assertIsNone(self.launch()[0])
+        os.remove(self.address)
+        self.assertIsNone(self.launch()[0])
+
+    def test_missing_executable(self):
+        rc = launchserver.launch(self.address,
+                                 os.path.join(self.work_dir, 'nothing'),
+                                 [self.script])
+        self.assertIsNone(rc)
+        self.assertEqual(self.pools.stats()['refused'], 1)
+
+    def test_idle_eviction(self):
+        self.pools.idle_timeout = 0.1
+        self.launch()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            [pool] = self.pools.stats()['pools']
+            if pool['evicted'] and not pool['waiting']:
+                break
+            time.sleep(0.05)
+        self.assertTrue(pool['evicted'])
+        self.assertEqual(pool['waiting'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
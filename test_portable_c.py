@@ -0,0 +1,33 @@
+#!python3
+#
+# Runs the C unit tests for the portable parts of the launcher (see
+# CLILauncher/Makefile). Unlike tests.py, these don't need Windows or any
+# installed Pythons - just make and a C compiler.
+#
+
+import os
+import shutil
+import subprocess
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HAVE_TOOLCHAIN = (shutil.which('make') is not None and
+                  any(shutil.which(cc) for cc in ('cc', 'gcc', 'clang')))
+
+
+@unittest.skipUnless(HAVE_TOOLCHAIN, 'make and a C compiler are needed')
+class PortableCTest(unittest.TestCase):
+    def make(self, target):
+        p = subprocess.run(['make', '-C', os.path.join(HERE, 'CLILauncher'),
+                            target], stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT)
+        self.assertEqual(p.returncode, 0, p.stdout.decode('utf-8', 'replace'))
+
+    def test_check(self):
+        "Test the portable launcher modules"
+        self.make('check')
+
+
+if __name__ == '__main__':
+    unittest.main()
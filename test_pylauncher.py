@@ -0,0 +1,588 @@
+#!python3
+#
+# Tests for the pure-Python reference implementation of the launcher (the
+# pylauncher package). These use the in-memory backends, so they run on any
+# platform.
+#
+
+import codecs
+import threading
+import time
+import unittest
+
+from pylauncher import (Resolver, LauncherError, parse_shebang, skip_prefix,
+                        find_BOM, validate_version, parse_version, PyVersion,
+                        VIEW_HKLM, VIEW_WOW64_32)
+from pylauncher.config import parse_ini
+from pylauncher.discovery import locate_all_pythons, registry_views
+from pylauncher.fakes import FakeRegistry, FakeFileSystem, FakeEnvironment
+from pylauncher.project import MAX_STATS, find_project, parse_pin
+from pylauncher.resolver import (RC_BAD_VIRTUAL_PATH, RC_NO_PYTHON,
+                                 RULE_COMMAND, RULE_DEFAULT, RULE_MAGIC,
+                                 RULE_PATH, RULE_PROJECT, RULE_SHEBANG,
+                                 RULE_VENV, RULE_VERSION, RULE_VIRTUAL)
+from pylauncher.shebang import (HEADER_NONE, HEADER_PYC, HEADER_READ_SIZE,
+                                HEADER_TEXT, HEADER_ZIPAPP, classify_header,
+                                read_shebang_line)
+from pylauncher.versions import ARCH_32, ARCH_ANY, ARCH_ARM64, UNPARSED
+
+LAUNCHER_DIR = r'C:\Windows'
+APPDATA_DIR = r'C:\Users\me\AppData\Local'
+
+# (view, version, install path, bits)
+PYTHONS = [
+    (VIEW_HKLM, '2.7', r'C:\Python27', 64),
+    (VIEW_HKLM | VIEW_WOW64_32, '2.7', r'C:\Python27-32', 32),
+    (VIEW_HKLM, '3.6', r'C:\Program Files\Python36', 64),
+    (VIEW_HKLM | VIEW_WOW64_32, '3.6', r'C:\Python36-32', 32),
+    (0, '3.5', r'C:\Users\me\Python35', 64),
+]
+
+
+def make_resolver(pythons=PYTHONS, env=None, **kwargs):
+    registry = FakeRegistry()
+    fs = FakeFileSystem([r'C:\Tools'])
+    for view, version, install_path, bits in pythons:
+        registry.add_python(view, version, install_path)
+        fs.add_python(install_path + r'\python.exe', bits)
+    env = FakeEnvironment(env or {}, PATHEXT='.COM;.EXE')
+    return Resolver(registry, fs, env, LAUNCHER_DIR, APPDATA_DIR, **kwargs)
+
+
+class ShebangTest(unittest.TestCase):
+    def test_not_a_shebang(self):
+        self.assertEqual(parse_shebang('import sys'),
+                         (False, None, None, False))
+        self.assertEqual(parse_shebang('#!   '), (False, None, None, False))
+
+    def test_virtual(self):
+        self.assertEqual(parse_shebang('#!/usr/bin/env python3 -v  '),
+                         (True, 'python3 -v', None, True))
+        self.assertEqual(parse_shebang('#! /usr/bin/python2.7'),
+                         (True, 'python2.7', None, False))
+        self.assertEqual(parse_shebang('#!python'),
+                         (True, 'python', None, False))
+
+    def test_command(self):
+        def find_command(name):
+            return {'perl': r'C:\Perl\perl.exe'}.get(name)
+        self.assertEqual(parse_shebang('#!/usr/bin/perl -w  ', find_command),
+                         (False, r'C:\Perl\perl.exe', '-w', False))
+        self.assertEqual(parse_shebang('#!/bin/sh -x', find_command),
+                         (False, '/bin/sh -x', None, False))
+
+    def test_skip_prefix(self):
+        self.assertEqual(skip_prefix('/usr/bin/env   perl'), 'perl')
+        self.assertEqual(skip_prefix('/USR/LOCAL/BIN/perl'), 'perl')
+        self.assertEqual(skip_prefix('/opt/perl'), '/opt/perl')
+
+    def test_boms(self):
+        for encoding, bom in (('utf-8', codecs.BOM_UTF8),
+                              ('utf-16-le', codecs.BOM_UTF16_LE),
+                              ('utf-16-be', codecs.BOM_UTF16_BE),
+                              ('utf-32-le', codecs.BOM_UTF32_LE),
+                              ('utf-32-be', codecs.BOM_UTF32_BE)):
+            data = bom + '#!python3\nprint()\n'.encode(encoding)
+            self.assertEqual(find_BOM(data).sequence, bom)
+            self.assertEqual(read_shebang_line(data), '#!python3', encoding)
+        self.assertIsNone(find_BOM(b'#!python'))
+        self.assertIsNone(read_shebang_line(b'#!python'))
+        # U+0A23 holds an LF byte, but isn't a line terminator.
+        data = codecs.BOM_UTF16_LE + '#!\u0a23x\n'.encode('utf-16-le')
+        self.assertEqual(read_shebang_line(data), '#!\u0a23x')
+
+    def test_classify(self):
+        def kind(data):
+            return classify_header(data, True)[1].kind
+        self.assertEqual(kind(b'\xcb\x0d\r\n' + bytes(12)), HEADER_PYC)
+        self.assertEqual(kind(b'#!/usr/bin/env python3\nPK\x03\x04'),
+                         HEADER_ZIPAPP)
+        self.assertEqual(kind(b'PK\x03\x04\x14\x00'), HEADER_ZIPAPP)
+        self.assertEqual(kind(b'import sys\n'), HEADER_TEXT)
+        self.assertEqual(kind(b'#!python'), HEADER_NONE)
+        # A long shebang line asks for more of the file.
+        data = b'#!' + b'x' * 1000 + b'\npass\n'
+        wanted, header = classify_header(data[:HEADER_READ_SIZE], False)
+        self.assertIsNone(header)
+        self.assertEqual(wanted, 4 * HEADER_READ_SIZE)
+        header = classify_header(data[:wanted], False)[1]
+        self.assertEqual(header.line_length, 1003)
+
+
+class VersionTest(unittest.TestCase):
+    def test_validate(self):
+        for spec in ('3', '3.6', '3.6-32', '3.10', '3.6-64', '36',
+                     '3.13t', '3.12-arm64', '3.13t-ARM64', '3-32'):
+            self.assertTrue(validate_version(spec), spec)
+        for spec in ('', 'x', '3.', '3.6-', '2.7-3x', '3.6.1', '3t',
+                     '3.13tt', '256'):
+            self.assertFalse(validate_version(spec), spec)
+
+    def test_parse(self):
+        self.assertEqual(parse_version('3.12-arm64'),
+                         PyVersion(3, 12, False, ARCH_ARM64))
+        self.assertEqual(parse_version('3.13t-32'),
+                         PyVersion(3, 13, True, ARCH_32))
+        self.assertEqual(parse_version('2.7-foo', strict=False),
+                         PyVersion(2, 7, False, ARCH_ANY))
+        self.assertIs(parse_version('2.7-foo'), UNPARSED)
+
+
+class ConfigTest(unittest.TestCase):
+    def test_parse(self):
+        sections = parse_ini('[Defaults]\npython = "3.6"\n; comment\n'
+                             'Python=3.5\nempty=\n[defaults]\npython3=2\n'
+                             '[commands]\nx=y=z\n')
+        self.assertEqual(sections, {'defaults': {'python': ('python', '3.6')},
+                                    'commands': {'x': ('x', 'y=z')}})
+
+    def test_no_limits(self):
+        r = make_resolver()
+        r.fs.add_file(APPDATA_DIR + r'\py.ini', b'[commands]\n' + b''.join(
+            b'cmd%d=%s\n' % (i, b'x' * 2000) for i in range(500)))
+        self.assertEqual(r.config.find_command('CMD499'), 'x' * 2000)
+
+    def test_bom(self):
+        r = make_resolver()
+        r.fs.add_file(APPDATA_DIR + r'\py.ini',
+                      codecs.BOM_UTF8 + b'[defaults]\npython=3\n')
+        self.assertEqual(r.get_configured_value('python'), '3')
+
+    def test_precedence(self):
+        r = make_resolver(env={'py_python2': '2.7-32'})
+        r.fs.add_file(LAUNCHER_DIR + r'\py.ini',
+                      b'[defaults]\npython=2\npython3=3.5\n'
+                      b'[commands]\nperl=global-perl\nruby=ruby\n')
+        r.fs.add_file(APPDATA_DIR + r'\py.ini',
+                      b'[defaults]\npython3=3.6-32\n[commands]\nperl=my-perl\n')
+        self.assertEqual(r.get_configured_value('python'), '2')
+        self.assertEqual(r.get_configured_value('python3'), '3.6-32')
+        self.assertEqual(r.get_configured_value('python2'), '2.7-32')
+        self.assertEqual(r.config.find_command('PERL'), 'my-perl')
+        self.assertEqual(r.config.find_command('ruby'), 'ruby')
+        # The overall default is a version to look for, not a key to look up
+        self.assertEqual(r.locate_python('', False).executable,
+                         r'C:\Python27\python.exe')
+        self.assertEqual(r.locate_python('2', False).executable,
+                         r'C:\Python27-32\python.exe')
+
+    def test_overridden_paths(self):
+        r = make_resolver(env={'PYLAUNCH_LOCAL_INI': r'C:\tmp\1\local.ini',
+                               'PYLAUNCH_GLOBAL_INI': r'C:\tmp\1\none.ini'})
+        r.fs.add_file(LAUNCHER_DIR + r'\py.ini', b'[defaults]\npython=2\n')
+        r.fs.add_file(APPDATA_DIR + r'\py.ini', b'[defaults]\npython3=3.5\n')
+        r.fs.add_file(r'C:\tmp\1\local.ini', b'[defaults]\npython3=3.6-32\n')
+        # The usual files are ignored, even when the override doesn't exist.
+        self.assertEqual(r.get_configured_value('python3'), '3.6-32')
+        self.assertIsNone(r.get_configured_value('python'))
+
+
+class DiscoveryTest(unittest.TestCase):
+    def test_order(self):
+        r = make_resolver()
+        self.assertEqual([(ip.version, ip.bits) for ip in r.installed_pythons],
+                         [('3.6', 64), ('3.6', 32), ('3.5', 64), ('2.7', 64),
+                          ('2.7', 32)])
+        self.assertEqual(r.installed_pythons[0].executable,
+                         r'"C:\Program Files\Python36\python.exe"')
+
+    def test_quirks(self):
+        registry = FakeRegistry()
+        fs = FakeFileSystem()
+        for version in ('3.10', '3.11-32x', '3.9', 'x' * 32, '3.8'):
+            registry.add_python(0, version, r'C:\Py' + version)
+            fs.add_python(r'C:\Py%s\python.exe' % version)
+        found = locate_all_pythons(registry, fs, registry_views())
+        # Versions sort numerically, and an overlong key name ends the
+        # enumeration.
+        self.assertEqual([ip.version for ip in found],
+                         ['3.11-32x', '3.10', '3.9'])
+
+    def test_variants(self):
+        r = make_resolver([
+            (0, '3.12-arm64', r'C:\Py312-arm64', 64),
+            (0, '3.12', r'C:\Py312', 64),
+            (0, '3.13', r'C:\Py313', 64),
+            (0, '3.13t', r'C:\Py313', 64),
+            (0, '3.9', r'C:\Py39', 64),
+            (VIEW_WOW64_32, '3.10', r'C:\Py310-32', 32),
+        ])
+        r.fs.add_python(r'C:\Py313\python3.13t.exe')
+        self.assertEqual(r.locate_python('3', False).version, '3.13')
+        self.assertEqual(r.locate_python('3.13t', False).executable,
+                         r'C:\Py313\python3.13t.exe')
+        self.assertEqual(r.locate_python('3.12', False).version, '3.12')
+        self.assertEqual(r.locate_python('3.12-arm64', False).version,
+                         '3.12-arm64')
+        self.assertEqual(r.locate_python('3-32', False).version, '3.10')
+        self.assertIsNone(r.locate_python('3.1', False))
+        result = r.resolve_args(['-V:PythonCore/3.12-arm64', 'x.py'])
+        self.assertEqual(result.python.version, '3.12-arm64')
+        self.assertEqual(result.consumed, 1)
+        self.assertRaises(LauncherError, r.resolve_args, ['-V:3.1'])
+        self.assertRaises(LauncherError, r.resolve_args, ['-V:spam'])
+
+    def test_early_exit(self):
+        full = make_resolver()
+        full.installed_pythons
+        for wanted in ('3.6', '3.6-32', '2.7', '2.7-32', '3.5', '3.4', '3',
+                       '2', ''):
+            lazy = make_resolver()
+            self.assertEqual(lazy.locate_python(wanted, False),
+                             full.locate_python(wanted, False), wanted)
+        lazy = make_resolver()
+        self.assertEqual(lazy.locate_python('3.6-32', False).bits, 32)
+        self.assertIsNone(lazy._installed)
+        calls = sum(lazy.registry.calls.values())
+        self.assertLess(calls, sum(full.registry.calls.values()))
+
+    def test_duplicates(self):
+        r = make_resolver(PYTHONS + [(VIEW_HKLM, '3.7', r'C:\Python27', 64)])
+        self.assertEqual(len(r.installed_pythons), len(PYTHONS))
+        # Paths with spaces are compared unquoted, so they're found once too.
+        r = make_resolver(PYTHONS + [(0, '3.7', r'C:\Program Files\Python36',
+                                      64)])
+        self.assertEqual(len(r.installed_pythons), len(PYTHONS))
+
+    def test_companies(self):
+        r = make_resolver()
+        r.registry.add_python(0, '3.12', r'C:\Contoso\Py', 'ContosoPython')
+        r.fs.add_python(r'C:\Contoso\Py\python.exe')
+        r.registry.add_python(VIEW_HKLM, 'env', r'C:\Anaconda', 'Anaconda',
+                              sys_version='3.11',
+                              executable_path=r'C:\Anaconda\bin\python.exe')
+        r.fs.add_python(r'C:\Anaconda\bin\python.exe')
+        r.registry.add_python(VIEW_HKLM, 'odd', r'C:\Odd', 'Odd')
+        r.fs.add_python(r'C:\Odd\python.exe')
+        self.assertEqual([(ip.company, ip.version)
+                          for ip in r.installed_pythons[:3]],
+                         [('ContosoPython', '3.12'), ('Anaconda', 'env'),
+                          ('PythonCore', '3.6')])
+        self.assertEqual(r.installed_pythons[1].parsed.minor, 11)
+        # Only python.org builds satisfy version requests ...
+        self.assertEqual(r.resolve_args([]).python.version, '3.6')
+        self.assertRaises(LauncherError, r.resolve_args, ['-3.12'])
+        # ... others are asked for by company and tag.
+        result = r.resolve_args(['-V:contosopython/3.12'])
+        self.assertEqual(result.executable, r'C:\Contoso\Py\python.exe')
+        result = r.resolve_args(['-V:Anaconda/env'])
+        self.assertEqual(result.executable, r'C:\Anaconda\bin\python.exe')
+        self.assertRaises(LauncherError, r.resolve_args, ['-V:Odd/odd'])
+        self.assertRaises(LauncherError, r.resolve_args, ['-V:Anaconda/3.11'])
+
+    def test_company_order(self):
+        registry = FakeRegistry()
+        fs = FakeFileSystem()
+        for company in ('zeta', 'PythonCore', 'Alpha'):
+            registry.add_python(0, '3.9', r'C:\%s' % company, company)
+            fs.add_python(r'C:\%s\python.exe' % company)
+        found = locate_all_pythons(registry, fs, registry_views())
+        self.assertEqual([ip.company for ip in found],
+                         ['PythonCore', 'Alpha', 'zeta'])
+
+    def test_workers(self):
+        pythons = PYTHONS + [(view, '3.%d' % minor, r'C:\Py3%d-%d' % (minor,
+                                                                    view), 64)
+                             for minor in range(7, 13)
+                             for view in (0, VIEW_HKLM, VIEW_WOW64_32)]
+        serial = make_resolver(pythons).installed_pythons
+        for workers in (1, 2, 8):
+            r = make_resolver(pythons, discovery_workers=workers)
+            self.assertEqual(r.installed_pythons, serial)
+            self.assertEqual([ip.view for ip in r.installed_pythons],
+                             [ip.view for ip in serial])
+            r = make_resolver(pythons, discovery_workers=workers)
+            self.assertEqual(r.locate_python('3.6-32', False).bits, 32)
+            self.assertIsNone(r._installed)
+
+    def test_speedup(self):
+        def timed(workers):
+            fs = FakeFileSystem(latency=0.002)
+            registry = FakeRegistry()
+            for minor in range(16):
+                install_path = r'C:\Python3%d' % minor
+                registry.add_python(VIEW_HKLM, '3.%d' % minor, install_path)
+                fs.add_python(install_path + r'\python.exe')
+            start = time.perf_counter()
+            found = locate_all_pythons(registry, fs, registry_views(),
+                                       workers=workers)
+            self.assertEqual(len(found), 16)
+            return time.perf_counter() - start
+
+        # 80 probes of 2ms each, spread over 4 threads
+        self.assertLess(timed(4), timed(0) / 2)
+
+
+class ResolverTest(unittest.TestCase):
+    def add_script(self, r, text, name=r'C:\work\script.py', mtime=0):
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        r.fs.add_file(name, text, mtime=mtime)
+        return name
+
+    def test_default(self):
+        r = make_resolver()
+        self.assertEqual(r.resolve_args([]).rule, RULE_DEFAULT)
+        self.assertEqual(r.resolve_args([]).python.version, '3.6')
+        script = self.add_script(r, 'print()\n')
+        self.assertEqual(r.resolve(script).python.version, '3.6')
+
+    def test_version_argument(self):
+        r = make_resolver()
+        result = r.resolve_args(['-2.7-32', 'x.py'])
+        self.assertEqual((result.rule, result.executable, result.consumed),
+                         (RULE_VERSION, r'C:\Python27-32\python.exe', 1))
+        with self.assertRaises(LauncherError) as cm:
+            r.resolve_args(['-3.4'])
+        self.assertEqual(cm.exception.rc, RC_NO_PYTHON)
+
+    def test_virtual_shebangs(self):
+        r = make_resolver()
+        for shebang, version in (('#!python', '2.7'), ('#!python3', '3.6'),
+                                 ('#!/usr/bin/python3.5', '3.5'),
+                                 ('#!/usr/local/bin/python2', '2.7')):
+            script = self.add_script(r, shebang + ' -u\n')
+            result = r.resolve(script)
+            self.assertEqual((result.rule, result.python.version,
+                              result.suffix), (RULE_VIRTUAL, version, '-u'),
+                             shebang)
+        script = self.add_script(r, '#!/usr/bin/python3.4\n')
+        with self.assertRaises(LauncherError) as cm:
+            r.resolve(script)
+        self.assertEqual(cm.exception.rc, RC_NO_PYTHON)
+        script = self.add_script(r, '#!/usr/bin/python3x\n')
+        with self.assertRaises(LauncherError) as cm:
+            r.resolve(script)
+        self.assertEqual(cm.exception.rc, RC_BAD_VIRTUAL_PATH)
+
+    def test_env_search(self):
+        r = make_resolver()
+        script = self.add_script(r, '#!/usr/bin/env python -u\n')
+        self.assertEqual(r.resolve(script).rule, RULE_VIRTUAL)
+        r.fs.add_python(r'C:\Tools\python.exe')
+        r.invalidate()
+        result = r.resolve(script)
+        self.assertEqual((result.rule, result.executable, result.suffix),
+                         (RULE_PATH, r'C:\Tools\python.exe', '-u'))
+        # A version prevents the search
+        script = self.add_script(r, '#!/usr/bin/env python3\n')
+        self.assertEqual(r.resolve(script).rule, RULE_VIRTUAL)
+
+    def test_commands(self):
+        r = make_resolver()
+        r.fs.add_file(APPDATA_DIR + r'\py.ini',
+                      b'[commands]\nperl=C:\\Perl\\perl.exe\n')
+        r.fs.add_file(r'C:\Tools\ruby.exe')
+        script = self.add_script(r, '#!/usr/bin/perl -w\n')
+        self.assertEqual(r.resolve(script).rule, RULE_COMMAND)
+        self.assertEqual(r.resolve(script).command_line('a b'),
+                         r'C:\Perl\perl.exe -w a b')
+        script = self.add_script(r, '#!/usr/bin/env ruby\n')
+        self.assertEqual(r.resolve(script).executable, r'C:\Tools\ruby.exe')
+        self.assertEqual(r.resolve(script).rule, RULE_PATH)
+        script = self.add_script(r, '#!/bin/sh -x\n')
+        self.assertEqual(r.resolve(script).rule, RULE_SHEBANG)
+        self.assertEqual(r.resolve_args(['-perl', 'x.pl']).rule, RULE_COMMAND)
+
+    def test_config_read_when_needed(self):
+        r = make_resolver(env={'VIRTUAL_ENV': r'C:\venv'})
+        r.fs.add_python(r'C:\venv\Scripts\python.exe')
+        r.fs.add_file(APPDATA_DIR + r'\py.ini',
+                      b'[commands]\n3.6=C:\\Tools\\other.exe\n'
+                      b'[defaults]\npython3=3.5\n')
+        # A version option wins over a command of the same name.
+        self.assertEqual(r.resolve_args(['-3.6']).rule, RULE_VERSION)
+        self.assertEqual(r.resolve_args(['-V:3.6']).rule, RULE_VERSION)
+        self.assertEqual(r.resolve_args([]).rule, RULE_VENV)
+        self.assertEqual(r.fs.calls['read'], 0)
+        self.assertEqual(r.resolve_args(['-3']).python.version, '3.5')
+        self.assertEqual(r.fs.calls['read'], 1)
+
+    def test_magic(self):
+        r = make_resolver()
+        script = self.add_script(r, b'\x16\x0d\x0d\x0a' + bytes(12),
+                                 r'C:\work\x.pyc')
+        result = r.resolve(script)
+        self.assertEqual((result.rule, result.python.version),
+                         (RULE_MAGIC, '3.5'))
+        r = make_resolver(PYTHONS + [(VIEW_HKLM, '3.12', r'C:\Python312',
+                                      64)])
+        script = self.add_script(r, b'\xcb\x0d\x0d\x0a' + bytes(12),
+                                 r'C:\work\x.pyc')
+        self.assertEqual(r.resolve(script).python.version, '3.12')
+
+    def test_long_shebang(self):
+        r = make_resolver()
+        venv = 'C:\\' + '\\'.join(['envs'] * 100) + r'\python.exe'
+        script = self.add_script(r, '#!%s -u\nPK\x03\x04' % venv)
+        result = r.resolve(script)
+        self.assertEqual((result.rule, result.executable, result.suffix),
+                         (RULE_SHEBANG, venv + ' -u', None))
+
+    def test_venv(self):
+        r = make_resolver(env={'VIRTUAL_ENV': r'C:\venv'})
+        self.assertEqual(r.resolve_args([]).rule, RULE_DEFAULT)
+        r.fs.add_python(r'C:\venv\Scripts\python.exe')
+        self.assertEqual(r.resolve_args([]).rule, RULE_VENV)
+        script = self.add_script(r, '#!python3\n')
+        self.assertEqual(r.resolve(script).rule, RULE_VIRTUAL)
+
+    def test_cache(self):
+        r = make_resolver(cache_size=2)
+        script = self.add_script(r, '#!python3\n')
+        r.resolve(script)
+        reads = r.fs.calls['read']
+        r.resolve(script)
+        self.assertEqual((r.hits, r.misses, r.fs.calls['read']),
+                         (1, 1, reads))
+        # A changed script is looked at again
+        self.add_script(r, '#!python2\n', mtime=1)
+        self.assertEqual(r.resolve(script).python.version, '2.7')
+        for i in range(3):
+            r.resolve(self.add_script(r, '', r'C:\work\%d.py' % i))
+        self.assertEqual(len(r._cache), 2)
+
+    def test_concurrent_resolve(self):
+        # Threads sharing a fresh Resolver share its discovery, too, whether
+        # they need all of it (#!python3) or can stop early (#!python3.6).
+        for trial in range(5):
+            r = make_resolver()
+            r.registry.latency = 0.001
+            scripts = [self.add_script(r, '#!python3%s\n' %
+                                       ('.6' if i % 2 else ''),
+                                       r'C:\work\%d.py' % i)
+                       for i in range(20)]
+            barrier = threading.Barrier(len(scripts))
+            results = {}
+            errors = []
+
+            def run(script):
+                barrier.wait()
+                try:
+                    results[script] = r.resolve(script).python.version
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run, args=(script,))
+                       for script in scripts]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(set(results.values()), {'3.6'})
+            self.assertEqual(len(r.installed_pythons), len(PYTHONS))
+
+
+class ProjectTest(unittest.TestCase):
+    def make_project(self, r):
+        r.fs.add_python(r'C:\proj\.venv\Scripts\python.exe')
+        r.fs.add_file(r'C:\proj\.venv\pyvenv.cfg')
+        r.fs.add_dir(r'C:\proj\.git')
+        r.fs.add_file(r'C:\proj\src\.python-version', b'3.5.4\n')
+        r.fs.add_file(r'C:\proj\src\py.ini',
+                      b'[defaults]\npython2=2.7-32\n'
+                      b'[commands]\nperl=C:\\Perl\\perl.exe\n')
+        script = r'C:\proj\src\pkg\script.py'
+        r.fs.add_file(script, b'print()\n')
+        return script
+
+    def test_walk(self):
+        fs = FakeFileSystem()
+        fs.add_file(r'C:\.python-version')
+        fs.add_file(r'C:\proj\.venv\pyvenv.cfg')
+        fs.add_dir(r'C:\proj\.hg')
+        fs.add_file(r'C:\proj\a\py.ini')
+        fs.add_dir(r'C:\proj\a\b\c')
+        project = find_project(fs, r'C:\proj\a\b\c\\')
+        self.assertEqual((project.venv, project.pin, project.ini),
+                         (r'C:\proj\.venv', None, r'C:\proj\a\py.ini'))
+        self.assertEqual(project.dirs, 4)
+        # Without the repository, the walk goes on to the volume's root.
+        fs.dirs.discard(r'c:\proj\.hg')
+        self.assertEqual(find_project(fs, r'C:\proj\a').pin,
+                         r'C:\.python-version')
+        # A .venv is only a virtual environment with its pyvenv.cfg.
+        fs.remove(r'C:\proj\.venv\pyvenv.cfg')
+        self.assertIsNone(find_project(fs, r'C:\proj\a').venv)
+        self.assertEqual(find_project(fs, r'\\server\share\x').dirs, 0)
+        self.assertEqual(find_project(fs, r'relative\dir').dirs, 0)
+
+    def test_capped(self):
+        fs = FakeFileSystem()
+        deep = 'C:\\' + '\\'.join(['d'] * 100)
+        fs.add_dir(deep)
+        project = find_project(fs, deep)
+        self.assertTrue(project.capped)
+        self.assertLessEqual(project.stats, MAX_STATS + 6)
+        self.assertEqual(fs.calls['attributes'], project.stats)
+
+    def test_parse_pin(self):
+        for text, expected in ((b'3.12\n', '3.12'), (b'3.12.4', '3.12'),
+                               (b'  3.11.0rc2  \r\n', '3.11'),
+                               (b'\xef\xbb\xbf# pinned\n\n3.13t\n', '3.13t'),
+                               (b'cpython-3.10', '3.10'), (b'3', '3'),
+                               (b'3.12-arm64', '3.12-arm64'),
+                               (b'3.12 3.11\n', '3.12'), (b'pypy3.10', None),
+                               (b'system\n3.12\n', None), (b'312345', None),
+                               (b'3.x', None), (b'', None)):
+            self.assertEqual(parse_pin(text), expected, text)
+
+    def test_resolve(self):
+        r = make_resolver()
+        script = self.make_project(r)
+        result = r.resolve(script)
+        self.assertEqual((result.rule, result.executable),
+                         (RULE_PROJECT, r'C:\proj\.venv\Scripts\python.exe'))
+        # The active virtual environment comes first.
+        r.env['VIRTUAL_ENV'] = r'C:\venv'
+        r.fs.add_python(r'C:\venv\Scripts\python.exe')
+        r.invalidate()
+        self.assertEqual(r.resolve(script).rule, RULE_VENV)
+        del r.env['VIRTUAL_ENV']
+        r.env['PYLAUNCH_NO_PROJECT'] = '1'
+        r.invalidate()
+        self.assertEqual(r.resolve(script).rule, RULE_DEFAULT)
+
+    def test_precedence(self):
+        r = make_resolver(env={'py_python3': '3.6-32'})
+        script = self.make_project(r)
+        r.fs.add_file(APPDATA_DIR + r'\py.ini',
+                      b'[defaults]\npython=3.6\npython2=2.7\n')
+        project = r.find_project(script)
+        self.assertEqual(project.version, '3.5')
+        # The environment, then the pin, then the project's py.ini
+        self.assertEqual(r.get_configured_value('python3', project), '3.6-32')
+        self.assertEqual(r.get_configured_value('python', project), '3.5')
+        self.assertEqual(r.get_configured_value('python2', project), '2.7-32')
+        self.assertEqual(r.get_configured_value('python2'), '2.7')
+        for i, (shebang, version) in enumerate((
+                ('#!python', '3.5'), ('#!python3', '3.6'),
+                ('#!python2', '2.7'), ('#!python3.6', '3.6'))):
+            r.fs.add_file(script, shebang.encode('ascii') + b'\n',
+                          mtime=i + 1)
+            result = r.resolve(script)
+            self.assertEqual((result.rule, result.python.version),
+                             (RULE_VIRTUAL, version), shebang)
+        r.fs.add_file(script, b'#!python2\n', mtime=5)
+        self.assertEqual(r.resolve(script).python.bits, 32)
+        r.fs.add_file(script, b'#!/usr/bin/perl\n', mtime=6)
+        self.assertEqual(r.resolve(script).rule, RULE_COMMAND)
+        # A version option doesn't look at the script.
+        self.assertEqual(r.resolve_args(['-2', script]).python.bits, 64)
+        # Nor is the pin used if the launcher can't.
+        r.fs.add_file(r'C:\proj\src\.python-version', b'pypy3.10\n', mtime=1)
+        self.assertIsNone(r.find_project(script).version)
+
+
+class MatrixTest(unittest.TestCase):
+    def test_portable(self):
+        # A sample of the conformance matrix in tests.py.
+        import tests
+        pythons = tests.matrix_pythons(True)
+        cases = tests.generate_cases(pythons)[::20]
+        self.assertEqual(tests.run_matrix(cases, pythons, True, workers=2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!python3
+#
+# Tests for pyprobe.py, which runs interpreters to find out what they are.
+# Apart from this Python itself, the interpreters are shell scripts which
+# print what a Python would, and note each time they're run.
+#
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import pyprobe
+
+FAKE = '''#!/bin/sh
+echo run >> "$0.runs"
+%s
+'''
+
+ANSWER = {'version': '3.13.1', 'releaselevel': 'final',
+          'implementation': 'cpython', 'bits': 64, 'freethreaded': True,
+          'magic': 3571, 'prefix': '/opt/python3.13t',
+          'sys_version': '3.13.1 experimental free-threading build'}
+
+
+@unittest.skipIf(os.name == 'nt', 'the fake interpreters are shell scripts')
+class FakeTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.cache = os.path.join(self.work_dir, 'cache', 'probe.json')
+
+    def fake(self, name, body=None, **changes):
+        if body is None:
+            answer = dict(ANSWER, **changes)
+            body = "echo '%s'" % json.dumps(answer)
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'w') as f:
+            f.write(FAKE % body)
+        os.chmod(path, 0o755)
+        return path
+
+    def runs(self, path):
+        try:
+            with open(path + '.runs') as f:
+                return len(f.readlines())
+        except FileNotFoundError:
+            return 0
+
+    def test_probe(self):
+        python = self.fake('python3.13t')
+        old = self.fake('python2.7', version='2.7.18', bits=32,
+                        freethreaded=False, magic=62211)
+        prober = pyprobe.Prober(self.cache)
+        [new, old] = prober.probe([python, old])
+        self.assertEqual((new.tag, new.major, new.minor, new.magic,
+                          new.prefix), ('3.13t', 3, 13, 3571,
+                                        '/opt/python3.13t'))
+        self.assertEqual((old.tag, old.bits), ('2.7-32', 32))
+        self.assertEqual((prober.probed, prober.hits, prober.errors),
+                         (2, 0, {}))
+
+    def test_cache(self):
+        python = self.fake('python')
+        self.assertEqual(pyprobe.probe([python], cache_path=self.cache)[0].tag,
+                         '3.13t')
+        prober = pyprobe.Prober(self.cache)
+        self.assertEqual(prober.probe([python])[0].version, '3.13.1')
+        self.assertEqual((prober.probed, prober.hits, self.runs(python)),
+                         (0, 1, 1))
+        # A changed interpreter is run again.
+        self.fake('python', version='3.13.2')
+        st = os.stat(python)
+        os.utime(python, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        prober = pyprobe.Prober(self.cache)
+        self.assertEqual(prober.probe([python])[0].version, '3.13.2')
+        self.assertEqual((prober.probed, self.runs(python)), (1, 2))
+        # Without a cache, it always is.
+        pyprobe.probe([python], cache_path='')
+        self.assertEqual(self.runs(python), 3)
+
+    def test_failures(self):
+        good = self.fake('good')
+        broken = self.fake('broken', 'echo oops >&2; exit 3')
+        garbled = self.fake('garbled', 'echo "{not json"')
+        slow = self.fake('slow', 'sleep 5')
+        missing = os.path.join(self.work_dir, 'missing')
+        prober = pyprobe.Prober(self.cache, timeout=0.5)
+        start = time.monotonic()
+        results = prober.probe([good, broken, garbled, slow, missing])
+        self.assertLess(time.monotonic() - start, 4)
+        self.assertEqual([r is not None for r in results],
+                         [True, False, False, False, False])
+        self.assertIn('exit code 3: oops', prober.errors[broken])
+        self.assertIn('unexpected output', prober.errors[garbled])
+        self.assertIn('no answer', prober.errors[slow])
+        self.assertIn('not found', prober.errors[missing])
+        # Failures aren't remembered.
+        prober = pyprobe.Prober(self.cache, timeout=0.5)
+        prober.probe([good, broken])
+        self.assertEqual((prober.hits, self.runs(broken)), (1, 2))
+
+    def test_concurrent(self):
+        fakes = [self.fake('slow%d' % i, 'sleep 0.5; echo \'%s\'' %
+                           json.dumps(ANSWER)) for i in range(8)]
+        start = time.monotonic()
+        results = pyprobe.Prober('', workers=8).probe(fakes)
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertTrue(all(results))
+
+    def test_corrupt_cache(self):
+        python = self.fake('python')
+        os.makedirs(os.path.dirname(self.cache))
+        with open(self.cache, 'w') as f:
+            f.write('{"format": 1, "entries": [')
+        self.assertIsNotNone(pyprobe.probe([python], cache_path=self.cache)[0])
+        with open(self.cache) as f:
+            self.assertEqual(json.load(f)['format'], pyprobe.CACHE_FORMAT)
+
+
+class RealTest(unittest.TestCase):
+    def test_this_python(self):
+        [result] = pyprobe.probe([sys.executable], cache_path='')
+        self.assertEqual(result.version, '%d.%d.%d' % sys.version_info[:3])
+        self.assertEqual(result.sys_version, sys.version.split('\n')[0])
+        self.assertEqual(result.implementation, sys.implementation.name)
+        self.assertEqual(result.bits, 64 if sys.maxsize > 2 ** 32 else 32)
+        self.assertEqual(result.prefix, sys.prefix)
+        import importlib.util
+        self.assertEqual(result.magic.to_bytes(2, 'little'),
+                         importlib.util.MAGIC_NUMBER[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!python3
+#
+# Tests for stampwrap.py, which makes script wrappers. The wrappers made
+# here have a pretend executable in front, but Python can run them all the
+# same, as it's given the wrapper itself to run.
+#
+
+import contextlib
+import io
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import stampwrap
+
+STUB = b'MZ\x90\x00' + b'pretend wrapper executable' * 100
+
+SCRIPT = b'''#!/usr/bin/env python3
+import sys
+print('hello from', sys.argv[1:])
+'''
+
+
+class StampTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.stub = self.write('stub.exe', STUB)
+        self.script = self.write('hello.py', SCRIPT)
+        self.out_dir = os.path.join(self.work_dir, 'out')
+
+    def write(self, name, data):
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def wrapper(self, name):
+        return os.path.join(self.out_dir, name + '.exe')
+
+    def test_appended(self):
+        rc = stampwrap.main(['-s', self.stub, '-o', self.out_dir,
+                             self.script, 'tool=json.tool:main'])
+        self.assertEqual(rc, 0)
+        exe = self.wrapper('hello')
+        with open(exe, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(STUB))
+        self.assertEqual(data[-16:], struct.pack('<Q', len(STUB)) +
+                         b'PYWRAP01')
+        offset, size = stampwrap.find_payload(exe)
+        self.assertEqual((offset, offset + size + 16), (len(STUB), len(data)))
+        # The payload starts with the script's shebang line, for the
+        # launcher, and the whole file is a zip application, for Python.
+        payload = data[offset:offset + size]
+        self.assertTrue(payload.startswith(b'#!/usr/bin/env python3\nPK'))
+        with zipfile.ZipFile(exe) as zf:
+            self.assertEqual(zf.read('__main__.py'), SCRIPT)
+        p = subprocess.run([sys.executable, exe, 'a b'],
+                           stdout=subprocess.PIPE)
+        self.assertEqual(p.stdout.strip(), b"hello from ['a b']")
+        p = subprocess.run([sys.executable, self.wrapper('tool')],
+                           input=b'{"a":1}', stdout=subprocess.PIPE)
+        self.assertEqual(p.stdout.split(), [b'{', b'"a":', b'1', b'}'])
+        self.assertIsNone(stampwrap.find_payload(self.stub))
+
+    def test_zipapp(self):
+        pyz = os.path.join(self.work_dir, 'app.pyz')
+        with zipfile.ZipFile(pyz, 'w') as zf:
+            zf.writestr('__main__.py', 'print("app")\n')
+        with open(pyz, 'rb') as f:
+            app = b'#!python3\n' + f.read()
+        self.write('app.pyz', app)
+        stampwrap.stamp(self.stub, [('app', pyz)], self.out_dir)
+        exe = self.wrapper('app')
+        offset, size = stampwrap.find_payload(exe)
+        with open(exe, 'rb') as f:
+            f.seek(offset)
+            self.assertEqual(f.read(size), app)
+        p = subprocess.run([sys.executable, exe], stdout=subprocess.PIPE)
+        self.assertEqual(p.stdout.strip(), b'app')
+
+    @unittest.skipUnless(hasattr(os, 'link'), 'needs hard links')
+    def test_links(self):
+        commands = [('one', self.script), ('two', self.script),
+                    ('tool', 'json.tool:main')]
+        self.assertEqual(stampwrap.stamp(self.stub, commands, self.out_dir),
+                         (3, 1))
+        one, two, tool = [os.stat(self.wrapper(name))
+                          for name in ('one', 'two', 'tool')]
+        self.assertEqual(one.st_ino, two.st_ino)
+        self.assertNotEqual(one.st_ino, tool.st_ino)
+        # Stamping again replaces the files, rather than writing through the
+        # links.
+        self.assertEqual(stampwrap.stamp(self.stub, commands[:1],
+                                         self.out_dir, link=False), (1, 0))
+        self.assertNotEqual(os.stat(self.wrapper('one')).st_ino, two.st_ino)
+
+    @unittest.skipUnless(hasattr(os, 'link'), 'needs hard links')
+    def test_side_file(self):
+        commands = [stampwrap.parse_command(c)
+                    for c in ('hello=%s' % self.script, 'tool=json.tool:main')]
+        self.assertEqual(stampwrap.stamp(self.stub, commands, self.out_dir,
+                                         gui=True, side_file=True,
+                                         shebang='#!pythonw3'), (2, 2))
+        for name in ('hello', 'tool'):
+            self.assertEqual(os.stat(self.wrapper(name)).st_ino,
+                             os.stat(self.stub).st_ino)
+            self.assertIsNone(stampwrap.find_payload(self.wrapper(name)))
+        with open(os.path.join(self.out_dir, 'tool-script.pyw'), 'rb') as f:
+            script = f.read()
+        self.assertTrue(script.startswith(b'#!pythonw3\n'))
+        self.assertIn(b'from json.tool import main\n', script)
+
+    @unittest.skipUnless(hasattr(os, 'link'), 'needs hard links')
+    def test_restamp(self):
+        commands = [('one', self.script), ('two', self.script),
+                    ('tool', 'json.tool:main')]
+        for side_file in (False, True, True, False):
+            self.assertEqual(stampwrap.stamp(self.stub, commands, self.out_dir,
+                                             side_file=side_file),
+                             (3, 3 if side_file else 1))
+            self.assertEqual([name for name in os.listdir(self.out_dir)
+                              if name.endswith('.tmp')], [])
+
+    def test_old_pythons(self):
+        # Scripts for Pythons before 3.8, which can't run appended scripts,
+        # are written beside their wrappers instead.
+        sources = {}
+        for name, line in (('two', '#!python2'), ('three7', '#!python3.7-32'),
+                           ('bare', '#!/usr/bin/env python -u'),
+                           ('three', '#!python3'), ('new', '#!python3.8')):
+            sources[name] = self.write(name + '.py', line.encode('ascii') +
+                                       b'\nprint()\n')
+        commands = sorted(sources.items()) + [('tool', 'json.tool:main')]
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            stampwrap.stamp(self.stub, commands, self.out_dir,
+                            shebang='#!python2.7')
+        for name in ('two', 'three7', 'bare', 'tool'):
+            self.assertIsNone(stampwrap.find_payload(self.wrapper(name)),
+                              name)
+            side_file = os.path.join(self.out_dir, name + '-script.py')
+            self.assertTrue(os.path.exists(side_file), name)
+            self.assertIn(name + ': ', stderr.getvalue())
+        for name in ('three', 'new'):
+            self.assertIsNotNone(stampwrap.find_payload(self.wrapper(name)),
+                                 name)
+            self.assertFalse(os.path.exists(
+                os.path.join(self.out_dir, name + '-script.py')), name)
+        self.assertNotIn('three:', stderr.getvalue())
+        self.assertFalse(stampwrap.can_append(b'\xef\xbb\xbf#!python2\r\n'))
+        self.assertTrue(stampwrap.can_append(b'#!python3.13t\n'))
+        self.assertTrue(stampwrap.can_append(b'#!/bin/sh\n'))
+        self.assertTrue(stampwrap.can_append(b'print()\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
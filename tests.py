@@ -6,20 +6,29 @@
 #  - python3.x 32bit
 #  - python3.x 64bit
 # to be installed
+#
+# "tests.py matrix" instead runs the conformance matrix (see below), which
+# can also be run anywhere against the pure-Python reference implementation
+# with "tests.py matrix --portable".
 
 import sys
 if sys.version_info[0] < 3:
     raise ImportError("These tests require Python 3 to run.")
 
-import ctypes
+import argparse
+import collections
+import concurrent.futures
+import json
 import logging
 import os
 import os.path
 import shutil
 import subprocess
 import tempfile
+import time
 import unittest
-import winreg
+
+import pyprobe
 
 logger = logging.getLogger()
 
@@ -67,77 +76,41 @@ class VirtualPath: # think a C struct...
         self.version = version
         self.bits = bits
         self.executable = executable
-
-def is_64_bit_os():
-    i = ctypes.c_int()
-    kernel32 = ctypes.windll.kernel32
-    process = kernel32.GetCurrentProcess()
-    kernel32.IsWow64Process(process, ctypes.byref(i))
-    return i.value
-
-def locate_pythons_for_key(root, flags, infos):
-    executable = 'pythonw.exe' if IS_W else 'python.exe'
-    python_path = r'SOFTWARE\Python\PythonCore'
-    try:
-        core_root = winreg.OpenKeyEx(root, python_path, 0, flags)
-    except WindowsError:
-        return
-    try:
-        i = 0
-        while True:
-            try:
-                verspec = winreg.EnumKey(core_root, i)
-            except WindowsError:
-                break
-            try:
-                ip_path = python_path + '\\' + verspec + '\\' + 'InstallPath'
-                key_installed_path = winreg.OpenKeyEx(root, ip_path, 0, flags)
-                try:
-                    install_path, typ = winreg.QueryValueEx(key_installed_path,
-                                                            None)
-                finally:
-                    winreg.CloseKey(key_installed_path)
-                if typ==winreg.REG_SZ:
-                    for check in ['', 'pcbuild', 'pcbuild/amd64']:
-                        maybe = os.path.join(install_path, check, executable)
-                        if os.path.isfile(maybe):
-                            if ' ' in maybe:
-                                maybe = '"' + maybe + '"'
-                            infos.append(VirtualPath(verspec, 32, maybe))
-                            #debug("found version %s at '%s'" % (verspec, maybe))
-                            break
-            except WindowsError:
-                pass
-            i += 1
-    finally:
-        winreg.CloseKey(core_root)
-
-# Locate all installed Python versions, reverse-sorted by their version
-# number - the sorting allows a simplistic linear scan to find the higest
-# matching version number.
+        self.probe = None   # what it says it is, if it could be asked
+
+# Locate all installed Python versions as the launcher under test sees them,
+# in its order of preference - highest version first, which allows a
+# simplistic linear scan to find the highest matching version number. The
+# launcher does the registry scanning (and caches it), so these tests agree
+# with it about the bitness of each Python, too. Each Python is then asked
+# what it is (see pyprobe.py) - all at once, and only when it has changed
+# since the last run - so that tests know exactly what it will print.
 def locate_all_pythons():
+    output = subprocess.check_output([LAUNCHER, '--list', '--json'])
+    records = [json.loads(line) for line in output.decode('utf-8').splitlines()
+               if line.strip()]
+    # Other distributions' Pythons are never chosen by version.
+    records = [record for record in records[:-1]    # the last is a summary
+               if record['company'] == 'PythonCore']
+    prober = pyprobe.Prober()
+    probes = prober.probe([record['executable'] for record in records])
+    logger.debug('probed %d Pythons, %d from the cache: %s', prober.probed,
+                 prober.hits, prober.errors or 'no errors')
     infos = []
-    
-    if not is_64_bit_os():
-        locate_pythons_for_key(winreg.HKEY_CURRENT_USER, winreg.KEY_READ,
-                               infos)
-        locate_pythons_for_key(winreg.HKEY_LOCAL_MACHINE, winreg.KEY_READ,
-                               infos)
-    else:
-        locate_pythons_for_key(winreg.HKEY_CURRENT_USER,
-                               winreg.KEY_READ | winreg.KEY_WOW64_64KEY,
-                               infos)
-        locate_pythons_for_key(winreg.HKEY_LOCAL_MACHINE,
-                               winreg.KEY_READ | winreg.KEY_WOW64_64KEY,
-                               infos)
-        locate_pythons_for_key(winreg.HKEY_CURRENT_USER,
-                               winreg.KEY_READ | winreg.KEY_WOW64_32KEY,
-                               infos)
-        locate_pythons_for_key(winreg.HKEY_LOCAL_MACHINE,
-                               winreg.KEY_READ | winreg.KEY_WOW64_32KEY,
-                               infos)
-
-    return sorted(infos, reverse=True, key=lambda info: (info.version, -info.bits))
+    for record, probe in zip(records, probes):
+        executable = record['executable']
+        if IS_W:
+            executable = os.path.join(os.path.dirname(executable),
+                                      'pythonw.exe')
+        if ' ' in executable:
+            executable = '"' + executable + '"'
+        info = VirtualPath(record['version'], record['bits'], executable)
+        info.probe = probe
+        if probe is not None and probe.bits != record['bits']:
+            logger.warning('%s is %d-bit, not %d-bit as the launcher says',
+                           executable, probe.bits, record['bits'])
+        infos.append(info)
+    return infos
 
 
 # These are defined later in the main clause.
@@ -149,7 +122,8 @@ def locate_all_pythons():
 def locate_python_ver(spec):
     assert spec
     for info in ALL_PYTHONS:
-        if info.version.startswith(spec):
+        rest = info.version[len(spec):]
+        if info.version.startswith(spec) and not rest[:1].isdigit():
             return info
     return None
 
@@ -178,7 +152,10 @@ def locate_python(spec):
 
 def update_for_installed_pythons(*pythons):
     for python in pythons:
-        python.bversion = python.version.encode('ascii')
+        # sys.version starts with the full version, such as 3.12.4, which
+        # tells apart 3.1 and 3.12 - and 3.13 from a 3.13t tag.
+        version = python.probe.version if python.probe else python.version
+        python.bversion = version.encode('ascii')
         python.dir = 'Python%s' % python.version.replace('.', '')
         python.bdir = python.dir.encode('ascii')
         python.output_version = b'Python ' + python.bversion
@@ -341,6 +318,32 @@ class BasicTest(ScriptMaker, unittest.TestCase):
             python = self.get_python_for_shebang(shebang)
             self.assertTrue(self.matches(stdout, python))
 
+    def test_resolve(self):
+        "Test batch resolution, which shouldn't run anything"
+        expected = []
+        for i, shebang in enumerate(SHEBANGS.values()):
+            path = os.path.join(self.work_dir, 'script%d.py' % i)
+            with open(path, 'w') as f:
+                f.write(shebang + 'raise SystemExit(1)\n')
+            expected.append((path, shebang,
+                             self.get_python_for_shebang(shebang)))
+        p = subprocess.Popen([LAUNCHER, '--resolve'], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        paths = '\n'.join(path for path, shebang, python in expected)
+        stdout, stderr = p.communicate(paths.encode('utf-8'))
+        self.assertEqual(p.returncode, 0)
+        records = [json.loads(line) for line in stdout.decode('ascii').splitlines()]
+        summary = records.pop()['summary']
+        self.assertEqual(summary['scripts'], len(expected))
+        self.assertEqual(summary['errors'], 0)
+        for record, (path, shebang, python) in zip(records, expected):
+            self.assertEqual(record['script'], path)
+            if record['rule'] != 'path':    # /usr/bin/env can search PATH
+                self.assertTrue(python.version.startswith(record['version']),
+                                'Failed for shebang: %s' % shebang)
+            self.assertEqual(set(record['timings_us']),
+                             {'read', 'parse', 'locate'})
+
     def test_venv(self):
         "Test correct operation in a virtualenv"
         if not os.path.isdir('venv34'):
@@ -361,35 +364,25 @@ class BasicTest(ScriptMaker, unittest.TestCase):
                 self.assertEqual(stdout.startswith(b'3.4'), key == 'ENV_PY')
                 self.assertEqual(stdout.startswith(b'2.7'), key != 'ENV_PY')
 
-def read_data(path):
-    if not os.path.exists(path):
-        result = None
-    else:
-        with open(path, 'r') as f:
-            result = f.read()
-    return result
-
 def write_data(path, value):
     with open(path, 'w') as f:
         f.write(value)
 
+# Each test has its own ini files, which the launcher is pointed at through
+# the environment, so the real ones are never touched - nor any project the
+# work directory happens to be in.
 class ConfiguredScriptMaker(ScriptMaker):
     def setUp(self):
         ScriptMaker.setUp(self)
+        self.local_ini = os.path.join(self.work_dir, 'local.ini')
+        self.global_ini = os.path.join(self.work_dir, 'global.ini')
 
-        self.local_ini = path = os.path.join(os.environ['LOCALAPPDATA'],
-                                                  'py.ini')
-        self.local_config = read_data(path)
-        self.global_ini = path = os.path.join(os.path.dirname(LAUNCHER),
-                                              'py.ini')
-        self.global_config = read_data(path)
-
-    def tearDown(self):
-        if self.local_config is not None:
-            write_data(self.local_ini, self.local_config)
-        if self.global_config is not None:
-            write_data(self.global_ini, self.global_config)
-        ScriptMaker.tearDown(self)
+    def run_child(self, path, env=None):
+        env = dict(os.environ if env is None else env,
+                   PYLAUNCH_LOCAL_INI=self.local_ini,
+                   PYLAUNCH_GLOBAL_INI=self.global_ini,
+                   PYLAUNCH_NO_PROJECT='1')
+        return ScriptMaker.run_child(self, path, env)
 
 LOCAL_INI_IN = '''[commands]
 h3  = {p3.executable} --help
@@ -514,7 +507,386 @@ class ConfigurationTest(ConfiguredScriptMaker, unittest.TestCase):
         self.assertTrue(self.matches(stdout, DEFAULT_PYTHON3))
 
 
+#
+# The conformance matrix: every combination of shebang form, encoding, line
+# ending and configuration (per-user py.ini, global py.ini and environment),
+# with the Python the launcher should choose worked out, independently of
+# the launcher, by expected_python(). The cases run on a pool of processes,
+# each with its own directory for scripts and ini files; the launcher is told
+# where its ini files are through PYLAUNCH_LOCAL_INI and PYLAUNCH_GLOBAL_INI.
+#
+# On Windows, the launcher under test runs each script. With --portable (the
+# default elsewhere), the cases are resolved by the pure-Python reference
+# implementation in the pylauncher package, with fake interpreters.
+#
+
+MatrixPython = collections.namedtuple('MatrixPython',
+                                      'version major minor bits executable')
+
+# A case's script, and environment variables and [defaults] of the per-user
+# and global py.ini files (dicts; the [commands] are always the same, from
+# matrix_commands()); expected is the executable the launcher should run,
+# or None if it should fail.
+Case = collections.namedtuple('Case', 'name script env local_ini global_ini '
+                                      'expected')
+
+MATRIX_TEMPLATE = '''%(shebang)s%(coding)simport sys
+print(sys.executable)
+%(comment)s'''
+
+# (name, encoding, BOM, coding line, comment)
+ENCODINGS = [
+    ('ascii', 'ascii', b'', '', ''),
+    ('utf-8', 'utf-8', b'', '# -*- coding: utf-8 -*-\n',
+     COMMENT_WITH_UNICODE),
+    ('utf-8-bom', 'utf-8', BOM_UTF8, '', COMMENT_WITH_UNICODE),
+]
+
+LINE_ENDINGS = [('lf', '\n'), ('crlf', '\r\n')]
+
+# The interpreters of the portable matrix, as (registry view, tag, bits,
+# executable), in the order the launcher should prefer them.
+FAKE_PYTHONS = [
+    (0, '3.12', 64, r'C:\Users\me\AppData\Local\Programs\Python312\python.exe'),
+    (1 | 2, '3.12-32', 32, r'C:\Program Files (x86)\Python312-32\python.exe'),
+    (1, '3.11', 64, r'C:\Python311\python.exe'),
+    (1 | 2, '3.11-32', 32, r'C:\Python311-32\python.exe'),
+    (1, '2.7', 64, r'C:\Python27\python.exe'),
+    (1 | 2, '2.7', 32, r'C:\Python27-32\python.exe'),
+]
+
+# The prefixes which make "python..." a virtual command (see shebang.c).
+# VIRT_PATHS has one more, with extra whitespace, which only works for
+# [commands] entries.
+VIRTUAL_PREFIXES = ['/usr/bin/env ', '/usr/bin/', '/usr/local/bin/', '']
+
+FAKE_SCRIPT = r'C:\matrix\script.py'
+FAKE_LOCAL_INI = r'C:\matrix\local.ini'
+FAKE_GLOBAL_INI = r'C:\matrix\global.ini'
+
+
+def matrix_pythons(portable):
+    "The Pythons which can be chosen, in order of preference."
+    if portable:
+        result = []
+        for view, tag, bits, executable in FAKE_PYTHONS:
+            major, minor = tag.split('-')[0].split('.')
+            result.append(MatrixPython(tag, int(major), int(minor), bits,
+                                       executable))
+        return result
+    output = subprocess.check_output([LAUNCHER, '--list', '--json'])
+    result = []
+    for line in output.decode('utf-8').splitlines()[:-1]:
+        record = json.loads(line)
+        # Free-threaded builds and other companies' Pythons are only used
+        # when asked for by name.
+        if record['company'] == 'PythonCore' and not record['freethreaded']:
+            result.append(MatrixPython(record['version'], record['major'],
+                                       record['minor'], record['bits'],
+                                       record['executable']))
+    return result
+
+
+def find_expected(pythons, spec):
+    "The first of pythons satisfying a version spec such as 3, 3.6 or 3.6-32."
+    version, _, bits = spec.partition('-')
+    major, _, minor = version.partition('.')
+    for python in pythons:
+        if (python.major == int(major) and
+                (not minor or python.minor == int(minor)) and
+                (not bits or python.bits == int(bits))):
+            return python
+    return None
+
+
+def expected_python(pythons, wanted, from_shebang, env, local_ini,
+                    global_ini):
+    "The Python the launcher should choose, or None - see locate_python()."
+    def configured(key):
+        return (env.get('PY_' + key.upper()) or local_ini.get(key) or
+                global_ini.get(key))
+
+    if len(wanted) == 1:
+        wanted = configured('python' + wanted) or wanted
+    if wanted:
+        return find_expected(pythons, wanted)
+    result = None
+    if configured('python'):
+        result = find_expected(pythons, configured('python'))
+    for spec in ('2', '3') if from_shebang else ('3', '2'):
+        if result is None:
+            result = find_expected(pythons, spec)
+    return result
+
+
+def distinctive_spec(pythons, major):
+    """
+    A version spec for a major version which the launcher wouldn't choose
+    for that major version alone, so that it shows when it's configured.
+    """
+    candidates = [p for p in pythons if p.major == major]
+    if len(candidates) < 2:
+        return None
+    p = candidates[-1]
+    return '%d.%d-%d' % (p.major, p.minor, p.bits)
+
+
+def config_variants(pythons):
+    "Yield (name, environment, local [defaults], global [defaults])."
+    spec2 = distinctive_spec(pythons, 2)
+    spec3 = distinctive_spec(pythons, 3)
+    envs = [{}, {'PY_PYTHON': '2'}]
+    locals_ = [{}, {'python': '3'}]
+    globals_ = [{}, {'python': '2'}]
+    if spec3:
+        envs.append({'PY_PYTHON3': spec3})
+        locals_.append({'python3': spec3})
+    if spec2:
+        globals_.append({'python2': spec2})
+    for env in envs:
+        for local_ini in locals_:
+            for global_ini in globals_:
+                name = ' '.join('%s:%s=%s' % (scope, k, v)
+                                for scope, d in (('env', env),
+                                                 ('local', local_ini),
+                                                 ('global', global_ini))
+                                for k, v in d.items())
+                yield name or 'unconfigured', env, local_ini, global_ini
+
+
+def matrix_commands(pythons):
+    """
+    The [commands] of the per-user and global py.ini files, as dicts mapping
+    names to Pythons: "both" is in both, and the per-user one should win.
+    """
+    if not pythons:
+        return {}, {}
+    mine, theirs = pythons[-1], pythons[min(1, len(pythons) - 1)]
+    return ({'localcmd': mine, 'bothcmd': mine},
+            {'globalcmd': theirs, 'bothcmd': theirs})
+
+
+def shebang_variants(pythons):
+    """
+    Yield (shebang line, kind, value), where kind is "virtual" for a virtual
+    command (whose value is the version asked for), "command" for a command
+    from py.ini (whose value is its name), or "none" for no shebang at all.
+    """
+    versions = ['', '2', '3']
+    for major, minor in sorted({(p.major, p.minor) for p in pythons}):
+        versions += ['%d.%d' % (major, minor), '%d.%d-32' % (major, minor)]
+    # Not installed, one hopes; and 3.1 mustn't match 3.10 or later.
+    versions += ['2.5', '3.1']
+    yield '', 'none', ''
+    for prefix in VIRTUAL_PREFIXES:
+        for version in versions:
+            yield '#!%spython%s\n' % (prefix, version), 'virtual', version
+    for prefix in VIRT_PATHS:
+        for name in ('localcmd', 'globalcmd', 'bothcmd'):
+            yield '#!%s%s\n' % (prefix, name), 'command', name
+
+
+def generate_cases(pythons):
+    "The matrix, as a list of Cases."
+    local_commands, global_commands = matrix_commands(pythons)
+    commands = dict(global_commands, **local_commands)
+    cases = []
+    for shebang, kind, value in shebang_variants(pythons):
+        if kind == 'command' and value not in commands:
+            continue
+        for enc_name, encoding, bom, coding, comment in ENCODINGS:
+            for eol_name, eol in LINE_ENDINGS:
+                text = MATRIX_TEMPLATE % dict(shebang=shebang, coding=coding,
+                                              comment=comment)
+                script = bom + text.replace('\n', eol).encode(encoding)
+                for config in config_variants(pythons):
+                    config_name, env, local_ini, global_ini = config
+                    if kind == 'command':
+                        expected = commands[value]
+                    else:
+                        expected = expected_python(pythons, value,
+                                                   kind == 'virtual', env,
+                                                   local_ini, global_ini)
+                    name = '%s | %s %s | %s' % (shebang.strip() or 'none',
+                                                enc_name, eol_name,
+                                                config_name)
+                    cases.append(Case(name, script, env, local_ini,
+                                      global_ini,
+                                      expected and expected.executable))
+    return cases
+
+
+def ini_text(defaults, commands):
+    lines = ['[commands]']
+    for name, python in sorted(commands.items()):
+        executable = python.executable
+        if ' ' in executable:
+            executable = '"%s"' % executable
+        lines.append('%s=%s' % (name, executable))
+    lines.append('[defaults]')
+    lines.extend('%s=%s' % item for item in defaults.items())
+    return '\n'.join(lines) + '\n'
+
+
+# The state of a worker process, set up by init_worker().
+_worker = {}
+
+
+def init_worker(root, portable, pythons):
+    _worker['commands'] = matrix_commands(pythons)
+    if portable:
+        from pylauncher.fakes import FakeRegistry, FakeFileSystem
+        registry = FakeRegistry()
+        fs = FakeFileSystem()
+        for view, tag, bits, executable in FAKE_PYTHONS:
+            registry.add_python(view, tag, os.path.dirname(
+                executable.replace('\\', '/')).replace('/', '\\'))
+            fs.add_python(executable, bits)
+        _worker.update(registry=registry, fs=fs)
+    else:
+        _worker['dir'] = tempfile.mkdtemp(dir=root)
+    _worker['portable'] = portable
+
+
+def run_case_portable(case):
+    "Resolve a case with the reference implementation: (executable, error)."
+    from pylauncher import Resolver, LauncherError
+    from pylauncher.fakes import FakeEnvironment
+    fs = _worker['fs']
+    fs.add_file(FAKE_SCRIPT, case.script)
+    local_commands, global_commands = _worker['commands']
+    fs.add_file(FAKE_LOCAL_INI,
+                ini_text(case.local_ini, local_commands).encode('ascii'))
+    fs.add_file(FAKE_GLOBAL_INI,
+                ini_text(case.global_ini, global_commands).encode('ascii'))
+    env = FakeEnvironment(case.env, PYLAUNCH_LOCAL_INI=FAKE_LOCAL_INI,
+                          PYLAUNCH_GLOBAL_INI=FAKE_GLOBAL_INI)
+    r = Resolver(_worker['registry'], fs, env, r'C:\Windows',
+                 r'C:\Users\me\AppData\Local')
+    try:
+        return r.resolve_args([FAKE_SCRIPT]).executable.strip('"'), None
+    except LauncherError as e:
+        return None, str(e)
+
+
+def run_case_launcher(case):
+    "Run a case with the launcher under test: (executable, error)."
+    work_dir = _worker['dir']
+    script = os.path.join(work_dir, 'script.py')
+    with open(script, 'wb') as f:
+        f.write(case.script)
+    env = dict((k, v) for k, v in os.environ.items()
+               if not k.upper().startswith('PY_PYTHON') and
+               k.upper() not in ('VIRTUAL_ENV', 'PYLAUNCH_PLAN_CACHE'))
+    local_commands, global_commands = _worker['commands']
+    for name, defaults, commands in (
+            ('local', case.local_ini, local_commands),
+            ('global', case.global_ini, global_commands)):
+        path = os.path.join(work_dir, name + '.ini')
+        write_data(path, ini_text(defaults, commands))
+        env['PYLAUNCH_%s_INI' % name.upper()] = path
+    env.update(case.env)
+    # Keep any .python-version or .venv above the work directory out of it.
+    env['PYLAUNCH_NO_PROJECT'] = '1'
+    # Keep any Python on PATH from answering "#!/usr/bin/env python".
+    env['PATH'] = os.path.join(os.environ.get('SystemRoot', r'C:\Windows'),
+                               'System32')
+    p = subprocess.Popen([LAUNCHER, script], stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, env=env)
+    stdout, stderr = p.communicate()
+    if p.returncode:
+        return None, stderr.decode('utf-8', 'replace').strip()
+    return stdout.decode('utf-8', 'replace').strip(), None
+
+
+def run_case(case):
+    "Return (passed, the executable chosen or None, any error message)."
+    if _worker['portable']:
+        executable, error = run_case_portable(case)
+    else:
+        executable, error = run_case_launcher(case)
+    if case.expected is None:
+        passed = executable is None
+    else:
+        passed = (executable is not None and
+                  os.path.normcase(executable) ==
+                  os.path.normcase(case.expected))
+    return passed, executable, error
+
+
+def run_matrix(cases, pythons, portable, workers=None, report=None):
+    """
+    Run cases on a pool of worker processes, printing any failures and the
+    throughput, and writing each case's result to report (a file) as a line
+    of JSON if given. Returns the failed cases.
+    """
+    workers = workers or os.cpu_count() or 1
+    root = None if portable else tempfile.mkdtemp(prefix='pylauncher-')
+    failures = []
+    start = time.perf_counter()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=init_worker,
+                initargs=(root, portable, pythons)) as pool:
+            chunksize = max(1, len(cases) // (workers * 16))
+            results = pool.map(run_case, cases, chunksize=chunksize)
+            for case, (passed, executable, error) in zip(cases, results):
+                if report is not None:
+                    report.write(json.dumps({
+                        'case': case.name, 'passed': passed,
+                        'expected': case.expected, 'executable': executable,
+                        'error': error}) + '\n')
+                if not passed:
+                    failures.append(case)
+                    print('FAIL: %s\n  expected %s, got %s%s' % (
+                          case.name, case.expected, executable,
+                          '\n  ' + error if error else ''))
+    finally:
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    print('%d cases, %d failed, in %.1fs (%.0f cases/s on %d workers, %s)' % (
+          len(cases), len(failures), elapsed, len(cases) / elapsed, workers,
+          'portable' if portable else LAUNCHER))
+    return failures
+
+
+def matrix_main(args):
+    parser = argparse.ArgumentParser(prog='tests.py matrix',
+                                     description='Run the conformance '
+                                     'matrix.')
+    parser.add_argument('--portable', action='store_true',
+                        default=sys.platform != 'win32',
+                        help='resolve cases with the reference '
+                        'implementation and fake interpreters (the default '
+                        'away from Windows)')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-k', dest='pattern',
+                        help='only run cases whose names contain this')
+    parser.add_argument('--sample', type=int, default=1, metavar='N',
+                        help='only run every Nth case')
+    parser.add_argument('--report', type=argparse.FileType('w'),
+                        help='write each case\'s result to this file')
+    parser.add_argument('--list', action='store_true',
+                        help='list the cases rather than run them')
+    options = parser.parse_args(args)
+    pythons = matrix_pythons(options.portable)
+    cases = generate_cases(pythons)
+    if options.pattern:
+        cases = [case for case in cases if options.pattern in case.name]
+    cases = cases[::options.sample]
+    if options.list:
+        for case in cases:
+            print('%s -> %s' % (case.name, case.expected))
+        return 0
+    return 1 if run_matrix(cases, pythons, options.portable, options.workers,
+                           options.report) else 0
+
+
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['matrix']:
+        sys.exit(matrix_main(sys.argv[2:]))
     logging.basicConfig(filename='tests.log', filemode='w', level=logging.DEBUG,
                         format='%(lineno)4d %(message)s')
     global DEFAULT_PYTHON2, DEFAULT_PYTHON3, ALL_PYTHONS, LOCAL_INI, GLOBAL_INI
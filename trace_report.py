@@ -0,0 +1,123 @@
+#!python3
+#
+# Summarizes the launcher's trace output, to find which launches are slow
+# and where their time goes. It reads the one-line summaries which the
+# launcher appends to the log named by PYLAUNCH_TRACE_SUMMARY (pass the
+# rotated ".1" file too, to cover more launches), or full traces written
+# with PYLAUNCH_TRACE, which end with the same summary line.
+#
+# For all the launches read, it reports the distribution of total startup
+# time, the time spent in each phase, the merged histograms of each kind of
+# event, and the slowest launches.
+#
+
+import argparse
+import json
+import sys
+
+PHASES = ['config', 'version', 'discovery', 'shebang', 'path', 'child']
+
+# Fields of a summary which aren't event histograms
+NOT_EVENTS = {'t_us', 'event', 'pid', 'time_ms', 'command_line', 'rc',
+              'total_us', 'dropped'} | {'%s_us' % p for p in PHASES}
+
+
+def read_summaries(paths):
+    for path in paths:
+        with open(path, encoding='ascii', errors='replace') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue    # e.g. a line cut short by rotation
+                if event.get('event') == 'summary':
+                    yield event
+
+
+def percentile(values, fraction):
+    "The value below which the given fraction of the values fall."
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def merge_histograms(summaries):
+    result = {}
+    for summary in summaries:
+        for name, h in summary.items():
+            if name in NOT_EVENTS or not isinstance(h, dict):
+                continue
+            merged = result.setdefault(name, {'count': 0, 'total_us': 0.0,
+                                              'max_us': 0.0, 'buckets': {}})
+            merged['count'] += h['count']
+            merged['total_us'] += h['total_us']
+            merged['max_us'] = max(merged['max_us'], h['max_us'])
+            for bound, count in h['buckets'].items():
+                merged['buckets'][bound] = (merged['buckets'].get(bound, 0) +
+                                            count)
+    return result
+
+
+def bucket_key(bound):
+    return float('inf') if bound == 'inf' else float(bound)
+
+
+def report(summaries, slowest):
+    totals = [s['total_us'] for s in summaries]
+    print('%d launches, %d failed' % (len(summaries),
+                                      sum(1 for s in summaries if s['rc'])))
+    print('total us: p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % (
+        percentile(totals, 0.5), percentile(totals, 0.9),
+        percentile(totals, 0.99), max(totals)))
+
+    print('\n%-12s %10s %10s %10s' % ('phase', 'mean us', 'p90 us', 'max us'))
+    for phase in PHASES:
+        values = [s.get('%s_us' % phase, 0.0) for s in summaries]
+        print('%-12s %10.1f %10.1f %10.1f' % (
+            phase, sum(values) / len(values), percentile(values, 0.9),
+            max(values)))
+
+    print('\n%-16s %8s %10s %10s  %s' % ('event', 'count', 'mean us',
+                                         'max us', 'histogram (us: count)'))
+    for name, h in sorted(merge_histograms(summaries).items()):
+        buckets = sorted(h['buckets'].items(), key=lambda i: bucket_key(i[0]))
+        print('%-16s %8d %10.1f %10.1f  %s' % (
+            name, h['count'], h['total_us'] / h['count'], h['max_us'],
+            ' '.join('<%s:%d' % item for item in buckets)))
+
+    if slowest:
+        print('\nslowest launches:')
+        for s in sorted(summaries, key=lambda s: -s['total_us'])[:slowest]:
+            phases = sorted(PHASES, key=lambda p: -s.get('%s_us' % p, 0.0))
+            print('%10.1f us  pid %-6d %s=%.1f  %s' % (
+                s['total_us'], s['pid'], phases[0],
+                s.get('%s_us' % phases[0], 0.0), s['command_line']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize launcher '
+                                     'traces.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='a summary log or trace file')
+    parser.add_argument('--slowest', type=int, default=10,
+                        help='how many of the slowest launches to list '
+                        '(default %(default)s)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the merged event histograms as JSON')
+    options = parser.parse_args(argv)
+    summaries = list(read_summaries(options.paths))
+    if not summaries:
+        print('no launch summaries found')
+        return 1
+    if options.json:
+        json.dump(merge_histograms(summaries), sys.stdout, indent=2,
+                  sort_keys=True)
+        print()
+    else:
+        report(summaries, options.slowest)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())